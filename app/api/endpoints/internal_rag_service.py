@@ -1,9 +1,11 @@
 import json
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Union
 from mcp.types import Content, TextContent
+from app.configs.config import settings
 from app.rag.mcp_rag_service import retriever
+from app.rag.retrieval_filters import filters_from_arguments
 import uvicorn
 
 # 创建FastAPI应用
@@ -15,13 +17,35 @@ app = FastAPI(
 
 # 初始化检索器
 
-class RetrieveRequest(BaseModel):
-    query: str
+class RetrieveOptions(BaseModel):
     n_results: Optional[int] = 5
+    # 可选的过滤条件，在向量库中先过滤再检索，含义见 app.rag.retrieval_filters.build_filters
+    source_type: Optional[Union[str, List[str]]] = None
+    metadata_filter: Optional[Dict[str, Any]] = None
+    created_after: Optional[Union[str, float]] = None
+    created_before: Optional[Union[str, float]] = None
+    since_days: Optional[float] = None
+    where: Optional[Dict[str, Any]] = None
+    where_document: Optional[Dict[str, Any]] = None
+    # 是否用 MMR 去掉内容几乎相同的结果，不传时使用 RAG_MMR_ENABLED
+    mmr: Optional[bool] = None
+
+class RetrieveRequest(RetrieveOptions):
+    query: str
+    # 所属对话，追问时复用上一轮的检索候选池
+    conversation_id: Optional[str] = None
+
+class RetrieveBatchRequest(RetrieveOptions):
+    # 过滤条件和 n_results 对所有查询生效
+    queries: List[str]
 
 class RetrieveResponse(BaseModel):
     response: List[Dict[str, Any]] 
 
+class RetrieveBatchResponse(BaseModel):
+    # 与 queries 一一对应
+    response: List[List[Dict[str, Any]]]
+
 
 class FormatRequest(BaseModel):
     retrieved_docs: List[Dict[str, Any]] 
@@ -40,9 +64,16 @@ async def retrieve_documents(request: RetrieveRequest):
         
         if request.n_results < 1 or request.n_results > 10:
             raise HTTPException(status_code=400, detail="n_results必须在1-10之间")
+
+        try:
+            where, where_document = filters_from_arguments(request.model_dump(), settings.RAG_FILTER_TIME_FIELD)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"过滤条件不合法: {str(e)}")
         
         # 执行检索，直接返回 Python 列表
-        retrieved_docs = retriever.retrieve(request.query, request.n_results)
+        retrieved_docs = retriever.retrieve(request.query, request.n_results, where=where,
+                                            where_document=where_document, mmr=request.mmr,
+                                            conversation_id=request.conversation_id)
         
         # 直接返回 Pydantic 模型，FastAPI 会自动处理 JSON 序列化
         return RetrieveResponse(response=retrieved_docs)
@@ -52,6 +83,36 @@ async def retrieve_documents(request: RetrieveRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"检索失败: {str(e)}")
 
+@app.post("/retrieve_batch", response_model=RetrieveBatchResponse)
+async def retrieve_documents_batch(request: RetrieveBatchRequest):
+    """
+    批量检索：所有查询一次编码、一次向量库查询，按查询顺序返回每个查询的文档片段
+    """
+    try:
+        if not request.queries:
+            raise HTTPException(status_code=400, detail="queries不能为空")
+        if len(request.queries) > settings.RAG_BATCH_MAX_QUERIES:
+            raise HTTPException(status_code=400, detail=f"queries最多{settings.RAG_BATCH_MAX_QUERIES}个")
+        if any(not query.strip() for query in request.queries):
+            raise HTTPException(status_code=400, detail="查询不能为空")
+
+        if request.n_results < 1 or request.n_results > 10:
+            raise HTTPException(status_code=400, detail="n_results必须在1-10之间")
+
+        try:
+            where, where_document = filters_from_arguments(request.model_dump(), settings.RAG_FILTER_TIME_FIELD)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"过滤条件不合法: {str(e)}")
+
+        batch_docs = retriever.retrieve_batch(request.queries, request.n_results, where=where,
+                                              where_document=where_document, mmr=request.mmr)
+        return RetrieveBatchResponse(response=batch_docs)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量检索失败: {str(e)}")
+
 @app.post("/format", response_model=FormatResponse)
 async def format_documents(request: FormatRequest):
     '''
@@ -68,6 +129,39 @@ async def format_documents(request: FormatRequest):
     return FormatResponse(response=[TextContent(type="text", text=context_str)])
 
 
+@app.get("/sources/{chunk_id:path}")
+async def get_source(chunk_id: str):
+    """按 ID 取一个文本块的完整正文和 metadata，紧凑溯源模式下前端点开来源时按需加载"""
+    try:
+        chunk = retriever.get_chunk(chunk_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取文本块失败: {str(e)}")
+    if chunk is None:
+        raise HTTPException(status_code=404, detail="文本块不存在")
+    return chunk
+
+
+@app.get("/shards")
+async def shard_stats():
+    """各分片的当前集合、文本块数量和查询延迟 (RAG_SHARDING=none 时只有一个未分片的集合)"""
+    resolver = retriever.collection_resolver
+    if not hasattr(resolver, "shard_stats"):
+        return {"sharding": "none", "collection": resolver.active_name()}
+    try:
+        return {"sharding": settings.RAG_SHARDING, "shards": resolver.shard_stats()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取分片状态失败: {str(e)}")
+
+
+@app.get("/conversation-stats")
+async def conversation_stats():
+    """对话内检索候选池的复用次数、完整检索次数和复用比例 (RAG_CONVERSATION_REUSE 关闭时只返回 enabled=false)"""
+    store = retriever.conversation_store
+    if store is None:
+        return {"enabled": False}
+    return {"enabled": True, **store.stats()}
+
+
 @app.get("/health")
 async def health_check():
     """健康检查接口"""
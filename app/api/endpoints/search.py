@@ -1,13 +1,19 @@
 import httpx
 import json
-from fastapi import APIRouter, Depends, HTTPException
+import time
+from typing import Optional
+from urllib.parse import quote
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
 from fastapi.concurrency import run_in_threadpool
+from redis import asyncio as aioredis
 from starlette.responses import StreamingResponse
 from app.utils.auth import get_api_key
 from app.configs.config import settings
 # from app.rag.mcp_rag_service import retrieve, format_context
 from app.schemas import SearchQuery, SearchResponse
 from app.utils.singleton import logger
+from app.utils.source_events import SOURCE_MODES, metered, source_payload
+from app.utils.sse_replay import SSEReplayBuffer, parse_last_event_id
 
 def build_final_prompt(user_query: str, context_str: str):
     return f"""你是一位顶级的AI信息分析与总结专家。你的核心任务是深入分析用户问题和系统提供的参考资料，然后输出一份逻辑清晰、信息全面、高度浓缩的优质回答。
@@ -45,19 +51,60 @@ router = APIRouter(
     dependencies=[Depends(get_api_key)]
 )
 
+# 每次生成的事件缓冲在 Redis Stream 中，断线重连时按 Last-Event-ID 续传
+sse_buffer = SSEReplayBuffer(
+    aioredis.Redis(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=0,
+        password=settings.REDIS_PASSWORD,
+        decode_responses=True
+    ),
+    key_prefix=settings.SSE_BUFFER_KEY_PREFIX,
+    ttl_s=settings.SSE_BUFFER_TTL_S,
+    idle_timeout_s=settings.SSE_RESUME_IDLE_TIMEOUT_S,
+    logger=logger
+)
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"  # 让 Nginx 类代理不要缓冲事件
+}
+
 @router.get("/smart-search", summary="AI智能搜索总结接口测试")
 def test_smart_search():
     return "smart-search 接口的 GET 请求成功了！"
 
 
 @router.post("/smart-search", summary="AI智能搜素总结接口")
-async def smart_search(search_query: SearchQuery):
+async def smart_search(search_query: SearchQuery, last_event_id: Optional[str] = Header(None),
+                       source_mode: str = Query(settings.SOURCE_EVENT_MODE)):
     """
     接收用户查询，通过 RAG 增强后调用大模型，以流式响应返回最终总结及溯源信息。
+    每个事件带有 id；断线重连时带上 Last-Event-ID 请求头，从中断处继续 (生成仍在进行则接着推送，
+    已经结束则回放剩余事件)，不会重新检索和生成。缓冲过期后按新请求处理。
+    source_mode: 溯源事件格式，"full" 或 "compact" (只含 ID、标题、链接和摘要，详情通过 /sources/{id} 获取)
     """
+    started_at = time.perf_counter()
     user_query = search_query.query
     if not user_query:
         raise HTTPException(status_code=400, detail="没有收到查询内容")
+    if source_mode not in SOURCE_MODES:
+        raise HTTPException(status_code=400, detail=f"source_mode必须是{'/'.join(SOURCE_MODES)}之一")
+
+    resume = parse_last_event_id(last_event_id)
+    if resume:
+        generation_id, after = resume
+        try:
+            resumable = await sse_buffer.exists(generation_id)
+        except Exception as e:
+            logger.warning(f"无法读取智能搜索 {generation_id} 的缓冲，重新生成: {e}")
+            resumable = False
+        if resumable:
+            logger.info(f"智能搜索 {generation_id} 从事件 {after} 之后续传")
+            stream = metered(sse_buffer.stream(generation_id, after), "smart-search resume", started_at, logger)
+            return StreamingResponse(stream, media_type="text/event-stream", headers=SSE_HEADERS)
+        logger.info(f"智能搜索 {generation_id} 的缓冲已过期，重新生成")
     logger.info(f"收到新的智能搜索请求, 查询: '{user_query}'")
 
     # 1. 通过 HTTP 调用 RAG 微服务进行文档检索和格式化
@@ -105,12 +152,12 @@ async def smart_search(search_query: SearchQuery):
     
     logger.debug(f"构建的最终提示 (前300字符): {final_prompt[:300]}...")
 
-    # 3. 定义一个异步生成器，用于流式处理
-    async def stream_generator():
-        # a. 通过 SSE 发送溯源文档事件
+    # 3. 定义一个异步生成器，产出 (事件名, 数据)。它在后台任务中运行并写入缓冲，客户端断开不会中止生成
+    async def generate_events():
+        # a. 溯源文档事件
         # logger.debug(f"retrieved_docs: {type(retrieved_docs[0])}")
-        yield f"event: source\ndata: {json.dumps(retrieved_docs, ensure_ascii=False)}\n\n"
-        logger.info("已将溯源文档事件发送到前端")
+        yield "source", source_payload(retrieved_docs, source_mode)
+        logger.info("已将溯源文档事件写入缓冲")
 
         # b. 准备并开始流式调用 vLLM
         payload = {
@@ -135,33 +182,49 @@ async def smart_search(search_query: SearchQuery):
             "Authorization": f"Bearer {settings.VLLM_API_KEY}"
         }
         logger.info(f"正在调用 vLLM 模型服务: {settings.VLLM_API_URL}")
-        try: 
-            async with httpx.AsyncClient() as client:
-                # 调用模型客户端接口获取流式响应
-                async with client.stream("POST", settings.VLLM_API_URL, json=payload, headers=headers, timeout=60.0) as response:
-                    response.raise_for_status()
-                    logger.info("成功连接到 vLLM 流式服务")
-                    # 流式处理部分
-                    # vLLM 的 OpenAI 兼容接口返回 SSE 格式的流 (Server-Sent Events)
-                    async for line in response.aiter_lines():  # aiter_lines 用于异步迭代器，运行逐行读取异步生成的数据
-                        if line.startswith("data:"):  # 处理数据
-                            data_str = line[len("data:"):].strip()
-                            if data_str == "[DONE]":
-                                break
-                            if not data_str:
-                                continue
-                            try:
-                                chunk = json.loads(data_str)
-                                if 'choices' in chunk and chunk['choices'][0].get('delta', {}).get('content'):
-                                    token = chunk['choices'][0]['delta']['content']
-                                    # 将每个 token 作为 'token' 事件发送
-                                    yield f"event: token\ndata: {json.dumps({"token": token})}\n\n" 
-                            except json.JSONDecodeError:
-                                continue
-            logger.info("vLLM 流式传输完成")
-        except Exception as e:
-            logger.error(f"调用LLM流式接口时出错: {e}", exc_info=True)
-            error_message = json.dumps({"error": "处理请求时发生内部错误"}, ensure_ascii=False)
-            yield f"event: error\ndata: {error_message}\n\n"
-        yield "event: end\ndata: {}\n\n"
-    return StreamingResponse(stream_generator(), media_type="text/event-stream")
\ No newline at end of file
+        async with httpx.AsyncClient() as client:
+            # 调用模型客户端接口获取流式响应
+            async with client.stream("POST", settings.VLLM_API_URL, json=payload, headers=headers, timeout=60.0) as response:
+                response.raise_for_status()
+                logger.info("成功连接到 vLLM 流式服务")
+                # 流式处理部分
+                # vLLM 的 OpenAI 兼容接口返回 SSE 格式的流 (Server-Sent Events)
+                async for line in response.aiter_lines():  # aiter_lines 用于异步迭代器，运行逐行读取异步生成的数据
+                    if line.startswith("data:"):  # 处理数据
+                        data_str = line[len("data:"):].strip()
+                        if data_str == "[DONE]":
+                            break
+                        if not data_str:
+                            continue
+                        try:
+                            chunk = json.loads(data_str)
+                            if 'choices' in chunk and chunk['choices'][0].get('delta', {}).get('content'):
+                                token = chunk['choices'][0]['delta']['content']
+                                # 将每个 token 作为 'token' 事件发送
+                                yield "token", {"token": token}
+                        except json.JSONDecodeError:
+                            continue
+        logger.info("vLLM 流式传输完成")
+
+    # 出错时缓冲中写入 error 事件，最后总是写入 end 事件；Redis 不可用时直接转发，事件不带 id
+    stream = metered(await sse_buffer.open(generate_events), f"smart-search source_mode={source_mode}", started_at,
+                     logger)
+    return StreamingResponse(stream, media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.get("/sources/{chunk_id:path}", summary="溯源文本块详情")
+async def get_source(chunk_id: str):
+    """
+    按 ID 获取一个溯源文本块的完整正文和 metadata，紧凑溯源模式下前端点开来源时调用
+    """
+    try:
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            response = await client.get(f"{settings.INTERNAL_RAG_API_URL}/sources/{quote(chunk_id, safe='')}")
+    except httpx.RequestError as e:
+        logger.error(f"调用RAG服务失败: {e}", exc_info=True)
+        raise HTTPException(status_code=503, detail=f"无法连接到内部检索服务: {str(e)}")
+    if response.status_code == 404:
+        raise HTTPException(status_code=404, detail="文本块不存在")
+    if response.status_code != 200:
+        raise HTTPException(status_code=502, detail="获取文本块失败")
+    return response.json()
@@ -1,4 +1,5 @@
 import os
+from typing import Dict, List
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings
 
@@ -23,14 +24,93 @@ class Settings(BaseSettings):
     # 文本切分器配置
     CHUNK_SIZE: int = 300
     CHUNK_OVERLAP: int = 50
+    # 文本块长度的计量单位: "char" 按字符，"token" 按分词器的 token 数。修改后需要重建向量集合
+    CHUNK_LENGTH_UNIT: str = "char"
+    CHUNK_TOKENIZER_DIR: str = ""  # 按 token 计长时使用的分词器目录，为空时使用 EMBEDDING_MODEL_DIR
 
     # 向量数据库配置
+    VECTOR_STORE_BACKEND: str = "chroma_http"  # "chroma_http" | "chroma_persistent" (单机嵌入式) | "memory" (测试、基准)
+    CHROMA_PERSIST_DIR: str = "/root/autodl-tmp/chroma_data"  # chroma_persistent 后端的数据目录
     CHROMA_SERVER_HOST: str = "127.0.0.1"
     CHROMA_SERVER_PORT: int = 8030
     CHROMA_SERVER_SSL: bool = False  # 是否启用 HTTPS
     CHROMA_RAG_COLLECTION_NAME: str = "club_management_rag"
     STATIC_DOC_PATH: str = "/root/autodl-tmp/static_doc"
+    STATIC_DOC_MANIFEST_PATH: str = ""  # 静态文档导入清单路径，为空时使用 STATIC_DOC_PATH/.ingest_manifest.json
     RAG_N_RESULT: int = 5  # rag 检索 top-k
+    RAG_BATCH_MAX_QUERIES: int = 64  # /retrieve_batch 和 MCP retrieve_batch 工具一次最多接受的查询数
+    # MCP 检索服务的 HTTP 传输 (python -m app.rag.mcp_rag_service --transport http)，多个客户端共用一个进程
+    MCP_HTTP_HOST: str = "127.0.0.1"
+    MCP_HTTP_PORT: int = 8050
+    MCP_MAX_CONCURRENT_CALLS: int = 4  # 同时执行的工具调用上限，超出的调用排队等待
+    # 检索时按时间范围过滤的 metadata 字段，同步时会为它补充数值字段 "{字段}_ts" (秒级时间戳)，修改后需要重建动态数据
+    RAG_FILTER_TIME_FIELD: str = "created_at"
+    RAG_ALIAS_REFRESH_S: float = 10.0  # 重新读取集合别名的间隔，蓝绿切换最多延迟这么久生效
+    RAG_COLLECTION_KEEP_VERSIONS: int = 1  # 蓝绿切换后保留的旧版本集合数量，用于回滚
+    # 重建换了嵌入模型时，重建窗口内同步 worker 写入 active 的文本块ID排在 "{前缀}{新版本集合}" 中，由重建进程重新嵌入
+    RAG_REEMBED_QUEUE_PREFIX: str = "rag:reembed:"
+    # 集合分片: "none" 所有文本块放在同一个集合; "source" 静态手册和动态数据分别放在
+    # "{CHROMA_RAG_COLLECTION_NAME}__static" / "__dynamic" 分片中，查询并行发往各分片后合并;
+    # "time" 在 "source" 的基础上把 dynamic 分片按 (source_type, 月份) 分区，过期分区由 compact_partitions 整体删除
+    RAG_SHARDING: str = "none"
+    RAG_SHARD_QUERY_WORKERS: int = 4  # 分片并行查询的线程数
+    RAG_PARTITION_TIME_FIELD: str = "created_at"  # 决定分区月份的 metadata 字段，缺失或无法解析时使用写入时间
+    # 各 source_type 的保留月数 (分区所在月份结束后再保留多少个月)，环境变量中用 JSON 配置
+    RAG_PARTITION_RETENTION_MONTHS: Dict[str, int] = {"reminder": 3, "announcement": 12, "event": 12}
+    RAG_PARTITION_DEFAULT_RETENTION_MONTHS: int = 0  # 未列出的 source_type 的保留月数，0 表示永久保留
+    RAG_PARTITION_ARCHIVE_DIR: str = ""  # 过期分区删除前导出为 JSONL 的目录，为空时直接删除
+    RAG_PARTITION_COMPACT_INTERVAL_S: int = 86400  # compact_partitions --loop 的执行间隔
+
+    # 混合检索配置: 向量检索与 BM25 关键词检索的结果用 RRF (Reciprocal Rank Fusion) 融合
+    HYBRID_RETRIEVAL: bool = False  # 开启后写入方会向 KEYWORD_INDEX_STREAM 发布增量更新，检索进程在内存中维护 BM25 索引
+    HYBRID_CANDIDATES: int = 20  # 两路检索各取多少个候选参与融合
+    RRF_K: int = 60  # RRF 的平滑常数，越大名次靠后的结果权重越接近靠前的结果
+    KEYWORD_TOKENIZER: str = "bigram"  # "bigram": 汉字二元组，不依赖第三方库; "jieba": jieba 分词 (需要安装 jieba)
+    KEYWORD_INDEX_STREAM: str = "rag_keyword_index_stream"  # 写入方向检索进程发布增量更新的 Stream
+    KEYWORD_INDEX_STREAM_MAXLEN: int = 100000  # 增量更新 Stream 的近似最大长度
+    KEYWORD_INDEX_REFRESH_S: float = 0  # 兜底的全量重建间隔，0 表示只在启动和蓝绿切换时全量构建
+    KEYWORD_FILTER_FIELDS: List[str] = ["source_type"]  # 关键词索引记录的等值过滤字段，时间范围字段按 RAG_FILTER_TIME_FIELD 记录
+    KEYWORD_FILTER_OVERFETCH: int = 5  # where 用到未记录的字段时关键词检索多取的倍数，在向量库中筛选后截断
+
+    # 交叉编码器重排配置: 先取 RERANK_CANDIDATES 个候选，成对打分后保留前 n_results 个
+    RERANK_ENABLED: bool = False
+    RERANK_MODEL_DIR: str = "/root/autodl-tmp/BAAI/bge-reranker-base"
+    RERANK_CANDIDATES: int = 20
+    RERANK_BATCH_SIZE: int = 32
+    RERANK_MAX_LENGTH: int = 512  # (问题, 文本块) 拼接后的最大 token 数
+    RERANK_BUDGET_MS: float = 150  # 重排的延迟预算，预计超出时只给排名靠前的候选打分或跳过重排，0 表示不限制
+    RERANK_MAX_CONCURRENCY: int = 2  # 同时进行的重排上限，超出时跳过重排
+
+    # 对话内的检索复用: 追问的问题向量与上一次完整检索的问题向量余弦相似度不低于阈值时，
+    # 用新问题给 Redis 中保存的候选池重新打分，不再查询向量库
+    RAG_CONVERSATION_REUSE: bool = True
+    RAG_CONVERSATION_REUSE_THRESHOLD: float = 0.85
+    RAG_CONVERSATION_POOL_SIZE: int = 30  # 完整检索时为对话保存的候选数
+    RAG_CONVERSATION_TTL_S: int = 1800  # 对话多久没有新问题后丢弃候选池
+    RAG_CONVERSATION_MAX_AGE_S: int = 300  # 距上一次完整检索多久后不再复用候选池，复用不会延长这个期限
+    RAG_CONVERSATION_KEY_PREFIX: str = "rag:conversation:"
+
+    # MMR (最大边际相关性) 多样化: 从 n_results * RAG_MMR_FETCH_FACTOR 个候选中选出互相不重复的 n_results 个
+    RAG_MMR_ENABLED: bool = False  # 检索请求没有指定 mmr 时的默认值
+    RAG_MMR_LAMBDA: float = 0.5  # 1 表示只看相关性，越小越强调多样性
+    RAG_MMR_FETCH_FACTOR: int = 4
+
+    # 近重复文本块检测配置
+    DEDUP_MODE: str = "skip"  # "skip": 跳过近重复文本块并链接到规范文本块; "report": 只统计重复率; "off": 关闭
+    DEDUP_MAX_DISTANCE: int = 6  # 64 位 SimHash 海明距离不超过该值视为近重复，300 字左右的文本块改动几个字时距离通常在 6 以内
+    DEDUP_MIN_CHARS: int = 30  # 短于该长度的文本块不参与去重
+    DEDUP_INDEX_REFRESH_S: float = 3600  # 从集合重新加载指纹索引的间隔，用于看到其他进程写入的数据
+
+    # 静态文档导入配置
+    INGEST_WORKERS: int = max(1, (os.cpu_count() or 2) - 1)  # 并行解析 PDF 的进程数
+    INGEST_EMBED_BATCH_SIZE: int = 64  # 每次嵌入的文本块数
+    INGEST_UPLOAD_WORKERS: int = 2  # 并行上传的线程数
+    INGEST_MAX_INFLIGHT_UPLOADS: int = 4  # 同时在途的上传批次上限
+
+    # 动态文档批量回填配置
+    BACKFILL_WORKERS: int = max(1, (os.cpu_count() or 2) // 4)  # 嵌入进程数，每个进程各加载一份模型
+    BACKFILL_EMBED_BATCH_SIZE: int = 256  # 每个嵌入任务的文本块数
+    BACKFILL_UPSERT_PAGE_SIZE: int = 2048  # 每次写入向量数据库的文本块数
 
     # Redis 连接配置
     REDIS_HOST: str = os.getenv('REDIS_HOST')
@@ -39,14 +119,55 @@ class Settings(BaseSettings):
     REDIS_STREAM_NAME: str = "rag_sync_stream"
     REDIS_CONSUMER_GROUP_NAME: str = "rag_sync_consumer_group0"
     REDIS_CONSUMER_NAME: str = f"sync-worker-{os.uname().nodename}-{os.getpid()}"  # 动态生成消费者名称
-    REDIS_MESSAGES_PER_PULL: int = 64
+    REDIS_MESSAGES_PER_PULL: int = 64  # 初始拉取条数，运行时会根据嵌入耗时自适应调整
     REDIS_BLOCK_TIMEOUT_MS: int = 10000
+    REDIS_STREAM_TRIM_INTERVAL_S: int = 600  # 同步 worker 裁剪 Stream 的间隔，0 表示不裁剪
+    REDIS_STREAM_RETENTION_MAXLEN: int = 0  # 裁剪后至少保留的最新消息条数，0 表示不限制
+    REDIS_STREAM_RETENTION_MIN_AGE_S: int = 0  # 裁剪后至少保留最近多少秒的消息，0 表示不限制
+    REDIS_STREAM_TRIM_APPROXIMATE: bool = True  # 使用 XTRIM ~ 近似裁剪
+
+    # 同步 worker 配置
+    SYNC_DEBOUNCE_MS: int = 2000  # 拉到消息后继续收集的去抖窗口，窗口内同一 source_id 只嵌入最新版本，0 表示关闭
+    SYNC_DEBOUNCE_MAX_MESSAGES: int = 512  # 去抖窗口内最多累积的消息数
+    SYNC_MIN_MESSAGES_PER_PULL: int = 8  # 自适应拉取条数的下限
+    SYNC_MAX_MESSAGES_PER_PULL: int = 512  # 自适应拉取条数的上限
+    SYNC_EMBED_MAX_CHUNKS: int = 128  # 单个嵌入批次最多的文本块数
+    SYNC_EMBED_MAX_TOKENS: int = 16384  # 单个嵌入批次最多的估计 token 数
+    SYNC_EMBED_LATENCY_TARGET_MS: int = 1000  # 单个嵌入批次的目标耗时
+    SYNC_MAX_INFLIGHT_BATCHES: int = 4  # asyncio worker 中同时进行写入的批次上限
+    SYNC_BACKOFF_BASE_S: float = 0.5  # 重连指数退避的初始等待时间
+    SYNC_BACKOFF_MAX_S: float = 30.0  # 重连指数退避的最长等待时间
+    SYNC_METRICS_PORT: int = 8040  # 同步 worker 的 Prometheus /metrics 端口，0 表示不启动
+    SYNC_METRICS_LOG_INTERVAL_S: int = 60  # 输出结构化指标日志的间隔，0 表示不输出
 
     # FastAPI port
     FASTAPI_PORT: int = 8000
     INTERNAL_RAG_PORT: int = 8020
     INTERNAL_RAG_API_URL: str = "http://127.0.0.1:8020"
 
+    # sider-chat 服务端对话历史 (Redis 列表，每轮追加并裁剪)
+    CHAT_HISTORY_MAX_MESSAGES: int = 20  # 每个对话保留的最近消息条数 (用户和助手各算一条)
+    CHAT_HISTORY_TTL_S: int = 86400  # 对话多久没有新消息后删除
+    CHAT_HISTORY_KEY_PREFIX: str = "chat:history:"
+    CHAT_MAX_QUERY_CHARS: int = 2000  # 每条用户消息的最大长度 (WebSocket 和 POST /sider-chat)
+
+    # 溯源事件格式: "full" 发送完整的检索结果; "compact" 只发送 ID、标题、链接和摘要，完整内容通过 /sources/{id} 获取。
+    # 请求可以用 source_mode 参数覆盖
+    SOURCE_EVENT_MODE: str = "full"
+    SOURCE_SNIPPET_CHARS: int = 80
+    SOURCE_TITLE_FIELDS: List[str] = ["title", "name", "source"]  # 依次取第一个非空的 metadata 字段作为标题
+    SOURCE_URL_FIELDS: List[str] = ["url", "link"]
+
+    # /smart-search 的 SSE 事件缓冲 (Redis Stream)，断线后带 Last-Event-ID 重连可以续传
+    SSE_BUFFER_KEY_PREFIX: str = "sse:smart-search:"
+    SSE_BUFFER_TTL_S: int = 300  # 最后一个事件之后缓冲保留的时间
+    SSE_RESUME_IDLE_TIMEOUT_S: float = 90  # 超过这么久没有新事件就认为生成已中断 (应大于 LLM 请求超时)
+
+    # sider-chat 检索跳过: 去掉标点后整句只由问候、感谢、应答等闲聊短语组成时不检索知识库
+    RETRIEVAL_GATE_ENABLED: bool = True
+    RETRIEVAL_GATE_MAX_CHARS: int = 12  # 超过这个长度的消息总是检索
+    RETRIEVAL_GATE_EXTRA_PHRASES: List[str] = []  # 额外的闲聊短语，环境变量中用 JSON 配置
+
     # 日志配置
     LOG_LEVEL: str = "DEBUG"
 
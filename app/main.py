@@ -27,4 +27,5 @@ def read_root():
 
 app.include_router(search.router, tags=["Search"])
 app.include_router(sider_chat.router, tags=["SiderChat"])
+app.include_router(sider_chat.ws_router, tags=["SiderChat"])
 app.include_router(health.router, tags=["Health"])
\ No newline at end of file
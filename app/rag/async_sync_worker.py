@@ -0,0 +1,360 @@
+import asyncio
+import functools
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
+
+from redis import Redis, exceptions
+from redis import asyncio as aioredis
+
+from app.configs.config import settings
+from app.utils.singleton import collection_resolver, redis_pool, logger
+from app.rag.mcp_rag_service import retriever
+from app.rag.collection_alias import reembed_queue_key
+from app.rag.dedup import ChunkDeduplicator
+from app.rag.keyword_index import notify_keyword_index
+from app.rag.sync_batching import AdaptivePullSizer, backoff_delay, plan_embedding_batches
+from app.rag.sync_pipeline import SyncPipeline
+from app.rag.stream_retention import StreamTrimScheduler
+from app.rag.sync_metrics import MetricsReporter, start_metrics_server, sync_metrics
+
+
+class _ThreadedCollection:
+    """没有异步客户端的向量库后端 (嵌入式 Chroma、内存) 和分片集合在线程池中执行写入"""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.name = collection.name
+
+    async def upsert(self, **kwargs):
+        await asyncio.get_running_loop().run_in_executor(None, functools.partial(self._collection.upsert, **kwargs))
+
+
+class AsyncSyncWorker:
+    """
+    asyncio 版本的同步 worker：
+    使用 redis.asyncio 读取 Stream，使用 Chroma 的异步 HTTP 客户端写入，
+    嵌入模型在单独的线程池中运行，因此一个批次在嵌入时，前面批次的写入和 ACK 可以同时进行。
+    """
+
+    def __init__(self):
+        self.shutdown_event = asyncio.Event()
+        self.redis = None
+        self.chroma_client = None  # 只有 chroma_http 后端使用异步 HTTP 客户端
+        self.collections = {}  # 集合名 -> 异步集合对象
+        # 嵌入模型只用一个线程，避免多个批次争抢 CPU
+        self.embed_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+        self.inflight_batches = asyncio.Semaphore(settings.SYNC_MAX_INFLIGHT_BATCHES)
+        # source_id -> 尚未完成写入的任务，保证跨批次时同一 source_id 仍然后写覆盖
+        self.pending_sources: Dict[str, asyncio.Task] = {}
+        self.background_tasks = set()
+        self.sizer = AdaptivePullSizer(
+            initial_pull_size=settings.REDIS_MESSAGES_PER_PULL,
+            min_pull_size=settings.SYNC_MIN_MESSAGES_PER_PULL,
+            max_pull_size=settings.SYNC_MAX_MESSAGES_PER_PULL,
+            max_chunks=settings.SYNC_EMBED_MAX_CHUNKS,
+            target_latency_s=settings.SYNC_EMBED_LATENCY_TARGET_MS / 1000
+        )
+        # 裁剪和指标刷新是低频的管理操作，直接复用同步客户端，在线程池中执行
+        self.trimmer = StreamTrimScheduler(settings.REDIS_STREAM_TRIM_INTERVAL_S)
+        self.trim_redis = Redis(connection_pool=redis_pool)
+        self.reporter = MetricsReporter(sync_metrics, settings.SYNC_METRICS_LOG_INTERVAL_S, logger)
+        # 近重复文本块检测：重复的文本块不嵌入，记录到 duplicates 集合中
+        deduplicator = ChunkDeduplicator(
+            collection_resolver.collection,
+            retriever.get_embeddings,
+            mode=settings.DEDUP_MODE,
+            max_distance=settings.DEDUP_MAX_DISTANCE,
+            min_chars=settings.DEDUP_MIN_CHARS,
+            refresh_interval_s=settings.DEDUP_INDEX_REFRESH_S,
+            on_promoted=notify_keyword_index
+        )
+        self.pipeline = SyncPipeline(deduplicator, logger)
+
+    def request_shutdown(self):
+        """停机信号处理器"""
+        if not self.shutdown_event.is_set():
+            logger.warning("Shutdown signal received. Finishing in-flight batches before exiting...")
+            self.shutdown_event.set()
+
+    async def _sleep(self, seconds: float):
+        """可被停机信号打断的等待"""
+        try:
+            await asyncio.wait_for(self.shutdown_event.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def connect(self):
+        """连接 Redis 和 ChromaDB，并确保消费者组存在。失败时按指数退避重试。"""
+        attempt = 0
+        while not self.shutdown_event.is_set():
+            try:
+                self.redis = aioredis.Redis(
+                    host=settings.REDIS_HOST,
+                    port=settings.REDIS_PORT,
+                    db=0,
+                    password=settings.REDIS_PASSWORD,
+                    decode_responses=True
+                )
+                await self.redis.ping()
+                try:
+                    await self.redis.xgroup_create(
+                        name=settings.REDIS_STREAM_NAME,
+                        groupname=settings.REDIS_CONSUMER_GROUP_NAME,
+                        id='0-0',
+                        mkstream=True
+                    )
+                except exceptions.ResponseError as e:
+                    if "BUSYGROUP" not in str(e):
+                        raise
+
+                # 分片模式下的路由和合并由 ShardedCollection 完成，它只有同步实现，在线程池中调用
+                if settings.VECTOR_STORE_BACKEND == "chroma_http" and settings.RAG_SHARDING == "none":
+                    import chromadb
+                    self.chroma_client = await chromadb.AsyncHttpClient(
+                        host=settings.CHROMA_SERVER_HOST,
+                        port=settings.CHROMA_SERVER_PORT,
+                        ssl=settings.CHROMA_SERVER_SSL
+                    )
+                await self.write_collections()
+                logger.info(f"Async sync worker connected to Redis and the '{settings.VECTOR_STORE_BACKEND}' vector store.")
+                return
+            except Exception as e:
+                delay = backoff_delay(attempt, settings.SYNC_BACKOFF_BASE_S, settings.SYNC_BACKOFF_MAX_S)
+                logger.error(f"Failed to connect: {e}. Retrying in {delay:.2f} seconds...", extra={'msg_id': 'N/A'})
+                attempt += 1
+                await self._sleep(delay)
+
+    async def pull_messages(self) -> List[Tuple[str, Dict[str, str]]]:
+        """
+        从 Stream 拉取一批消息，并在去抖窗口内继续收集新消息。
+        """
+        count = self.sizer.pull_size
+        messages = await self.redis.xreadgroup(
+            groupname=settings.REDIS_CONSUMER_GROUP_NAME,
+            consumername=settings.REDIS_CONSUMER_NAME,
+            streams={settings.REDIS_STREAM_NAME: '>'},
+            count=count,
+            block=settings.REDIS_BLOCK_TIMEOUT_MS
+        )
+        if not messages:
+            return []
+        message_list = list(messages[0][1])
+
+        deadline = time.monotonic() + settings.SYNC_DEBOUNCE_MS / 1000
+        while len(message_list) < settings.SYNC_DEBOUNCE_MAX_MESSAGES and not self.shutdown_event.is_set():
+            remaining_ms = int((deadline - time.monotonic()) * 1000)
+            if remaining_ms <= 0:
+                break
+            more = await self.redis.xreadgroup(
+                groupname=settings.REDIS_CONSUMER_GROUP_NAME,
+                consumername=settings.REDIS_CONSUMER_NAME,
+                streams={settings.REDIS_STREAM_NAME: '>'},
+                count=min(count, settings.SYNC_DEBOUNCE_MAX_MESSAGES - len(message_list)),
+                block=remaining_ms
+            )
+            if more:
+                message_list.extend(more[0][1])
+        return message_list
+
+    async def write_collections(self, embedding: Optional[Dict] = None) -> Tuple[List, List[str]]:
+        """
+        按别名解析需要写入的集合 (蓝绿重建期间包含新旧两个版本)，返回 (集合, 需要排队重新嵌入的 building 集合名)，
+        见 CollectionAliasResolver.write_plan。
+        别名读取沿用同步解析器并带缓存，在线程池中执行；集合对象本身使用异步客户端。
+        """
+        loop = asyncio.get_running_loop()
+        if self.chroma_client is None:
+            collections, deferred = await loop.run_in_executor(None, collection_resolver.write_plan, embedding)
+            return [_ThreadedCollection(collection) for collection in collections], deferred
+        names, deferred = await loop.run_in_executor(None, collection_resolver.plan_names, embedding)
+        for name in names:
+            if name not in self.collections:
+                self.collections[name] = await self.chroma_client.get_or_create_collection(name=name)
+        return [self.collections[name] for name in names], deferred
+
+    async def _queue_reembed(self, deferred: List[str], ids: List[str]):
+        """building 版本换了嵌入模型时不双写，把文本块ID放进重新嵌入队列，见 app.rag.collection_alias"""
+        routed = {name: chunk_ids for name, chunk_ids in collection_resolver.route_deferred(deferred, ids).items()
+                  if chunk_ids}
+        if not routed:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for name, chunk_ids in routed.items():
+            pipe.sadd(reembed_queue_key(name, settings.RAG_REEMBED_QUEUE_PREFIX), *chunk_ids)
+        await pipe.execute()
+
+    async def _upsert(self, batch: Dict[str, list], embeddings: List[List[float]], collections: List,
+                      deferred: List[str]) -> bool:
+        """写入一个嵌入批次，返回是否成功。无论成功与否都会释放在途批次名额。"""
+        try:
+            # 先登记重新嵌入，再写入，登记失败时本批次按失败处理
+            await self._queue_reembed(deferred, batch["ids"])
+            upsert_start = time.perf_counter()
+            for collection in collections:
+                await collection.upsert(
+                    ids=batch["ids"],
+                    embeddings=embeddings,
+                    metadatas=batch["metadatas"],
+                    documents=batch["documents"]
+                )
+            sync_metrics.observe_upsert(time.perf_counter() - upsert_start)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to upsert batch. Error: {e}", extra={"msg_id": "batch_operation"})
+            return False
+        finally:
+            self.inflight_batches.release()
+
+    async def _finalize(self, message_list: List[Tuple[str, Dict[str, str]]], message_count: int, prepared,
+                        batches, upserts, dedup_collections: List, duplicates_by_msg: Dict[str, List[Dict]]):
+        """等待一次拉取的所有写入完成后统一 ACK"""
+        results = await asyncio.gather(*upserts)
+        failed_msg_ids = set()
+        for batch, ok in zip(batches, results):
+            if not ok:
+                failed_msg_ids.update(batch["msg_ids"])
+        processed = await asyncio.get_running_loop().run_in_executor(
+            None, self.pipeline.finalize, dedup_collections, prepared, duplicates_by_msg, failed_msg_ids,
+            message_count)
+        total_chunks = sum(len(batch["ids"]) for batch in batches)
+        logger.info(
+            f"Successfully processed and upserted chunks from {len(processed)} original messages "
+            f"({total_chunks} chunks in {len(batches)} embedding batches).")
+
+        # 与同步版本一致：全部 ACK 以防止毒丸消息，失败的消息记录日志和失败数后丢弃，不会重试
+        await self._ack([msg_id for msg_id, _ in message_list])
+
+    async def _ack(self, msg_ids: List[str]):
+        if not msg_ids:
+            return
+        try:
+            await self.redis.xack(settings.REDIS_STREAM_NAME, settings.REDIS_CONSUMER_GROUP_NAME, *msg_ids)
+        except Exception as e:
+            logger.error(f"Failed to ACK {len(msg_ids)} messages: {e}", extra={'msg_id': 'N/A'})
+
+    def _track(self, task: asyncio.Task, source_ids):
+        self.background_tasks.add(task)
+        for source_id in source_ids:
+            self.pending_sources[source_id] = task
+
+        def _done(finished):
+            self.background_tasks.discard(finished)
+            for source_id in source_ids:
+                if self.pending_sources.get(source_id) is finished:
+                    del self.pending_sources[source_id]
+
+        task.add_done_callback(_done)
+
+    async def handle_pull(self, message_list: List[Tuple[str, Dict[str, str]]]):
+        """
+        合并、切分并嵌入一次拉取的消息。嵌入在当前协程中按顺序进行，
+        写入和 ACK 放到后台任务中，与下一批次的拉取和嵌入重叠。
+        """
+        latest_messages = self.pipeline.coalesce(message_list)
+
+        # 同一 source_id 的旧版本仍在写入时，先等它完成，保证后写覆盖
+        source_ids = {msg_data.get('source_id') for _, msg_data in latest_messages if msg_data.get('source_id')}
+        earlier_tasks = {self.pending_sources[s] for s in source_ids if s in self.pending_sources}
+        if earlier_tasks:
+            await asyncio.gather(*earlier_tasks, return_exceptions=True)
+
+        loop = asyncio.get_running_loop()
+        prepared = await loop.run_in_executor(None, self.pipeline.prepare_messages, latest_messages)
+        if not prepared:
+            # 如果所有消息都解析失败，也要 ACK，防止毒丸消息
+            sync_metrics.observe_processed([], 0, failed_count=len(latest_messages))
+            await self._ack([msg_id for msg_id, _ in message_list])
+            return
+
+        # 跟上 active 集合的嵌入模型 (模型在嵌入线程中加载)，整次拉取使用同一份写入计划
+        await loop.run_in_executor(self.embed_executor, retriever.sync_embedding_model)
+        embedding = retriever.embedding
+        collections, deferred = await self.write_collections(embedding)
+        # 近重复检测要读写 duplicates 集合，沿用同步客户端，在线程池中执行
+        dedup_collections, _ = await loop.run_in_executor(None, collection_resolver.write_plan, embedding)
+        prepared, duplicates_by_msg = await loop.run_in_executor(
+            None, self.pipeline.deduplicate, prepared, dedup_collections[0])
+        if deferred and duplicates_by_msg:
+            # 近重复文本块只会从 active 中移除，也要排队，重建进程发现它不在 active 中时会从新版本删除
+            await self._queue_reembed(deferred, [record["id"] for records in duplicates_by_msg.values()
+                                                 for record in records])
+
+        total_chunks = sum(len(chunk_ids) for _, chunk_ids, _, _ in prepared)
+        self.sizer.observe_pull(len(latest_messages), total_chunks)
+        batches = plan_embedding_batches(prepared, self.sizer.chunk_budget, settings.SYNC_EMBED_MAX_TOKENS)
+
+        upserts = []
+        for batch in batches:
+            embed_start = time.perf_counter()
+            try:
+                embeddings = await loop.run_in_executor(self.embed_executor, retriever.get_embeddings, batch["documents"])
+            except Exception as e:
+                logger.error(f"Failed to embed batch. Error: {e}", extra={"msg_id": "batch_operation"})
+                upserts.append(asyncio.sleep(0, result=False))
+                continue
+            embed_elapsed = time.perf_counter() - embed_start
+            sync_metrics.observe_embed(embed_elapsed)
+            self.sizer.observe_embedding(len(batch["ids"]), embed_elapsed)
+
+            # 限制在途写入批次数量，防止写入跟不上时内存无限增长
+            await self.inflight_batches.acquire()
+            upserts.append(asyncio.create_task(self._upsert(batch, embeddings, collections, deferred)))
+
+        finalize_task = asyncio.create_task(
+            self._finalize(message_list, len(latest_messages), prepared, batches, upserts, dedup_collections,
+                           duplicates_by_msg))
+        self._track(finalize_task, source_ids)
+
+    async def run(self):
+        await self.connect()
+
+        attempt = 0
+        while not self.shutdown_event.is_set():
+            try:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, self.trimmer.maybe_trim, self.trim_redis)
+                await loop.run_in_executor(None, self.reporter.maybe_report, self.trim_redis,
+                                           settings.REDIS_STREAM_NAME, settings.REDIS_CONSUMER_GROUP_NAME)
+
+                # 在拉取之前跟上 active 集合的嵌入模型，加载失败时不拉取消息，留在 Stream 中等待重试
+                await loop.run_in_executor(self.embed_executor, retriever.sync_embedding_model)
+                message_list = await self.pull_messages()
+                attempt = 0
+                if message_list:
+                    await self.handle_pull(message_list)
+            except Exception as e:
+                # 连接错误和其他未知错误都按指数退避重试，redis.asyncio 会在下一次命令时自动重连
+                delay = backoff_delay(attempt, settings.SYNC_BACKOFF_BASE_S, settings.SYNC_BACKOFF_MAX_S)
+                kind = "Redis connection error" if isinstance(e, exceptions.ConnectionError) \
+                    else "An unexpected error occurred in the main loop"
+                logger.error(f"{kind}: {e}. Retrying in {delay:.2f} seconds...", extra={'msg_id': 'N/A'})
+                attempt += 1
+                await self._sleep(delay)
+
+        # 停机前等待所有在途写入和 ACK 完成
+        if self.background_tasks:
+            await asyncio.gather(*self.background_tasks, return_exceptions=True)
+        self.embed_executor.shutdown(wait=True)
+        if self.redis is not None:
+            await self.redis.aclose()
+
+
+async def main():
+    worker = AsyncSyncWorker()
+    loop = asyncio.get_running_loop()
+    # 注册信号处理器
+    loop.add_signal_handler(signal.SIGINT, worker.request_shutdown)
+    loop.add_signal_handler(signal.SIGTERM, worker.request_shutdown)
+    if settings.SYNC_METRICS_PORT:
+        metrics_redis = Redis(connection_pool=redis_pool)
+        refresh = functools.partial(sync_metrics.refresh_stream_state, metrics_redis, settings.REDIS_STREAM_NAME,
+                                    settings.REDIS_CONSUMER_GROUP_NAME)
+        if start_metrics_server(sync_metrics, settings.SYNC_METRICS_PORT, refresh=refresh, logger=logger):
+            logger.info(f"Sync metrics exposed at http://0.0.0.0:{settings.SYNC_METRICS_PORT}/metrics")
+    await worker.run()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
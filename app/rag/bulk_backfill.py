@@ -0,0 +1,194 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Tuple, Callable, Optional
+
+from redis import Redis
+
+from app.configs.config import settings
+from app.utils.singleton import collection_resolver, logger, redis_pool
+from app.rag.dynamic_chunks import build_dynamic_chunks
+from app.rag.collection_alias import embedding_signature, queue_reembed
+from app.rag.keyword_index import notify_keyword_index
+from app.rag.embedding_workers import init_embedding_worker, embed_texts
+
+
+def iter_snapshot_records(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    逐条读取业务库导出的快照，每条记录与同步 Stream 的消息结构相同:
+    {"source_id": ..., "content": ..., "metadata": {...} 或 JSON 字符串}
+    支持 JSONL 和 Parquet (需要安装 pandas 和 pyarrow)。
+    """
+    if path.endswith(".parquet"):
+        try:
+            import pandas as pd
+        except ImportError as e:
+            raise RuntimeError("Reading Parquet snapshots requires pandas and pyarrow") from e
+        yield from pd.read_parquet(path).to_dict(orient="records")
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.error(f"Skipping malformed line {line_number} in {path}: {e}")
+
+
+def load_latest_records(path: str) -> List[Dict[str, Any]]:
+    """同一个 source_id 在快照中出现多次时，与同步 worker 一样只保留最后一条"""
+    latest = OrderedDict()
+    for record in iter_snapshot_records(path):
+        key = str(record.get("source_id") or "")
+        latest.pop(key, None)
+        latest[key] = record
+    return list(latest.values())
+
+
+def iter_chunks(records: List[Dict[str, Any]], stats: Dict[str, Any]) -> Iterator[Tuple[str, str, Dict]]:
+    """按与同步 worker 相同的规则切分记录，逐个产出 (chunk_id, 文本块, metadata)"""
+    for record in records:
+        source_id = record.get("source_id")
+        try:
+            chunk_ids, chunks, metadatas = build_dynamic_chunks(
+                str(source_id) if source_id is not None else None, record.get("content"), record.get("metadata"))
+        except Exception as e:
+            stats["failed_records"] += 1
+            logger.error(f"Failed to parse record {source_id}. Error: {e}")
+            continue
+        stats["records"] += 1
+        yield from zip(chunk_ids, chunks, metadatas)
+
+
+def _create_embed_pool(workers: int, embed_fn: Optional[Callable]):
+    """
+    返回 (执行器, 嵌入函数)。
+    调用方已经加载了模型时 (例如蓝绿重建中)，直接在本进程的单个线程里复用它：
+    此时 fork 出的子进程会继承已初始化的 torch 线程池，有死锁风险；spawn 又会在子进程里重新导入主模块。
+    """
+    if embed_fn is not None:
+        return ThreadPoolExecutor(max_workers=1), embed_fn
+    # 主进程没有加载模型，直接 fork 即可；每个子进程按 CPU 数平分 torch 线程
+    torch_threads = max(1, (os.cpu_count() or workers) // workers)
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"),
+                               initializer=init_embedding_worker,
+                               initargs=(settings.EMBEDDING_MODEL_DIR, torch_threads))
+    return pool, embed_texts
+
+
+def backfill(path: str, collections: List = None, workers: int = None,
+             embed_batch_size: int = None, upsert_page_size: int = None,
+             embed_fn: Callable[[List[str]], List[List[float]]] = None) -> Dict[str, Any]:
+    """
+    绕过 Redis，把快照中的全部记录切分、嵌入并写入向量数据库。
+    嵌入在多个子进程中并行进行 (每个子进程一份模型)，写入按大页在线程池中进行，与嵌入重叠。
+    传入 embed_fn 时改为在本进程中用它嵌入。
+    collections 默认为别名解析出的写入集合，building 版本换了嵌入模型时不写入，改为把文本块ID放进重新嵌入队列。
+    """
+    deferred = []
+    if collections is None:
+        # 子进程按配置加载模型，维度要等第一批嵌入完成才知道，这里只按模型名比较
+        collections, deferred = collection_resolver.write_plan(embedding_signature(settings.EMBEDDING_MODEL_NAME))
+    workers = workers or settings.BACKFILL_WORKERS
+    embed_batch_size = embed_batch_size or settings.BACKFILL_EMBED_BATCH_SIZE
+    upsert_page_size = upsert_page_size or settings.BACKFILL_UPSERT_PAGE_SIZE
+    start_time = time.perf_counter()
+
+    records = load_latest_records(path)
+    logger.info(f"Loaded {len(records)} unique records from {path}. Backfilling into "
+                f"{[c.name for c in collections]} with {workers} embedding processes.")
+
+    stats = {"records": 0, "failed_records": 0, "chunks": 0, "failed_chunks": 0}
+    page_ids, page_documents, page_metadatas, page_embeddings = [], [], [], []
+    uploads = deque()
+
+    def upsert_page(ids, documents, metadatas, embeddings):
+        if deferred:
+            queue_reembed(Redis(connection_pool=redis_pool), collection_resolver.route_deferred(deferred, ids),
+                          settings.RAG_REEMBED_QUEUE_PREFIX)
+        for collection in collections:
+            collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+        notify_keyword_index(ids)
+        return len(ids)
+
+    def drain_upload():
+        future = uploads.popleft()
+        try:
+            stats["chunks"] += future.result()
+        except Exception as e:
+            stats["failed_chunks"] += future.page_size
+            logger.error(f"Failed to upsert page. Error: {e}")
+
+    def submit_page():
+        nonlocal page_ids, page_documents, page_metadatas, page_embeddings
+        while len(uploads) >= 2:
+            drain_upload()
+        future = upload_pool.submit(upsert_page, page_ids, page_documents, page_metadatas, page_embeddings)
+        future.page_size = len(page_ids)
+        uploads.append(future)
+        page_ids, page_documents, page_metadatas, page_embeddings = [], [], [], []
+
+    def collect_embedding(job):
+        nonlocal page_embeddings
+        future, ids, documents, metadatas = job
+        try:
+            page_embeddings.extend(future.result())
+        except Exception as e:
+            stats["failed_chunks"] += len(ids)
+            logger.error(f"Failed to embed batch of {len(ids)} chunks. Error: {e}")
+            return
+        page_ids.extend(ids)
+        page_documents.extend(documents)
+        page_metadatas.extend(metadatas)
+        if len(page_ids) >= upsert_page_size:
+            submit_page()
+
+    pool, embed = _create_embed_pool(workers, embed_fn)
+    with pool as embed_pool, ThreadPoolExecutor(max_workers=2) as upload_pool:
+        jobs = deque()
+        batch = []
+        for chunk in iter_chunks(records, stats):
+            batch.append(chunk)
+            if len(batch) < embed_batch_size:
+                continue
+            ids, documents, metadatas = (list(column) for column in zip(*batch))
+            jobs.append((embed_pool.submit(embed, documents), ids, documents, metadatas))
+            batch = []
+            # 限制在途的嵌入任务数量，按提交顺序收集结果
+            while len(jobs) > workers * 2:
+                collect_embedding(jobs.popleft())
+
+        if batch:
+            ids, documents, metadatas = (list(column) for column in zip(*batch))
+            jobs.append((embed_pool.submit(embed, documents), ids, documents, metadatas))
+        while jobs:
+            collect_embedding(jobs.popleft())
+        if page_ids:
+            submit_page()
+        while uploads:
+            drain_upload()
+
+    elapsed = time.perf_counter() - start_time
+    stats["elapsed_s"] = elapsed
+    logger.info(
+        f"Backfill finished: {stats['records']} records, {stats['chunks']} chunks upserted in {elapsed:.1f}s "
+        f"({stats['chunks'] / max(elapsed, 1e-9):.1f} chunks/s), {stats['failed_records']} records and "
+        f"{stats['failed_chunks']} chunks failed.")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="从 JSONL/Parquet 快照批量回填动态文档，绕过 Redis")
+    parser.add_argument("path", help="快照文件路径 (.jsonl 或 .parquet)")
+    parser.add_argument("--collection", help="写入指定集合 (例如蓝绿重建中的新版本)，默认写入别名解析出的集合")
+    parser.add_argument("--workers", type=int, default=None, help="嵌入进程数")
+    args = parser.parse_args()
+
+    target = [collection_resolver.collection(args.collection)] if args.collection else None
+    backfill(args.path, collections=target, workers=args.workers)
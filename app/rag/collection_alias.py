@@ -0,0 +1,184 @@
+import json
+import re
+import threading
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+# 别名记录保存在一个单独的小集合里，只有一条 ID 为 "alias" 的记录，文档内容是 JSON。
+# 别名集合与向量集合放在同一个向量库中，检索服务和同步 worker 都能直接读取，不需要额外的存储。
+# 这里的 client 是 app.rag.vector_store 中的 VectorStore。
+#
+# 别名记录同时登记每个版本所用的嵌入模型 (active_embedding / building_embedding，见 embedding_signature)。
+# 重建换了嵌入模型或向量维度时，同步 worker 不能把旧模型的向量双写进新版本：
+# 写入只发往模型一致的集合，模型不一致的 building 版本改为把文本块ID放进重新嵌入队列 (Redis 集合)，
+# 由重建进程在切换前后用新模型补齐。active 版本的模型与写入方不一致时拒绝写入 (EmbeddingMismatchError)。
+ALIAS_RECORD_ID = "alias"
+_PLACEHOLDER_EMBEDDING = [0.0]
+
+
+class EmbeddingMismatchError(RuntimeError):
+    """写入方的嵌入模型与 active 集合登记的模型不一致"""
+
+
+def embedding_signature(model: str, dim: Optional[int] = None, model_dir: Optional[str] = None) -> Dict[str, Any]:
+    """嵌入模型的标识: 模型名、向量维度 (未知时为 None) 和模型目录 (检索服务切换模型时从这里加载)"""
+    return {"model": model, "dim": dim, "dir": model_dir}
+
+
+def same_embedding(a: Optional[Dict[str, Any]], b: Optional[Dict[str, Any]]) -> bool:
+    """
+    两个嵌入模型是否一致：比较模型名，两边都知道维度时也比较维度。
+    任意一边未登记 (引入本字段之前建的集合) 时视为一致。
+    """
+    if not a or not b:
+        return True
+    if a.get("model") != b.get("model"):
+        return False
+    return a.get("dim") is None or b.get("dim") is None or a["dim"] == b["dim"]
+
+
+def reembed_queue_key(collection_name: str, prefix: str = "rag:reembed:") -> str:
+    """重建窗口内需要用新模型重新嵌入的文本块ID (Redis 集合)，每个 building 版本一个"""
+    return f"{prefix}{collection_name}"
+
+
+def queue_reembed(redis, deferred: Dict[str, List[str]], prefix: str = "rag:reembed:"):
+    """把 route_deferred 的结果 (集合名 -> 文本块ID) 写入重新嵌入队列"""
+    deferred = {name: ids for name, ids in deferred.items() if ids}
+    if not deferred:
+        return
+    pipe = redis.pipeline(transaction=False)
+    for name, ids in deferred.items():
+        pipe.sadd(reembed_queue_key(name, prefix), *ids)
+    pipe.execute()
+
+
+def alias_collection_name(base_name: str) -> str:
+    return f"{base_name}__alias"
+
+
+def versioned_collection_name(base_name: str, version: int) -> str:
+    return f"{base_name}__v{version}"
+
+
+def parse_version(base_name: str, collection_name: str) -> Optional[int]:
+    """从 '{base}__v{n}' 中解析版本号，不是该基础名的版本集合时返回 None"""
+    match = re.fullmatch(re.escape(base_name) + r"__v(\d+)", collection_name)
+    return int(match.group(1)) if match else None
+
+
+def list_collection_names(client) -> List[str]:
+    return list(client.list_collections())
+
+
+def list_versions(client, base_name: str) -> List[int]:
+    versions = (parse_version(base_name, name) for name in list_collection_names(client))
+    return sorted(v for v in versions if v is not None)
+
+
+def read_alias(client, base_name: str) -> Dict[str, Any]:
+    """
+    读取别名记录: {"active": 当前对外服务的集合, "building": 正在重建的集合或 None,
+    "active_embedding" / "building_embedding": 两个集合的嵌入模型 (embedding_signature) 或 None}。
+    从未做过蓝绿重建时，直接使用未带版本号的原始集合。
+    """
+    record = {"active": base_name, "building": None, "active_embedding": None, "building_embedding": None}
+    alias_collection = client.get_or_create_collection(name=alias_collection_name(base_name))
+    result = alias_collection.get(ids=[ALIAS_RECORD_ID], include=["documents"])
+    if result["ids"]:
+        record.update(json.loads(result["documents"][0]))
+    return record
+
+
+def write_alias(client, base_name: str, record: Dict[str, Any]):
+    """整条覆盖别名记录。单条 upsert 在 Chroma 中是原子的，读者要么看到旧记录，要么看到新记录。"""
+    alias_collection = client.get_or_create_collection(name=alias_collection_name(base_name))
+    alias_collection.upsert(
+        ids=[ALIAS_RECORD_ID],
+        embeddings=[_PLACEHOLDER_EMBEDDING],
+        documents=[json.dumps(record, ensure_ascii=False)],
+        metadatas=[{"updated_at": time.time()}]
+    )
+
+
+class CollectionAliasResolver:
+    """
+    按别名解析当前应读写的集合，并缓存一小段时间，避免每次检索都多一次网络往返。
+    - 读: 只读 active 集合
+    - 写: active 集合，以及重建窗口内的 building 集合 (双写)。
+      写入向量时应通过 write_plan 传入写入方的嵌入模型：只双写到模型一致的 building 集合，
+      其余的 building 集合改为把文本块ID放进重新嵌入队列 (route_deferred + queue_reembed)
+    """
+
+    def __init__(self, client, base_name: str, refresh_interval_s: float):
+        self.client = client
+        self.base_name = base_name
+        self.refresh_interval_s = refresh_interval_s
+        self._lock = threading.Lock()
+        self._record = None
+        self._loaded_at = 0.0
+        self._collections = {}
+
+    def _current_record(self) -> Dict[str, Any]:
+        with self._lock:
+            if self._record is None or time.monotonic() - self._loaded_at >= self.refresh_interval_s:
+                record = read_alias(self.client, self.base_name)
+                if self._record is not None and record != self._record:
+                    # 别名切换后丢弃旧集合的缓存
+                    self._collections = {}
+                self._record = record
+                self._loaded_at = time.monotonic()
+            return self._record
+
+    def refresh(self):
+        """强制在下一次访问时重新读取别名"""
+        with self._lock:
+            self._loaded_at = 0.0
+
+    def collection(self, name: str):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = self.client.get_or_create_collection(name=name)
+            return self._collections[name]
+
+    def active_name(self) -> str:
+        return self._current_record()["active"]
+
+    def active_embedding(self) -> Optional[Dict[str, Any]]:
+        return self._current_record().get("active_embedding")
+
+    def plan_names(self, embedding: Optional[Dict[str, Any]]) -> Tuple[List[str], List[str]]:
+        """write_plan 的集合名版本，embedding 为 None 时不检查模型 (删除等不涉及向量的写入)"""
+        record = self._current_record()
+        if embedding is not None and not same_embedding(embedding, record.get("active_embedding")):
+            raise EmbeddingMismatchError(
+                f"'{record['active']}' is embedded with {record.get('active_embedding')}, "
+                f"refusing to write vectors from {embedding}")
+        names, deferred = [record["active"]], []
+        if record.get("building") and record["building"] != record["active"]:
+            if embedding is None or same_embedding(embedding, record.get("building_embedding")):
+                names.append(record["building"])
+            else:
+                deferred.append(record["building"])
+        return names, deferred
+
+    def write_names(self) -> List[str]:
+        return self.plan_names(None)[0]
+
+    def active_collection(self):
+        return self.collection(self.active_name())
+
+    def write_collections(self) -> List:
+        return [self.collection(name) for name in self.write_names()]
+
+    def write_plan(self, embedding: Dict[str, Any]) -> Tuple[List, List[str]]:
+        """
+        写入方用 embedding 这个模型生成向量时的写入计划 (基于同一份别名记录):
+        (需要写入的集合, 模型不一致、改为排队重新嵌入的 building 集合名)
+        """
+        names, deferred = self.plan_names(embedding)
+        return [self.collection(name) for name in names], deferred
+
+    def route_deferred(self, deferred: List[str], ids: List[str]) -> Dict[str, List[str]]:
+        """把写入的文本块ID分配给 write_plan 返回的 building 集合，结果可直接交给 queue_reembed"""
+        return {name: list(ids) for name in deferred}
@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+from app.configs.config import settings
+from app.utils.singleton import vector_store, collection_resolver, logger
+from app.rag.collection_alias import list_collection_names, read_alias
+from app.rag.dedup import ChunkDeduplicator, duplicates_collection_name
+from app.rag.keyword_index import notify_keyword_index
+from app.rag.partitions import TimePartitioner
+from app.rag.sharding import shard_base_name
+
+# 时间分区的压缩任务 (RAG_SHARDING=time 时使用)：按 source_type 的保留期整体删除过期分区，
+# 可以先导出为 JSONL 归档。可以由 cron 定时执行一次，也可以用 --loop 常驻按 RAG_PARTITION_COMPACT_INTERVAL_S 执行。
+# 删除分区后，处理挂在被删除文本块名下的近重复文本块：本身也已过期的直接删除，其余的重新嵌入后写回。
+
+
+def _embed(texts: List[str]) -> List[List[float]]:
+    # 只有需要把近重复文本块写回时才加载嵌入模型
+    from app.rag.mcp_rag_service import retriever
+    return retriever.get_embeddings(texts)
+
+
+deduplicator = ChunkDeduplicator(
+    collection_resolver.collection,
+    _embed,
+    mode=settings.DEDUP_MODE,
+    max_distance=settings.DEDUP_MAX_DISTANCE,
+    min_chars=settings.DEDUP_MIN_CHARS,
+    refresh_interval_s=settings.DEDUP_INDEX_REFRESH_S,
+    on_promoted=notify_keyword_index
+)
+
+
+def read_chunk_ids(collection, page_size: int = 1000, archive_path: str = None) -> List[str]:
+    """读出分区中的所有文本块ID；传入 archive_path 时同时把文本块导出为 JSONL"""
+    include = ["documents", "metadatas"] if archive_path else []
+    ids, offset = [], 0
+    archive = open(archive_path, "w", encoding="utf-8") if archive_path else None
+    try:
+        while True:
+            page = collection.get(include=include, limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            offset += len(page["ids"])
+            ids.extend(page["ids"])
+            if archive is not None:
+                for chunk_id, document, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+                    archive.write(json.dumps({"id": chunk_id, "document": document, "metadata": metadata},
+                                             ensure_ascii=False) + "\n")
+    finally:
+        if archive is not None:
+            archive.close()
+    return ids
+
+
+def compact_duplicates(collections: List, partitioner: TimePartitioner, now: datetime = None,
+                       page_size: int = 1000) -> Dict[str, int]:
+    """
+    删除本身已过期的近重复记录，并让规范文本块已不存在的近重复文本块顶替上来。
+    不只检查本次删除的文本块：同步 worker 的指纹索引刷新之前，新文本块仍可能被链接到已删除的文本块上。
+    """
+    stats = {"expired_duplicates": 0, "promoted": 0}
+    if deduplicator.mode != "skip" or not collections:
+        return stats
+    name = duplicates_collection_name(collections[0].name)
+    if name not in list_collection_names(vector_store):
+        return stats
+    duplicates = vector_store.get_collection(name=name)
+
+    expired, canonical_ids, offset = [], set(), 0
+    while True:
+        page = duplicates.get(include=["metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        offset += len(page["ids"])
+        for chunk_id, metadata in zip(page["ids"], page["metadatas"]):
+            if chunk_id.startswith("dynamic::") and partitioner.is_expired(*partitioner.partition_for(metadata), now):
+                expired.append(chunk_id)
+            else:
+                canonical_ids.add(metadata["canonical_id"])
+    for i in range(0, len(expired), page_size):
+        duplicates.delete(ids=expired[i:i + page_size])
+    stats["expired_duplicates"] = len(expired)
+
+    canonical_ids = sorted(canonical_ids)
+    existing = set()
+    for i in range(0, len(canonical_ids), page_size):
+        existing.update(collections[0].get(ids=canonical_ids[i:i + page_size], include=[])["ids"])
+    missing = sorted(set(canonical_ids) - existing)
+    # 指纹索引从删除分区后的集合重新加载，被删除的文本块不会再被当作规范文本块
+    deduplicator.invalidate()
+    stats["promoted"] = deduplicator.promote_orphans(collections, missing)
+    return stats
+
+
+def compact(now: datetime = None, archive_dir: str = None, dry_run: bool = False) -> Dict[str, Any]:
+    """删除 dynamic 分片当前版本 (以及重建中的新版本) 的所有过期分区"""
+    if settings.RAG_SHARDING != "time":
+        logger.warning(f"RAG_SHARDING is '{settings.RAG_SHARDING}', time partitions are not enabled. Nothing to compact.")
+        return {"dropped": []}
+    start_time = time.perf_counter()
+    now = now or datetime.now(timezone.utc)
+    base_name = shard_base_name(settings.CHROMA_RAG_COLLECTION_NAME, "dynamic")
+    record = read_alias(vector_store, base_name)
+    names = [record["active"]] + ([record["building"]] if record.get("building") else [])
+
+    dropped, dropped_ids, partitioner = [], [], None
+    for name in names:
+        collection = collection_resolver.shard_collection("dynamic", name)
+        partitioner = collection.partitioner
+        for partition, (source_type, month) in sorted(collection.partitions().items()):
+            if not partitioner.is_expired(source_type, month, now):
+                continue
+            if dry_run:
+                logger.info(f"[dry run] Would drop expired partition '{partition}'.")
+                dropped.append(partition)
+                continue
+            archive_path = os.path.join(archive_dir, f"{partition}.jsonl") if archive_dir else None
+            ids = read_chunk_ids(vector_store.get_collection(name=partition), archive_path=archive_path)
+            vector_store.delete_collection(name=partition)
+            dropped.append(partition)
+            if name == record["active"]:
+                dropped_ids.extend(ids)
+            logger.info(f"Dropped expired partition '{partition}' ({len(ids)} chunks"
+                        f"{', archived to ' + archive_path if archive_path else ''}).")
+        collection.invalidate()
+
+    stats = {"dropped": dropped, "chunks": len(dropped_ids)}
+    notify_keyword_index(deleted_ids=dropped_ids)
+    if not dry_run and partitioner is not None:
+        stats.update(compact_duplicates(collection_resolver.write_collections(), partitioner, now))
+    stats["elapsed_s"] = time.perf_counter() - start_time
+    logger.info(f"Partition compaction finished in {stats['elapsed_s']:.1f}s: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="删除 (或归档后删除) 超过保留期的动态数据时间分区")
+    parser.add_argument("--archive-dir", default=settings.RAG_PARTITION_ARCHIVE_DIR or None,
+                        help="删除前把分区导出为 JSONL 的目录")
+    parser.add_argument("--dry-run", action="store_true", help="只列出会被删除的分区")
+    parser.add_argument("--loop", action="store_true", help="常驻运行，每隔 RAG_PARTITION_COMPACT_INTERVAL_S 秒执行一次")
+    args = parser.parse_args()
+
+    if args.archive_dir:
+        os.makedirs(args.archive_dir, exist_ok=True)
+    while True:
+        try:
+            compact(archive_dir=args.archive_dir, dry_run=args.dry_run)
+        except Exception as e:
+            if not args.loop:
+                raise
+            logger.error(f"Partition compaction failed: {e}", exc_info=True)
+        if not args.loop:
+            break
+        time.sleep(settings.RAG_PARTITION_COMPACT_INTERVAL_S)
@@ -0,0 +1,111 @@
+import base64
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+# 同一段对话里连续的问题通常围绕同一个社团或流程，每轮都从头检索既慢，前后回答引用的资料也可能不一致。
+# 每个对话在 Redis 中保存上一次完整检索的问题向量 (锚点) 和候选池 (文本、metadata、向量)。
+# 新问题的向量与锚点足够接近时，直接用新问题向量给候选池重新打分，不再查询向量库；
+# 关键词检索命中的、不在池中的文本块按 id 补进候选池 (增量扩展)。
+# 锚点只在完整检索时更新，连续复用不会让候选池逐渐偏离；集合版本或过滤条件变化时不复用。
+# 候选池中的文本是完整检索时的快照，距上一次完整检索超过 max_age_s 后不再复用 (复用不会延长这个期限)，
+# 这期间被更新或删除的文本块最多被沿用 max_age_s。
+
+
+def encode_vector(vector) -> str:
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def decode_vector(text: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(text), dtype=np.float32)
+
+
+def retrieval_scope(collection_name: str, where: Optional[Dict[str, Any]],
+                    where_document: Optional[Dict[str, Any]]) -> str:
+    """候选池只在相同的集合版本和过滤条件下复用"""
+    return json.dumps([collection_name, where, where_document], sort_keys=True, ensure_ascii=False, default=str)
+
+
+def rescore_candidates(candidates: List[Dict[str, Any]], query_embedding) -> List[Dict[str, Any]]:
+    """按新问题向量重新计算相似度 (与 Chroma l2 距离一致: 1 - 距离平方) 并从高到低排序"""
+    if not candidates:
+        return []
+    query = np.asarray(query_embedding, dtype=np.float32)
+    matrix = np.asarray([candidate["embedding"] for candidate in candidates], dtype=np.float32)
+    similarities = 1 - np.sum((matrix - query) ** 2, axis=1)
+    order = np.argsort(-similarities, kind="stable")
+    return [dict(candidates[i], similarity=float(similarities[i]), rrf_score=None) for i in order]
+
+
+class ConversationRetrievalStore:
+    def __init__(self, redis_factory: Callable[[], Any], ttl_s: int = 1800, key_prefix: str = "rag:conversation:",
+                 reuse_threshold: float = 0.85, max_pool: int = 40, max_age_s: float = 300):
+        """
+        redis_factory: 返回 Redis 客户端 (decode_responses=True)
+        ttl_s: 对话多久没有新问题后丢弃候选池
+        reuse_threshold: 新问题与锚点问题向量的余弦相似度达到这个值时复用候选池
+        max_pool: 候选池最多保留的文本块数
+        max_age_s: 距上一次完整检索多久后必须重新完整检索
+        """
+        self.redis_factory = redis_factory
+        self.ttl_s = ttl_s
+        self.max_age_s = max_age_s
+        self.key_prefix = key_prefix
+        self.reuse_threshold = reuse_threshold
+        self.max_pool = max_pool
+        self.counts = {"reused": 0, "refreshed": 0}
+
+    def _key(self, conversation_id: str) -> str:
+        return f"{self.key_prefix}{conversation_id}"
+
+    def load(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        raw = self.redis_factory().get(self._key(conversation_id))
+        if not raw:
+            return None
+        context = json.loads(raw)
+        context["anchor"] = decode_vector(context["anchor"])
+        for candidate in context["candidates"]:
+            candidate["embedding"] = decode_vector(candidate["embedding"])
+        return context
+
+    def save(self, conversation_id: str, anchor, candidates: List[Dict[str, Any]], scope: str,
+             anchored_at: float = None):
+        """
+        保存锚点问题向量和候选池 (候选需要带 "embedding")。
+        anchored_at: 锚点所在的完整检索的时间，复用候选池时传入原来的值，不传表示刚完整检索过；
+        过期时间不超过 anchored_at + max_age_s，复用不会延长候选池的寿命
+        """
+        now = time.time()
+        anchored_at = now if anchored_at is None else anchored_at
+        remaining_s = int(anchored_at + self.max_age_s - now)
+        if remaining_s <= 0:
+            return
+        context = {
+            "anchor": encode_vector(anchor),
+            "scope": scope,
+            "anchored_at": anchored_at,
+            "candidates": [
+                {"id": candidate["id"], "content": candidate["content"], "metadata": candidate["metadata"],
+                 "embedding": encode_vector(candidate["embedding"])}
+                for candidate in candidates[:self.max_pool]
+            ]
+        }
+        self.redis_factory().set(self._key(conversation_id), json.dumps(context, ensure_ascii=False),
+                                 ex=min(self.ttl_s, remaining_s))
+
+    def reusable(self, context: Optional[Dict[str, Any]], query_embedding, scope: str) -> bool:
+        """候选池是否可以用于新问题：范围相同、没有超过 max_age_s，且问题向量与锚点足够接近"""
+        if not context or context["scope"] != scope or not context["candidates"]:
+            return False
+        if time.time() - context.get("anchored_at", 0) >= self.max_age_s:
+            return False
+        query = np.asarray(query_embedding, dtype=np.float32)
+        anchor = context["anchor"]
+        denominator = float(np.linalg.norm(query) * np.linalg.norm(anchor))
+        return denominator > 0 and float(query @ anchor) / denominator >= self.reuse_threshold
+
+    def stats(self) -> Dict[str, float]:
+        total = self.counts["reused"] + self.counts["refreshed"]
+        return {**self.counts, "reuse_ratio": self.counts["reused"] / total if total else 0.0}
@@ -0,0 +1,307 @@
+import hashlib
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 入库前的近重复文本块检测。
+# 每个文本块按字符 n-gram 计算 64 位 SimHash，海明距离不超过 max_distance 的视为近重复。
+# 索引按鸽巢原理把指纹分成 max_distance + 1 段，距离不超过 max_distance 的两个指纹至少有一段完全相同，
+# 因此只需要比较某一段相同的候选，而不用和全部指纹逐一比较。
+#
+# 索引中只有真正写入了向量集合的 "规范" 文本块，启动时从集合的文档重新计算，不需要额外维护一份状态。
+# 被跳过的近重复文本块 (原文、metadata 和对应的规范文本块ID) 保存在旁边的 "{集合名}__duplicates" 集合中，
+# 规范文本块被修改或删除后，挂在它名下的重复文本块会被重新嵌入并写回向量集合，内容不会丢失。
+
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 3
+DUPLICATES_SUFFIX = "__duplicates"
+_PLACEHOLDER_EMBEDDING = [0.0]
+_DEDUP_KEYS = ("canonical_id", "simhash")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def duplicates_collection_name(collection_name: str) -> str:
+    return f"{collection_name}{DUPLICATES_SUFFIX}"
+
+
+def simhash(text: str, shingle_size: int = SHINGLE_SIZE) -> int:
+    """按字符 n-gram 计算 64 位 SimHash。空白统一折叠，避免排版差异影响指纹"""
+    text = _WHITESPACE.sub(" ", text).strip()
+    if len(text) <= shingle_size:
+        shingles = [text]
+    else:
+        shingles = [text[i:i + shingle_size] for i in range(len(text) - shingle_size + 1)]
+    digests = b"".join(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest() for s in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8), bitorder="little").reshape(-1, SIMHASH_BITS)
+    # 每一位上超过半数的 n-gram 为 1，则指纹的这一位为 1
+    fingerprint_bits = (bits.sum(axis=0) * 2 > len(shingles)).astype(np.uint8)
+    return int.from_bytes(np.packbits(fingerprint_bits, bitorder="little").tobytes(), "little")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class SimHashIndex:
+    """chunk_id -> 指纹，支持按海明距离查找近重复"""
+
+    def __init__(self, max_distance: int = 6):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        bounds = [round(SIMHASH_BITS * i / bands) for i in range(bands + 1)]
+        self._bands = [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]
+        self._tables = [{} for _ in self._bands]  # 每段: 段的取值 -> chunk_id 集合
+        self._fingerprints = {}
+
+    def __len__(self):
+        return len(self._fingerprints)
+
+    def __contains__(self, chunk_id: str):
+        return chunk_id in self._fingerprints
+
+    def _keys(self, fingerprint: int):
+        return [(fingerprint >> shift) & mask for shift, mask in self._bands]
+
+    def get(self, chunk_id: str) -> Optional[int]:
+        return self._fingerprints.get(chunk_id)
+
+    def add(self, chunk_id: str, fingerprint: int):
+        self.remove(chunk_id)
+        self._fingerprints[chunk_id] = fingerprint
+        for table, key in zip(self._tables, self._keys(fingerprint)):
+            table.setdefault(key, set()).add(chunk_id)
+
+    def remove(self, chunk_id: str):
+        fingerprint = self._fingerprints.pop(chunk_id, None)
+        if fingerprint is None:
+            return
+        for table, key in zip(self._tables, self._keys(fingerprint)):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(chunk_id)
+                if not bucket:
+                    del table[key]
+
+    def find_near(self, fingerprint: int, exclude_id: str = None) -> Optional[str]:
+        """返回距离最近的近重复文本块ID，忽略 exclude_id (同一文本块的旧版本不算重复)"""
+        best_id, best_distance = None, self.max_distance + 1
+        seen = set()
+        for table, key in zip(self._tables, self._keys(fingerprint)):
+            for candidate in table.get(key, ()):
+                if candidate == exclude_id or candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = hamming_distance(fingerprint, self._fingerprints[candidate])
+                if distance > self.max_distance:
+                    continue
+                # 距离相同时取ID较小的，保证结果与集合的遍历顺序无关
+                if distance < best_distance or (distance == best_distance and candidate < best_id):
+                    best_id, best_distance = candidate, distance
+        return best_id
+
+
+class ChunkDeduplicator:
+    """
+    在嵌入之前过滤近重复文本块。
+    - mode="skip": 近重复文本块不嵌入、不写入向量集合，记录到 duplicates 集合并链接到规范文本块
+    - mode="report": 只统计重复率，全部照常写入
+    - mode="off": 不做检测
+    写入多个集合 (蓝绿重建双写) 时，以第一个集合的索引为准做判断，结果同样应用到其他集合。
+    on_promoted(ids) 在重复文本块顶替写回向量集合后调用 (通知关键词索引)。
+    """
+
+    def __init__(self, get_collection: Callable[[str], Any], embed_fn: Callable[[List[str]], List[List[float]]],
+                 mode: str = "skip", max_distance: int = 6, min_chars: int = 30,
+                 refresh_interval_s: float = 3600, page_size: int = 1000,
+                 on_promoted: Callable[[List[str]], None] = None):
+        if mode not in ("off", "report", "skip"):
+            raise ValueError(f"Unknown dedup mode: {mode}")
+        self.get_collection = get_collection
+        self.embed_fn = embed_fn
+        self.mode = mode
+        self.max_distance = max_distance
+        self.min_chars = min_chars
+        self.refresh_interval_s = refresh_interval_s
+        self.page_size = page_size
+        self.on_promoted = on_promoted
+        self._lock = threading.RLock()
+        self._indexes = {}  # 集合名 -> (SimHashIndex, 加载时间)
+        self.checked_total = 0
+        self.duplicates_total = 0
+        self.promoted_total = 0
+        self.last_load_s = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def dedup_rate(self) -> float:
+        return self.duplicates_total / self.checked_total if self.checked_total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {"checked": self.checked_total, "duplicates": self.duplicates_total,
+                "promoted": self.promoted_total, "dedup_rate": round(self.dedup_rate(), 4),
+                "index_load_s": self.last_load_s}
+
+    def _fingerprint(self, text: str) -> Optional[int]:
+        # 太短的文本块 (标题、页眉等) 指纹不可靠，不参与去重
+        if not text or len(text.strip()) < self.min_chars:
+            return None
+        return simhash(text)
+
+    def _load_index(self, collection) -> SimHashIndex:
+        index = SimHashIndex(self.max_distance)
+        offset = 0
+        while True:
+            page = collection.get(include=["documents"], limit=self.page_size, offset=offset)
+            if not page["ids"]:
+                break
+            offset += len(page["ids"])
+            for chunk_id, document in zip(page["ids"], page["documents"]):
+                fingerprint = self._fingerprint(document)
+                if fingerprint is not None:
+                    index.add(chunk_id, fingerprint)
+        return index
+
+    def index(self, collection) -> SimHashIndex:
+        """返回集合的指纹索引，首次使用或超过刷新间隔时从集合重新加载，以便看到其他进程写入的数据"""
+        with self._lock:
+            index, loaded_at = self._indexes.get(collection.name, (None, 0.0))
+            if index is None or time.monotonic() - loaded_at >= self.refresh_interval_s:
+                start = time.perf_counter()
+                index = self._load_index(collection)
+                self._indexes[collection.name] = (index, time.monotonic())
+                self.last_load_s = time.perf_counter() - start
+            return index
+
+    def invalidate(self, collection=None):
+        """写入失败后丢弃索引 (里面可能有未写入成功的文本块)，下次使用时重新加载"""
+        with self._lock:
+            if collection is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(collection.name, None)
+
+    def filter_chunks(self, collection, ids: List[str], documents: List[str],
+                      metadatas: List[Dict]) -> Tuple[List[int], List[Dict[str, Any]]]:
+        """
+        检查一批文本块，返回 (需要嵌入并写入的下标, 近重复记录)。
+        同一批次中靠后的文本块也会与靠前的比较。近重复记录在写入成功后交给 record_stored。
+        """
+        if not self.enabled:
+            return list(range(len(ids))), []
+        keep, duplicates = [], []
+        with self._lock:
+            index = self.index(collection)
+            for i, (chunk_id, document) in enumerate(zip(ids, documents)):
+                fingerprint = self._fingerprint(document)
+                if fingerprint is None:
+                    keep.append(i)
+                    continue
+                self.checked_total += 1
+                canonical_id = index.find_near(fingerprint, exclude_id=chunk_id)
+                if canonical_id is not None:
+                    self.duplicates_total += 1
+                if canonical_id is None or self.mode == "report":
+                    index.add(chunk_id, fingerprint)
+                    keep.append(i)
+                    continue
+                # 同一ID之前可能是规范文本块，现在内容变成了别的文本块的重复
+                index.remove(chunk_id)
+                duplicates.append({"id": chunk_id, "document": document, "metadata": metadatas[i],
+                                   "simhash": fingerprint, "canonical_id": canonical_id})
+        return keep, duplicates
+
+    def _write_duplicates(self, collections: List, duplicates: List[Dict[str, Any]]):
+        ids = [d["id"] for d in duplicates]
+        metadatas = [dict(d["metadata"], canonical_id=d["canonical_id"], simhash=f"{d['simhash']:016x}")
+                     for d in duplicates]
+        for collection in collections:
+            self.get_collection(duplicates_collection_name(collection.name)).upsert(
+                ids=ids,
+                embeddings=[_PLACEHOLDER_EMBEDDING] * len(ids),
+                documents=[d["document"] for d in duplicates],
+                metadatas=metadatas
+            )
+            # 这些ID的旧版本可能已经写入过向量集合
+            collection.delete(ids=ids)
+
+    def record_stored(self, collections: List, stored_ids: List[str], duplicates: List[Dict[str, Any]]):
+        """
+        在文本块写入成功后调用：
+        - 已写入的文本块如果之前是重复记录，从 duplicates 集合中移除
+        - 记录本批的近重复文本块，并从向量集合中删除它们的旧版本
+        - 规范文本块内容变化后，重新检查挂在它们名下的重复文本块
+        """
+        if self.mode != "skip":
+            return
+        for collection in collections:
+            if stored_ids:
+                self.get_collection(duplicates_collection_name(collection.name)).delete(ids=stored_ids)
+        if duplicates:
+            self._write_duplicates(collections, duplicates)
+        self.promote_orphans(collections, stored_ids + [d["id"] for d in duplicates])
+
+    def remove(self, collections: List, chunk_ids: List[str]):
+        """文本块从向量集合中删除后调用：清理索引和重复记录，并让挂在它们名下的重复文本块顶替上来"""
+        if not self.enabled or not collections or not chunk_ids:
+            return
+        with self._lock:
+            index = self.index(collections[0])
+            for chunk_id in chunk_ids:
+                index.remove(chunk_id)
+        if self.mode != "skip":
+            return
+        for collection in collections:
+            self.get_collection(duplicates_collection_name(collection.name)).delete(ids=chunk_ids)
+        self.promote_orphans(collections, chunk_ids)
+
+    def promote_orphans(self, collections: List, changed_ids: List[str]) -> int:
+        """
+        changed_ids 中的文本块被修改或删除后，挂在它们名下的重复文本块可能已经不再重复：
+        仍与某个规范文本块近重复的，改挂到那个文本块下；否则重新嵌入并写回向量集合。
+        """
+        if not collections or not changed_ids or self.mode != "skip":
+            return 0
+        primary = collections[0]
+        duplicates_collection = self.get_collection(duplicates_collection_name(primary.name))
+        orphans = {"ids": [], "documents": [], "metadatas": []}
+        for i in range(0, len(changed_ids), 256):
+            page = duplicates_collection.get(where={"canonical_id": {"$in": changed_ids[i:i + 256]}},
+                                             include=["documents", "metadatas"])
+            for key in orphans:
+                orphans[key].extend(page[key])
+        if not orphans["ids"]:
+            return 0
+
+        relinked, promoted = [], []
+        with self._lock:
+            index = self.index(primary)
+            for chunk_id, document, metadata in zip(orphans["ids"], orphans["documents"], orphans["metadatas"]):
+                fingerprint = int(metadata["simhash"], 16)
+                original = {k: v for k, v in metadata.items() if k not in _DEDUP_KEYS}
+                canonical_id = index.find_near(fingerprint, exclude_id=chunk_id)
+                if canonical_id is not None:
+                    if canonical_id != metadata["canonical_id"]:
+                        relinked.append({"id": chunk_id, "document": document, "metadata": original,
+                                         "simhash": fingerprint, "canonical_id": canonical_id})
+                    continue
+                index.add(chunk_id, fingerprint)
+                promoted.append((chunk_id, document, original))
+
+        if relinked:
+            self._write_duplicates(collections, relinked)
+        if promoted:
+            ids, documents, metadatas = (list(column) for column in zip(*promoted))
+            embeddings = self.embed_fn(documents)
+            for collection in collections:
+                collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+                self.get_collection(duplicates_collection_name(collection.name)).delete(ids=ids)
+            with self._lock:
+                self.promoted_total += len(ids)
+            if self.on_promoted is not None:
+                self.on_promoted(ids)
+        return len(promoted)
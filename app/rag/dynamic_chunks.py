@@ -0,0 +1,69 @@
+import json
+from typing import List, Dict, Tuple, Any, Union
+
+from app.configs.config import settings
+from app.rag.metadata_fields import normalize_metadata
+from app.rag.text_splitter import create_text_splitter
+
+# 动态文档 (来自业务数据库的社团、活动等) 的切分与ID规则。
+# 同步 worker 和批量回填共用这里的实现，保证两条路径产生完全相同的文本块ID和 metadata，
+# 回填之后实时同步可以直接接着运行而不会产生重复数据。
+# 这个模块会在进程池的子进程中导入，不要在这里导入嵌入模型或向量数据库客户端。
+
+text_splitter = create_text_splitter(
+    settings.CHUNK_SIZE,
+    settings.CHUNK_OVERLAP,
+    length_unit=settings.CHUNK_LENGTH_UNIT,
+    tokenizer_dir=settings.CHUNK_TOKENIZER_DIR or settings.EMBEDDING_MODEL_DIR
+)
+
+
+def sanitize_metadata_value(value):
+    """
+    【工具函数】
+    如果值是列表或字典，将其JSON序列化为字符串。
+    否则，按原样返回。
+    """
+    if isinstance(value, (list, dict)):
+        try:
+            # 使用紧凑的格式，不带不必要的空格
+            return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+        except TypeError:
+            # 如果JSON序列化失败，将其转换为字符串作为最后的保障
+            return str(value)
+    return value
+
+
+def parse_metadata(metadata: Union[str, Dict[str, Any], None]) -> Dict[str, Any]:
+    """Stream 中的 metadata 是 JSON 字符串，快照导出中可能已经是字典，两种都接受"""
+    if metadata is None:
+        return {}
+    if isinstance(metadata, dict):
+        return metadata
+    return json.loads(metadata) if metadata.strip() else {}
+
+
+def build_dynamic_chunks(source_id_base: str, content: str,
+                         metadata: Union[str, Dict[str, Any], None]) -> Tuple[List[str], List[str], List[Dict]]:
+    """
+    切分一篇动态文档，返回 (chunk_ids, 文本块列表, metadata 列表)。
+    """
+    # 检查必要字段是否存在且不为空
+    if not source_id_base or not content:
+        raise ValueError("Message is missing 'source_id' or 'content', or they are empty.")
+
+    source_id = "dynamic::" + source_id_base
+    chunks = text_splitter.split_text(content)
+
+    # 安全地处理 metadata
+    raw_metadata = parse_metadata(metadata)
+    sanitized_metadata = {key: sanitize_metadata_value(value) for key, value in raw_metadata.items()}
+
+    if not sanitized_metadata:
+        sanitized_metadata['source'] = source_id_base
+    # 补充检索过滤用的字段 (数值时间戳等)
+    sanitized_metadata = normalize_metadata(sanitized_metadata, [settings.RAG_FILTER_TIME_FIELD])
+
+    # 为每个切分出的文本块准备数据
+    chunk_ids = [f"{source_id}::chunk::{i}" for i in range(len(chunks))]
+    return chunk_ids, chunks, [sanitized_metadata] * len(chunks)
@@ -0,0 +1,21 @@
+from typing import List
+
+# 进程池子进程中使用的嵌入函数。每个子进程在初始化时加载一份嵌入模型，
+# 这个模块只在子进程里用到 sentence_transformers，主进程导入它不会加载模型。
+
+_model = None
+
+
+def init_embedding_worker(model_dir: str, torch_threads: int):
+    """进程池 initializer：限制每个子进程的 torch 线程数，避免多进程之间抢占 CPU，然后加载模型"""
+    global _model
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(max(1, torch_threads))
+    _model = SentenceTransformer(model_dir)
+
+
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    """与 KnowledgeRetrieverMCP.get_embeddings 保持一致：归一化后返回 Python 列表"""
+    return _model.encode(texts, normalize_embeddings=True).tolist()
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+from typing import Callable, Collection, List, Dict, Any, Optional, Set, Tuple
+
+MANIFEST_VERSION = 1
+
+
+def file_sha256(file_path: str, block_size: int = 1 << 20) -> str:
+    """分块计算文件的 SHA-256，避免一次性把大 PDF 读入内存"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_path: str, target: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    读取导入清单，返回 filename -> {path, size, mtime, sha256, chunk_ids}。
+    清单不存在、版本不匹配或记录的导入目标 (向量库后端和集合) 与 target 不同时返回空清单，相当于全量导入。
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('version') != MANIFEST_VERSION:
+        return {}
+    if target is not None and data.get('target') != target:
+        return {}
+    return data.get('files', {})
+
+
+def save_manifest(manifest_path: str, files: Dict[str, Dict[str, Any]], target: Optional[str] = None):
+    """先写临时文件再原子替换，防止中途退出留下损坏的清单"""
+    directory = os.path.dirname(os.path.abspath(manifest_path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': MANIFEST_VERSION, 'target': target, 'files': files}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def missing_from_collection(filenames: List[str], manifest: Dict[str, Dict[str, Any]],
+                            existing_ids: Callable[[List[str]], Collection[str]], page_size: int = 1000) -> List[str]:
+    """
+    清单认为未变化、但记录的文本块已不在集合中的文件 (集合被清空或重建)，这些文件需要重新导入。
+    existing_ids 返回给定ID中实际存在于集合的那些，只查询ID，不读取正文和向量
+    """
+    owner = {chunk_id: filename for filename in filenames for chunk_id in manifest[filename].get('chunk_ids', [])}
+    chunk_ids = list(owner)
+    missing: Set[str] = set()
+    for i in range(0, len(chunk_ids), page_size):
+        page = chunk_ids[i:i + page_size]
+        found = set(existing_ids(page))
+        missing.update(owner[chunk_id] for chunk_id in page if chunk_id not in found)
+    return [filename for filename in filenames if filename in missing]
+
+
+def plan_incremental_ingest(pdf_dir: str, manifest: Dict[str, Dict[str, Any]],
+                            force: bool = False) -> Tuple[List[str], List[str], List[str], Dict[str, Dict[str, Any]]]:
+    """
+    对比目录和清单，决定哪些文件需要处理。
+
+    大小和修改时间都没变的文件直接视为未变化，不计算哈希；
+    只有大小或修改时间变化时才计算哈希，内容相同（例如只是被 touch 过）仍视为未变化。
+
+    返回值:
+    (需要导入的文件, 未变化的文件, 已删除的文件, 扫描到的文件指纹 filename -> {path, size, mtime, sha256})
+    """
+    to_ingest, unchanged, fingerprints = [], [], {}
+    on_disk = sorted(f for f in os.listdir(pdf_dir) if f.endswith(".pdf"))
+
+    for filename in on_disk:
+        file_path = os.path.join(pdf_dir, filename)
+        stat = os.stat(file_path)
+        entry = manifest.get(filename)
+        fingerprint = {'path': file_path, 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+        if not force and entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            fingerprint['sha256'] = entry['sha256']
+            unchanged.append(filename)
+        else:
+            fingerprint['sha256'] = file_sha256(file_path)
+            if not force and entry and entry['sha256'] == fingerprint['sha256']:
+                unchanged.append(filename)
+            else:
+                to_ingest.append(filename)
+        fingerprints[filename] = fingerprint
+
+    deleted = sorted(set(manifest) - set(on_disk))
+    return to_ingest, unchanged, deleted, fingerprints
@@ -1,79 +1,292 @@
+import argparse
+import multiprocessing
 import os
 import random
-
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyMuPDFLoader
+import time
+from typing import List, Dict, Any, Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 
 from app.configs.config import settings
-from app.utils.singleton import chroma_collection
-from app.utils.singleton import logger
-from app.rag.mcp_rag_service import retriever
-
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=settings.CHUNK_SIZE,
-    chunk_overlap=settings.CHUNK_OVERLAP,
-    separators=["\n\n", "\n", "。", "，", "、", " "],
-    length_function=len
-)
-
-def init_vector_db(pdf_dir: str):
+from app.rag.pdf_loader import load_and_split_pdf
+from app.rag.ingest_manifest import load_manifest, missing_from_collection, save_manifest, plan_incremental_ingest
+from app.rag.dedup import ChunkDeduplicator
+from app.rag.collection_alias import queue_reembed
+from app.rag.keyword_index import notify_keyword_index
+
+# 解析进程池以 spawn 启动，子进程会重新导入主模块 (python -m 运行本模块时就是这里)。
+# 因此本模块顶层只导入轻量的依赖，嵌入模型 (retriever) 和向量数据库客户端 (app.utils.singleton)
+# 都在函数内部按需导入，子进程只会加载 pdf_loader。
+
+_deduplicator: Optional[ChunkDeduplicator] = None
+
+
+def get_deduplicator() -> ChunkDeduplicator:
+    """近重复文本块检测器：不同 PDF 中重复的模板段落只保留一份。第一次调用时创建"""
+    global _deduplicator
+    if _deduplicator is None:
+        from app.utils.singleton import collection_resolver
+        from app.rag.mcp_rag_service import retriever
+        _deduplicator = ChunkDeduplicator(
+            collection_resolver.collection,
+            retriever.get_embeddings,
+            mode=settings.DEDUP_MODE,
+            max_distance=settings.DEDUP_MAX_DISTANCE,
+            min_chars=settings.DEDUP_MIN_CHARS,
+            refresh_interval_s=settings.DEDUP_INDEX_REFRESH_S,
+            on_promoted=notify_keyword_index
+        )
+    return _deduplicator
+
+
+def _upsert_batch(collections, batch_ids, batch_embeddings, batch_texts, batch_metadatas, duplicates,
+                  reembed=None):
     """
-    从PDF目录初始化向量数据库，通过HTTP客户端连接。
+    通过HTTP客户端批量上传数据，并登记本批次的近重复文本块，在上传线程池中执行。
+    reembed 为 (解析器, 模型不一致的 building 集合名)，这些集合不写入，改为把文本块ID放进重新嵌入队列
+    (近重复文本块也排队，重建进程发现它不在 active 中时会从新版本删除)
     """
-    logger.info(f"Starting to process PDF files from directory: {pdf_dir}")
+    if reembed and reembed[1]:
+        from app.utils.singleton import redis_pool
+        from redis import Redis
+        resolver, deferred = reembed
+        queued_ids = list(batch_ids) + [record["id"] for record in duplicates]
+        queue_reembed(Redis(connection_pool=redis_pool), resolver.route_deferred(deferred, queued_ids),
+                      settings.RAG_REEMBED_QUEUE_PREFIX)
+    if batch_ids:
+        for collection in collections:
+            collection.upsert(
+                ids=batch_ids,
+                embeddings=batch_embeddings,
+                documents=batch_texts,
+                metadatas=batch_metadatas
+            )
+    get_deduplicator().record_stored(collections, batch_ids, duplicates)
+    notify_keyword_index(batch_ids, deleted_ids=[record["id"] for record in duplicates])
+
+
+def ingest_pdf_files(pdf_dir: str, filenames: List[str], collections: List = None) -> Dict[str, Any]:
+    """
+    解析、嵌入并上传指定的 PDF 文件。
+    PDF 的解析和切分在进程池中并行进行，切分结果流入主进程的嵌入队列；
+    嵌入在主进程中按批进行，上传在线程池中进行，与下一批的嵌入重叠。
+    collections 默认为别名解析出的写入集合 (蓝绿重建期间包含新旧两个版本，新版本换了嵌入模型时改为排队重新嵌入)。
+    """
+    from app.utils.singleton import collection_resolver, logger
+    from app.rag.mcp_rag_service import retriever
+
+    deduplicator = get_deduplicator()
+    reembed = None
+    if collections is None:
+        retriever.sync_embedding_model()
+        collections, deferred = collection_resolver.write_plan(retriever.embedding)
+        reembed = (collection_resolver, deferred)
     # 定义批处理大小，避免一次性向量化上万个条目，提高稳健性
-    batch_size = 64
+    batch_size = settings.INGEST_EMBED_BATCH_SIZE
+    start_time = time.perf_counter()
+
+    failures = {}  # filename -> 错误信息
+    file_chunk_ids = {}  # filename -> 该文件的所有文本块ID
+    pending_ids, pending_texts, pending_metadatas, pending_files = [], [], [], []
+    uploads = {}  # future -> 该批次涉及的文件
+    total_chunks = 0
 
-    for filename in os.listdir(pdf_dir):
-        if not filename.endswith(".pdf"):
-            continue
+    def collect_uploads(block: bool):
+        # 收集已完成的上传；block=True 时至少等待一个完成，用于限制在途上传数量
+        if not uploads:
+            return
+        if block:
+            done, _ = wait(list(uploads), return_when=FIRST_COMPLETED)
+        else:
+            done = [future for future in uploads if future.done()]
+        for future in done:
+            batch_files = uploads.pop(future)
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Failed to upsert batch for files {sorted(batch_files)}. Error: {e}")
+                deduplicator.invalidate()
+                for name in batch_files:
+                    failures.setdefault(name, f"upsert failed: {e}")
 
-        file_path = os.path.join(pdf_dir, filename)
-        logger.info(f"Processing file: {file_path}")
+    def flush(limit: int):
+        # 嵌入并提交前 limit 个待处理文本块
+        nonlocal pending_ids, pending_texts, pending_metadatas, pending_files
+        batch_ids, batch_texts = pending_ids[:limit], pending_texts[:limit]
+        batch_metadatas, batch_files = pending_metadatas[:limit], set(pending_files[:limit])
+        pending_ids, pending_texts = pending_ids[limit:], pending_texts[limit:]
+        pending_metadatas, pending_files = pending_metadatas[limit:], pending_files[limit:]
+
+        # 近重复文本块不嵌入，写入成功后登记到 duplicates 集合
+        keep, duplicates = deduplicator.filter_chunks(collections[0], batch_ids, batch_texts, batch_metadatas)
+        if len(keep) < len(batch_ids):
+            batch_ids = [batch_ids[i] for i in keep]
+            batch_texts = [batch_texts[i] for i in keep]
+            batch_metadatas = [batch_metadatas[i] for i in keep]
 
         try:
-            # 准备 pdf loader 和 文本块
-            loader = PyMuPDFLoader(file_path)
-            chunks = loader.load_and_split(text_splitter=text_splitter)
+            batch_embeddings = retriever.get_embeddings(batch_texts) if batch_texts else []
+        except Exception as e:
+            logger.error(f"Failed to embed batch for files {sorted(batch_files)}. Error: {e}")
+            deduplicator.invalidate()
+            for name in batch_files:
+                failures.setdefault(name, f"embedding failed: {e}")
+            return
 
-            if not chunks:
+        while len(uploads) >= settings.INGEST_MAX_INFLIGHT_UPLOADS:
+            collect_uploads(block=True)
+        future = upload_pool.submit(_upsert_batch, collections, batch_ids, batch_embeddings, batch_texts,
+                                    batch_metadatas, duplicates, reembed)
+        uploads[future] = batch_files
+        collect_uploads(block=False)
+
+    # 子进程使用 spawn 启动，避免 fork 已加载嵌入模型 (已初始化 torch 线程池) 的主进程；
+    # 子进程重新导入主模块时只会加载 pdf_loader，见模块开头的说明
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=settings.INGEST_WORKERS, mp_context=mp_context) as parse_pool, \
+            ThreadPoolExecutor(max_workers=settings.INGEST_UPLOAD_WORKERS) as upload_pool:
+        futures = {
+            parse_pool.submit(load_and_split_pdf, os.path.join(pdf_dir, filename),
+                              settings.CHUNK_SIZE, settings.CHUNK_OVERLAP, settings.CHUNK_LENGTH_UNIT,
+                              settings.CHUNK_TOKENIZER_DIR or settings.EMBEDDING_MODEL_DIR): filename
+            for filename in filenames
+        }
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                texts, metadatas = future.result()
+            except Exception as e:
+                logger.error(f"Failed to process file {filename}. Error: {e}", exc_info=True)
+                failures[filename] = f"parse failed: {e}"
+                continue
+
+            # 为每个块生成一个唯一的、确定性的ID
+            chunk_ids = [f"static::{filename}_chunk_{i}" for i in range(len(texts))]
+            file_chunk_ids[filename] = chunk_ids
+            if not texts:
                 logger.warning(f"No text chunks extracted from {filename}. Skipping.")
                 continue
 
-            # --- 3. 批量处理和上传 ---
-            for i in range(0, len(chunks), batch_size):
-                batch_chunks = chunks[i:i + batch_size]
+            logger.info(f"Parsed {filename} into {len(texts)} chunks.")
+            total_chunks += len(texts)
+            pending_ids.extend(chunk_ids)
+            pending_texts.extend(texts)
+            pending_metadatas.extend(metadatas)
+            pending_files.extend([filename] * len(texts))
+
+            while len(pending_ids) >= batch_size:
+                flush(batch_size)
+
+        if pending_ids:
+            flush(len(pending_ids))
+        while uploads:
+            collect_uploads(block=True)
+
+    elapsed = time.perf_counter() - start_time
+    succeeded = [name for name in file_chunk_ids if name not in failures]
+    logger.info(
+        f"Finished processing PDF files: {len(succeeded)}/{len(filenames)} files succeeded, "
+        f"{total_chunks} chunks in {elapsed:.1f}s ({total_chunks / max(elapsed, 1e-9):.1f} chunks/s).")
+    for name, error in sorted(failures.items()):
+        logger.error(f"  Failed: {name}: {error}")
+    dedup_stats = deduplicator.stats()
+    if deduplicator.enabled:
+        logger.info(f"Near-duplicate chunks ({deduplicator.mode}): {dedup_stats['duplicates']}/"
+                    f"{dedup_stats['checked']} ({dedup_stats['dedup_rate']:.1%}), "
+                    f"{dedup_stats['promoted']} promoted back after their canonical chunk changed.")
+    return {"files": len(filenames), "succeeded": succeeded, "failures": failures,
+            "chunk_ids": file_chunk_ids, "chunks": total_chunks, "elapsed_s": elapsed, "dedup": dedup_stats}
+
 
-                # a. 准备 upsert 所需的四项数据
-                batch_texts = [doc.page_content for doc in batch_chunks]
-                batch_metadatas = [doc.metadata for doc in batch_chunks]
+def _delete_chunks(chunk_ids: List[str]):
+    """按ID分批从所有写入集合中删除文本块，挂在它们名下的近重复文本块会顶替上来"""
+    from app.utils.singleton import collection_resolver
+
+    page_size = settings.INGEST_EMBED_BATCH_SIZE * 16
+    collections = collection_resolver.write_collections()
+    for collection in collections:
+        for i in range(0, len(chunk_ids), page_size):
+            collection.delete(ids=chunk_ids[i:i + page_size])
+    notify_keyword_index(deleted_ids=chunk_ids)
+    get_deduplicator().remove(collections, chunk_ids)
+
+
+def manifest_target() -> str:
+    """导入清单对应的向量库后端和集合，换了后端或集合时清单作废"""
+    if settings.VECTOR_STORE_BACKEND == "chroma_http":
+        location = f"{settings.CHROMA_SERVER_HOST}:{settings.CHROMA_SERVER_PORT}"
+    elif settings.VECTOR_STORE_BACKEND == "chroma_persistent":
+        location = settings.CHROMA_PERSIST_DIR
+    else:
+        location = ""
+    return f"{settings.VECTOR_STORE_BACKEND}:{location}/{settings.CHROMA_RAG_COLLECTION_NAME}"
 
-                # b. 为每个块生成一个唯一的、确定性的ID
-                batch_ids = [f"static::{filename}_chunk_{i + j}" for j in range(len(batch_chunks))]
 
-                # c. 批量生成向量
-                logger.info(f"Generating embeddings for batch {i // batch_size + 1} of file {filename}...")
-                batch_embeddings = retriever.get_embeddings(batch_texts)
+def init_vector_db(pdf_dir: str, force: bool = False):
+    """
+    从PDF目录初始化向量数据库，通过HTTP客户端连接。
+    借助导入清单增量处理：未变化的文件直接跳过，变化的文件重新切分并删除多余的旧文本块，
+    已从目录中删除的文件会从向量数据库中清除。force=True 时忽略清单，全量重新导入。
+    清单只对记录的向量库后端和集合有效；清单认为未变化、但文本块已不在 active 集合中的文件
+    (集合被清空、重建) 同样重新导入。
+    """
+    from app.utils.singleton import collection_resolver, logger
 
-                # d. 通过HTTP客户端批量上传数据
-                chroma_collection.upsert(
-                    ids=batch_ids,
-                    embeddings=batch_embeddings,
-                    documents=batch_texts,
-                    metadatas=batch_metadatas
-                )
-                logger.info(f"Successfully upserted batch of {len(batch_chunks)} chunks for {filename}.")
+    logger.info(f"Starting to process PDF files from directory: {pdf_dir}")
+    manifest_path = settings.STATIC_DOC_MANIFEST_PATH or os.path.join(pdf_dir, ".ingest_manifest.json")
+    target = manifest_target()
+    manifest = load_manifest(manifest_path, target)
+    to_ingest, unchanged, deleted, fingerprints = plan_incremental_ingest(pdf_dir, manifest, force=force)
+    active = collection_resolver.active_collection()
+    missing = missing_from_collection(unchanged, manifest,
+                                      lambda ids: active.get(ids=ids, include=[])["ids"],
+                                      page_size=settings.INGEST_EMBED_BATCH_SIZE * 16)
+    if missing:
+        logger.warning(f"{len(missing)} unchanged files have chunks missing from the collection, re-ingesting them.")
+        unchanged = sorted(set(unchanged) - set(missing))
+        to_ingest = sorted(to_ingest + missing)
+    logger.info(f"Manifest diff: {len(to_ingest)} new/changed, {len(unchanged)} unchanged, {len(deleted)} deleted.")
 
+    # 清除已删除文件的文本块
+    for filename in deleted:
+        try:
+            _delete_chunks(manifest[filename].get("chunk_ids", []))
+            del manifest[filename]
+            logger.info(f"Purged {filename} from the collection.")
         except Exception as e:
-            logger.error(f"Failed to process file {filename}. Error: {e}", exc_info=True)
+            logger.error(f"Failed to purge deleted file {filename}. Error: {e}")
 
-    logger.info("Finished processing all PDF files.")
+    # 未变化的文件只刷新指纹（例如被 touch 过、内容相同的文件）
+    for filename in unchanged:
+        manifest[filename].update(fingerprints[filename])
+
+    stats = {"succeeded": [], "failures": {}, "chunk_ids": {}}
+    if to_ingest:
+        stats = ingest_pdf_files(pdf_dir, to_ingest)
+        for filename in stats["succeeded"]:
+            new_ids = stats["chunk_ids"][filename]
+            old_ids = manifest.get(filename, {}).get("chunk_ids", [])
+            # 新版本写入成功后，再删除新版本中已不存在的旧文本块
+            stale_ids = sorted(set(old_ids) - set(new_ids))
+            if stale_ids:
+                try:
+                    _delete_chunks(stale_ids)
+                except Exception as e:
+                    logger.error(f"Failed to delete {len(stale_ids)} stale chunks of {filename}. Error: {e}")
+                    continue
+            manifest[filename] = dict(fingerprints[filename], chunk_ids=new_ids)
+
+    save_manifest(manifest_path, manifest, target)
+    logger.info(f"Finished processing all PDF files. Manifest saved to {manifest_path}.")
+    return stats
 
 
 def check_collection_data(collection):
     """
     检查集合中是否有数据。
     """
+    from app.utils.singleton import logger
+    from app.rag.mcp_rag_service import retriever
+
     # 查询集合中的所有数据
     results = collection.query(
         query_embeddings=[random.random() for _ in range(len(retriever.get_embeddings([""])[0]))],
@@ -89,5 +302,12 @@ def check_collection_data(collection):
 
 
 if __name__ == "__main__":
-    init_vector_db(settings.STATIC_DOC_PATH)
-    # check_collection_data(chroma_collection)  # 测试向量数据库初始化是否正常的函数，生产环境请注释
+    parser = argparse.ArgumentParser(
+        description="从静态PDF目录增量初始化向量数据库。按导入清单 (STATIC_DOC_MANIFEST_PATH) 跳过未变化的文件，"
+                    "换了向量库后端或集合、或者文本块已不在集合中的文件会自动重新导入")
+    parser.add_argument("--force", action="store_true",
+                        help="忽略导入清单，重新切分、嵌入并写入目录中的所有PDF (例如修改了切分参数或嵌入模型之后)")
+    args = parser.parse_args()
+
+    init_vector_db(settings.STATIC_DOC_PATH, force=args.force)
+    # check_collection_data(collection_resolver.active_collection())  # 测试向量数据库初始化是否正常的函数，生产环境请注释
@@ -0,0 +1,545 @@
+import json
+import math
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+from functools import reduce
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# 内存倒排索引 (BM25)，用于关键词检索，与向量检索的结果用 RRF 融合。
+# 社团名、教室号 ("活动室301") 这类精确字面在向量空间里常常不够近，关键词检索可以补上。
+# - 分词: 默认对连续汉字取相邻二元组 (bigram)，字母数字串整体作为一个词并转为小写；可选 jieba
+# - 倒排表: 每个词一对紧凑数组 (文本块序号 uint32、词频 uint16)，序号单调递增，因此倒排表天然有序
+# - 更新: 新文本块追加新序号，删除和覆盖只把旧序号标记为失效，失效比例过高时整体压缩重新编号；
+#   压缩之前失效序号仍计入词的文档频率 (idf 略有偏差，不影响排序的大致结果)
+# - 查询: 按词逐个累加分数 (term-at-a-time)，用分数上界剪枝。先处理上界高的稀有词，已有候选的分数足够高后，
+#   常见词只给有希望的候选加分 (二分查找)；长倒排表按块 (block-max) 记录上界，只展开可能进入 top-k 的块
+# - 过滤: 每个序号另外记录几个 metadata 字段 (source_type 这类等值字段编码为整数，"{时间字段}_ts" 这类范围字段为浮点数)，
+#   where 先换算成序号上的掩码，不满足条件的文本块不会成为候选，top-k 直接在满足条件的文本块中选出。
+#   用到未记录字段的 where 抛出 UnsupportedFilterError，由调用方多取一些结果再在向量库中筛选
+
+_TOKEN_RE = re.compile(r"[㐀-䶿一-鿿豈-﫿]+|[A-Za-z0-9]+(?:[._\-][A-Za-z0-9]+)*")
+_MAX_TF = 65535
+_BLOCK = 128  # 长倒排表的分块大小
+_MIN_BLOCKS = 8  # 至少这么多块的倒排表才按块剪枝，短倒排表直接全部展开
+_MISSING = -1  # 等值字段缺失时的编码
+_RANGE_OPERATORS = {"$eq": np.equal, "$ne": np.not_equal, "$gt": np.greater, "$gte": np.greater_equal,
+                    "$lt": np.less, "$lte": np.less_equal}
+
+
+class UnsupportedFilterError(ValueError):
+    """where 用到了关键词索引没有记录的字段或不支持的写法"""
+
+
+def bigram_tokenize(text: str) -> List[str]:
+    """连续汉字切成相邻二元组 (单个汉字保留为一个词)，字母数字串整体保留并转为小写，其余字符丢弃"""
+    tokens = []
+    for match in _TOKEN_RE.finditer(text or ""):
+        run = match.group()
+        if run[0] >= "㐀":
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend([a + b for a, b in zip(run, run[1:])])
+        else:
+            tokens.append(run.lower())
+    return tokens
+
+
+def create_tokenizer(kind: str = "bigram") -> Callable[[str], List[str]]:
+    """kind: "bigram" 不依赖第三方库; "jieba" 使用 jieba 的搜索引擎模式分词 (需要安装 jieba)"""
+    if kind == "bigram":
+        return bigram_tokenize
+    if kind == "jieba":
+        try:
+            import jieba
+        except ImportError as e:
+            raise RuntimeError("KEYWORD_TOKENIZER=jieba requires the jieba package") from e
+
+        def jieba_tokenize(text: str) -> List[str]:
+            return [word.strip().lower() for word in jieba.lcut_for_search(text or "") if _TOKEN_RE.search(word)]
+        return jieba_tokenize
+    raise ValueError(f"Unknown keyword tokenizer: {kind}")
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """RRF: 每个ID的分数为它在各个排序中 1 / (k + 名次) 之和，名次从 1 开始；返回按分数降序的 (ID, 分数)"""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, 1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+class KeywordIndex:
+    """
+    线程安全的 BM25 倒排索引。
+    filter_fields 为按等值条件 ($eq/$ne/$in/$nin) 过滤的 metadata 字段，range_fields 为数值字段，另外支持范围比较。
+    字段缺失的文本块不满足任何条件 (包括 $ne/$nin)
+    """
+
+    def __init__(self, tokenizer: Callable[[str], List[str]] = bigram_tokenize, k1: float = 1.2, b: float = 0.75,
+                 compact_ratio: float = 0.25, filter_fields: Sequence[str] = (), range_fields: Sequence[str] = ()):
+        self.tokenizer = tokenizer
+        self.k1 = k1
+        self.b = b
+        self.compact_ratio = compact_ratio
+        self._lock = threading.RLock()
+        self._ids: List[Optional[str]] = []  # 序号 -> 文本块ID，失效的序号为 None
+        self._ordinals: Dict[str, int] = {}
+        self._lengths = array("I")
+        self._alive = bytearray()
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        # 过滤字段: 等值字段按序号记录取值编码，范围字段按序号记录数值 (缺失为 NaN)
+        self._codes: Dict[str, Dict[Any, int]] = {field: {} for field in filter_fields}
+        self._categories: Dict[str, array] = {field: array("i") for field in filter_fields}
+        self._ranges: Dict[str, array] = {field: array("d") for field in range_fields}
+        self._live = 0
+        self._total_length = 0
+        # 查询用的缓存: 每个序号的 BM25 长度归一化项和失效标记，索引变化后第一次查询时重新计算
+        self._norms = None
+        self._dead = None
+        self._blocks: Dict[str, Tuple[int, np.ndarray, np.ndarray]] = {}
+
+    def __len__(self):
+        return self._live
+
+    def __contains__(self, chunk_id: str):
+        return chunk_id in self._ordinals
+
+    def _remove_locked(self, chunk_id: str):
+        ordinal = self._ordinals.pop(chunk_id, None)
+        if ordinal is None:
+            return
+        self._norms = None
+        self._ids[ordinal] = None
+        self._alive[ordinal] = 0
+        self._live -= 1
+        self._total_length -= self._lengths[ordinal]
+
+    def _append_fields_locked(self, metadata: Optional[Dict[str, Any]]):
+        metadata = metadata or {}
+        for field, column in self._categories.items():
+            value = metadata.get(field)
+            if value is None or isinstance(value, (list, dict)):
+                column.append(_MISSING)
+            else:
+                codes = self._codes[field]
+                column.append(codes.setdefault(value, len(codes)))
+        for field, column in self._ranges.items():
+            value = metadata.get(field)
+            numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+            column.append(float(value) if numeric else math.nan)
+
+    def upsert(self, ids: Iterable[str], documents: Iterable[str], metadatas: Iterable[Dict[str, Any]] = None):
+        """metadatas 提供过滤字段的取值，不传时这些文本块的过滤字段视为缺失"""
+        # 分词在锁外进行，避免阻塞查询
+        ids = list(ids)
+        metadatas = list(metadatas) if metadatas is not None else [None] * len(ids)
+        tokenized = [(chunk_id, Counter(self.tokenizer(document)), metadata)
+                     for chunk_id, document, metadata in zip(ids, documents, metadatas)]
+        with self._lock:
+            for chunk_id, counts, metadata in tokenized:
+                self._remove_locked(chunk_id)
+                ordinal = len(self._ids)
+                self._ids.append(chunk_id)
+                self._ordinals[chunk_id] = ordinal
+                length = sum(counts.values())
+                self._lengths.append(length)
+                self._alive.append(1)
+                self._append_fields_locked(metadata)
+                self._norms = None
+                self._live += 1
+                self._total_length += length
+                for term, tf in counts.items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = self._postings[term] = (array("I"), array("H"))
+                    postings[0].append(ordinal)
+                    postings[1].append(min(tf, _MAX_TF))
+            self._maybe_compact()
+
+    def remove(self, ids: Iterable[str]):
+        with self._lock:
+            for chunk_id in ids:
+                self._remove_locked(chunk_id)
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        dead = len(self._ids) - self._live
+        if dead < 1024 or dead < self.compact_ratio * len(self._ids):
+            return
+        self.compact()
+
+    def compact(self):
+        """去掉失效的序号并重新编号，倒排表保持有序"""
+        with self._lock:
+            alive = np.frombuffer(bytes(self._alive), dtype=np.uint8).astype(bool)
+            remap = np.cumsum(alive, dtype=np.int64) - 1
+            postings = {}
+            for term, (ordinals, tfs) in self._postings.items():
+                ords = np.frombuffer(ordinals, dtype=np.uint32)
+                keep = alive[ords]
+                if not keep.any():
+                    continue
+                new_ordinals, new_tfs = array("I"), array("H")
+                new_ordinals.frombytes(remap[ords[keep]].astype(np.uint32).tobytes())
+                new_tfs.frombytes(np.frombuffer(tfs, dtype=np.uint16)[keep].tobytes())
+                postings[term] = (new_ordinals, new_tfs)
+            self._postings = postings
+            self._ids = [chunk_id for chunk_id in self._ids if chunk_id is not None]
+            self._ordinals = {chunk_id: i for i, chunk_id in enumerate(self._ids)}
+            lengths = array("I")
+            lengths.frombytes(np.frombuffer(self._lengths, dtype=np.uint32)[alive].tobytes())
+            self._lengths = lengths
+            for columns, typecode, dtype in ((self._categories, "i", np.int32), (self._ranges, "d", np.float64)):
+                for field, column in columns.items():
+                    compacted = array(typecode)
+                    compacted.frombytes(np.frombuffer(column, dtype=dtype)[alive].tobytes())
+                    columns[field] = compacted
+            self._alive = bytearray(b"\x01" * len(self._ids))
+            self._norms = None
+            self._blocks = {}
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            postings = sum(len(ordinals) for ordinals, _ in self._postings.values())
+            return {"chunks": self._live, "ordinals": len(self._ids), "terms": len(self._postings),
+                    "postings": postings, "posting_bytes": postings * 6}
+
+    def _block_bounds(self, term: str, ordinals: array, tfs: array) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        长倒排表每 _BLOCK 条记录一块，返回每块的最大词频和最短文本块长度，用于计算块内的分数上界。
+        倒排表只会追加，已经满的块的统计值不会再变，缓存起来只计算新增的部分。
+        """
+        size = len(ordinals)
+        cached = self._blocks.get(term)
+        if cached is not None and cached[0] == size:
+            return cached[1], cached[2]
+        full = cached[0] // _BLOCK if cached is not None else 0
+        start = full * _BLOCK
+        ords = np.frombuffer(ordinals, dtype=np.uint32)[start:]
+        offsets = np.arange(0, len(ords), _BLOCK)
+        max_tf = np.maximum.reduceat(np.frombuffer(tfs, dtype=np.uint16)[start:], offsets)
+        min_length = np.minimum.reduceat(np.frombuffer(self._lengths, dtype=np.uint32)[ords], offsets)
+        if full:
+            max_tf = np.concatenate([cached[1][:full], max_tf])
+            min_length = np.concatenate([cached[2][:full], min_length])
+        self._blocks[term] = (size, max_tf, min_length)
+        return max_tf, min_length
+
+    def _prepare_locked(self):
+        if self._norms is None:
+            avgdl = self._total_length / self._live if self._live else 1.0
+            lengths = np.frombuffer(self._lengths, dtype=np.uint32).astype(np.float32)
+            self._norms = (self.k1 * (1 - self.b + self.b * lengths / avgdl)).astype(np.float32)
+            self._dead = np.frombuffer(self._alive, dtype=np.uint8) == 0
+
+    def prepare(self):
+        """预先计算查询用的缓存和所有长倒排表的分块统计，避免第一次用到某个常见词的查询变慢，全量构建后调用"""
+        with self._lock:
+            self._prepare_locked()
+            for term, (ordinals, tfs) in self._postings.items():
+                if len(ordinals) >= _MIN_BLOCKS * _BLOCK:
+                    self._block_bounds(term, ordinals, tfs)
+
+    def _field_mask(self, field: str, operator: str, target: Any) -> np.ndarray:
+        if field in self._ranges:
+            targets = target if isinstance(target, list) else [target]
+            if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in targets):
+                raise UnsupportedFilterError(f"Keyword index compares '{field}' with numbers only")
+            values = np.frombuffer(self._ranges[field], dtype=np.float64)
+            if operator in ("$in", "$nin"):
+                hit = np.isin(values, np.asarray(targets, dtype=np.float64))
+                return hit if operator == "$in" else ~hit & ~np.isnan(values)
+            return _RANGE_OPERATORS[operator](values, float(target)) & ~np.isnan(values)
+        if field in self._categories:
+            if operator not in ("$eq", "$ne", "$in", "$nin"):
+                raise UnsupportedFilterError(f"Keyword index supports equality filters only on '{field}'")
+            codes = self._codes[field]
+            targets = target if isinstance(target, list) else [target]
+            values = np.frombuffer(self._categories[field], dtype=np.int32)
+            target_codes = [codes[value] for value in targets if value in codes]
+            hit = values == target_codes[0] if len(target_codes) == 1 else np.isin(values, target_codes)
+            return hit if operator in ("$eq", "$in") else ~hit & (values != _MISSING)
+        raise UnsupportedFilterError(f"Keyword index does not track metadata field '{field}'")
+
+    def _where_mask(self, where: Dict[str, Any]) -> np.ndarray:
+        masks = []
+        for key, condition in where.items():
+            if key in ("$and", "$or"):
+                clauses = [self._where_mask(clause) for clause in condition]
+                masks.append(reduce(np.logical_and if key == "$and" else np.logical_or, clauses))
+                continue
+            operators = condition if isinstance(condition, dict) else {"$eq": condition}
+            masks.extend(self._field_mask(key, operator, target) for operator, target in operators.items())
+        return reduce(np.logical_and, masks)
+
+    def filter_mask(self, where: Dict[str, Any]) -> np.ndarray:
+        """
+        按序号给出满足 where (Chroma 语法，见 validate_where) 的文本块，失效序号不做处理。
+        用到没有记录的字段或不支持的写法时抛出 UnsupportedFilterError
+        """
+        with self._lock:
+            return self._where_mask(where)
+
+    def search(self, query: str, k: int = 10, where: Dict[str, Any] = None) -> List[Tuple[str, float]]:
+        """
+        返回 BM25 分数最高的 k 个 (文本块ID, 分数)。
+        传入 where 时只在满足条件的文本块中选出 top-k，where 无法在索引中判断时抛出 UnsupportedFilterError
+        """
+        query_terms = Counter(self.tokenizer(query))
+        with self._lock:
+            excluded = ~self._where_mask(where) if where else None
+            if not query_terms or not self._live:
+                return []
+            n = self._live
+            k1, b = self.k1, self.b
+            avgdl = self._total_length / n or 1.0
+            self._prepare_locked()
+            norms, dead = self._norms, self._dead
+
+            terms = []
+            for term, qtf in query_terms.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    continue
+                ordinals, tfs = postings
+                df = len(ordinals)
+                # 每个词的贡献为 W * tf / (tf + norm)，W = idf * 查询词频 * (k1 + 1)
+                w = math.log(1 + (n - df + 0.5) / (df + 0.5)) * qtf * (k1 + 1)
+                block_bounds = None
+                if df >= _MIN_BLOCKS * _BLOCK:
+                    max_tf, min_length = self._block_bounds(term, ordinals, tfs)
+                    max_tf = max_tf.astype(np.float32)
+                    block_bounds = w * max_tf / (max_tf + k1 * (1 - b + b * min_length / avgdl))
+                bound = float(block_bounds.max()) if block_bounds is not None else w
+                terms.append((bound, w, np.frombuffer(ordinals, dtype=np.uint32),
+                              np.frombuffer(tfs, dtype=np.uint16), block_bounds))
+            if not terms:
+                return []
+            # 按分数上界从高到低处理，rest[i] 是第 i 个词之后的词能贡献的最大分数
+            terms.sort(key=lambda term: -term[0])
+            bounds = [term[0] for term in terms]
+            rest = [sum(bounds[i + 1:]) for i in range(len(bounds))]
+
+            def contribution(w, ords, tf_values):
+                tf = tf_values.astype(np.float32)
+                return w * tf / (tf + norms[ords])
+
+            # 稠密累加数组按序号记录部分分数 (已处理的词的贡献之和)，部分分数的第 k 大值是最终第 k 大分数的下界。
+            # seen 标记已经处理过的序号，失效序号和不满足过滤条件的序号预先标记，不会成为候选
+            scores = np.zeros(len(dead), dtype=np.float32)
+            seen = dead | excluded if excluded is not None else dead.copy()
+            cand = np.empty(0, dtype=np.uint32)
+
+            def threshold():
+                return np.partition(scores[cand], -k)[-k] if len(cand) >= k else -np.inf
+
+            for i, (bound, w, ords, tf_values, block_bounds) in enumerate(terms):
+                theta = threshold()
+                # 新文本块 (之前的词都不包含它) 的最终分数不超过本词的贡献加上 rest[i]
+                admit = bound + rest[i] >= theta
+                # 还没有门槛时按最好的块估计门槛: 连最差的块都可能有进入 top-k 的新文本块时，按块展开没有意义
+                use_blocks = block_bounds is not None and (
+                    block_bounds.min() + rest[i] < (theta if np.isfinite(theta) else bound))
+                if admit and not use_blocks:
+                    # 整个倒排表直接累加，新文本块全部成为候选
+                    scores[ords] += contribution(w, ords, tf_values)
+                    new_ords = ords[~seen[ords]]
+                    seen[new_ords] = True
+                    cand = np.concatenate([cand, new_ords])
+                    continue
+                if not admit and len(cand) * 8 > len(ords):
+                    # 不会有新候选，候选又比较多时，整个倒排表累加比逐个二分查找快；其余文本块标记为已处理
+                    scores[ords] += contribution(w, ords, tf_values)
+                    seen[ords] = True
+                    continue
+
+                # 已有候选: 去掉即使拿到剩余所有词的最大贡献也进不了 top-k 的，其余的用二分查找取本词的贡献
+                cand = cand[scores[cand] + (bound + rest[i]) >= theta]
+                pos = np.searchsorted(ords, cand)
+                pos[pos == len(ords)] = 0
+                hit = ords[pos] == cand
+                scores[cand[hit]] += contribution(w, cand[hit], tf_values[pos[hit]])
+                if not admit or block_bounds is None:
+                    continue
+                # 按块的分数上界从高到低展开，块上界加 rest[i] 低于门槛后剩下的块都不用看
+                order = np.argsort(-block_bounds, kind="stable")
+                taken, batch = 0, max(1, -(-k // _BLOCK))
+                while taken < len(order) and block_bounds[order[taken]] + rest[i] >= threshold():
+                    blocks = order[taken:taken + batch]
+                    taken += len(blocks)
+                    batch *= 2
+                    positions = (blocks[:, None] * _BLOCK + np.arange(_BLOCK)).ravel()
+                    positions = positions[positions < len(ords)]
+                    block_ords = ords[positions]
+                    new = ~seen[block_ords]
+                    new_ords, positions = block_ords[new], positions[new]
+                    seen[new_ords] = True
+                    scores[new_ords] += contribution(w, new_ords, tf_values[positions])
+                    cand = np.concatenate([cand, new_ords])
+
+            if not len(cand):
+                return []
+            cand_scores = scores[cand]
+            top = np.argpartition(-cand_scores, k - 1)[:k] if len(cand) > k else np.arange(len(cand))
+            top = top[np.argsort(-cand_scores[top], kind="stable")]
+            return [(self._ids[cand[i]], float(cand_scores[i])) for i in top]
+
+
+def publish_keyword_updates(r, stream_name: str, ids: List[str] = None, deleted_ids: List[str] = None,
+                            maxlen: int = 100000):
+    """
+    写入或删除文本块后，把变化的文本块ID发布到 Redis Stream，检索进程据此增量更新关键词索引。
+    只发布ID和操作类型，正文和 metadata 由检索进程从向量集合读取，Stream 的内存占用与文本块长度无关
+    """
+    if ids:
+        r.xadd(stream_name, {"op": "upsert", "ids": json.dumps(ids, ensure_ascii=False)},
+               maxlen=maxlen, approximate=True)
+    if deleted_ids:
+        r.xadd(stream_name, {"op": "delete", "ids": json.dumps(deleted_ids, ensure_ascii=False)},
+               maxlen=maxlen, approximate=True)
+
+
+def notify_keyword_index(ids: List[str] = None, deleted_ids: List[str] = None):
+    """
+    按配置发布关键词索引的增量更新，未启用混合检索时什么也不做。
+    所有直接写向量集合的地方 (同步 worker、静态文档导入、批量回填、近重复文本块顶替) 都在写入完成后通过它通知检索进程；
+    发布失败只记录日志，检索进程下一次全量构建时会补上
+    """
+    from app.configs.config import settings
+    if not settings.HYBRID_RETRIEVAL or not (ids or deleted_ids):
+        return
+    from redis import Redis
+    from app.utils.singleton import logger, redis_pool
+    try:
+        publish_keyword_updates(Redis(connection_pool=redis_pool), settings.KEYWORD_INDEX_STREAM, ids, deleted_ids,
+                                maxlen=settings.KEYWORD_INDEX_STREAM_MAXLEN)
+    except Exception as e:
+        logger.error(f"Failed to publish keyword index updates. Error: {e}")
+
+
+class KeywordSearch:
+    """
+    检索进程中的关键词索引：第一次使用时在后台线程中从集合构建 (构建完成前返回空结果，检索退化为纯向量检索)，
+    之后跟随 Redis Stream 中的增量更新 (所有写向量集合的地方都会发布，见 notify_keyword_index)。
+    只在 get_version 的返回值变化 (蓝绿切换到另一个集合) 时重新全量构建；
+    refresh_interval_s 大于 0 时另外按这个间隔全量重建，作为增量更新丢失时的兜底，默认关闭。
+    """
+
+    def __init__(self, get_collection: Callable[[], object], redis_factory: Optional[Callable[[], object]],
+                 stream_name: str, tokenizer: Callable[[str], List[str]] = bigram_tokenize,
+                 refresh_interval_s: float = 0, page_size: int = 1000, logger=None,
+                 get_version: Optional[Callable[[], str]] = None, filter_fields: Sequence[str] = (),
+                 range_fields: Sequence[str] = (), overfetch: int = 5):
+        self.get_collection = get_collection
+        self.redis_factory = redis_factory
+        self.stream_name = stream_name
+        self.tokenizer = tokenizer
+        self.refresh_interval_s = refresh_interval_s
+        self.page_size = page_size
+        self.logger = logger
+        self.get_version = get_version
+        self.filter_fields = tuple(filter_fields)
+        self.range_fields = tuple(range_fields)
+        self.overfetch = overfetch
+        self.index: Optional[KeywordIndex] = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.last_build_s = None
+
+    def _log(self, level: str, message: str):
+        if self.logger is not None:
+            getattr(self.logger, level)(message)
+
+    def build(self) -> KeywordIndex:
+        """从集合全量构建一个新索引"""
+        start = time.perf_counter()
+        index = KeywordIndex(self.tokenizer, filter_fields=self.filter_fields, range_fields=self.range_fields)
+        collection = self.get_collection()
+        offset = 0
+        while True:
+            page = collection.get(include=["documents", "metadatas"], limit=self.page_size, offset=offset)
+            if not page["ids"]:
+                break
+            offset += len(page["ids"])
+            index.upsert(page["ids"], page["documents"], page["metadatas"])
+        index.prepare()
+        self.last_build_s = time.perf_counter() - start
+        self._log("info", f"Keyword index built in {self.last_build_s:.1f}s: {index.stats()}")
+        return index
+
+    def apply(self, fields: Dict[str, str]):
+        if self.index is None:
+            return
+        ids = json.loads(fields["ids"])
+        if fields.get("op") == "delete":
+            self.index.remove(ids)
+            return
+        # 按ID从集合读取当前的正文和 metadata；已经不在集合中的 (之后又被删除) 从索引中去掉
+        page = self.get_collection().get(ids=ids, include=["documents", "metadatas"])
+        self.index.upsert(page["ids"], page["documents"], page["metadatas"])
+        found = set(page["ids"])
+        missing = [chunk_id for chunk_id in ids if chunk_id not in found]
+        if missing:
+            self.index.remove(missing)
+
+    def _last_stream_id(self, r) -> str:
+        entries = r.xrevrange(self.stream_name, count=1)
+        return entries[0][0] if entries else "0-0"
+
+    def _version(self) -> Optional[str]:
+        return self.get_version() if self.get_version is not None else None
+
+    def _run(self):
+        r = self.redis_factory() if self.redis_factory is not None else None
+        while True:
+            try:
+                # 先记下 Stream 的位置再构建，构建期间发布的更新会在之后重放 (重复应用是幂等的)
+                last_id = self._last_stream_id(r) if r is not None else None
+                version = self._version()
+                self.index = self.build()
+                deadline = time.monotonic() + self.refresh_interval_s if self.refresh_interval_s > 0 else None
+                while deadline is None or time.monotonic() < deadline:
+                    if self._version() != version:
+                        self._log("info", f"Active collection changed from {version}, rebuilding keyword index")
+                        break
+                    if r is None:
+                        time.sleep(1)
+                        continue
+                    response = r.xread({self.stream_name: last_id}, count=500, block=1000)
+                    for _, entries in response or []:
+                        for entry_id, fields in entries:
+                            self.apply(fields)
+                            last_id = entry_id
+            except Exception as e:
+                self._log("error", f"Keyword index update failed: {e}. Rebuilding in 10 seconds...")
+                time.sleep(10)
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="keyword-index", daemon=True)
+                self._thread.start()
+
+    def search(self, query: str, k: int = 10, where: Dict[str, Any] = None,
+               where_document: Dict[str, Any] = None) -> List[Tuple[str, float]]:
+        """
+        where 能在索引中判断时直接在满足条件的文本块中取 top-k；
+        否则 (未记录的字段、where_document) 多取 overfetch 倍，由调用方在向量库中按条件筛选后截断
+        """
+        self.start()
+        index = self.index
+        if index is None:
+            return []
+        if not where_document:
+            try:
+                return index.search(query, k, where)
+            except UnsupportedFilterError:
+                pass
+        return index.search(query, k * self.overfetch)
@@ -1,5 +1,8 @@
+import argparse
 import asyncio
+import contextlib
 import json
+import threading
 from typing import List, Dict, Any, Optional
 
 from mcp.server import Server
@@ -8,24 +11,29 @@ from mcp.types import TextContent, Tool, CallToolRequest, CallToolResult, Conten
 import mcp.server.stdio
 from mcp.server.models import InitializationOptions
 
-import chromadb
+import numpy as np
+from redis import Redis
 from sentence_transformers import SentenceTransformer
 
 from app.configs.config import settings
-from app.utils.singleton import logger
+from app.utils.singleton import collection_resolver, logger, redis_pool
+from app.rag.collection_alias import CollectionAliasResolver, EmbeddingMismatchError, embedding_signature, same_embedding
+from app.rag.conversation_context import ConversationRetrievalStore, rescore_candidates, retrieval_scope
+from app.rag.keyword_index import KeywordSearch, create_tokenizer, reciprocal_rank_fusion
+from app.rag.metadata_fields import derived_fields, timestamp_field
+from app.rag.mmr import mmr_select
+from app.rag.reranker import CrossEncoderReranker
+from app.rag.retrieval_filters import FILTER_SCHEMA_PROPERTIES, filters_from_arguments
 from langchain.retrievers.document_compressors import DocumentCompressorPipeline, EmbeddingsFilter
 from langchain_community.document_transformers import LongContextReorder
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_core.documents import Document
 
 class KnowledgeRetrieverMCP:
-    def __init__(self):
-        # 初始化向量数据库客户端
-        self.client = chromadb.HttpClient(
-            host=settings.CHROMA_SERVER_HOST,
-            port=settings.CHROMA_SERVER_PORT
-        )
-        self.collection = self.client.get_or_create_collection(name=settings.CHROMA_RAG_COLLECTION_NAME)
+    def __init__(self, resolver: CollectionAliasResolver = None):
+        # 通过别名解析当前对外服务的集合版本，蓝绿重建切换后自动生效。
+        # 默认与同步、导入代码共用 singleton 中按配置创建的向量库，测试时可以传入基于内存向量库的解析器
+        self.collection_resolver = resolver or collection_resolver
 
         # 加载模型
         self.st_model = SentenceTransformer(settings.EMBEDDING_MODEL_DIR)
@@ -35,7 +43,83 @@ class KnowledgeRetrieverMCP:
                 'device': 'cpu'
             }
         )
+        # 当前加载的嵌入模型，蓝绿重建换模型时登记在别名记录中，见 sync_embedding_model
+        self.embedding = embedding_signature(settings.EMBEDDING_MODEL_NAME,
+                                             self.st_model.get_sentence_embedding_dimension(),
+                                             settings.EMBEDDING_MODEL_DIR)
+        self._model_lock = threading.Lock()
         self.lc_reorder = LongContextReorder()
+        self.hidden_metadata_fields = derived_fields([settings.RAG_FILTER_TIME_FIELD])
+
+        # BM25 关键词索引，第一次检索时在后台构建，之后跟随写入方发布的增量更新，蓝绿切换后重新构建
+        self.keyword_search = None
+        if settings.HYBRID_RETRIEVAL:
+            self.keyword_search = KeywordSearch(
+                lambda: self.collection,
+                lambda: Redis(connection_pool=redis_pool),
+                settings.KEYWORD_INDEX_STREAM,
+                tokenizer=create_tokenizer(settings.KEYWORD_TOKENIZER),
+                refresh_interval_s=settings.KEYWORD_INDEX_REFRESH_S,
+                logger=logger,
+                get_version=lambda: self.collection_resolver.active_name(),
+                filter_fields=settings.KEYWORD_FILTER_FIELDS,
+                range_fields=[timestamp_field(settings.RAG_FILTER_TIME_FIELD)],
+                overfetch=settings.KEYWORD_FILTER_OVERFETCH
+            )
+
+        # 可选的交叉编码器重排，模型在第一次重排时加载
+        self.reranker = None
+        if settings.RERANK_ENABLED:
+            self.reranker = CrossEncoderReranker(
+                settings.RERANK_MODEL_DIR,
+                batch_size=settings.RERANK_BATCH_SIZE,
+                max_length=settings.RERANK_MAX_LENGTH,
+                budget_ms=settings.RERANK_BUDGET_MS,
+                max_concurrency=settings.RERANK_MAX_CONCURRENCY
+            )
+
+        # 对话内的检索候选池复用，按 conversation_id 保存在 Redis 中
+        self.conversation_store = None
+        if settings.RAG_CONVERSATION_REUSE:
+            self.conversation_store = ConversationRetrievalStore(
+                lambda: Redis(connection_pool=redis_pool),
+                ttl_s=settings.RAG_CONVERSATION_TTL_S,
+                key_prefix=settings.RAG_CONVERSATION_KEY_PREFIX,
+                reuse_threshold=settings.RAG_CONVERSATION_REUSE_THRESHOLD,
+                max_pool=settings.RAG_CONVERSATION_POOL_SIZE,
+                max_age_s=settings.RAG_CONVERSATION_MAX_AGE_S
+            )
+
+    @property
+    def collection(self):
+        return self.collection_resolver.active_collection()
+
+    def sync_embedding_model(self):
+        """
+        active 集合登记的嵌入模型与当前加载的不一致时 (蓝绿重建切换到了用新模型嵌入的版本)，
+        从登记的模型目录加载新模型，之后的查询和写入都用新模型生成向量。
+        检索服务在每次检索前调用，同步 worker 在每批写入前调用；加载失败时抛出 EmbeddingMismatchError。
+        """
+        target = self.collection_resolver.active_embedding()
+        if same_embedding(self.embedding, target):
+            return
+        with self._model_lock:
+            if same_embedding(self.embedding, target):
+                return
+            if not target.get("dir"):
+                raise EmbeddingMismatchError(f"Active collection is embedded with {target}, "
+                                             f"but no model directory is recorded to load it from")
+            logger.warning(f"Active collection is embedded with {target['model']} (dim {target['dim']}), "
+                           f"switching from {self.embedding['model']}. "
+                           f"Update EMBEDDING_MODEL_NAME / EMBEDDING_MODEL_DIR to load it at startup.")
+            st_model = SentenceTransformer(target["dir"])
+            dim = st_model.get_sentence_embedding_dimension()
+            if target.get("dim") is not None and dim != target["dim"]:
+                raise EmbeddingMismatchError(f"Model at {target['dir']} produces {dim}-dim vectors, "
+                                             f"but the active collection expects {target['dim']}")
+            self.lc_embeddings = HuggingFaceEmbeddings(model_name=target["dir"], model_kwargs={'device': 'cpu'})
+            self.st_model = st_model
+            self.embedding = embedding_signature(target["model"], dim, target["dir"])
 
     def get_embeddings(self, texts: List[str]) -> List[List[float]]:
         """
@@ -48,65 +132,295 @@ class KnowledgeRetrieverMCP:
         embeddings = self.st_model.encode(texts, normalize_embeddings=True)
         return embeddings.tolist()
 
-    def retrieve(self, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
+    def retrieve(self, query: str, n_results: int = 5, where: Dict[str, Any] = None,
+                 where_document: Dict[str, Any] = None, mmr: Optional[bool] = None,
+                 conversation_id: Optional[str] = None) -> List[Dict[str, Any]]:
         '''
-        检索最相关的文档片段，包含 长上下文重排 和 上下文压缩 优化
+        检索最相关的文档片段，包含 (可选的) 交叉编码器重排、长上下文重排 和 上下文压缩 优化
         query: 用于查询相关文档的输入
         n_results: 决定取前几个最相关的文档
+        where / where_document: metadata 和正文过滤条件 (见 build_filters)，在向量库中先过滤再检索
+        mmr: 是否用 MMR 去掉内容几乎相同的结果，为 None 时使用 RAG_MMR_ENABLED
+        conversation_id: 所属对话，追问与上一轮问题足够接近时复用上一轮的候选池 (见 conversation_candidates)
         '''
         try:
             logger.warning(f"query: {query}")
             logger.warning(f"n_results: {n_results}")
+            if where or where_document:
+                logger.info(f"filters: where={where}, where_document={where_document}")
+            self.sync_embedding_model()
             query_embedding = self.get_embeddings(query if isinstance(query, List) else [query])
-            retrieved_docs = self.collection.query(
-                query_embeddings=query_embedding,
-                n_results=n_results,
-                include=["metadatas", "documents", "distances"]
-            )
-            logger.warning(f"retrieved_docs: {retrieved_docs}")
+            mmr = settings.RAG_MMR_ENABLED if mmr is None else mmr
+            n_candidates = self.candidate_count(n_results, mmr)
+            if conversation_id and self.conversation_store is not None and isinstance(query, str):
+                candidates = self.conversation_candidates(conversation_id, query, query_embedding[0], n_candidates,
+                                                          where, where_document)
+            else:
+                candidates = self.search_candidates(query, query_embedding[0], n_candidates, where, where_document,
+                                                    with_embeddings=mmr)
+            return self.select_documents(query, query_embedding[0], candidates, n_results, mmr)
 
-            docs = []
-            if not retrieved_docs['ids'] or not retrieved_docs['ids'][0]:
-                return []
-    
-            for i in range(len(retrieved_docs["ids"][0])):
-                similarity = 1 - retrieved_docs['distances'][0][i]
-                metadata=retrieved_docs["metadatas"][0][i]
-                metadata['similarity_score'] = similarity
-        
-                docs.append(
-                    Document(
-                        page_content=retrieved_docs["documents"][0][i],
-                        metadata=metadata
-                    )
+        except Exception as e:
+            logger.error(f"检索过程中发生错误: {str(e)}")
+            return []
+
+    def retrieve_batch(self, queries: List[str], n_results: int = 5, where: Dict[str, Any] = None,
+                       where_document: Dict[str, Any] = None, mmr: Optional[bool] = None) -> List[List[Dict[str, Any]]]:
+        '''
+        批量检索，参数含义与 retrieve 相同，过滤条件对所有问题生效，按 queries 的顺序返回每个问题的结果。
+        所有问题一次编码成向量，向量库只收到一次多向量查询；重排和上下文压缩仍逐个问题进行
+        '''
+        if not queries:
+            return []
+        try:
+            logger.info(f"batch queries: {len(queries)}, n_results: {n_results}")
+            if where or where_document:
+                logger.info(f"filters: where={where}, where_document={where_document}")
+            self.sync_embedding_model()
+            query_embeddings = self.get_embeddings(queries)
+            mmr = settings.RAG_MMR_ENABLED if mmr is None else mmr
+            batch_candidates = self.search_candidates_batch(queries, query_embeddings,
+                                                            self.candidate_count(n_results, mmr),
+                                                            where, where_document, with_embeddings=mmr)
+        except Exception as e:
+            logger.error(f"批量检索过程中发生错误: {str(e)}")
+            return [[] for _ in queries]
+
+        results = []
+        for query, query_embedding, candidates in zip(queries, query_embeddings, batch_candidates):
+            try:
+                results.append(self.select_documents(query, query_embedding, candidates, n_results, mmr))
+            except Exception as e:
+                logger.error(f"批量检索中处理问题 '{query}' 时发生错误: {str(e)}")
+                results.append([])
+        return results
+
+    def candidate_count(self, n_results: int, mmr: bool) -> int:
+        """向量检索要取回的候选数：MMR 需要 n_results * RAG_MMR_FETCH_FACTOR 个，重排至少需要 RERANK_CANDIDATES 个"""
+        pool_size = self.pool_size(n_results, mmr)
+        return max(pool_size, settings.RERANK_CANDIDATES) if self.reranker is not None else pool_size
+
+    @staticmethod
+    def pool_size(n_results: int, mmr: bool) -> int:
+        return n_results * max(1, settings.RAG_MMR_FETCH_FACTOR) if mmr else n_results
+
+    def select_documents(self, query, query_embedding: List[float], candidates: List[Dict[str, Any]],
+                         n_results: int, mmr: bool) -> List[Dict[str, Any]]:
+        """对一个问题的候选依次做 (可选的) 重排、MMR、上下文压缩和长上下文重排，返回最终的文档片段"""
+        if not candidates:
+            return []
+        # 重排在 MMR 之前进行，保留 MMR 需要的候选数
+        candidates = self.rerank_candidates(query, candidates, self.pool_size(n_results, mmr))
+        if mmr:
+            candidates = self.diversify_candidates(query_embedding, candidates, n_results)
+
+        docs = []
+        for candidate in candidates:
+            # 过滤用的派生字段 (数值时间戳) 不返回给调用方
+            metadata = {key: value for key, value in (candidate["metadata"] or {}).items()
+                        if key not in self.hidden_metadata_fields}
+            metadata['similarity_score'] = candidate["similarity"]
+            for score in ("rrf_score", "rerank_score"):
+                if candidate.get(score) is not None:
+                    metadata[score] = candidate[score]
+            # 压缩管道只保留 metadata，文本块 ID 先放在 metadata 里，输出时再取出
+            metadata['chunk_id'] = candidate["id"]
+
+            docs.append(
+                Document(
+                    page_content=candidate["content"],
+                    metadata=metadata
                 )
-    
-            embeddings_filter = EmbeddingsFilter(
-                embeddings=self.lc_embeddings,
-                similarity_threshold=settings.SIMILARITY_THRESHOLD
-            )
-            # 压缩管道，包含 长上下文重排 和 上下文压缩
-            pipeline_compressor = DocumentCompressorPipeline(
-                transformers=[embeddings_filter, self.lc_reorder]
             )
 
-            compressed_docs = pipeline_compressor.compress_documents(docs, query)
+        embeddings_filter = EmbeddingsFilter(
+            embeddings=self.lc_embeddings,
+            similarity_threshold=settings.SIMILARITY_THRESHOLD
+        )
+        # 压缩管道，包含 长上下文重排 和 上下文压缩
+        pipeline_compressor = DocumentCompressorPipeline(
+            transformers=[embeddings_filter, self.lc_reorder]
+        )
+
+        compressed_docs = pipeline_compressor.compress_documents(docs, query)
 
-            results = [
-                {"content": doc.page_content, "metadata": doc.metadata}
-                for doc in compressed_docs
-            ]
+        results = [
+            {"id": doc.metadata.pop("chunk_id", None), "content": doc.page_content, "metadata": doc.metadata}
+            for doc in compressed_docs
+        ]
 
-            for i, result in enumerate(results):
-                logger.debug(f"""第{i+1}篇文档，前30个字符为'{result['content'][:30]}'，
-                            与prompt的相似度为{result['metadata']['similarity_score']}""")
+        for i, result in enumerate(results):
+            logger.debug(f"""第{i+1}篇文档，前30个字符为'{result['content'][:30]}'，
+                        与prompt的相似度为{result['metadata']['similarity_score']}""")
 
-            return results
-    
+        return results
+
+    def search_candidates(self, query, query_embedding: List[float], n_results: int, where: Dict[str, Any] = None,
+                          where_document: Dict[str, Any] = None, with_embeddings: bool = False) -> List[Dict[str, Any]]:
+        """
+        向量检索，启用混合检索时再与 BM25 关键词检索的结果做 RRF 融合。
+        返回按排名排列的候选 {"id", "content", "metadata", "similarity", "rrf_score"}，未融合时 rrf_score 为 None；
+        with_embeddings 为 True 时每个候选还带有 "embedding"。
+        """
+        return self.search_candidates_batch([query], [query_embedding], n_results, where, where_document,
+                                            with_embeddings)[0]
+
+    def search_candidates_batch(self, queries: List[Any], query_embeddings: List[List[float]], n_results: int,
+                                where: Dict[str, Any] = None, where_document: Dict[str, Any] = None,
+                                with_embeddings: bool = False) -> List[List[Dict[str, Any]]]:
+        """
+        search_candidates 的批量版本，按 queries 的顺序返回每个问题的候选。
+        向量库只查询一次 (多个查询向量)，只由关键词命中的文本块也合并成一次 get 取回
+        """
+        hybrid = [self.keyword_search is not None and isinstance(query, str) for query in queries]
+        n_candidates = max(n_results, settings.HYBRID_CANDIDATES) if any(hybrid) else n_results
+        include = ["metadatas", "documents", "distances"] + (["embeddings"] if with_embeddings else [])
+        retrieved_docs = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_candidates,
+            where=where,
+            where_document=where_document,
+            include=include
+        )
+
+        batch_ids, batch_dense = [], []
+        for position in range(len(queries)):
+            dense_ids = retrieved_docs["ids"][position] if retrieved_docs['ids'] else []
+            row = {key: values[position] for key, values in retrieved_docs.items()
+                   if key in include and values is not None and len(values)}
+            batch_ids.append(dense_ids)
+            batch_dense.append({chunk_id: self.make_candidate(row, i, chunk_id, 1 - row["distances"][i],
+                                                              with_embeddings)
+                                for i, chunk_id in enumerate(dense_ids)})
+        return self.fuse_keyword_hits(queries, query_embeddings, batch_ids, batch_dense, hybrid, n_results,
+                                      n_candidates, where, where_document, with_embeddings)
+
+    @staticmethod
+    def make_candidate(result: Dict[str, Any], i: int, chunk_id: str, similarity: float,
+                       with_embeddings: bool) -> Dict[str, Any]:
+        item = {"id": chunk_id, "content": result["documents"][i], "metadata": result["metadatas"][i],
+                "similarity": similarity, "rrf_score": None}
+        if with_embeddings:
+            item["embedding"] = result["embeddings"][i]
+        return item
+
+    def fuse_keyword_hits(self, queries: List[Any], query_embeddings: List[List[float]], batch_ids: List[List[str]],
+                          batch_dense: List[Dict[str, Dict[str, Any]]], hybrid: List[bool], n_results: int,
+                          n_candidates: int, where: Dict[str, Any] = None, where_document: Dict[str, Any] = None,
+                          with_embeddings: bool = False) -> List[List[Dict[str, Any]]]:
+        """
+        把每个问题的向量检索结果 (batch_ids 为排名，batch_dense 为 id -> 候选) 与关键词检索结果做 RRF 融合。
+        只由关键词命中的文本块合并成一次 get 取回，并补进对应问题的 batch_dense
+        """
+        if not any(hybrid):
+            return [list(dense.values())[:n_results] for dense in batch_dense]
+
+        # 过滤条件能在关键词索引中判断时直接在满足条件的文本块中取 top-k，否则多取一些，下面在向量库中筛选
+        batch_keyword_ids = [[chunk_id for chunk_id, _ in self.keyword_search.search(query, n_candidates, where,
+                                                                                     where_document)]
+                             if use_keywords else [] for query, use_keywords in zip(queries, hybrid)]
+        # 只由关键词命中的文本块需要从向量库取回正文和向量，同时套用过滤条件 (索引中的 metadata 可能稍旧)
+        missing = sorted({chunk_id for keyword_ids, dense in zip(batch_keyword_ids, batch_dense)
+                          for chunk_id in keyword_ids if chunk_id not in dense})
+        fetched = {"ids": []}
+        if missing:
+            fetched = self.collection.get(ids=missing, where=where, where_document=where_document,
+                                          include=["metadatas", "documents", "embeddings"])
+        fetched_rows = {chunk_id: i for i, chunk_id in enumerate(fetched["ids"])}
+
+        results = []
+        for query_embedding, use_keywords, dense_ids, dense, keyword_ids in zip(
+                query_embeddings, hybrid, batch_ids, batch_dense, batch_keyword_ids):
+            if not use_keywords:
+                results.append(list(dense.values())[:n_results])
+                continue
+            query_vector = np.asarray(query_embedding, dtype=np.float32)
+            for chunk_id in keyword_ids:
+                if chunk_id in dense or chunk_id not in fetched_rows:
+                    continue
+                i = fetched_rows[chunk_id]
+                # 与 Chroma 默认的 l2 距离保持一致：向量已归一化，相似度 = 1 - 距离平方
+                distance = float(np.sum((np.asarray(fetched["embeddings"][i], dtype=np.float32) - query_vector) ** 2))
+                dense[chunk_id] = self.make_candidate(fetched, i, chunk_id, 1 - distance, with_embeddings)
+            keyword_ids = [chunk_id for chunk_id in keyword_ids if chunk_id in dense][:n_candidates]
+
+            fused = reciprocal_rank_fusion([dense_ids, keyword_ids], k=settings.RRF_K)[:n_results]
+            for chunk_id, score in fused:
+                dense[chunk_id]["rrf_score"] = score
+            results.append([dense[chunk_id] for chunk_id, _ in fused])
+        return results
+
+    def conversation_candidates(self, conversation_id: str, query: str, query_embedding: List[float],
+                                n_candidates: int, where: Dict[str, Any] = None,
+                                where_document: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """
+        对话中的检索：新问题与上一次完整检索的问题足够接近时，用新问题向量给保存的候选池重新打分，
+        再补上关键词检索新命中的文本块，不查询向量库；否则完整检索并保存新的候选池。
+        Redis 不可用时退回普通检索
+        """
+        store = self.conversation_store
+        scope = retrieval_scope(self.collection_resolver.active_name(), where, where_document)
+        try:
+            context = store.load(conversation_id)
         except Exception as e:
-            logger.error(f"检索过程中发生错误: {str(e)}")
-            return []
+            logger.warning(f"读取对话 {conversation_id} 的检索上下文失败，改为完整检索: {e}")
+            context = None
 
+        if store.reusable(context, query_embedding, scope):
+            rescored = rescore_candidates(context["candidates"], query_embedding)
+            pool = {candidate["id"]: candidate for candidate in rescored}
+            hybrid = [self.keyword_search is not None]
+            candidates = self.fuse_keyword_hits([query], [query_embedding], [list(pool)], [pool], hybrid,
+                                                n_candidates, max(n_candidates, settings.HYBRID_CANDIDATES),
+                                                where, where_document, with_embeddings=True)[0]
+            store.counts["reused"] += 1
+            anchor, anchored_at = context["anchor"], context["anchored_at"]
+            # 关键词补进来的文本块加入候选池，按与新问题的相似度保留前 max_pool 个
+            pool_candidates = sorted(pool.values(), key=lambda candidate: -candidate["similarity"])
+            logger.info(f"对话 {conversation_id} 复用检索候选池 ({len(rescored)} -> {len(pool)} 个文本块)")
+        else:
+            pool_candidates = self.search_candidates(query, query_embedding,
+                                                     max(n_candidates, settings.RAG_CONVERSATION_POOL_SIZE),
+                                                     where, where_document, with_embeddings=True)
+            candidates = pool_candidates[:n_candidates]
+            store.counts["refreshed"] += 1
+            anchor, anchored_at = query_embedding, None
+
+        try:
+            store.save(conversation_id, anchor, pool_candidates, scope, anchored_at)
+        except Exception as e:
+            logger.warning(f"保存对话 {conversation_id} 的检索上下文失败: {e}")
+        return candidates
+
+    def rerank_candidates(self, query, candidates: List[Dict[str, Any]], n_results: int) -> List[Dict[str, Any]]:
+        """
+        用交叉编码器给候选重排并保留前 n_results 个，重排分数记在 "rerank_score" 中；
+        未启用重排或因延迟预算跳过时按原有排名截断
+        """
+        ranked = None
+        if self.reranker is not None and isinstance(query, str):
+            ranked = self.reranker.rerank(query, [candidate["content"] for candidate in candidates], n_results)
+        if ranked is None:
+            return candidates[:n_results]
+        return [dict(candidates[i], rerank_score=score) for i, score in ranked]
+
+    def diversify_candidates(self, query_embedding: List[float], candidates: List[Dict[str, Any]],
+                             n_results: int) -> List[Dict[str, Any]]:
+        """用 MMR 从候选中选出 n_results 个，减少内容几乎相同的文本块"""
+        if len(candidates) <= 1:
+            return candidates[:n_results]
+        selected = mmr_select(query_embedding, [candidate["embedding"] for candidate in candidates], n_results,
+                              lambda_mult=settings.RAG_MMR_LAMBDA)
+        return [candidates[i] for i in selected]
+
+    def get_chunk(self, chunk_id: str) -> Optional[Dict[str, Any]]:
+        """按 ID 取一个文本块的完整正文和 metadata (供溯源详情按需加载)，不存在时返回 None"""
+        result = self.collection.get(ids=[chunk_id], include=["documents", "metadatas"])
+        if not result["ids"]:
+            return None
+        metadata = {key: value for key, value in (result["metadatas"][0] or {}).items()
+                    if key not in self.hidden_metadata_fields}
+        return {"id": result["ids"][0], "content": result["documents"][0], "metadata": metadata}
 
     def format_context(self, retrieved_docs: List[Dict]) -> str:
         '''
@@ -147,30 +461,80 @@ async def handle_list_tools() -> List[Tool]:
                         "default": 5,
                         "minimum": 0,
                         "maximum": 10 
-                    }
+                    },
+                    **FILTER_SCHEMA_PROPERTIES
                 },
                 "required": ["query"]
             }
+        ),
+        Tool(
+            name="retrieve_batch",
+            description="一次检索多个查询，按顺序返回每个查询最相关的文档片段，适合批量评估或一次需要多个问题上下文的场景",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "queries": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "查询文本列表",
+                        "minItems": 1,
+                        "maxItems": settings.RAG_BATCH_MAX_QUERIES
+                    },
+                    "n_results": {
+                        "type": "integer",
+                        "description": "每个查询返回的文档数量",
+                        "default": 5,
+                        "minimum": 0,
+                        "maximum": 10
+                    },
+                    **FILTER_SCHEMA_PROPERTIES
+                },
+                "required": ["queries"]
+            }
         )
     ]
 
+# 同时执行的工具调用上限。检索是阻塞的模型推理和向量库查询，放到线程池中执行，
+# HTTP 模式下多个客户端共用一个进程时不会互相阻塞事件循环，也不会同时压上过多的推理任务
+tool_call_slots = asyncio.Semaphore(settings.MCP_MAX_CONCURRENT_CALLS)
+
+
+def run_tool(name: str, arguments: Dict[str, Any]) -> str:
+    """执行一次工具调用，返回 JSON 文本"""
+    n_results = arguments.get('n_results', 5)
+    if name == "retrieve_batch":
+        queries = arguments.get('queries')
+        if not queries or not all(isinstance(query, str) and query.strip() for query in queries):
+            raise ValueError("queries 参数不能为空，且每个查询都不能为空")
+        if len(queries) > settings.RAG_BATCH_MAX_QUERIES:
+            raise ValueError(f"queries 最多 {settings.RAG_BATCH_MAX_QUERIES} 个")
+        where, where_document = filters_from_arguments(arguments, settings.RAG_FILTER_TIME_FIELD)
+        batch_docs = retriever.retrieve_batch(queries, n_results, where=where, where_document=where_document)
+        results = [{"query": query, "context": retriever.format_context(retrieved_docs)}
+                   for query, retrieved_docs in zip(queries, batch_docs)]
+        return json.dumps(results, ensure_ascii=False, indent=2)
+
+    query = arguments.get('query')
+    if not query:
+        raise ValueError("query 参数不能为空")
+    where, where_document = filters_from_arguments(arguments, settings.RAG_FILTER_TIME_FIELD)
+    retrieved_docs = retriever.retrieve(query, n_results, where=where, where_document=where_document)
+    results = retriever.format_context(retrieved_docs)
+    return json.dumps(results, ensure_ascii=False, indent=2)
+
+
 # 处理工具调用，其实相当于调用函数
 @server.call_tool()
 async def handle_call_tool(name: str, arguments: Dict[str, Any]) -> List[Content]:
     """
     处理工具调用请求
     """
-    if name != "retrieve":
+    if name not in ("retrieve", "retrieve_batch"):
         raise ValueError(f"未知工具: {name}")
     
     try:
-        query = arguments.get('query')
-        n_results = arguments.get('n_results', 5) 
-        if not query:
-            raise ValueError("query 参数不能为空")
-        retrieved_docs = retriever.retrieve(query, n_results)
-        results = retriever.format_context(retrieved_docs)
-        response_text = json.dumps(results, ensure_ascii=False, indent=2)
+        async with tool_call_slots:
+            response_text = await asyncio.get_running_loop().run_in_executor(None, run_tool, name, arguments)
         
         return [TextContent(type="text", text=response_text)]
 
@@ -182,7 +546,7 @@ async def handle_call_tool(name: str, arguments: Dict[str, Any]) -> List[Content
 
      
 
-# 主函数，启动服务器，运行 MCP 服务
+# 主函数，启动服务器，通过标准输入输出运行 MCP 服务 (每个客户端启动一个进程，适合本地使用)
 async def main():
     # 运行 MCP 服务器
     async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
@@ -202,5 +566,41 @@ async def main():
         )
         logger.info("MCP Stdio Server: Run loop finished or client disconnected.")
 
+
+def create_http_app():
+    """
+    Streamable HTTP 传输 (POST /mcp，流式响应使用 SSE)。
+    服务常驻，所有客户端会话共用同一个 retriever (嵌入模型、向量库连接、关键词索引只加载一次)
+    """
+    from starlette.applications import Starlette
+    from starlette.routing import Mount
+    from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+
+    session_manager = StreamableHTTPSessionManager(app=server, json_response=False)
+
+    async def handle_streamable_http(scope, receive, send):
+        await session_manager.handle_request(scope, receive, send)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        async with session_manager.run():
+            logger.info("MCP HTTP Server: session manager started")
+            yield
+        logger.info("MCP HTTP Server: session manager stopped")
+
+    return Starlette(routes=[Mount("/mcp", app=handle_streamable_http)], lifespan=lifespan)
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="知识检索 MCP 服务")
+    parser.add_argument("--transport", choices=["stdio", "http"], default="stdio",
+                        help="stdio: 由客户端启动的子进程; http: 常驻服务，多个客户端共用")
+    parser.add_argument("--host", default=settings.MCP_HTTP_HOST)
+    parser.add_argument("--port", type=int, default=settings.MCP_HTTP_PORT)
+    args = parser.parse_args()
+
+    if args.transport == "http":
+        import uvicorn
+        uvicorn.run(create_http_app(), host=args.host, port=args.port)
+    else:
+        asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,56 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional
+
+# 检索过滤依赖的 metadata 字段规范化。业务后端推送的时间是 ISO 8601 字符串，
+# 向量库的 where 只能对数值做范围比较，因此写入前为每个时间字段补一个秒级时间戳字段 "{字段}_ts"；
+# source_type 统一为去掉首尾空白的小写字符串，等值过滤不需要关心大小写。
+# 这个模块会在进程池的子进程中导入，只依赖标准库。
+TIMESTAMP_SUFFIX = "_ts"
+
+
+def timestamp_field(field: str) -> str:
+    return field + TIMESTAMP_SUFFIX
+
+
+def parse_timestamp(value: Any) -> Optional[datetime]:
+    """
+    解析 metadata 中的时间：ISO 8601 字符串 ("2025-07-05T12:30:00Z")，或者秒/毫秒级的 Unix 时间戳。
+    无法解析时返回 None。没有时区的时间按 UTC 处理。
+    """
+    if value is None or value == "" or isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            try:
+                parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+            except ValueError:
+                return None
+            return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    if isinstance(value, (int, float)):
+        seconds = value / 1000 if value > 1e11 else value
+        try:
+            return datetime.fromtimestamp(seconds, tz=timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            return None
+    return None
+
+
+def normalize_metadata(metadata: Dict[str, Any], time_fields: Iterable[str]) -> Dict[str, Any]:
+    """返回规范化后的 metadata 副本，原有字段保持不变，只补充或规范化过滤用的字段"""
+    normalized = dict(metadata)
+    if isinstance(normalized.get("source_type"), str):
+        normalized["source_type"] = normalized["source_type"].strip().lower()
+    for field in time_fields:
+        timestamp = parse_timestamp(normalized.get(field))
+        if timestamp is not None:
+            normalized[timestamp_field(field)] = int(timestamp.timestamp())
+        else:
+            normalized.pop(timestamp_field(field), None)
+    return normalized
+
+
+def derived_fields(time_fields: Iterable[str]) -> set:
+    """normalize_metadata 补充的字段，返回给调用方 (和 LLM) 时去掉"""
+    return {timestamp_field(field) for field in time_fields}
@@ -0,0 +1,40 @@
+from typing import List, Sequence
+
+import numpy as np
+
+# 最大边际相关性 (MMR) 选择：每一步选 λ·与问题的相似度 - (1-λ)·与已选结果的最大相似度 最高的候选，
+# 避免同一篇公告的几个几乎相同的文本块同时占满 top-k。
+# 每一步只需要刚选中的候选与全部候选的相似度 (一次矩阵-向量乘)，不计算完整的 N×N 相似度矩阵；
+# 余弦相似度通过除以预先算好的范数得到，不复制归一化后的候选矩阵。
+# 100 个 768 维候选、k=10 时耗时约 0.2 毫秒，其中大半是把候选向量拼成矩阵 (见 tests/rag/bench_mmr.py)。
+
+
+def mmr_select(query_embedding: Sequence[float], embeddings: Sequence[Sequence[float]], k: int,
+               lambda_mult: float = 0.5) -> List[int]:
+    """
+    从候选向量中选出 k 个，返回按选中顺序排列的候选下标。
+    lambda_mult 为 1 时等价于按相似度排序，越小越强调多样性。向量不要求事先归一化。
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if k <= 0 or matrix.size == 0:
+        return []
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norms = np.maximum(np.sqrt(np.einsum("ij,ij->i", matrix, matrix)), 1e-12)
+    relevance = lambda_mult * (matrix @ query) / (norms * max(float(np.linalg.norm(query)), 1e-12))
+    # 每个候选与已选结果的余弦相似度除以 norms 前乘上 (1-λ)/norms[pick]
+    weights = (1 - lambda_mult) / norms
+
+    k = min(k, len(matrix))
+    selected = np.empty(k, dtype=np.intp)
+    scores = relevance.copy()
+    redundancy = None  # 候选与已选结果的最大相似度 (已乘 1-λ)
+    for step in range(k):
+        pick = int(np.argmax(scores))
+        selected[step] = pick
+        if step == k - 1:
+            break
+        similarity = (matrix @ matrix[pick]) * (weights * (1 / norms[pick]))
+        redundancy = similarity if redundancy is None else np.maximum(redundancy, similarity)
+        scores = relevance - redundancy
+        scores[selected[:step + 1]] = -np.inf
+    return selected.tolist()
@@ -0,0 +1,246 @@
+import hashlib
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.rag.collection_alias import list_collection_names
+from app.rag.metadata_fields import parse_timestamp, timestamp_field
+from app.rag.retrieval_filters import conjunctive_conditions
+from app.rag.sharding import ShardedCollection
+from app.rag.vector_store import VectorStore
+
+# 动态数据的时间分区：dynamic 分片的每个版本 (如 "{base}__dynamic__v2") 不再是单个集合，
+# 而是按 (source_type, 月份) 拆成多个分区集合 "{版本名}__p__{source_type}__{YYYYMM}"。
+# 过期数据按 source_type 的保留期整月删除：直接删掉整个分区集合，不需要逐个ID删除。
+PARTITION_MARKER = "__p__"
+DEFAULT_SOURCE_TYPE = "other"
+# Chroma 集合名最长 63 个字符。超过 _MAX_SOURCE_TYPE_CHARS 的 source_type 换成 "前缀_哈希" 的固定长度形式，
+# 同一个 source_type 总是得到同一个分区名，"{base}__dynamic__vN" 形式的版本名加上分区后缀仍不超过上限
+MAX_COLLECTION_NAME_CHARS = 63
+_MAX_SOURCE_TYPE_CHARS = 16
+_HASH_CHARS = 8
+
+
+def partition_collection_name(name: str, source_type: str, month: str) -> str:
+    partition = f"{name}{PARTITION_MARKER}{source_type}__{month}"
+    if len(partition) > MAX_COLLECTION_NAME_CHARS:
+        raise ValueError(f"Partition collection name {partition!r} exceeds {MAX_COLLECTION_NAME_CHARS} characters, "
+                         f"use a shorter collection base name")
+    return partition
+
+
+def parse_partition(name: str, collection_name: str) -> Optional[Tuple[str, str]]:
+    """从分区集合名中解析 (source_type, YYYYMM)，不是 name 的分区时返回 None"""
+    match = re.fullmatch(re.escape(name + PARTITION_MARKER) + r"(.+)__(\d{6})", collection_name)
+    return (match.group(1), match.group(2)) if match else None
+
+
+def list_partitions(client: VectorStore, name: str) -> Dict[str, Tuple[str, str]]:
+    """集合名 -> (source_type, YYYYMM)"""
+    partitions = {}
+    for collection_name in list_collection_names(client):
+        key = parse_partition(name, collection_name)
+        if key is not None:
+            partitions[collection_name] = key
+    return partitions
+
+
+def drop_partitions(client: VectorStore, name: str) -> List[str]:
+    """删除某个版本的所有分区集合 (删除版本集合时调用)"""
+    dropped = sorted(list_partitions(client, name))
+    for collection_name in dropped:
+        client.delete_collection(name=collection_name)
+    return dropped
+
+
+def month_index(month: str) -> int:
+    return int(month[:4]) * 12 + int(month[4:]) - 1
+
+
+class TimePartitioner:
+    """
+    按 metadata 计算文本块所在的分区 (source_type, YYYYMM)，并按 source_type 的保留期判断分区是否过期。
+    metadata 中没有可解析的时间时使用写入时间。
+    retention_months: source_type -> 保留月数，未列出的使用 default_retention_months，0 表示永久保留。
+    """
+
+    def __init__(self, time_field: str = "created_at", retention_months: Dict[str, int] = None,
+                 default_retention_months: int = 0):
+        self.time_field = time_field
+        self.retention_months = {self.source_type({"source_type": k}): v for k, v in (retention_months or {}).items()}
+        self.default_retention_months = default_retention_months
+
+    @staticmethod
+    def source_type(metadata: Optional[Dict[str, Any]]) -> str:
+        value = str((metadata or {}).get("source_type") or DEFAULT_SOURCE_TYPE)
+        value = re.sub(r"[^A-Za-z0-9_-]", "_", value).strip("_-")
+        if len(value) > _MAX_SOURCE_TYPE_CHARS:
+            digest = hashlib.sha1(value.encode("utf-8")).hexdigest()[:_HASH_CHARS]
+            value = f"{value[:_MAX_SOURCE_TYPE_CHARS - _HASH_CHARS - 1].rstrip('_-')}_{digest}"
+        return value or DEFAULT_SOURCE_TYPE
+
+    def partition_for(self, metadata: Optional[Dict[str, Any]], now: datetime = None) -> Tuple[str, str]:
+        timestamp = parse_timestamp((metadata or {}).get(self.time_field))
+        if timestamp is None:
+            timestamp = now or datetime.now(timezone.utc)
+        return self.source_type(metadata), timestamp.astimezone(timezone.utc).strftime("%Y%m")
+
+    def retention_for(self, source_type: str) -> int:
+        return self.retention_months.get(source_type, self.default_retention_months)
+
+    def may_match(self, source_type: str, month: str, where: Optional[Dict[str, Any]]) -> bool:
+        """
+        分区中是否可能有满足 where 的文本块：source_type 不在等值/$in 条件内，
+        或者分区所在月份与时间范围条件 (按 time_field 的数值字段) 不相交时返回 False。
+        """
+        month_start = datetime(int(month[:4]), int(month[4:]), 1, tzinfo=timezone.utc).timestamp()
+        next_index = month_index(month) + 1
+        month_end = datetime(next_index // 12, next_index % 12 + 1, 1, tzinfo=timezone.utc).timestamp()
+        ts_field = timestamp_field(self.time_field)
+        for field, operator, target in conjunctive_conditions(where):
+            if field == "source_type" and operator in ("$eq", "$in"):
+                allowed = [target] if operator == "$eq" else target
+                if source_type not in {self.source_type({"source_type": value}) for value in allowed}:
+                    return False
+            elif field == ts_field and isinstance(target, (int, float)):
+                if operator in ("$gt", "$gte") and month_end <= target:
+                    return False
+                if (operator == "$lt" and month_start >= target) or (operator == "$lte" and month_start > target):
+                    return False
+        return True
+
+    def is_expired(self, source_type: str, month: str, now: datetime = None) -> bool:
+        """分区所在的月份结束后超过保留期 (按自然月计) 即视为过期"""
+        retention = self.retention_for(source_type)
+        if retention <= 0:
+            return False
+        now = now or datetime.now(timezone.utc)
+        current = now.year * 12 + now.month - 1
+        return month_index(month) + 1 + retention <= current
+
+
+class PartitionedCollection(ShardedCollection):
+    """
+    由一组时间分区组成的集合，对外接口与普通集合相同：
+    写入按 metadata 路由到分区 (分区不存在时创建)，查询并行发往所有分区后按距离合并。
+    其他进程新建的分区在 refresh_interval_s 内可见。
+    """
+
+    def __init__(self, client: VectorStore, name: str, partitioner: TimePartitioner, executor: ThreadPoolExecutor,
+                 refresh_interval_s: float = 10.0):
+        super().__init__(name, {}, router=None, executor=executor)
+        self.client = client
+        self.partitioner = partitioner
+        self.refresh_interval_s = refresh_interval_s
+        self._lock = threading.Lock()
+        self._loaded_at = None
+
+    def _refresh(self) -> Dict[str, List]:
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.refresh_interval_s:
+                if self._loaded_at is None:
+                    # 版本集合本身保持为空，只用来标记这个版本存在 (列出版本、清理旧版本都按集合名进行)
+                    self.client.get_or_create_collection(name=self.name)
+                shards = dict(self.shards)
+                names = list_partitions(self.client, self.name)
+                for partition in names:
+                    if partition not in shards:
+                        shards[partition] = [self.client.get_or_create_collection(name=partition)]
+                # 已被压缩任务删除的分区
+                self.shards = {partition: shards[partition] for partition in names}
+                self._loaded_at = time.monotonic()
+            return self.shards
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def _ids_by_shard(self, ids: List[str]) -> Dict[str, List[str]]:
+        # 只凭ID无法知道文本块在哪个分区
+        return {partition: list(ids) for partition in self._refresh()}
+
+    def _targets(self, where: Optional[Dict] = None) -> Dict[str, List]:
+        shards = self._refresh()
+        if not where:
+            return shards
+        return {partition: collections for partition, collections in shards.items()
+                if self.partitioner.may_match(*parse_partition(self.name, partition), where)}
+
+    def partitions(self) -> Dict[str, Tuple[str, str]]:
+        return {partition: parse_partition(self.name, partition) for partition in self._refresh()}
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        groups = {}
+        for i in range(len(ids)):
+            key = self.partitioner.partition_for(metadatas[i] if metadatas is not None else None)
+            groups.setdefault(partition_collection_name(self.name, *key), []).append(i)
+
+        shards = self._refresh()
+        # 文本块的时间或 source_type 变化后会落到另一个分区。先并行只读地查出其他分区中的旧副本，
+        # 只在确实有旧副本的分区执行删除，绝大多数批次 (新文本块、分区不变的更新) 不产生删除
+        lookups = {}
+        for partition, collections in shards.items():
+            others = [ids[i] for target, positions in groups.items() if target != partition for i in positions]
+            if others:
+                lookups[partition] = self.executor.submit(collections[0].get, ids=others, include=[])
+        stale = []
+        for partition, lookup in lookups.items():
+            found = lookup.result()["ids"]
+            if found:
+                stale.append(self.executor.submit(shards[partition][0].delete, ids=found))
+        for future in stale:
+            future.result()
+
+        for partition, positions in groups.items():
+            if partition not in shards:
+                with self._lock:
+                    if partition not in self.shards:
+                        self.shards = dict(self.shards, **{
+                            partition: [self.client.get_or_create_collection(name=partition)]})
+                    shards = self.shards
+            shards[partition][0].upsert(
+                ids=[ids[i] for i in positions],
+                embeddings=[embeddings[i] for i in positions],
+                documents=[documents[i] for i in positions] if documents is not None else None,
+                metadatas=[metadatas[i] for i in positions] if metadatas is not None else None
+            )
+
+    def delete(self, ids=None, where=None):
+        self._refresh()
+        super().delete(ids=ids, where=where)
+
+    def count(self):
+        self._refresh()
+        return super().count()
+
+    def get(self, ids=None, where=None, where_document=None, limit=None, offset=None, include=None):
+        self._refresh()
+        return super().get(ids=ids, where=where, where_document=where_document, limit=limit, offset=offset,
+                           include=include)
+
+    def query(self, query_embeddings, n_results=10, where=None, where_document=None, include=None):
+        self._refresh()
+        return super().query(query_embeddings, n_results=n_results, where=where, where_document=where_document,
+                             include=include)
+
+
+def partitioned_shard_factory(client: VectorStore, partitioner: TimePartitioner, shards, refresh_interval_s: float,
+                              max_workers: int = 4):
+    """供 ShardedCollectionResolver 使用：shards 中的分片以 PartitionedCollection 打开，每个版本名只创建一次"""
+    # 分区查询在上层分片查询的线程中发起，使用单独的线程池，避免互相等待而耗尽线程
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="partition-query")
+    lock = threading.Lock()
+    collections = {}
+
+    def factory(shard: str, name: str):
+        if shard not in shards:
+            return None
+        with lock:
+            if name not in collections:
+                collections[name] = PartitionedCollection(client, name, partitioner, executor, refresh_interval_s)
+            return collections[name]
+
+    return factory
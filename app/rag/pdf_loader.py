@@ -0,0 +1,31 @@
+import copy
+from functools import lru_cache
+from typing import List, Dict, Tuple
+
+from langchain_community.document_loaders import PyMuPDFLoader
+
+from app.rag.text_splitter import ChineseTextSplitter, create_text_splitter
+
+# 这个模块会在进程池的子进程中导入，只能依赖轻量的解析库，
+# 不要在这里导入嵌入模型或向量数据库客户端
+
+
+@lru_cache(maxsize=4)
+def _get_text_splitter(chunk_size: int, chunk_overlap: int, length_unit: str,
+                       tokenizer_dir: str) -> ChineseTextSplitter:
+    # 子进程会处理多个文件，分词器只加载一次
+    return create_text_splitter(chunk_size, chunk_overlap, length_unit=length_unit, tokenizer_dir=tokenizer_dir)
+
+
+def load_and_split_pdf(file_path: str, chunk_size: int, chunk_overlap: int, length_unit: str = "char",
+                       tokenizer_dir: str = None) -> Tuple[List[str], List[Dict]]:
+    """
+    解析单个 PDF 并逐页切分成文本块，返回 (文本列表, metadata 列表)。
+    """
+    text_splitter = _get_text_splitter(chunk_size, chunk_overlap, length_unit, tokenizer_dir)
+    texts, metadatas = [], []
+    for page in PyMuPDFLoader(file_path).lazy_load():
+        for chunk in text_splitter.iter_split_text(page.page_content):
+            texts.append(chunk)
+            metadatas.append(copy.deepcopy(page.metadata))
+    return texts, metadatas
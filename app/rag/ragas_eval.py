@@ -130,10 +130,12 @@ async def generate_evaluation_data_remote():
     # 构建 LangChain 调用链
     rag_chain = ChatPromptTemplate.from_template(RAG_PROMPT_TEMPLATE) | llm | StrOutputParser()
 
-    for question in questions:
+    # 所有问题一次批量检索，之后逐个调用 LLM 生成回答
+    batch_docs = retriever.retrieve_batch(list(questions), settings.RAG_N_RESULT)
+
+    for question, retrieved_docs in zip(questions, batch_docs):
         print(f"正在处理问题: {question}")
         
-        retrieved_docs = retriever.retrieve(question)
         contexts = [doc['content'] for doc in retrieved_docs]
         ground_truth = ground_truths.get(question, "")
         
@@ -0,0 +1,457 @@
+import argparse
+import os
+import time
+from typing import List, Dict, Any
+
+import numpy as np
+from redis import Redis
+
+from app.configs.config import settings
+from app.utils.singleton import vector_store, collection_resolver, logger, redis_pool
+from app.rag.mcp_rag_service import retriever
+from app.rag.init_vector_db import get_deduplicator, ingest_pdf_files
+from app.rag.dedup import duplicates_collection_name
+from app.rag.bulk_backfill import backfill
+from app.rag.sharding import SOURCE_SHARDS, shard_base_name
+from app.rag.partitions import drop_partitions
+from app.rag.metadata_fields import normalize_metadata
+from app.rag.ingest_manifest import plan_incremental_ingest, save_manifest
+from app.rag.collection_alias import (
+    list_collection_names, list_versions, parse_version, read_alias, reembed_queue_key, same_embedding, write_alias,
+    versioned_collection_name
+)
+
+BASE_NAME = settings.CHROMA_RAG_COLLECTION_NAME
+
+
+def copy_dynamic_chunks(source, target, page_size: int = 512) -> int:
+    """
+    把 source 中的动态文本块 (dynamic::) 用当前嵌入模型重新嵌入后写入 target。
+    动态文档的原文只在业务数据库中，这里沿用已有的切分结果；
+    如果需要按新的 CHUNK_SIZE 重新切分，请改用业务库导出的快照做批量回填。
+    嵌入模型不变时重建窗口内同步 worker 会双写，target 中已存在的ID是更新的版本，不再覆盖；
+    换了模型时 worker 不写 target，窗口内的更新排在重新嵌入队列里，由 reembed_queued 补齐。
+    复制时按当前规则重新规范化 metadata，旧数据也会补上检索过滤用的字段。
+    """
+    copied, offset = 0, 0
+    while True:
+        page = source.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        offset += len(page["ids"])
+
+        rows = [(i, d, normalize_metadata(m, [settings.RAG_FILTER_TIME_FIELD]))
+                for i, d, m in zip(page["ids"], page["documents"], page["metadatas"]) if i.startswith("dynamic::")]
+        if not rows:
+            continue
+        existing = set(target.get(ids=[i for i, _, _ in rows], include=[])["ids"])
+        rows = [row for row in rows if row[0] not in existing]
+        if not rows:
+            continue
+
+        ids, documents, metadatas = (list(column) for column in zip(*rows))
+        target.upsert(
+            ids=ids,
+            embeddings=retriever.get_embeddings(documents),
+            documents=documents,
+            metadatas=metadatas
+        )
+        copied += len(ids)
+        logger.info(f"Copied {copied} dynamic chunks into '{target.name}'...")
+    return copied
+
+
+def copy_dynamic_duplicates(source, target, page_size: int = 512) -> int:
+    """
+    source 中被跳过的动态近重复文本块只保存在它的 duplicates 集合里，按新集合重新判断一遍：
+    仍是重复的登记到新集合的 duplicates 集合，否则嵌入后写入新集合。返回写入新集合的数量。
+    """
+    deduplicator = get_deduplicator()
+    if not deduplicator.enabled:
+        return 0
+    names = set(list_collection_names(vector_store))
+    if duplicates_collection_name(source.name) not in names:
+        return 0
+    source_duplicates = vector_store.get_collection(name=duplicates_collection_name(source.name))
+    # 新集合刚被直接写入过，丢弃可能过期的指纹索引
+    deduplicator.invalidate(target)
+
+    stored, offset = 0, 0
+    while True:
+        page = source_duplicates.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        offset += len(page["ids"])
+        rows = [(i, d, {k: v for k, v in m.items() if k not in ("canonical_id", "simhash")})
+                for i, d, m in zip(page["ids"], page["documents"], page["metadatas"]) if i.startswith("dynamic::")]
+        if not rows:
+            continue
+        ids, documents, metadatas = (list(column) for column in zip(*rows))
+        keep, duplicates = deduplicator.filter_chunks(target, ids, documents, metadatas)
+        kept_ids = [ids[i] for i in keep]
+        if keep:
+            target.upsert(
+                ids=kept_ids,
+                embeddings=retriever.get_embeddings([documents[i] for i in keep]),
+                documents=[documents[i] for i in keep],
+                metadatas=[metadatas[i] for i in keep]
+            )
+        deduplicator.record_stored([target], kept_ids, duplicates)
+        stored += len(keep)
+    logger.info(f"Re-checked dynamic near-duplicates into '{target.name}': {stored} stored as regular chunks.")
+    return stored
+
+
+def copy_duplicate_records(source_name: str, target_name: str, page_size: int = 512) -> int:
+    """
+    分片模式下近重复记录属于组合后的整体集合 ({base}__duplicates)，重建单个分片时不需要处理；
+    只有第一次从未分片的版本集合迁移时，把它的动态近重复记录原样复制过来 (规范文本块ID不变)。
+    """
+    source_duplicates, target_duplicates = duplicates_collection_name(source_name), duplicates_collection_name(target_name)
+    if source_duplicates == target_duplicates or source_duplicates not in list_collection_names(vector_store):
+        return 0
+    source = vector_store.get_collection(name=source_duplicates)
+    target = vector_store.get_or_create_collection(name=target_duplicates)
+    copied, offset = 0, 0
+    while True:
+        page = source.get(include=["documents", "metadatas", "embeddings"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        offset += len(page["ids"])
+        rows = [row for row in zip(page["ids"], page["embeddings"], page["documents"], page["metadatas"])
+                if row[0].startswith("dynamic::")]
+        if rows:
+            ids, embeddings, documents, metadatas = (list(column) for column in zip(*rows))
+            target.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+            copied += len(ids)
+    return copied
+
+
+def reembed_queued(source, target, queue_key: str, page_size: int = 256) -> int:
+    """
+    重建换了嵌入模型时，同步 worker 只写 active，把文本块ID放进重新嵌入队列 (见 app.rag.collection_alias)。
+    这里取出队列中的ID，按 source 中的最新内容用当前模型重新嵌入后写入 target；source 中已不存在的从 target 删除。
+    返回处理的ID数量。
+    """
+    r = Redis(connection_pool=redis_pool)
+    handled = 0
+    while True:
+        ids = r.spop(queue_key, page_size)
+        if not ids:
+            break
+        page = source.get(ids=ids, include=["documents", "metadatas"])
+        if page["ids"]:
+            metadatas = [normalize_metadata(m, [settings.RAG_FILTER_TIME_FIELD]) for m in page["metadatas"]]
+            target.upsert(
+                ids=page["ids"],
+                embeddings=retriever.get_embeddings(page["documents"]),
+                documents=page["documents"],
+                metadatas=metadatas
+            )
+        found = set(page["ids"])
+        missing = [chunk_id for chunk_id in ids if chunk_id not in found]
+        if missing:
+            target.delete(ids=missing)
+        handled += len(ids)
+    if handled:
+        logger.info(f"Re-embedded {handled} chunks written to '{source.name}' during the rebuild into '{target.name}'.")
+    return handled
+
+
+def _open_collection(shard: str, name: str):
+    """分片的版本可能由多个时间分区组成 (RAG_SHARDING=time 的 dynamic 分片)，通过解析器打开"""
+    if shard and hasattr(collection_resolver, "shard_collection"):
+        return collection_resolver.shard_collection(shard, name)
+    return vector_store.get_or_create_collection(name=name)
+
+
+def _delete_collection(name: str):
+    """删除一个版本集合、它的时间分区以及它的 duplicates 集合"""
+    if name in list_collection_names(vector_store):
+        vector_store.delete_collection(name=name)
+    drop_partitions(vector_store, name)
+    if duplicates_collection_name(name) in list_collection_names(vector_store):
+        vector_store.delete_collection(name=duplicates_collection_name(name))
+
+
+def sample_foreign_embeddings(collection, samples: int = 16, min_similarity: float = 0.98) -> int:
+    """
+    在集合中均匀抽取 samples 个文本块，用当前模型重新嵌入并与已存的向量比较，
+    返回相似度低于 min_similarity (不是当前模型生成) 的数量。
+    """
+    count = collection.count()
+    if count == 0:
+        return 0
+    step = max(1, count // samples)
+    foreign = 0
+    for offset in range(0, count, step)[:samples]:
+        page = collection.get(limit=1, offset=offset, include=["documents", "embeddings"])
+        if not page["ids"] or page["embeddings"] is None or len(page["embeddings"]) == 0:
+            continue
+        stored = np.asarray(page["embeddings"][0], dtype=np.float32)
+        fresh = np.asarray(retriever.get_embeddings([page["documents"][0]])[0], dtype=np.float32)
+        if stored.shape != fresh.shape:
+            foreign += 1
+            continue
+        denominator = float(np.linalg.norm(stored) * np.linalg.norm(fresh))
+        if denominator == 0 or float(stored @ fresh) / denominator < min_similarity:
+            foreign += 1
+    return foreign
+
+
+def verify_collection(collection, expected_count: int, min_count_ratio: float) -> List[str]:
+    """
+    切换前的校验：数量不低于预期的一定比例，用当前嵌入模型的向量能正常查询 (维度一致)，
+    且抽样的文本块都是用当前模型嵌入的。返回问题列表，为空表示通过。
+    """
+    problems = []
+    count = collection.count()
+    if count == 0:
+        problems.append("collection is empty")
+    elif count < expected_count * min_count_ratio:
+        problems.append(f"collection has {count} chunks, expected at least {expected_count * min_count_ratio:.0f}")
+    try:
+        probe = collection.query(query_embeddings=retriever.get_embeddings(["社团"]), n_results=1)
+        if count and not probe["ids"][0]:
+            problems.append("probe query returned no results")
+    except Exception as e:
+        problems.append(f"probe query failed: {e}")
+    try:
+        foreign = sample_foreign_embeddings(collection)
+        if foreign:
+            problems.append(f"{foreign} sampled chunks were not embedded with the current model")
+    except Exception as e:
+        problems.append(f"embedding sample check failed: {e}")
+    return problems
+
+
+def garbage_collect(keep: int = None, base_name: str = BASE_NAME) -> List[str]:
+    """删除既不是 active 也不是 building 的旧版本集合，只保留最近的 keep 个旧版本用于回滚"""
+    keep = settings.RAG_COLLECTION_KEEP_VERSIONS if keep is None else keep
+    record = read_alias(vector_store, base_name)
+    in_use = {record["active"], record.get("building")}
+
+    names = set(list_collection_names(vector_store))
+    # 未带版本号的原始集合视为第 0 版
+    candidates = [(0, base_name)] if base_name in names else []
+    candidates += [(v, versioned_collection_name(base_name, v)) for v in list_versions(vector_store, base_name)]
+    old_versions = [name for _, name in sorted(candidates, reverse=True) if name not in in_use]
+
+    deleted = []
+    for name in old_versions[keep:]:
+        _delete_collection(name)
+        deleted.append(name)
+        logger.info(f"Garbage-collected old collection version '{name}'.")
+    return deleted
+
+
+def _dynamic_source(base_name: str, active):
+    """
+    复制动态文本块的来源：通常是当前 active 集合。
+    第一次启用分片时 dynamic 分片还是空的，改为从未分片的集合复制。
+    """
+    if base_name == BASE_NAME or active.count() > 0:
+        return active
+    legacy_name = read_alias(vector_store, BASE_NAME)["active"]
+    if legacy_name not in list_collection_names(vector_store):
+        return active
+    logger.info(f"Shard '{base_name}' is empty, copying dynamic chunks from unsharded '{legacy_name}'.")
+    return vector_store.get_collection(name=legacy_name)
+
+
+def _check_other_shards(shard: str, embedding: Dict[str, Any]):
+    """单独重建一个分片时，其他分片的模型必须与本次一致，否则查询向量只能匹配其中一部分分片"""
+    for other in SOURCE_SHARDS:
+        if other == shard:
+            continue
+        other_embedding = read_alias(vector_store, shard_base_name(BASE_NAME, other)).get("active_embedding")
+        if not same_embedding(embedding, other_embedding):
+            raise RuntimeError(f"Shard '{other}' is embedded with {other_embedding}, but this rebuild uses "
+                               f"{embedding}. Changing the embedding model requires rebuilding all shards together "
+                               f"(run without --shard).")
+
+
+def rebuild(pdf_dir: str, min_count_ratio: float = 0.5, skip_dynamic: bool = False,
+            snapshot_path: str = None, shard: str = None, switch: bool = True,
+            all_shards: bool = False) -> Dict[str, Any]:
+    """
+    蓝绿重建：
+    1. 创建新版本集合 {base}__v{n}，并把它和当前嵌入模型登记为 building。
+       模型与 active 相同时同步 worker 开始双写；模型不同时 worker 只写 active，并把文本块ID放进重新嵌入队列
+    2. 导入全部静态 PDF；动态文档有快照时从快照重新切分回填，否则复制并重新嵌入已有的动态文本块，
+       然后用新模型补齐重新嵌入队列
+    3. 校验通过后原子地把 active 切到新版本 (见 switch_version)，校验失败则放弃新版本
+    4. 清理多余的旧版本
+    指定 shard 时只重建该分片 ({base}__{shard})：static 分片只导入 PDF，dynamic 分片只处理动态文档。
+    switch=False 时校验通过后不切换，由调用方之后调用 finish_rebuild (多个分片一起换模型时，全部建好后再依次切换)；
+    all_shards 表示调用方会重建所有分片，此时允许换模型。
+    """
+    start_time = time.perf_counter()
+    base_name = shard_base_name(BASE_NAME, shard) if shard else BASE_NAME
+    include_static = shard in (None, "static")
+    skip_dynamic = skip_dynamic or shard == "static"
+    record = read_alias(vector_store, base_name)
+    if record.get("building"):
+        raise RuntimeError(f"Another rebuild is in progress: '{record['building']}'. "
+                           f"Abort it with --abort before starting a new one.")
+    # 本进程按配置加载的模型就是新版本的模型
+    embedding = retriever.embedding
+    if shard and not all_shards:
+        _check_other_shards(shard, embedding)
+
+    active = _open_collection(shard, record["active"])
+    version = max(list_versions(vector_store, base_name) + [parse_version(base_name, record["active"]) or 0]) + 1
+    new_name = versioned_collection_name(base_name, version)
+    target = _open_collection(shard, new_name)
+    write_alias(vector_store, base_name, {"active": record["active"], "building": new_name,
+                                          "active_embedding": record.get("active_embedding"),
+                                          "building_embedding": embedding})
+    if same_embedding(embedding, record.get("active_embedding")):
+        logger.info(f"Started rebuild of '{new_name}' (active: '{record['active']}'). Dual-write is on.")
+    else:
+        logger.info(f"Started rebuild of '{new_name}' (active: '{record['active']}') with embedding model "
+                    f"{embedding['model']} (dim {embedding['dim']}), replacing "
+                    f"{record['active_embedding']['model']} (dim {record['active_embedding']['dim']}). "
+                    f"Sync writes are queued for re-embedding instead of dual-written.")
+
+    # 等别名刷新间隔过去，确保同步 worker 都已开始双写 (或排队)，再复制动态数据
+    time.sleep(settings.RAG_ALIAS_REFRESH_S)
+
+    queue_key = reembed_queue_key(new_name, settings.RAG_REEMBED_QUEUE_PREFIX)
+    try:
+        filenames = sorted(f for f in os.listdir(pdf_dir) if f.endswith(".pdf")) if include_static else []
+        static_stats = ingest_pdf_files(pdf_dir, filenames, collections=[target])
+        if static_stats["failures"]:
+            raise RuntimeError(f"{len(static_stats['failures'])} static files failed to ingest")
+        if skip_dynamic:
+            dynamic_copied = 0
+        elif snapshot_path:
+            dynamic_copied = backfill(snapshot_path, collections=[target], embed_fn=retriever.get_embeddings)["chunks"]
+        else:
+            source = _dynamic_source(base_name, active)
+            dynamic_copied = copy_dynamic_chunks(source, target)
+            if shard is None:
+                dynamic_copied += copy_dynamic_duplicates(source, target)
+            elif source is not active:
+                copy_duplicate_records(source.name, BASE_NAME)
+        reembedded = reembed_queued(active, target, queue_key)
+
+        problems = verify_collection(target, expected_count=active.count(), min_count_ratio=min_count_ratio)
+        if problems:
+            raise RuntimeError("verification failed: " + "; ".join(problems))
+    except Exception:
+        logger.error(f"Rebuild of '{new_name}' failed. Keeping '{record['active']}' active.", exc_info=True)
+        abort(base_name)
+        raise
+
+    result = {"collection": new_name, "base_name": base_name, "shard": shard, "pdf_dir": pdf_dir,
+              "include_static": include_static, "static_stats": static_stats, "static_chunks": static_stats["chunks"],
+              "dynamic_copied": dynamic_copied, "reembedded": reembedded, "start_time": start_time}
+    if switch:
+        finish_rebuild(result)
+    return result
+
+
+def switch_version(base_name: str) -> int:
+    """
+    把 building 版本原子地切换为 active，同时把别名记录中的嵌入模型切到新版本的模型：
+    检索服务和同步 worker 在别名刷新后加载新模型 (见 KnowledgeRetrieverMCP.sync_embedding_model)。
+    切换前按旧别名缓存写入旧版本的文本块仍会进入重新嵌入队列，等所有进程刷新别名后再补齐一次。
+    返回切换后补齐的文本块数量。
+    """
+    record = read_alias(vector_store, base_name)
+    old_name, new_name = record["active"], record["building"]
+    write_alias(vector_store, base_name, {"active": new_name, "building": None,
+                                          "active_embedding": record.get("building_embedding"),
+                                          "building_embedding": None})
+    collection_resolver.refresh()
+    logger.info(f"Switched alias '{base_name}' to '{new_name}'.")
+
+    shard = next((shard for shard in SOURCE_SHARDS if base_name == shard_base_name(BASE_NAME, shard)), None)
+    queue_key = reembed_queue_key(new_name, settings.RAG_REEMBED_QUEUE_PREFIX)
+    if same_embedding(record.get("building_embedding"), record.get("active_embedding")):
+        Redis(connection_pool=redis_pool).delete(queue_key)
+        return 0
+    time.sleep(settings.RAG_ALIAS_REFRESH_S)
+    reembedded = reembed_queued(_open_collection(shard, old_name), _open_collection(shard, new_name), queue_key)
+    Redis(connection_pool=redis_pool).delete(queue_key)
+    return reembedded
+
+
+def finish_rebuild(result: Dict[str, Any]) -> Dict[str, Any]:
+    """切换到 rebuild 建好的新版本，更新导入清单并清理旧版本"""
+    base_name = result["base_name"]
+    result["reembedded"] += switch_version(base_name)
+
+    if result["include_static"]:
+        # 新版本的文本块ID与清单一致，切换后把清单更新为新版本的切分结果
+        pdf_dir, static_stats = result["pdf_dir"], result["static_stats"]
+        manifest_path = settings.STATIC_DOC_MANIFEST_PATH or os.path.join(pdf_dir, ".ingest_manifest.json")
+        _, _, _, fingerprints = plan_incremental_ingest(pdf_dir, {}, force=True)
+        save_manifest(manifest_path, {
+            name: dict(fingerprints[name], chunk_ids=static_stats["chunk_ids"][name])
+            for name in static_stats["succeeded"] if name in fingerprints
+        })
+
+    result["garbage_collected"] = garbage_collect(base_name=base_name)
+    result["elapsed_s"] = time.perf_counter() - result["start_time"]
+    target = _open_collection(result["shard"], result["collection"])
+    logger.info(f"Rebuild finished in {result['elapsed_s']:.1f}s: {target.count()} chunks "
+                f"({result['static_chunks']} static, {result['dynamic_copied']} dynamic copied, "
+                f"{result['reembedded']} re-embedded from the queue), removed {result['garbage_collected']}.")
+    return result
+
+
+def abort(base_name: str = BASE_NAME):
+    """放弃正在进行的重建：关闭双写并删除未完成的新版本和它的重新嵌入队列"""
+    record = read_alias(vector_store, base_name)
+    building = record.get("building")
+    if not building:
+        return
+    write_alias(vector_store, base_name, {"active": record["active"], "building": None,
+                                          "active_embedding": record.get("active_embedding"),
+                                          "building_embedding": None})
+    _delete_collection(building)
+    Redis(connection_pool=redis_pool).delete(reembed_queue_key(building, settings.RAG_REEMBED_QUEUE_PREFIX))
+    logger.warning(f"Aborted rebuild of '{building}'.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="蓝绿重建向量集合，并通过别名原子切换")
+    parser.add_argument("--status", action="store_true", help="查看当前别名和所有版本")
+    parser.add_argument("--abort", action="store_true", help="放弃正在进行的重建")
+    parser.add_argument("--gc", action="store_true", help="只清理旧版本")
+    parser.add_argument("--skip-dynamic", action="store_true", help="不复制动态文本块")
+    parser.add_argument("--snapshot", help="业务库导出的 JSONL/Parquet 快照，用于按新的切分参数回填动态文档")
+    parser.add_argument("--min-count-ratio", type=float, default=0.5, help="新版本数量相对旧版本的最低比例")
+    parser.add_argument("--shard", choices=SOURCE_SHARDS,
+                        help="只处理一个分片 (RAG_SHARDING 为 source 或 time 时)，默认依次处理所有分片")
+    args = parser.parse_args()
+
+    if args.shard:
+        shards = [args.shard]
+    else:
+        shards = list(SOURCE_SHARDS) if settings.RAG_SHARDING != "none" else [None]
+    for shard in shards:
+        base = shard_base_name(BASE_NAME, shard) if shard else BASE_NAME
+        if args.status:
+            logger.info(f"Alias: {read_alias(vector_store, base)}")
+            logger.info(f"Versions: {list_versions(vector_store, base)}")
+        elif args.abort:
+            abort(base)
+        elif args.gc:
+            garbage_collect(base_name=base)
+    if not (args.status or args.abort or args.gc):
+        # 多个分片时全部建好并校验通过后再依次切换，换嵌入模型时各分片不会长时间处于不同的模型
+        built = []
+        try:
+            for shard in shards:
+                built.append(rebuild(settings.STATIC_DOC_PATH, min_count_ratio=args.min_count_ratio,
+                                     skip_dynamic=args.skip_dynamic, snapshot_path=args.snapshot, shard=shard,
+                                     switch=False, all_shards=not args.shard))
+        except Exception:
+            for result in built:
+                abort(result["base_name"])
+            raise
+        for result in built:
+            finish_rebuild(result)
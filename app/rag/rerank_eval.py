@@ -0,0 +1,91 @@
+import argparse
+import json
+import time
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from app.configs.config import settings
+from app.rag.keyword_index import bigram_tokenize
+from app.rag.mcp_rag_service import retriever
+from app.rag.reranker import CrossEncoderReranker
+from app.utils.singleton import logger
+
+# 在 rag_evaluation_dataset.json 的问题上对比重排前后的召回率和延迟，不调用 LLM。
+# 数据集没有标注相关文本块，召回率用参考答案的覆盖率近似:
+# 参考答案的汉字二元组 (以及字母数字词) 中有多少出现在返回的文本块里。
+# 对比三组结果: 向量/混合检索直接取前 k 个、取 k' 个候选重排后保留前 k 个、以及 k' 个候选本身 (重排能达到的上限)。
+
+
+def answer_recall(ground_truth: str, contexts: Sequence[str]) -> float:
+    expected = set(bigram_tokenize(ground_truth))
+    if not expected:
+        return 0.0
+    found = set()
+    for context in contexts:
+        found.update(bigram_tokenize(context))
+    return len(expected & found) / len(expected)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    return {"p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95)),
+            "mean": float(np.mean(values))}
+
+
+def evaluate(dataset_path: str, k: int, candidates: int, reranker: CrossEncoderReranker) -> Dict:
+    with open(dataset_path, "r", encoding="utf-8") as f:
+        dataset = json.load(f)
+    questions, ground_truths = dataset["question"], dataset["ground_truth"]
+
+    retriever.reranker = reranker
+    # 预热: 加载重排模型，并让嵌入模型完成第一次推理
+    retriever.rerank_candidates(questions[0], retriever.search_candidates(
+        questions[0], retriever.get_embeddings([questions[0]])[0], candidates), k)
+
+    recalls = {"top_k": [], "reranked": [], "candidates": []}
+    latencies = {"search_ms": [], "rerank_ms": []}
+    for question, ground_truth in zip(questions, ground_truths):
+        start = time.perf_counter()
+        query_embedding = retriever.get_embeddings([question])[0]
+        found = retriever.search_candidates(question, query_embedding, candidates)
+        searched = time.perf_counter()
+        reranked = retriever.rerank_candidates(question, found, k)
+        latencies["search_ms"].append((searched - start) * 1000)
+        latencies["rerank_ms"].append((time.perf_counter() - searched) * 1000)
+
+        recalls["top_k"].append(answer_recall(ground_truth, [candidate["content"] for candidate in found[:k]]))
+        recalls["reranked"].append(answer_recall(ground_truth, [candidate["content"] for candidate in reranked]))
+        recalls["candidates"].append(answer_recall(ground_truth, [candidate["content"] for candidate in found]))
+
+    return {
+        "questions": len(questions),
+        "k": k,
+        "candidates": candidates,
+        "recall": {name: float(np.mean(values)) for name, values in recalls.items()},
+        "latency_ms": {name: percentiles(values) for name, values in latencies.items()},
+        "reranker": reranker.stats()
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="在评估数据集上对比交叉编码器重排前后的召回率与延迟")
+    parser.add_argument("--dataset", default="rag_evaluation_dataset.json")
+    parser.add_argument("--k", type=int, default=settings.RAG_N_RESULT, help="最终保留的文本块数")
+    parser.add_argument("--candidates", type=int, default=settings.RERANK_CANDIDATES, help="参与重排的候选数 k'")
+    parser.add_argument("--model-dir", default=settings.RERANK_MODEL_DIR)
+    parser.add_argument("--budget-ms", type=float, default=0, help="延迟预算，默认不限制以测量完整重排的效果")
+    parser.add_argument("--output", help="把结果写入这个 JSON 文件")
+    args = parser.parse_args()
+
+    result = evaluate(args.dataset, args.k, args.candidates, CrossEncoderReranker(
+        args.model_dir,
+        batch_size=settings.RERANK_BATCH_SIZE,
+        max_length=settings.RERANK_MAX_LENGTH,
+        budget_ms=args.budget_ms,
+        max_concurrency=1
+    ))
+    logger.info(f"Rerank evaluation: {json.dumps(result, ensure_ascii=False)}")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,94 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# 检索结果的交叉编码器 (cross-encoder) 重排。向量检索先多取 k' 个候选，
+# 交叉编码器把 (问题, 文本块) 成对打分后保留前 k 个，减少送进 LLM 的边缘文本块。
+# CPU 上交叉编码器的耗时与候选数成正比，因此每次重排前按最近的单对耗时估算能在延迟预算内打分多少个候选:
+# - 预算内放得下全部候选: 全部打分
+# - 只放得下一部分 (但不少于 k 个): 只给排名靠前的候选打分
+# - 连 k 个都放不下，或同时进行的重排已达上限 (服务繁忙): 跳过重排，保持原有排序
+
+_SKIP_DECAY = 0.8  # 每次因预算跳过后单对耗时估计值乘以这个系数
+
+
+class CrossEncoderReranker:
+    def __init__(self, model_dir: str, batch_size: int = 32, max_length: int = 512, budget_ms: float = 150,
+                 max_concurrency: int = 2, device: str = "cpu", model=None,
+                 clock: Callable[[], float] = time.perf_counter, smoothing: float = 0.3):
+        """model: 提供 predict(pairs, batch_size=...) 的对象，为空时第一次使用时加载 model_dir 中的 CrossEncoder"""
+        self.model_dir = model_dir
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.budget_ms = budget_ms
+        self.max_concurrency = max_concurrency
+        self.device = device
+        self.clock = clock
+        self.smoothing = smoothing
+        self._model = model
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self.pair_cost_ms: Optional[float] = None  # 单对打分耗时的指数移动平均
+        self.counts = {"full": 0, "truncated": 0, "skipped_budget": 0, "skipped_load": 0}
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_dir, max_length=self.max_length, device=self.device)
+        return self._model
+
+    def plan(self, n_candidates: int, top_k: int) -> int:
+        """按延迟预算决定给多少个候选打分，0 表示跳过重排"""
+        if self.budget_ms <= 0 or not self.pair_cost_ms:
+            # 没有预算限制，或还没有耗时数据 (第一次) 时全部打分
+            return n_candidates
+        affordable = int(self.budget_ms / self.pair_cost_ms)
+        if affordable >= n_candidates:
+            return n_candidates
+        return affordable if affordable >= top_k else 0
+
+    def _observe(self, pairs: int, elapsed_ms: float):
+        cost = elapsed_ms / pairs
+        with self._lock:
+            if self.pair_cost_ms is None:
+                self.pair_cost_ms = cost
+            else:
+                self.pair_cost_ms += self.smoothing * (cost - self.pair_cost_ms)
+
+    def rerank(self, query: str, documents: Sequence[str], top_k: int) -> Optional[List[Tuple[int, float]]]:
+        """
+        documents 按原有排名排列，返回重排后的前 top_k 个 (documents 中的下标, 分数)；
+        跳过重排时返回 None，调用方保持原有排序。
+        """
+        if len(documents) <= 1:
+            return None
+        with self._lock:
+            if self._inflight >= self.max_concurrency:
+                self.counts["skipped_load"] += 1
+                return None
+            self._inflight += 1
+        try:
+            n_scored = self.plan(len(documents), top_k)
+            if n_scored == 0:
+                self.counts["skipped_budget"] += 1
+                # 跳过时没有新的耗时数据，让估计值逐渐回落，负载下降后重新尝试重排
+                with self._lock:
+                    self.pair_cost_ms *= _SKIP_DECAY
+                return None
+            self.counts["full" if n_scored == len(documents) else "truncated"] += 1
+
+            start = self.clock()
+            scores = self.model.predict([(query, document) for document in documents[:n_scored]],
+                                        batch_size=self.batch_size)
+            self._observe(n_scored, (self.clock() - start) * 1000)
+            ranked = sorted(range(n_scored), key=lambda i: -float(scores[i]))[:top_k]
+            return [(i, float(scores[i])) for i in ranked]
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+    def stats(self) -> Dict[str, float]:
+        return {"pair_cost_ms": self.pair_cost_ms, "budget_ms": self.budget_ms, **self.counts}
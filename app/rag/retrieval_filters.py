@@ -0,0 +1,177 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from app.rag.metadata_fields import parse_timestamp, timestamp_field
+
+# 检索接口的 metadata 过滤。调用方可以用几个常用参数 (source_type、等值字段、时间范围) 描述范围，
+# 也可以直接传 Chroma 语法的 where / where_document，两者用 $and 组合后原样交给向量库，
+# 在向量库内部先过滤再做近邻搜索。时间范围比较的是同步时补充的数值字段 "{时间字段}_ts"。
+
+WHERE_OPERATORS = {"$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin"}
+WHERE_DOCUMENT_OPERATORS = {"$contains", "$not_contains"}
+_SCALAR_TYPES = (str, int, float, bool)
+
+
+def validate_where(where: Dict[str, Any]):
+    """检查 where 是否只使用向量库支持的写法，不合法时抛出 ValueError"""
+    if not isinstance(where, dict) or not where:
+        raise ValueError("where must be a non-empty object")
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            if not isinstance(condition, list) or len(condition) < 2:
+                raise ValueError(f"{key} requires a list of at least two conditions")
+            for clause in condition:
+                validate_where(clause)
+            continue
+        if key.startswith("$"):
+            raise ValueError(f"Unsupported where operator: {key}")
+        operators = condition if isinstance(condition, dict) else {"$eq": condition}
+        if len(operators) != 1:
+            raise ValueError(f"Field '{key}' must have exactly one operator, combine them with $and")
+        for operator, target in operators.items():
+            if operator not in WHERE_OPERATORS:
+                raise ValueError(f"Unsupported where operator: {operator}")
+            if operator in ("$in", "$nin"):
+                if not isinstance(target, list) or not target or not all(isinstance(v, _SCALAR_TYPES) for v in target):
+                    raise ValueError(f"{operator} on '{key}' requires a non-empty list of scalars")
+            elif not isinstance(target, _SCALAR_TYPES):
+                raise ValueError(f"{operator} on '{key}' requires a scalar value")
+    if len(where) > 1:
+        raise ValueError("where must have a single top-level key, combine conditions with $and")
+
+
+def validate_where_document(where_document: Dict[str, Any]):
+    if not isinstance(where_document, dict) or len(where_document) != 1:
+        raise ValueError("where_document must be an object with a single key")
+    for key, condition in where_document.items():
+        if key in ("$and", "$or"):
+            if not isinstance(condition, list) or len(condition) < 2:
+                raise ValueError(f"{key} requires a list of at least two conditions")
+            for clause in condition:
+                validate_where_document(clause)
+        elif key in WHERE_DOCUMENT_OPERATORS:
+            if not isinstance(condition, str) or not condition:
+                raise ValueError(f"{key} requires a non-empty string")
+        else:
+            raise ValueError(f"Unsupported where_document operator: {key}")
+
+
+def _as_timestamp(value: Any, name: str) -> int:
+    parsed = parse_timestamp(value)
+    if parsed is None:
+        raise ValueError(f"{name} must be an ISO 8601 time or a Unix timestamp, got {value!r}")
+    return int(parsed.timestamp())
+
+
+def build_filters(source_type: Union[str, List[str], None] = None, metadata: Dict[str, Any] = None,
+                  created_after: Any = None, created_before: Any = None, since_days: float = None,
+                  where: Dict[str, Any] = None, where_document: Dict[str, Any] = None,
+                  time_field: str = "created_at", now: datetime = None) -> Tuple[Optional[Dict], Optional[Dict]]:
+    """
+    把检索参数组合成 (where, where_document)，没有任何过滤条件时返回 (None, None)。
+    - source_type: 一个或多个来源类型
+    - metadata: 字段等值条件，例如 {"department": "tech_dept"}
+    - created_after / created_before / since_days: 按 time_field 过滤的时间范围 (左闭右开)
+    - where / where_document: Chroma 语法的原始条件
+    参数不合法时抛出 ValueError。
+    """
+    clauses = []
+    if source_type:
+        values = [source_type] if isinstance(source_type, str) else list(source_type)
+        values = [str(value).strip().lower() for value in values]
+        clauses.append({"source_type": {"$eq": values[0]} if len(values) == 1 else {"$in": values}})
+    for key, value in (metadata or {}).items():
+        if not isinstance(value, _SCALAR_TYPES):
+            raise ValueError(f"metadata filter on '{key}' requires a scalar value")
+        clauses.append({key: {"$eq": value}})
+
+    ts_field = timestamp_field(time_field)
+    lower = _as_timestamp(created_after, "created_after") if created_after is not None else None
+    if since_days is not None:
+        if since_days <= 0:
+            raise ValueError("since_days must be positive")
+        since = int(((now or datetime.now(timezone.utc)) - timedelta(days=since_days)).timestamp())
+        lower = since if lower is None else max(lower, since)
+    if lower is not None:
+        clauses.append({ts_field: {"$gte": lower}})
+    if created_before is not None:
+        clauses.append({ts_field: {"$lt": _as_timestamp(created_before, "created_before")}})
+
+    if where:
+        validate_where(where)
+        clauses.append(where)
+    if where_document:
+        validate_where_document(where_document)
+
+    combined = None
+    if len(clauses) == 1:
+        combined = clauses[0]
+    elif clauses:
+        combined = {"$and": clauses}
+    return combined, where_document or None
+
+
+# MCP 工具的过滤参数，HTTP 接口使用同名字段
+FILTER_SCHEMA_PROPERTIES = {
+    "source_type": {
+        "type": ["string", "array"],
+        "items": {"type": "string"},
+        "description": "只检索这些来源类型，例如 event、announcement、member_profile"
+    },
+    "metadata_filter": {
+        "type": "object",
+        "description": "metadata 字段的等值条件，例如 {\"department\": \"tech_dept\"}"
+    },
+    "created_after": {
+        "type": ["string", "number"],
+        "description": "只检索这个时间 (ISO 8601 或 Unix 时间戳) 之后创建的内容"
+    },
+    "created_before": {
+        "type": ["string", "number"],
+        "description": "只检索这个时间之前创建的内容"
+    },
+    "since_days": {
+        "type": "number",
+        "description": "只检索最近这么多天内创建的内容"
+    },
+    "where": {
+        "type": "object",
+        "description": "Chroma 语法的 metadata 过滤条件，与上面的条件同时生效"
+    },
+    "where_document": {
+        "type": "object",
+        "description": "Chroma 语法的正文过滤条件，例如 {\"$contains\": \"报名\"}"
+    }
+}
+
+
+def filters_from_arguments(arguments: Dict[str, Any], time_field: str = "created_at",
+                           now: datetime = None) -> Tuple[Optional[Dict], Optional[Dict]]:
+    """从工具调用参数或请求体中取出过滤参数，组合成 (where, where_document)"""
+    return build_filters(
+        source_type=arguments.get("source_type"),
+        metadata=arguments.get("metadata_filter"),
+        created_after=arguments.get("created_after"),
+        created_before=arguments.get("created_before"),
+        since_days=arguments.get("since_days"),
+        where=arguments.get("where"),
+        where_document=arguments.get("where_document"),
+        time_field=time_field,
+        now=now
+    )
+
+
+def conjunctive_conditions(where: Optional[Dict[str, Any]]) -> List[Tuple[str, str, Any]]:
+    """
+    取出 where 中必须同时满足的字段条件 (顶层以及 $and 内的)，返回 [(字段, 操作符, 值)]。
+    $or 中的条件不一定成立，不会出现在结果里。用于判断某个分片/分区是否可能有匹配的文本块。
+    """
+    conditions = []
+    for key, condition in (where or {}).items():
+        if key == "$and":
+            for clause in condition:
+                conditions.extend(conjunctive_conditions(clause))
+        elif not key.startswith("$"):
+            operators = condition if isinstance(condition, dict) else {"$eq": condition}
+            conditions.extend((key, operator, target) for operator, target in operators.items())
+    return conditions
@@ -0,0 +1,306 @@
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.rag.collection_alias import CollectionAliasResolver
+from app.rag.sync_metrics import Histogram, LATENCY_BUCKETS
+from app.rag.vector_store import VectorCollection, VectorStore
+
+# 分片集合：静态手册 (static::) 和动态社团/活动数据 (dynamic::) 分别存放在独立的集合里，
+# 每个分片有自己的别名和版本 ("{base}__{分片名}" -> "{base}__{分片名}__v{n}")，可以单独重建、清理。
+# 对调用方来说，ShardedCollection 和普通集合的接口完全相同：
+# 写入按文本块ID路由到对应分片，查询并行发往所有分片，再按距离合并出全局的 top-k。
+
+SOURCE_SHARDS = ("static", "dynamic")
+
+
+def shard_base_name(base_name: str, shard: str) -> str:
+    return f"{base_name}__{shard}"
+
+
+class SourceShardRouter:
+    """按文本块ID的前缀 (static:: / dynamic::) 路由，未知前缀归入 default 分片"""
+
+    def __init__(self, shards=SOURCE_SHARDS, default: str = "dynamic"):
+        self.shards = tuple(shards)
+        self.default = default
+
+    def shard_for(self, chunk_id: str, metadata: Optional[Dict[str, Any]] = None) -> str:
+        prefix = chunk_id.split("::", 1)[0]
+        return prefix if prefix in self.shards else self.default
+
+    def shards_for_id(self, chunk_id: str) -> List[str]:
+        """只知道ID时，这个文本块可能所在的分片 (删除、按ID读取时使用)"""
+        return [self.shard_for(chunk_id)]
+
+
+class ShardedCollection(VectorCollection):
+    """
+    shards: 分片名 -> 集合列表。列表中第一个集合用于读取，写入会同时写到列表中的所有集合
+    (某个分片正在蓝绿重建时，它的新旧两个版本都在列表中)。
+    """
+
+    def __init__(self, name: str, shards: Dict[str, List[VectorCollection]], router, executor: ThreadPoolExecutor,
+                 latency: Dict[str, Histogram] = None):
+        self.name = name
+        self.shards = shards
+        self.router = router
+        self.executor = executor
+        self.latency = latency if latency is not None else {}
+
+    def _group(self, ids: List[str], metadatas: List[Dict] = None) -> Dict[str, List[int]]:
+        groups = {}
+        for i, chunk_id in enumerate(ids):
+            shard = self.router.shard_for(chunk_id, metadatas[i] if metadatas is not None else None)
+            groups.setdefault(shard, []).append(i)
+        return groups
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        for shard, positions in self._group(ids, metadatas).items():
+            for collection in self.shards[shard]:
+                collection.upsert(
+                    ids=[ids[i] for i in positions],
+                    embeddings=[embeddings[i] for i in positions],
+                    documents=[documents[i] for i in positions] if documents is not None else None,
+                    metadatas=[metadatas[i] for i in positions] if metadatas is not None else None
+                )
+
+    def _ids_by_shard(self, ids: List[str]) -> Dict[str, List[str]]:
+        grouped = {}
+        for chunk_id in ids:
+            for shard in self.router.shards_for_id(chunk_id):
+                grouped.setdefault(shard, []).append(chunk_id)
+        return grouped
+
+    def delete(self, ids=None, where=None):
+        targets = self._ids_by_shard(ids) if ids is not None else {shard: None for shard in self.shards}
+        for shard, shard_ids in targets.items():
+            for collection in self.shards.get(shard, []):
+                collection.delete(ids=shard_ids, where=where)
+
+    def count(self):
+        return sum(collections[0].count() for collections in self.shards.values())
+
+    def _targets(self, where: Optional[Dict] = None) -> Dict[str, List[VectorCollection]]:
+        """按 where 条件选出可能有匹配文本块的分片，默认所有分片"""
+        return self.shards
+
+    def get(self, ids=None, where=None, where_document=None, limit=None, offset=None, include=None):
+        keys = ("ids", "documents", "metadatas", "embeddings")
+        merged = {key: [] for key in keys}
+
+        def extend(page):
+            for key in keys:
+                if page.get(key) is not None:
+                    merged[key].extend(page[key])
+
+        if ids is not None:
+            for shard, shard_ids in self._ids_by_shard(ids).items():
+                if shard in self.shards:
+                    extend(self.shards[shard][0].get(ids=shard_ids, where=where, where_document=where_document,
+                                                     include=include))
+            # 按请求的ID顺序返回
+            order = {chunk_id: i for i, chunk_id in enumerate(ids)}
+            rows = sorted(range(len(merged["ids"])), key=lambda i: order[merged["ids"][i]])
+            merged = {key: [values[i] for i in rows] if values else values for key, values in merged.items()}
+        elif where is None and where_document is None:
+            # 按分片的固定顺序分页，用各分片的数量跳过整片
+            skip, remaining = offset or 0, limit
+            for shard in sorted(self.shards):
+                collection = self.shards[shard][0]
+                if remaining is not None and remaining <= 0:
+                    break
+                size = collection.count()
+                if skip >= size:
+                    skip -= size
+                    continue
+                page = collection.get(limit=remaining, offset=skip, include=include)
+                extend(page)
+                skip = 0
+                if remaining is not None:
+                    remaining -= len(page["ids"])
+        else:
+            # 同样按分片顺序分页，每个分片只取本页需要的行；offset 落在后面的分片时，
+            # 只取前面分片中匹配的ID (不带正文和向量) 来计算要跳过的行数
+            skip, remaining = offset or 0, limit
+            targets = self._targets(where)
+            for shard in sorted(targets):
+                collection = targets[shard][0]
+                if remaining is not None and remaining <= 0:
+                    break
+                page = collection.get(where=where, where_document=where_document, limit=remaining, offset=skip,
+                                      include=include)
+                if not page["ids"] and skip:
+                    skip -= len(collection.get(where=where, where_document=where_document, include=[])["ids"])
+                    continue
+                extend(page)
+                skip = 0
+                if remaining is not None:
+                    remaining -= len(page["ids"])
+
+        requested = include if include is not None else ("metadatas", "documents")
+        return {key: (merged[key] if key == "ids" or key in requested else None) for key in keys}
+
+    def _query_shard(self, shard: str, collection, kwargs):
+        start = time.perf_counter()
+        try:
+            return collection.query(**kwargs)
+        finally:
+            histogram = self.latency.get(shard)
+            if histogram is not None:
+                histogram.observe(time.perf_counter() - start)
+
+    def query(self, query_embeddings, n_results=10, where=None, where_document=None, include=None):
+        include = list(include) if include is not None else ["metadatas", "documents", "distances"]
+        # 合并需要距离，调用方没有请求时不返回
+        shard_include = include if "distances" in include else include + ["distances"]
+        kwargs = dict(query_embeddings=query_embeddings, n_results=n_results, where=where,
+                      where_document=where_document, include=shard_include)
+        # 各分片并行查询，总延迟取决于最慢的分片而不是所有分片之和
+        futures = {shard: self.executor.submit(self._query_shard, shard, collections[0], kwargs)
+                   for shard, collections in self._targets(where).items()}
+        results = [future.result() for future in futures.values()]
+
+        keys = [key for key in ("documents", "metadatas", "embeddings", "distances") if key in include]
+        merged = {key: [] for key in ["ids"] + keys}
+        for row in range(len(query_embeddings)):
+            candidates = [(distance, r, i)
+                          for r, result in enumerate(results)
+                          for i, distance in enumerate(result["distances"][row])]
+            top = heapq.nsmallest(n_results, candidates, key=lambda candidate: candidate[0])
+            for key in merged:
+                merged[key].append([results[r][key][row][i] for _, r, i in top])
+        for key in ("documents", "metadatas", "embeddings", "distances"):
+            merged.setdefault(key, None)
+        return merged
+
+
+class ShardedCollectionResolver:
+    """
+    与 CollectionAliasResolver 接口相同的分片版本：每个分片有独立的别名解析器，
+    active_collection / write_collections 返回把所有分片组合在一起的 ShardedCollection。
+    """
+
+    def __init__(self, client: VectorStore, base_name: str, router=None, refresh_interval_s: float = 10.0,
+                 max_workers: int = 4, collection_factory=None):
+        self.client = client
+        # (分片名, 集合名) -> 集合，返回 None 时使用普通集合；用于把 dynamic 分片换成时间分区集合
+        self.collection_factory = collection_factory
+        self.base_name = base_name
+        self.router = router or SourceShardRouter()
+        self.resolvers = {
+            shard: CollectionAliasResolver(client, shard_base_name(base_name, shard), refresh_interval_s)
+            for shard in self.router.shards
+        }
+        self.latency = {shard: Histogram(LATENCY_BUCKETS) for shard in self.router.shards}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard-query")
+        self._lock = threading.Lock()
+        self._collections = {}
+
+    def refresh(self):
+        for resolver in self.resolvers.values():
+            resolver.refresh()
+
+    def collection(self, name: str):
+        """按实际名称获取单个集合 (某个分片的版本集合、去重记录集合等)"""
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = self.client.get_or_create_collection(name=name)
+            return self._collections[name]
+
+    def shard_collection(self, shard: str, name: str):
+        """按实际名称打开某个分片的一个版本"""
+        if self.collection_factory is not None:
+            collection = self.collection_factory(shard, name)
+            if collection is not None:
+                return collection
+        return self.collection(name)
+
+    def active_name(self) -> str:
+        """
+        各分片 active 版本名拼成的版本标识 (不是实际的集合名)，任一分片切换别名后都会变化，
+        关键词索引和对话检索候选池用它判断是否需要重建或作废
+        """
+        return "|".join(sorted(resolver.active_name() for resolver in self.resolvers.values()))
+
+    def write_names(self) -> List[str]:
+        return [self.base_name]
+
+    def _sharded(self, shards: Dict[str, List[VectorCollection]]) -> ShardedCollection:
+        return ShardedCollection(self.base_name, shards, self.router, self.executor, self.latency)
+
+    def active_collection(self) -> ShardedCollection:
+        return self._sharded({shard: [self.shard_collection(shard, r.active_name())]
+                              for shard, r in self.resolvers.items()})
+
+    def write_collections(self) -> List[ShardedCollection]:
+        return [self._sharded({shard: [self.shard_collection(shard, name) for name in r.write_names()]
+                               for shard, r in self.resolvers.items()})]
+
+    def active_embedding(self) -> Optional[Dict[str, Any]]:
+        """各分片 active 版本登记的嵌入模型。换模型的重建会一起切换所有分片，这里取第一个已登记的"""
+        for resolver in self.resolvers.values():
+            embedding = resolver.active_embedding()
+            if embedding:
+                return embedding
+        return None
+
+    def write_plan(self, embedding: Dict[str, Any]) -> Tuple[List[ShardedCollection], List[str]]:
+        """与 CollectionAliasResolver.write_plan 相同，按分片分别判断"""
+        shards, deferred = {}, []
+        for shard, resolver in self.resolvers.items():
+            names, shard_deferred = resolver.plan_names(embedding)
+            shards[shard] = [self.shard_collection(shard, name) for name in names]
+            deferred.extend(shard_deferred)
+        return [self._sharded(shards)], deferred
+
+    def route_deferred(self, deferred: List[str], ids: List[str]) -> Dict[str, List[str]]:
+        """按文本块ID所属的分片，分配给该分片正在重建的版本"""
+        routed = {}
+        for name in deferred:
+            shard = next(shard for shard in self.router.shards
+                         if name.startswith(shard_base_name(self.base_name, shard) + "__"))
+            routed[name] = [chunk_id for chunk_id in ids if self.router.shard_for(chunk_id) == shard]
+        return routed
+
+    def shard_stats(self) -> Dict[str, Dict[str, Any]]:
+        """各分片当前的集合、文本块数量和查询延迟分位数 (秒)"""
+        stats = {}
+        for shard, resolver in self.resolvers.items():
+            histogram = self.latency[shard]
+            active = self.shard_collection(shard, resolver.active_name())
+            stats[shard] = {
+                "active": resolver.active_name(),
+                "building": resolver.write_names()[1:],
+                "count": active.count(),
+                "queries": histogram.count,
+                "query_p50_s": histogram.quantile(0.5),
+                "query_p95_s": histogram.quantile(0.95),
+            }
+            if hasattr(active, "partitions"):
+                stats[shard]["partitions"] = len(active.partitions())
+        return stats
+
+
+def create_collection_resolver(client: VectorStore, base_name: str, sharding: str, refresh_interval_s: float,
+                               max_workers: int = 4, partitioner=None):
+    """
+    sharding 为 "none" 时使用单个集合，"source" 时按来源分为 static / dynamic 两个分片，
+    "time" 时在 "source" 的基础上把 dynamic 分片按 partitioner (app.rag.partitions.TimePartitioner) 分区。
+    """
+    if sharding == "none":
+        return CollectionAliasResolver(client, base_name, refresh_interval_s=refresh_interval_s)
+    if sharding == "source":
+        return ShardedCollectionResolver(client, base_name, SourceShardRouter(),
+                                         refresh_interval_s=refresh_interval_s, max_workers=max_workers)
+    if sharding == "time":
+        # partitions 模块依赖本模块，在这里导入避免循环导入
+        from app.rag.partitions import TimePartitioner, partitioned_shard_factory
+        factory = partitioned_shard_factory(client, partitioner or TimePartitioner(), ("dynamic",),
+                                            refresh_interval_s=refresh_interval_s, max_workers=max_workers)
+        return ShardedCollectionResolver(client, base_name, SourceShardRouter(),
+                                         refresh_interval_s=refresh_interval_s, max_workers=max_workers,
+                                         collection_factory=factory)
+    raise ValueError(f"Unknown RAG sharding mode: {sharding}")
@@ -0,0 +1,114 @@
+import time
+from typing import Optional, Tuple, Dict, Any
+
+from redis import Redis
+
+from app.configs.config import settings
+from app.utils.singleton import redis_pool, logger
+
+
+def parse_stream_id(stream_id: str) -> Tuple[int, int]:
+    """把 Stream 消息 ID (形如 '1700000000000-0') 解析成可比较的 (毫秒时间戳, 序号)"""
+    ms, _, seq = stream_id.partition('-')
+    return int(ms), int(seq or 0)
+
+
+def _min_stream_id(a: Optional[str], b: Optional[str]) -> Optional[str]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a if parse_stream_id(a) <= parse_stream_id(b) else b
+
+
+def compute_safe_trim_id(r: Redis, stream_name: str) -> Optional[str]:
+    """
+    计算可以安全裁剪到的消息 ID：所有消费者组中最小的“未确认消息 ID”或“最后投递 ID”。
+    XTRIM MINID 只删除比该 ID 小的消息，所以仍有消费者持有的待确认消息不会被删除。
+    没有消费者组时返回 None，表示不能裁剪。
+    """
+    safe_id = None
+    for group in r.xinfo_groups(stream_name):
+        if group['pending']:
+            # 该组仍有待确认消息，只能裁剪到其中最小的 ID 为止
+            summary = r.xpending(stream_name, group['name'])
+            candidate = summary['min']
+        else:
+            candidate = group['last-delivered-id']
+        safe_id = _min_stream_id(safe_id, candidate)
+    return safe_id
+
+
+def compute_policy_trim_id(r: Redis, stream_name: str, now_ms: int) -> Optional[str]:
+    """
+    根据配置的保留策略计算裁剪 ID，两项都未配置时返回 None。
+    REDIS_STREAM_RETENTION_MAXLEN: 至少保留最新的 N 条消息
+    REDIS_STREAM_RETENTION_MIN_AGE_S: 至少保留最近这么多秒内发布的消息
+    """
+    policy_id = None
+    if settings.REDIS_STREAM_RETENTION_MAXLEN > 0:
+        newest = r.xrevrange(stream_name, count=settings.REDIS_STREAM_RETENTION_MAXLEN)
+        if len(newest) < settings.REDIS_STREAM_RETENTION_MAXLEN:
+            return '0-0'  # 消息总数还没超过保留条数，不裁剪
+        policy_id = newest[-1][0]
+    if settings.REDIS_STREAM_RETENTION_MIN_AGE_S > 0:
+        age_id = f"{now_ms - settings.REDIS_STREAM_RETENTION_MIN_AGE_S * 1000}-0"
+        policy_id = _min_stream_id(policy_id, age_id)
+    return policy_id
+
+
+def trim_stream(r: Redis, stream_name: str = None) -> Dict[str, Any]:
+    """
+    裁剪同步 Stream，删除所有消费者组都已确认的旧消息，并报告回收的内存。
+    实际裁剪位置取“安全位置”和“保留策略位置”中较早的那个，保留策略只会让裁剪更保守。
+    """
+    stream_name = stream_name or settings.REDIS_STREAM_NAME
+    stats = {"stream": stream_name, "trim_id": None, "trimmed": 0,
+             "memory_before": None, "memory_after": None, "length_after": None}
+
+    safe_id = compute_safe_trim_id(r, stream_name)
+    if safe_id is None:
+        logger.warning(f"Stream '{stream_name}' has no consumer group. Skipping trim.")
+        return stats
+
+    policy_id = compute_policy_trim_id(r, stream_name, int(time.time() * 1000))
+    trim_id = _min_stream_id(safe_id, policy_id)
+    stats["trim_id"] = trim_id
+    if parse_stream_id(trim_id) <= (0, 0):
+        return stats
+
+    stats["memory_before"] = r.memory_usage(stream_name, samples=0)
+    # approximate=True 时 Redis 只整块释放 radix tree 节点，代价远低于精确裁剪
+    stats["trimmed"] = r.xtrim(stream_name, minid=trim_id, approximate=settings.REDIS_STREAM_TRIM_APPROXIMATE)
+    stats["memory_after"] = r.memory_usage(stream_name, samples=0)
+    stats["length_after"] = r.xlen(stream_name)
+
+    reclaimed = (stats["memory_before"] or 0) - (stats["memory_after"] or 0)
+    logger.info(
+        f"Trimmed {stats['trimmed']} entries from '{stream_name}' up to {trim_id}. "
+        f"Length now {stats['length_after']}, reclaimed {reclaimed} bytes "
+        f"({stats['memory_before']} -> {stats['memory_after']}).")
+    return stats
+
+
+class StreamTrimScheduler:
+    """在 worker 主循环中按固定间隔触发裁剪，裁剪失败只记录日志，不影响同步"""
+
+    def __init__(self, interval_s: int):
+        self.interval_s = interval_s
+        self.last_run = time.monotonic()
+
+    def maybe_trim(self, r: Redis) -> Optional[Dict[str, Any]]:
+        if self.interval_s <= 0 or time.monotonic() - self.last_run < self.interval_s:
+            return None
+        self.last_run = time.monotonic()
+        try:
+            return trim_stream(r)
+        except Exception as e:
+            logger.error(f"Failed to trim stream: {e}", extra={'msg_id': 'N/A'})
+            return None
+
+
+if __name__ == "__main__":
+    # 手动执行一次裁剪
+    trim_stream(Redis(connection_pool=redis_pool))
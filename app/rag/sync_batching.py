@@ -0,0 +1,131 @@
+import random
+from typing import List, Dict, Tuple
+
+
+def coalesce_messages(messages: List[Tuple[str, Dict[str, str]]]) -> Tuple[List[Tuple[str, Dict[str, str]]], List[str]]:
+    """
+    对同一个 source_id 的多条消息做“后写覆盖”合并，只保留最新的一条。
+
+    Stream 消息 ID 单调递增，所以按拉取顺序最后出现的那条就是最新版本。
+    缺少 source_id 的消息原样保留，交给后续流程按毒丸消息处理。
+
+    参数:
+    messages: (msg_id, msg_data) 列表，按 Stream 顺序排列
+    返回值:
+    (保留的消息列表, 被覆盖的消息ID列表)，保留的消息仍按 Stream 顺序排列
+    """
+    latest_index: Dict[str, int] = {}
+    for index, (_, msg_data) in enumerate(messages):
+        source_id = msg_data.get('source_id')
+        if source_id:
+            latest_index[source_id] = index
+
+    kept, superseded_ids = [], []
+    for index, (msg_id, msg_data) in enumerate(messages):
+        source_id = msg_data.get('source_id')
+        if source_id and latest_index[source_id] != index:
+            superseded_ids.append(msg_id)
+        else:
+            kept.append((msg_id, msg_data))
+    return kept, superseded_ids
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估计文本的 token 数。m3e 的分词器对中文基本是一字一 token，
+    英文和数字会被切成子词，按字符数估计是偏保守的上界，足够用于控制批大小。
+    """
+    return len(text)
+
+
+def plan_embedding_batches(prepared: List[Tuple[str, List[str], List[str], List[Dict]]],
+                           max_chunks: int,
+                           max_tokens: int) -> List[Dict[str, list]]:
+    """
+    按文本块数量和 token 预算把一批已切分的消息重新组织成若干嵌入批次。
+    长文档会被拆到多个批次，短消息会被合并到同一批次。
+
+    参数:
+    prepared: (msg_id, chunk_ids, documents, metadatas) 列表
+    max_chunks: 每个批次最多的文本块数量
+    max_tokens: 每个批次最多的估计 token 数
+    返回值:
+    批次列表，每个批次包含 ids / documents / metadatas / msg_ids 四个列表，
+    msg_ids 记录该批次涉及的消息，用于判断消息的所有文本块是否都写入成功
+    """
+    batches = []
+    current = {"ids": [], "documents": [], "metadatas": [], "msg_ids": []}
+    current_tokens = 0
+
+    for msg_id, chunk_ids, documents, metadatas in prepared:
+        for chunk_id, document, metadata in zip(chunk_ids, documents, metadatas):
+            tokens = estimate_tokens(document)
+            # 当前批次放不下时先收尾；单个超大文本块也至少独占一个批次
+            if current["ids"] and (len(current["ids"]) >= max_chunks or current_tokens + tokens > max_tokens):
+                batches.append(current)
+                current = {"ids": [], "documents": [], "metadatas": [], "msg_ids": []}
+                current_tokens = 0
+            current["ids"].append(chunk_id)
+            current["documents"].append(document)
+            current["metadatas"].append(metadata)
+            if not current["msg_ids"] or current["msg_ids"][-1] != msg_id:
+                current["msg_ids"].append(msg_id)
+            current_tokens += tokens
+
+    if current["ids"]:
+        batches.append(current)
+    return batches
+
+
+class AdaptivePullSizer:
+    """
+    根据观测到的嵌入耗时自适应调整每次拉取的消息数和每个嵌入批次的块数，
+    使单个嵌入批次的耗时尽量接近目标延迟。
+    """
+
+    def __init__(self, initial_pull_size: int, min_pull_size: int, max_pull_size: int,
+                 max_chunks: int, target_latency_s: float, smoothing: float = 0.3):
+        self.min_pull_size = min_pull_size
+        self.max_pull_size = max_pull_size
+        self.max_chunks = max_chunks
+        self.target_latency_s = target_latency_s
+        self.smoothing = smoothing
+        self.pull_size = max(min_pull_size, min(initial_pull_size, max_pull_size))
+        self.chunk_budget = max_chunks
+        self.seconds_per_chunk = None  # 指数滑动平均，单位：秒/块
+        self.chunks_per_message = None  # 指数滑动平均
+
+    def _smooth(self, previous, observed):
+        if previous is None:
+            return observed
+        return (1 - self.smoothing) * previous + self.smoothing * observed
+
+    def observe_pull(self, message_count: int, chunk_count: int):
+        """记录一次拉取得到的消息数和切分出的文本块数"""
+        if message_count > 0:
+            self.chunks_per_message = self._smooth(self.chunks_per_message, chunk_count / message_count)
+
+    def observe_embedding(self, chunk_count: int, elapsed_s: float):
+        """记录一次嵌入的块数和耗时，并据此更新拉取大小和批次块数预算"""
+        if chunk_count <= 0 or elapsed_s <= 0:
+            return
+        self.seconds_per_chunk = self._smooth(self.seconds_per_chunk, elapsed_s / chunk_count)
+
+        target_chunks = max(1, int(self.target_latency_s / self.seconds_per_chunk))
+        self.chunk_budget = min(self.max_chunks, target_chunks)
+
+        chunks_per_message = max(self.chunks_per_message or 1.0, 1e-6)
+        target_messages = int(target_chunks / chunks_per_message)
+        self.pull_size = max(self.min_pull_size, min(target_messages, self.max_pull_size))
+
+
+_MAX_BACKOFF_EXPONENT = 32
+
+
+def backoff_delay(attempt: int, base_s: float, max_s: float) -> float:
+    """
+    指数退避 + 全抖动 (full jitter)：在 [0, min(max_s, base_s * 2^attempt)] 内均匀取值，
+    避免多个 worker 在故障恢复时同时重连。
+    指数最多取到 _MAX_BACKOFF_EXPONENT：长时间故障时 attempt 会一直增长，2 ** attempt 转成 float 会溢出。
+    """
+    return random.uniform(0, min(max_s, base_s * (2 ** min(attempt, _MAX_BACKOFF_EXPONENT))))
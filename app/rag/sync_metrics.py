@@ -0,0 +1,245 @@
+import bisect
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Dict, Optional, Iterable
+
+# 延迟直方图的桶上界（秒），覆盖从单条短消息到超大批次的范围
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 端到端新鲜度的桶上界（秒），从秒级到小时级
+FRESHNESS_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0, 14400.0)
+
+
+class Histogram:
+    """Prometheus 风格的累积直方图"""
+
+    def __init__(self, buckets: Iterable[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个桶是 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """用桶上界近似分位数，没有样本时返回 None"""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for upper, bucket_count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return upper
+        return float('inf')
+
+    def prometheus_lines(self, name: str) -> List[str]:
+        lines, cumulative = [], 0
+        for upper, bucket_count in zip(self.buckets, self.counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{le="{upper}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum {self.sum}')
+        lines.append(f'{name}_count {self.count}')
+        return lines
+
+
+def stream_id_to_seconds(stream_id: str) -> float:
+    """Stream 消息 ID 的前半部分是 XADD 时的毫秒时间戳，即消息的发布时间"""
+    return int(stream_id.split('-', 1)[0]) / 1000
+
+
+class SyncMetrics:
+    """
+    同步流水线的指标：吞吐计数、嵌入/写入延迟、端到端新鲜度，以及 Stream 的长度、积压和待确认数量。
+    worker 线程负责写入，HTTP 线程和日志负责读取，所有访问都经过同一把锁。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages_total = 0
+        self.chunks_total = 0
+        self.failed_messages_total = 0
+        self.superseded_total = 0
+        self.dedup_checked_total = 0
+        self.dedup_duplicates_total = 0
+        self.embed_seconds = Histogram(LATENCY_BUCKETS)
+        self.upsert_seconds = Histogram(LATENCY_BUCKETS)
+        self.freshness_seconds = Histogram(FRESHNESS_BUCKETS)
+        self.last_freshness_seconds = None
+        self.stream_length = None
+        self.group_lag = None
+        self.pending = None
+        # 用于计算两次快照之间的速率
+        self._rate_checkpoint = (time.monotonic(), 0, 0)
+
+    def observe_embed(self, seconds: float):
+        with self.lock:
+            self.embed_seconds.observe(seconds)
+
+    def observe_upsert(self, seconds: float):
+        with self.lock:
+            self.upsert_seconds.observe(seconds)
+
+    def observe_superseded(self, count: int):
+        with self.lock:
+            self.superseded_total += count
+
+    def observe_dedup(self, checked: int, duplicates: int):
+        with self.lock:
+            self.dedup_checked_total += checked
+            self.dedup_duplicates_total += duplicates
+
+    def observe_processed(self, msg_ids: List[str], chunk_count: int, failed_count: int = 0, now: float = None):
+        """记录一批处理完成的消息，并用消息 ID 中的发布时间计算端到端新鲜度"""
+        now = time.time() if now is None else now
+        with self.lock:
+            self.messages_total += len(msg_ids)
+            self.chunks_total += chunk_count
+            self.failed_messages_total += failed_count
+            for msg_id in msg_ids:
+                freshness = max(0.0, now - stream_id_to_seconds(msg_id))
+                self.freshness_seconds.observe(freshness)
+                self.last_freshness_seconds = freshness
+
+    def refresh_stream_state(self, r, stream_name: str, group_name: str):
+        """从 Redis 读取 Stream 长度、消费者组积压 (Redis 7+ 的 lag 字段) 和待确认数量"""
+        stream_length = r.xlen(stream_name)
+        group_lag, pending = None, None
+        for group in r.xinfo_groups(stream_name):
+            if group['name'] == group_name:
+                group_lag = group.get('lag')
+                pending = group['pending']
+        with self.lock:
+            self.stream_length = stream_length
+            self.group_lag = group_lag
+            self.pending = pending
+
+    def snapshot(self) -> Dict[str, Optional[float]]:
+        """返回当前指标的快照，速率按距上一次快照的时间计算"""
+        with self.lock:
+            now = time.monotonic()
+            last_time, last_messages, last_chunks = self._rate_checkpoint
+            elapsed = max(now - last_time, 1e-9)
+            snapshot = {
+                "stream_length": self.stream_length,
+                "group_lag": self.group_lag,
+                "pending": self.pending,
+                "messages_total": self.messages_total,
+                "chunks_total": self.chunks_total,
+                "failed_messages_total": self.failed_messages_total,
+                "superseded_total": self.superseded_total,
+                "dedup_rate": round(self.dedup_duplicates_total / self.dedup_checked_total, 4)
+                if self.dedup_checked_total else None,
+                "messages_per_sec": round((self.messages_total - last_messages) / elapsed, 3),
+                "chunks_per_sec": round((self.chunks_total - last_chunks) / elapsed, 3),
+                "embed_p50_s": self.embed_seconds.quantile(0.5),
+                "embed_p95_s": self.embed_seconds.quantile(0.95),
+                "upsert_p50_s": self.upsert_seconds.quantile(0.5),
+                "upsert_p95_s": self.upsert_seconds.quantile(0.95),
+                "freshness_last_s": self.last_freshness_seconds,
+                "freshness_p95_s": self.freshness_seconds.quantile(0.95),
+            }
+            self._rate_checkpoint = (now, self.messages_total, self.chunks_total)
+            return snapshot
+
+    def to_prometheus(self) -> str:
+        """输出 Prometheus text exposition 格式"""
+        prefix = "rag_sync"
+        with self.lock:
+            lines = []
+            for name, kind, value in (
+                    ("messages_total", "counter", self.messages_total),
+                    ("chunks_total", "counter", self.chunks_total),
+                    ("failed_messages_total", "counter", self.failed_messages_total),
+                    ("superseded_messages_total", "counter", self.superseded_total),
+                    ("dedup_checked_chunks_total", "counter", self.dedup_checked_total),
+                    ("dedup_duplicate_chunks_total", "counter", self.dedup_duplicates_total),
+                    ("stream_length", "gauge", self.stream_length),
+                    ("consumer_group_lag", "gauge", self.group_lag),
+                    ("pending_messages", "gauge", self.pending),
+                    ("last_freshness_seconds", "gauge", self.last_freshness_seconds),
+            ):
+                if value is None:
+                    continue
+                lines.append(f"# TYPE {prefix}_{name} {kind}")
+                lines.append(f"{prefix}_{name} {value}")
+            for name, histogram in (
+                    ("embed_seconds", self.embed_seconds),
+                    ("upsert_seconds", self.upsert_seconds),
+                    ("freshness_seconds", self.freshness_seconds),
+            ):
+                lines.append(f"# TYPE {prefix}_{name} histogram")
+                lines.extend(histogram.prometheus_lines(f"{prefix}_{name}"))
+            return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(metrics: SyncMetrics, port: int, refresh: Callable[[], None] = None,
+                         logger=None) -> Optional[ThreadingHTTPServer]:
+    """
+    在后台线程中启动 /metrics 端点，供 Prometheus 抓取。
+    refresh 在每次抓取前调用 (刷新 Stream 长度、积压和待确认数量)，失败时输出上一次的值。
+    同一台机器上运行多个 worker 时只有第一个能绑定端口，其余的记录警告后不提供端点 (返回 None)，worker 照常运行
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') != '/metrics':
+                self.send_error(404)
+                return
+            if refresh is not None:
+                try:
+                    refresh()
+                except Exception as e:
+                    if logger is not None:
+                        logger.error(f"Failed to refresh stream metrics: {e}", extra={'msg_id': 'N/A'})
+            body = metrics.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # 抓取请求很频繁，不写访问日志
+            pass
+
+    try:
+        httpd = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    except OSError as e:
+        if logger is not None:
+            logger.warning(f"Sync metrics port {port} is unavailable ({e}), /metrics is disabled for this worker",
+                           extra={'msg_id': 'N/A'})
+        return None
+    threading.Thread(target=httpd.serve_forever, name="sync-metrics", daemon=True).start()
+    return httpd
+
+
+class MetricsReporter:
+    """在 worker 主循环中按固定间隔刷新 Stream 状态，并输出一行结构化 (JSON) 日志"""
+
+    def __init__(self, metrics: SyncMetrics, interval_s: int, logger):
+        self.metrics = metrics
+        self.interval_s = interval_s
+        self.logger = logger
+        self.last_run = time.monotonic()
+
+    def maybe_report(self, r, stream_name: str, group_name: str) -> Optional[Dict[str, Optional[float]]]:
+        if self.interval_s <= 0 or time.monotonic() - self.last_run < self.interval_s:
+            return None
+        self.last_run = time.monotonic()
+        try:
+            self.metrics.refresh_stream_state(r, stream_name, group_name)
+        except Exception as e:
+            self.logger.error(f"Failed to refresh stream metrics: {e}", extra={'msg_id': 'N/A'})
+        snapshot = self.metrics.snapshot()
+        self.logger.info("sync_metrics " + json.dumps(snapshot, separators=(',', ':')))
+        return snapshot
+
+
+# 进程内共享的指标实例
+sync_metrics = SyncMetrics()
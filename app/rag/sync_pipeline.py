@@ -0,0 +1,123 @@
+from typing import Any, Collection, Dict, List, Tuple
+
+from app.rag.dedup import ChunkDeduplicator
+from app.rag.dynamic_chunks import build_dynamic_chunks
+from app.rag.keyword_index import notify_keyword_index
+from app.rag.sync_batching import coalesce_messages
+from app.rag.sync_metrics import sync_metrics
+
+# 同步 worker (sync_worker) 和异步 worker (async_sync_worker) 共用的处理步骤：合并、解析切分、近重复过滤和写入后的登记。
+# 这里不创建任何连接或全局对象，导入本模块没有副作用；近重复检测器和日志由各个 worker 创建后传入。
+
+Prepared = List[Tuple[str, List[str], List[str], List[Dict]]]
+
+
+class SyncPipeline:
+    def __init__(self, deduplicator: ChunkDeduplicator, logger):
+        self.deduplicator = deduplicator
+        self.logger = logger
+
+    def coalesce(self, messages: List[Tuple[str, Dict[str, str]]]) -> List[Tuple[str, Dict[str, str]]]:
+        """
+        同一 source_id 只保留最新版本，返回保留的消息。被覆盖的旧版本随整次拉取一起 ACK，
+        即使最新版本随后解析或写入失败也不会退回旧版本
+        """
+        latest_messages, superseded_ids = coalesce_messages(messages)
+        if superseded_ids:
+            sync_metrics.observe_superseded(len(superseded_ids))
+            self.logger.info(
+                f"Coalesced {len(messages)} messages into {len(latest_messages)} "
+                f"({len(superseded_ids)} superseded by newer versions of the same source_id).")
+        return latest_messages
+
+    def prepare_messages(self, messages: List[Tuple[str, Dict[str, str]]]) -> Prepared:
+        """
+        解析并切分一批消息，返回每条消息对应的 (msg_id, chunk_ids, documents, metadatas)。
+        解析失败的消息只记录日志，不会出现在返回值中。
+        """
+        prepared = []
+        for msg_id, msg_data in messages:
+            try:
+                # 直接以字符串形式获取 source_id 和 content，使用 .get() 保证安全
+                source_id_base = msg_data.get('source_id')
+                chunk_ids, chunks, metadatas = build_dynamic_chunks(
+                    source_id_base, msg_data.get('content'), msg_data.get('metadata', ''))
+                self.logger.debug(f"Document {source_id_base} was split into {len(chunks)} chunks.")
+                prepared.append((msg_id, chunk_ids, chunks, metadatas))
+
+            except Exception as e:
+                self.logger.error(f"Failed to parse or process message. Error: {e}", extra={"msg_id": msg_id})
+        return prepared
+
+    def deduplicate(self, prepared: Prepared, collection) -> Tuple[Prepared, Dict[str, List[Dict]]]:
+        """
+        从已切分的消息中去掉近重复文本块，返回 (过滤后的 prepared, msg_id -> 近重复记录)。
+        所有文本块都是重复的消息仍保留在 prepared 中 (文本块列表为空)，照常视为处理成功。
+        """
+        deduplicator = self.deduplicator
+        if not deduplicator.enabled or not prepared:
+            return prepared, {}
+        chunk_owner, ids, documents, metadatas = [], [], [], []
+        for msg_id, chunk_ids, chunks, chunk_metadatas in prepared:
+            chunk_owner.extend([msg_id] * len(chunk_ids))
+            ids.extend(chunk_ids)
+            documents.extend(chunks)
+            metadatas.extend(chunk_metadatas)
+
+        checked_before, duplicates_before = deduplicator.checked_total, deduplicator.duplicates_total
+        keep, duplicates = deduplicator.filter_chunks(collection, ids, documents, metadatas)
+        sync_metrics.observe_dedup(deduplicator.checked_total - checked_before,
+                                   deduplicator.duplicates_total - duplicates_before)
+
+        kept_by_msg = {msg_id: ([], [], []) for msg_id, _, _, _ in prepared}
+        for i in keep:
+            kept_ids, kept_documents, kept_metadatas = kept_by_msg[chunk_owner[i]]
+            kept_ids.append(ids[i])
+            kept_documents.append(documents[i])
+            kept_metadatas.append(metadatas[i])
+        duplicates_by_msg = {}
+        owner_by_id = dict(zip(ids, chunk_owner))
+        for record in duplicates:
+            duplicates_by_msg.setdefault(owner_by_id[record["id"]], []).append(record)
+        if duplicates:
+            self.logger.info(f"Skipped {len(duplicates)} near-duplicate chunks out of {len(ids)} "
+                             f"(dedup rate so far: {deduplicator.dedup_rate():.1%}).")
+        return [(msg_id,) + kept_by_msg[msg_id] for msg_id, _, _, _ in prepared], duplicates_by_msg
+
+    def finalize(self, collections: List[Any], prepared: Prepared, duplicates_by_msg: Dict[str, List[Dict]],
+                 failed_msg_ids: Collection[str], message_count: int) -> List[str]:
+        """
+        一次拉取的所有写入结束后调用：登记近重复文本块、通知关键词索引并更新指标，返回处理成功的消息ID。
+        message_count 是合并后的消息数，解析失败和写入失败的消息都计入失败数。
+        调用方随后会 ACK 整次拉取的所有消息，失败的消息不会重试
+        """
+        if failed_msg_ids:
+            # 索引中已经登记了写入失败的文本块，下次使用前重新加载
+            self.deduplicator.invalidate()
+        processed_msg_ids = [msg_id for msg_id, _, _, _ in prepared if msg_id not in failed_msg_ids]
+        processed = set(processed_msg_ids)
+        self._record_deduplication(collections, prepared, duplicates_by_msg, processed_msg_ids)
+
+        # 成功写入的文本块ID发布给检索进程的关键词索引，被判为近重复的文本块ID作为删除发布
+        stored_ids = [chunk_id for msg_id, chunk_ids, _, _ in prepared if msg_id in processed for chunk_id in chunk_ids]
+        deleted_ids = [record["id"] for msg_id in processed_msg_ids for record in duplicates_by_msg.get(msg_id, [])]
+        notify_keyword_index(stored_ids, deleted_ids)
+
+        sync_metrics.observe_processed(processed_msg_ids, len(stored_ids),
+                                       failed_count=message_count - len(processed_msg_ids))
+        return processed_msg_ids
+
+    def _record_deduplication(self, collections: List[Any], prepared: Prepared,
+                              duplicates_by_msg: Dict[str, List[Dict]], processed_msg_ids: List[str]):
+        """写入成功后，登记成功消息的近重复文本块，并处理挂在被修改文本块名下的重复文本块"""
+        if not self.deduplicator.enabled:
+            return
+        processed = set(processed_msg_ids)
+        stored_ids = [chunk_id for msg_id, chunk_ids, _, _ in prepared if msg_id in processed for chunk_id in chunk_ids]
+        duplicates = [record for msg_id in processed_msg_ids for record in duplicates_by_msg.get(msg_id, [])]
+        try:
+            self.deduplicator.record_stored(collections, stored_ids, duplicates)
+        except Exception as e:
+            self.logger.error(f"Failed to record near-duplicate chunks. Error: {e}",
+                              extra={"msg_id": "batch_operation"})
+            self.deduplicator.invalidate()
@@ -1,4 +1,4 @@
-import json
+import functools
 import signal
 import time
 from typing import List, Dict, Tuple
@@ -6,17 +6,29 @@ from typing import List, Dict, Tuple
 from redis import Redis, exceptions
 
 from app.configs.config import settings
-from app.utils.singleton import chroma_collection, redis_pool, logger  # 从工具文件中引入向量数据库集合 和 redis连接池
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from app.utils.singleton import collection_resolver, redis_pool, logger  # 从工具文件中引入向量数据库集合解析器 和 redis连接池
 from app.rag.mcp_rag_service import retriever
+from app.rag.collection_alias import queue_reembed
+from app.rag.dedup import ChunkDeduplicator
+from app.rag.keyword_index import notify_keyword_index
+from app.rag.sync_batching import AdaptivePullSizer, plan_embedding_batches
+from app.rag.sync_pipeline import SyncPipeline
+from app.rag.stream_retention import StreamTrimScheduler
+from app.rag.sync_metrics import MetricsReporter, start_metrics_server, sync_metrics
 
 SHUTDOWN_REQUESTED = False
 
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=settings.CHUNK_SIZE,
-    chunk_overlap=settings.CHUNK_OVERLAP,
-    separators=["\n\n", "\n", "。", "，", "、", " "]
+# 近重复文本块检测：重复的文本块不嵌入，记录到 duplicates 集合中
+deduplicator = ChunkDeduplicator(
+    collection_resolver.collection,
+    retriever.get_embeddings,
+    mode=settings.DEDUP_MODE,
+    max_distance=settings.DEDUP_MAX_DISTANCE,
+    min_chars=settings.DEDUP_MIN_CHARS,
+    refresh_interval_s=settings.DEDUP_INDEX_REFRESH_S,
+    on_promoted=notify_keyword_index
 )
+pipeline = SyncPipeline(deduplicator, logger)
 
 def handle_shutdown(signum, frame):
     """停机信号处理器"""
@@ -26,91 +38,106 @@ def handle_shutdown(signum, frame):
         SHUTDOWN_REQUESTED = True
 
 
-def sanitize_metadata_value(value):
-    """
-    【工具函数】
-    如果值是列表或字典，将其JSON序列化为字符串。
-    否则，按原样返回。
-    """
-    if isinstance(value, (list, dict)):
-        try:
-            # 使用紧凑的格式，不带不必要的空格
-            return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
-        except TypeError:
-            # 如果JSON序列化失败，将其转换为字符串作为最后的保障
-            return str(value)
-    return value
-
-
 # 批量消息处理
-def process_messages_batch(messages: List[Tuple[str, Dict[str, str]]]):
+def process_messages_batch(messages: List[Tuple[str, Dict[str, str]]], sizer: AdaptivePullSizer = None):
     """
-    一次性处理一批消息，对大文档进行切分，然后统一处理。
+    一次性处理一批消息，对大文档进行切分，然后按文本块数量和 token 预算分批嵌入并写入。
+    传入 sizer 时，会把观测到的嵌入耗时反馈给它，用于调整下一次的拉取大小。
     """
     first_msg_id = messages[0][0]
     last_msg_id = messages[-1][0]
     logger.debug(f"Parsing batch of {len(messages)} messages from {first_msg_id} to {last_msg_id}.")
 
-    batch_ids, batch_embeddings, batch_metadatas, batch_documents = [], [], [], []
-    processed_msg_ids = []
-
-    for msg_id, msg_data in messages:
-        try:
-            # 直接以字符串形式获取 source_id 和 content，使用 .get() 保证安全
-            source_id_base = msg_data.get('source_id')
-            content = msg_data.get('content')
-
-            # 2. 检查必要字段是否存在且不为空
-            if not source_id_base or not content:
-                raise ValueError("Message is missing 'source_id' or 'content', or they are empty.")
-
-            source_id = "dynamic::" + source_id_base
-
-            chunks = text_splitter.split_text(content)
-            logger.debug(f"Document {source_id_base} was split into {len(chunks)} chunks.")
-
-            # 安全地处理 metadata
-            metadata_str = msg_data.get('metadata', '')
-            raw_metadata = json.loads(metadata_str) if metadata_str.strip() else {}
-            sanitized_metadata = {key: sanitize_metadata_value(value) for key, value in raw_metadata.items()}
-
-            if not sanitized_metadata:
-                sanitized_metadata['source'] = source_id_base
-
-            # 为每个切分出的文本块准备数据
-            for i, chunk_content in enumerate(chunks):
-                chunk_id = f"{source_id}::chunk::{i}"
-                batch_ids.append(chunk_id)
-                batch_documents.append(chunk_content)
-                batch_metadatas.append(sanitized_metadata)
-
-            processed_msg_ids.append(msg_id)
-
-        except Exception as e:
-            logger.error(f"Failed to parse or process message. Error: {e}", extra={"msg_id": msg_id})
-
-    if not batch_documents:
+    prepared = pipeline.prepare_messages(messages)
+    if not prepared:
         # 如果所有消息都解析失败，也要返回ID以便ACK，防止毒丸消息
+        sync_metrics.observe_processed([], 0, failed_count=len(messages))
         return [msg_id for msg_id, _ in messages] if messages else []
 
-    try:
-        # 批量向量化所有切分出的文本块
-        batch_embeddings = retriever.get_embeddings(batch_documents)
-
-        # 批量写入向量数据库
-        chroma_collection.upsert(
-            ids=batch_ids,
-            embeddings=batch_embeddings,
-            metadatas=batch_metadatas,
-            documents=batch_documents
+    # 蓝绿重建期间同时写入新旧两个版本；新版本换了嵌入模型时不双写，文本块ID排队由重建进程用新模型重新嵌入
+    retriever.sync_embedding_model()
+    collections, deferred = collection_resolver.write_plan(retriever.embedding)
+    prepared, duplicates_by_msg = pipeline.deduplicate(prepared, collections[0])
+    if deferred and duplicates_by_msg:
+        # 近重复文本块只会从 active 中移除，也要排队，重建进程发现它不在 active 中时会从新版本删除
+        duplicate_ids = [record["id"] for records in duplicates_by_msg.values() for record in records]
+        queue_reembed(Redis(connection_pool=redis_pool), collection_resolver.route_deferred(deferred, duplicate_ids),
+                      settings.RAG_REEMBED_QUEUE_PREFIX)
+
+    total_chunks = sum(len(chunk_ids) for _, chunk_ids, _, _ in prepared)
+    if sizer is not None:
+        sizer.observe_pull(len(messages), total_chunks)
+    max_chunks = sizer.chunk_budget if sizer is not None else settings.SYNC_EMBED_MAX_CHUNKS
+    batches = plan_embedding_batches(prepared, max_chunks, settings.SYNC_EMBED_MAX_TOKENS)
+
+    failed_msg_ids = set()
+    for batch in batches:
+        try:
+            # 批量向量化本批次的文本块
+            embed_start = time.perf_counter()
+            batch_embeddings = retriever.get_embeddings(batch["documents"])
+            embed_elapsed = time.perf_counter() - embed_start
+            sync_metrics.observe_embed(embed_elapsed)
+            if sizer is not None:
+                sizer.observe_embedding(len(batch["ids"]), embed_elapsed)
+
+            # 先登记重新嵌入，再批量写入向量数据库，登记失败时本批次按失败处理
+            queue_reembed(Redis(connection_pool=redis_pool), collection_resolver.route_deferred(deferred, batch["ids"]),
+                          settings.RAG_REEMBED_QUEUE_PREFIX)
+            upsert_start = time.perf_counter()
+            for collection in collections:
+                collection.upsert(
+                    ids=batch["ids"],
+                    embeddings=batch_embeddings,
+                    metadatas=batch["metadatas"],
+                    documents=batch["documents"]
+                )
+            sync_metrics.observe_upsert(time.perf_counter() - upsert_start)
+        except Exception as e:
+            logger.error(f"Failed to process batch embeddings/upsert. Error: {e}", extra={"msg_id": "batch_operation"})
+            # 消息的任意一个文本块写入失败，都视为该消息处理失败 (只计入失败数和日志，不会重试)
+            failed_msg_ids.update(batch["msg_ids"])
+    processed_msg_ids = pipeline.finalize(collections, prepared, duplicates_by_msg, failed_msg_ids, len(messages))
+    logger.info(
+        f"Successfully processed and upserted chunks from {len(processed_msg_ids)} original messages "
+        f"({total_chunks} chunks in {len(batches)} embedding batches).")
+    if sizer is not None:
+        logger.debug(f"Adaptive sizing: pull_size={sizer.pull_size}, chunk_budget={sizer.chunk_budget}")
+    return processed_msg_ids
+
+def pull_messages(r: Redis, count: int) -> List[Tuple[str, Dict[str, str]]]:
+    """
+    从 Stream 拉取一批消息。拉到第一批后，在去抖窗口内继续收集新消息，
+    这样同一 source_id 的连续编辑可以合并为一次嵌入。
+    """
+    messages = r.xreadgroup(
+        groupname=settings.REDIS_CONSUMER_GROUP_NAME,
+        consumername=settings.REDIS_CONSUMER_NAME,
+        streams={settings.REDIS_STREAM_NAME: '>'},
+        count=count,
+        block=settings.REDIS_BLOCK_TIMEOUT_MS
+    )
+    if not messages:
+        return []
+    # messages[0][0] 是 stream name, messages[0][1] 是消息列表
+    message_list = list(messages[0][1])
+
+    deadline = time.monotonic() + settings.SYNC_DEBOUNCE_MS / 1000
+    while len(message_list) < settings.SYNC_DEBOUNCE_MAX_MESSAGES and not SHUTDOWN_REQUESTED:
+        remaining_ms = int((deadline - time.monotonic()) * 1000)
+        if remaining_ms <= 0:
+            break
+        more = r.xreadgroup(
+            groupname=settings.REDIS_CONSUMER_GROUP_NAME,
+            consumername=settings.REDIS_CONSUMER_NAME,
+            streams={settings.REDIS_STREAM_NAME: '>'},
+            count=min(count, settings.SYNC_DEBOUNCE_MAX_MESSAGES - len(message_list)),
+            block=remaining_ms
         )
-        logger.info(
-            f"Successfully processed and upserted {len(batch_ids)} chunks from {len(processed_msg_ids)} original messages.")
-        return processed_msg_ids
+        if more:
+            message_list.extend(more[0][1])
+    return message_list
 
-    except Exception as e:
-        logger.error(f"Failed to process batch embeddings/upsert. Error: {e}", extra={"msg_id": "batch_operation"})
-        return []  # 批量处理失败，不ACK，以便重试
 
 # 主运行循环
 def run_sync_worker():
@@ -127,25 +154,40 @@ def run_sync_worker():
         if "BUSYGROUP" not in str(e):
             raise
 
+    # 根据嵌入耗时自适应调整拉取大小
+    sizer = AdaptivePullSizer(
+        initial_pull_size=settings.REDIS_MESSAGES_PER_PULL,
+        min_pull_size=settings.SYNC_MIN_MESSAGES_PER_PULL,
+        max_pull_size=settings.SYNC_MAX_MESSAGES_PER_PULL,
+        max_chunks=settings.SYNC_EMBED_MAX_CHUNKS,
+        target_latency_s=settings.SYNC_EMBED_LATENCY_TARGET_MS / 1000
+    )
+
+    # 定期裁剪已被所有消费者组确认的旧消息
+    trimmer = StreamTrimScheduler(settings.REDIS_STREAM_TRIM_INTERVAL_S)
+    # 定期输出同步延迟与吞吐指标
+    reporter = MetricsReporter(sync_metrics, settings.SYNC_METRICS_LOG_INTERVAL_S, logger)
+
     while not SHUTDOWN_REQUESTED:
         try:
-            # 从 Stream 拉取一批新消息
-            messages = r.xreadgroup(
-                groupname=settings.REDIS_CONSUMER_GROUP_NAME,
-                consumername=settings.REDIS_CONSUMER_NAME,
-                streams={settings.REDIS_STREAM_NAME: '>'},
-                count=settings.REDIS_MESSAGES_PER_PULL,
-                block=settings.REDIS_BLOCK_TIMEOUT_MS
-            )
-            if not messages:
+            trimmer.maybe_trim(r)
+            reporter.maybe_report(r, settings.REDIS_STREAM_NAME, settings.REDIS_CONSUMER_GROUP_NAME)
+            # 在拉取之前跟上 active 集合的嵌入模型，加载失败时不拉取消息，留在 Stream 中等待重试
+            retriever.sync_embedding_model()
+
+            # 从 Stream 拉取一批新消息（含去抖窗口）
+            message_list = pull_messages(r, sizer.pull_size)
+            if not message_list:
                 continue
-            # messages[0][0] 是 stream name, messages[0][1] 是消息列表
-            message_list = messages[0][1]
+
+            # 同一 source_id 只保留最新版本，被覆盖的旧版本不再处理，随整次拉取一起 ACK
+            latest_messages = pipeline.coalesce(message_list)
 
             # 调用批量处理函数
-            successfully_processed_ids = process_messages_batch(message_list)
+            successfully_processed_ids = process_messages_batch(latest_messages, sizer)
 
-            # 只ACK成功处理的消息，或全部ACK，取决于业务需求。这里选择全部ACK以防止毒丸消息
+            # 全部 ACK 以防止毒丸消息：解析或写入失败的消息记录日志和失败数后丢弃，不会重新投递，
+            # 丢失的更新由该 source_id 的下一次修改或 bulk_backfill 补上
             all_ids_to_ack = [msg_id for msg_id, _ in message_list]
             if all_ids_to_ack:
                 r.xack(settings.REDIS_STREAM_NAME, settings.REDIS_CONSUMER_GROUP_NAME, *all_ids_to_ack)
@@ -164,4 +206,11 @@ if __name__ == "__main__":
     signal.signal(signal.SIGINT, handle_shutdown)
     signal.signal(signal.SIGTERM, handle_shutdown)
 
+    if settings.SYNC_METRICS_PORT:
+        metrics_redis = Redis(connection_pool=redis_pool)
+        refresh = functools.partial(sync_metrics.refresh_stream_state, metrics_redis, settings.REDIS_STREAM_NAME,
+                                    settings.REDIS_CONSUMER_GROUP_NAME)
+        if start_metrics_server(sync_metrics, settings.SYNC_METRICS_PORT, refresh=refresh, logger=logger):
+            logger.info(f"Sync metrics exposed at http://0.0.0.0:{settings.SYNC_METRICS_PORT}/metrics")
+
     run_sync_worker()
@@ -0,0 +1,137 @@
+from collections import deque
+from typing import Callable, Iterator, List
+
+# 项目专用的递归文本切分器，对同样的参数与 LangChain 的 RecursiveCharacterTextSplitter
+# (keep_separator=True, strip_whitespace=True, 分隔符按字面匹配) 输出逐字节相同的文本块，
+# 已有的文本块ID因此保持不变。与 LangChain 相比：
+# - 分隔符按字面用 str.split/str.find 切分，不用正则；超长文本逐段查找，不先把整篇文本拆成列表
+# - 每个片段的长度只计算一次 (LangChain 在切分和合并时各算一次，按 token 计长时开销翻倍)
+# - 合并逻辑内联在切分循环中，用 deque 弹出重叠部分，而不是反复复制列表
+# - iter_split_text 逐个产出文本块，超长文本不需要一次性物化所有结果
+# 这个模块会在进程池的子进程中导入，不要在这里导入嵌入模型或向量数据库客户端。
+
+DEFAULT_SEPARATORS = ["\n\n", "\n", "。", "，", "、", " "]
+# 超过这个长度的文本逐段查找分隔符，避免一次性生成所有片段
+_EAGER_SPLIT_CHARS = 1 << 20
+
+
+def _iter_pieces(text: str, separator: str) -> Iterator[str]:
+    """按分隔符切开文本，分隔符保留在后一段的开头，跳过空片段"""
+    if not separator:
+        yield from text
+        return
+    parts = text.split(separator) if len(text) <= _EAGER_SPLIT_CHARS else None
+    if parts is not None:
+        # 不太长的文本直接用 str.split，比逐个 find 快得多
+        if parts[0]:
+            yield parts[0]
+        for part in parts[1:]:
+            yield separator + part
+        return
+    start = 0
+    step = len(separator)
+    index = text.find(separator)
+    while index != -1:
+        if index > start:
+            yield text[start:index]
+        start = index
+        index = text.find(separator, index + step)
+    if start < len(text):
+        yield text[start:]
+
+
+class ChineseTextSplitter:
+    """
+    按分隔符优先级递归切分文本：先用文本中出现的第一个分隔符切开，
+    仍然超过 chunk_size 的片段再用后面的分隔符继续切，最后把小片段合并成文本块。
+    length_function 默认按字符计长，也可以传入 token 计数函数 (见 create_text_splitter)。
+    """
+
+    def __init__(self, chunk_size: int, chunk_overlap: int, separators: List[str] = None,
+                 length_function: Callable[[str], int] = len, strip_whitespace: bool = True):
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size must be > 0, got {chunk_size}")
+        if chunk_overlap < 0 or chunk_overlap > chunk_size:
+            raise ValueError(f"chunk_overlap must be between 0 and chunk_size, got {chunk_overlap}")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = list(separators or DEFAULT_SEPARATORS)
+        self.length_function = length_function
+        self.strip_whitespace = strip_whitespace
+
+    def _iter_split(self, text: str, separators: List[str]) -> Iterator[str]:
+        separator, remaining = separators[-1], []
+        for i, candidate in enumerate(separators):
+            if not candidate:
+                separator = candidate
+                break
+            if candidate in text:
+                separator, remaining = candidate, separators[i + 1:]
+                break
+
+        chunk_size, chunk_overlap = self.chunk_size, self.chunk_overlap
+        length_function, strip = self.length_function, self.strip_whitespace
+        # 合并状态：当前文本块由 current 中的片段组成，lengths 是对应的长度，total 是总长度
+        current, lengths, total = deque(), deque(), 0
+        for piece in _iter_pieces(text, separator):
+            length = length_function(piece)
+            if length < chunk_size:
+                if total + length > chunk_size and current:
+                    doc = "".join(current)
+                    doc = doc.strip() if strip else doc
+                    if doc:
+                        yield doc
+                    # 只保留不超过 chunk_overlap 的尾部片段作为下一个文本块的开头
+                    while total > chunk_overlap or (total + length > chunk_size and total > 0):
+                        current.popleft()
+                        total -= lengths.popleft()
+                current.append(piece)
+                lengths.append(length)
+                total += length
+                continue
+
+            if current:
+                doc = "".join(current)
+                doc = doc.strip() if strip else doc
+                if doc:
+                    yield doc
+                current, lengths, total = deque(), deque(), 0
+            if remaining:
+                yield from self._iter_split(piece, remaining)
+            else:
+                # 已经没有更细的分隔符，超长片段原样输出
+                yield piece
+        if current:
+            doc = "".join(current)
+            doc = doc.strip() if strip else doc
+            if doc:
+                yield doc
+
+    def iter_split_text(self, text: str) -> Iterator[str]:
+        """逐个产出文本块"""
+        return self._iter_split(text, self.separators)
+
+    def split_text(self, text: str) -> List[str]:
+        return list(self._iter_split(text, self.separators))
+
+
+def token_length_function(tokenizer_dir: str) -> Callable[[str], int]:
+    """用 Hugging Face 分词器 (如 Qwen、m3e) 计算 token 数，与 LangChain 的 from_huggingface_tokenizer 口径一致"""
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir)
+    return lambda text: len(tokenizer.tokenize(text))
+
+
+def create_text_splitter(chunk_size: int, chunk_overlap: int, length_unit: str = "char",
+                         tokenizer_dir: str = None) -> ChineseTextSplitter:
+    """
+    按配置创建切分器。length_unit 为 "token" 时 chunk_size/chunk_overlap 按 tokenizer_dir 中分词器的 token 数计算。
+    """
+    if length_unit == "char":
+        return ChineseTextSplitter(chunk_size, chunk_overlap)
+    if length_unit == "token":
+        if not tokenizer_dir:
+            raise ValueError("tokenizer_dir is required when length_unit is 'token'")
+        return ChineseTextSplitter(chunk_size, chunk_overlap, length_function=token_length_function(tokenizer_dir))
+    raise ValueError(f"Unknown chunk length unit: {length_unit}")
@@ -0,0 +1,401 @@
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+# 向量库抽象。检索、同步和导入代码只依赖这里的接口，具体后端由配置中的 VECTOR_STORE_BACKEND 决定：
+# - "chroma_http": 连接独立部署的 Chroma 服务 (默认，与之前的部署方式相同)
+# - "chroma_persistent": 进程内嵌入式 Chroma，数据保存在本地目录，省去 HTTP 往返，适合单机部署
+# - "memory": 纯 NumPy 的内存实现，不需要 chromadb，用于测试和基准测试
+# 接口的参数和返回值结构与 Chroma 的 Collection 保持一致，已有的调用代码不需要改写结果处理逻辑。
+# 这个模块不读取配置，chromadb 只在创建 Chroma 后端时才导入。
+
+DEFAULT_GET_INCLUDE = ("metadatas", "documents")
+DEFAULT_QUERY_INCLUDE = ("metadatas", "documents", "distances")
+
+
+class VectorCollection(ABC):
+    """
+    向量集合接口，后端需要实现全部抽象方法，缺少任何一个在创建实例时就会报错。
+    get 返回 {"ids": [...], "documents": [...], "metadatas": [...], "embeddings": [...]}，
+    query 对每个查询向量返回一组结果: {"ids": [[...]], "documents": [[...]], "metadatas": [[...]], "distances": [[...]]}，
+    未在 include 中请求的字段为 None。
+    """
+
+    name: str
+
+    @abstractmethod
+    def upsert(self, ids: List[str], embeddings: List[List[float]], documents: List[str] = None,
+               metadatas: List[Dict[str, Any]] = None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, ids: List[str] = None, where: Dict = None, where_document: Dict = None,
+            limit: int = None, offset: int = None, include: List[str] = None) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10, where: Dict = None,
+              where_document: Dict = None, include: List[str] = None) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, ids: List[str] = None, where: Dict = None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def count(self) -> int:
+        raise NotImplementedError
+
+
+class VectorStore(ABC):
+    """向量库接口：按名称管理集合"""
+
+    @abstractmethod
+    def get_or_create_collection(self, name: str) -> VectorCollection:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_collection(self, name: str) -> VectorCollection:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_collection(self, name: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_collections(self) -> List[str]:
+        raise NotImplementedError
+
+
+# ---------------------------------------------------------------------------
+# Chroma 后端 (HTTP 或嵌入式)
+# ---------------------------------------------------------------------------
+
+def _without_none(**kwargs) -> Dict[str, Any]:
+    return {key: value for key, value in kwargs.items() if value is not None}
+
+
+class ChromaCollection(VectorCollection):
+    def __init__(self, collection):
+        self._collection = collection
+        self.name = collection.name
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        self._collection.upsert(**_without_none(ids=ids, embeddings=embeddings, documents=documents,
+                                                metadatas=metadatas))
+
+    def get(self, ids=None, where=None, where_document=None, limit=None, offset=None, include=None):
+        return self._collection.get(**_without_none(ids=ids, where=where, where_document=where_document,
+                                                    limit=limit, offset=offset, include=include))
+
+    def query(self, query_embeddings, n_results=10, where=None, where_document=None, include=None):
+        return self._collection.query(**_without_none(query_embeddings=query_embeddings, n_results=n_results,
+                                                      where=where, where_document=where_document,
+                                                      include=include))
+
+    def delete(self, ids=None, where=None):
+        self._collection.delete(**_without_none(ids=ids, where=where))
+
+    def count(self):
+        return self._collection.count()
+
+
+class ChromaVectorStore(VectorStore):
+    """
+    包装 chromadb 的客户端。客户端在第一次使用时才创建，
+    导入模块时不会连接 Chroma 服务，服务暂时不可用也不会导致导入失败。
+    """
+
+    def __init__(self, client_factory: Callable[[], Any]):
+        self._client_factory = client_factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self._client_factory()
+            return self._client
+
+    def get_or_create_collection(self, name):
+        return ChromaCollection(self.client.get_or_create_collection(name=name))
+
+    def get_collection(self, name):
+        return ChromaCollection(self.client.get_collection(name=name))
+
+    def delete_collection(self, name):
+        self.client.delete_collection(name=name)
+
+    def list_collections(self):
+        # chromadb 0.6 之后 list_collections 直接返回名称，之前返回 Collection 对象
+        return [c if isinstance(c, str) else c.name for c in self.client.list_collections()]
+
+
+# ---------------------------------------------------------------------------
+# NumPy 内存后端
+# ---------------------------------------------------------------------------
+
+_COMPARATORS = {
+    "$eq": lambda value, target: value == target,
+    "$ne": lambda value, target: value != target,
+    "$gt": lambda value, target: value > target,
+    "$gte": lambda value, target: value >= target,
+    "$lt": lambda value, target: value < target,
+    "$lte": lambda value, target: value <= target,
+    "$in": lambda value, target: value in target,
+    "$nin": lambda value, target: value not in target,
+}
+
+
+def match_where(metadata: Optional[Dict[str, Any]], where: Optional[Dict]) -> bool:
+    """按 Chroma 的 where 语法判断 metadata 是否匹配，缺少字段的记录不匹配任何比较条件"""
+    if not where:
+        return True
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(match_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(match_where(metadata, clause) for clause in condition):
+                return False
+        else:
+            if key not in metadata:
+                return False
+            operators = condition if isinstance(condition, dict) else {"$eq": condition}
+            for operator, target in operators.items():
+                if operator not in _COMPARATORS:
+                    raise ValueError(f"Unsupported where operator: {operator}")
+                try:
+                    if not _COMPARATORS[operator](metadata[key], target):
+                        return False
+                except TypeError:
+                    return False
+    return True
+
+
+def match_where_document(document: Optional[str], where_document: Optional[Dict]) -> bool:
+    """支持 Chroma 的 $contains / $not_contains 以及 $and / $or 组合"""
+    if not where_document:
+        return True
+    document = document or ""
+    for key, condition in where_document.items():
+        if key == "$contains":
+            if condition not in document:
+                return False
+        elif key == "$not_contains":
+            if condition in document:
+                return False
+        elif key == "$and":
+            if not all(match_where_document(document, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(match_where_document(document, clause) for clause in condition):
+                return False
+        else:
+            raise ValueError(f"Unsupported where_document operator: {key}")
+    return True
+
+
+class InMemoryCollection(VectorCollection):
+    """
+    用一个连续的 NumPy 矩阵保存向量，查询时一次矩阵乘法算出所有距离。
+    距离口径与 Chroma 相同: "l2" 为平方欧氏距离 (Chroma 默认)，"cosine" 为 1 - 余弦相似度，"ip" 为 1 - 内积。
+    删除时把最后一行移到被删除的位置，因此 get 的返回顺序只在没有删除时与插入顺序一致。
+    """
+
+    def __init__(self, name: str, space: str = "l2"):
+        if space not in ("l2", "cosine", "ip"):
+            raise ValueError(f"Unknown distance space: {space}")
+        self.name = name
+        self.space = space
+        self._lock = threading.RLock()
+        self._ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._documents: List[Optional[str]] = []
+        self._metadatas: List[Optional[Dict[str, Any]]] = []
+        self._embeddings = None  # (容量, 维度)，按需倍增
+        self._norms = None  # 每行的平方范数，l2 距离用
+
+    def _ensure_capacity(self, dim: int, needed: int):
+        if self._embeddings is None:
+            self._embeddings = np.zeros((max(needed, 16), dim), dtype=np.float32)
+            self._norms = np.zeros(max(needed, 16), dtype=np.float32)
+            return
+        if self._embeddings.shape[1] != dim:
+            raise ValueError(f"Embedding dimension {dim} does not match collection dimensionality "
+                             f"{self._embeddings.shape[1]}")
+        if needed > len(self._embeddings):
+            capacity = max(needed, len(self._embeddings) * 2)
+            embeddings = np.zeros((capacity, dim), dtype=np.float32)
+            embeddings[:len(self._ids)] = self._embeddings[:len(self._ids)]
+            norms = np.zeros(capacity, dtype=np.float32)
+            norms[:len(self._ids)] = self._norms[:len(self._ids)]
+            self._embeddings, self._norms = embeddings, norms
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        if len(ids) != len(embeddings):
+            raise ValueError("ids and embeddings must have the same length")
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        documents = documents if documents is not None else [None] * len(ids)
+        metadatas = metadatas if metadatas is not None else [None] * len(ids)
+        with self._lock:
+            new_count = sum(1 for i in set(ids) if i not in self._positions)
+            self._ensure_capacity(vectors.shape[1], len(self._ids) + new_count)
+            for chunk_id, vector, document, metadata in zip(ids, vectors, documents, metadatas):
+                position = self._positions.get(chunk_id)
+                if position is None:
+                    position = len(self._ids)
+                    self._positions[chunk_id] = position
+                    self._ids.append(chunk_id)
+                    self._documents.append(document)
+                    self._metadatas.append(dict(metadata) if metadata is not None else None)
+                else:
+                    self._documents[position] = document
+                    self._metadatas[position] = dict(metadata) if metadata is not None else None
+                self._embeddings[position] = vector
+                self._norms[position] = float(vector @ vector)
+
+    def _select(self, ids=None, where=None, where_document=None) -> List[int]:
+        if ids is not None:
+            positions = [self._positions[i] for i in ids if i in self._positions]
+        else:
+            positions = range(len(self._ids))
+        if not where and not where_document:
+            return list(positions)
+        return [p for p in positions
+                if match_where(self._metadatas[p], where) and match_where_document(self._documents[p], where_document)]
+
+    def _rows(self, positions: List[int], include) -> Dict[str, Any]:
+        return {
+            "ids": [self._ids[p] for p in positions],
+            "documents": [self._documents[p] for p in positions] if "documents" in include else None,
+            "metadatas": [dict(self._metadatas[p]) if self._metadatas[p] is not None else None
+                          for p in positions] if "metadatas" in include else None,
+            "embeddings": [self._embeddings[p].tolist() for p in positions] if "embeddings" in include else None,
+        }
+
+    def get(self, ids=None, where=None, where_document=None, limit=None, offset=None, include=None):
+        include = DEFAULT_GET_INCLUDE if include is None else include
+        with self._lock:
+            positions = self._select(ids, where, where_document)
+            start = offset or 0
+            positions = positions[start:start + limit] if limit is not None else positions[start:]
+            return self._rows(positions, include)
+
+    def _distances(self, queries: np.ndarray, positions: np.ndarray) -> np.ndarray:
+        vectors = self._embeddings[positions]
+        dots = queries @ vectors.T
+        if self.space == "ip":
+            return 1.0 - dots
+        if self.space == "cosine":
+            query_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            vector_norms = np.sqrt(self._norms[positions])[None, :]
+            return 1.0 - dots / np.maximum(query_norms * vector_norms, 1e-12)
+        query_norms = np.einsum("ij,ij->i", queries, queries)[:, None]
+        return np.maximum(query_norms + self._norms[positions][None, :] - 2.0 * dots, 0.0)
+
+    def query(self, query_embeddings, n_results=10, where=None, where_document=None, include=None):
+        include = DEFAULT_QUERY_INCLUDE if include is None else include
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        result = {key: [] for key in ("ids", "documents", "metadatas", "embeddings", "distances")}
+        with self._lock:
+            positions = np.asarray(self._select(where=where, where_document=where_document), dtype=np.int64)
+            k = min(n_results, len(positions))
+            distances = self._distances(queries, positions) if k else None
+            for row in range(len(queries)):
+                if not k:
+                    top, top_distances = [], []
+                else:
+                    candidates = np.argpartition(distances[row], k - 1)[:k] if k < len(positions) \
+                        else np.arange(len(positions))
+                    order = candidates[np.argsort(distances[row][candidates], kind="stable")]
+                    top, top_distances = positions[order].tolist(), distances[row][order].tolist()
+                rows = self._rows(top, include)
+                result["ids"].append(rows["ids"])
+                for key in ("documents", "metadatas", "embeddings"):
+                    result[key].append(rows[key])
+                result["distances"].append(top_distances)
+        for key in ("documents", "metadatas", "embeddings", "distances"):
+            if key not in include:
+                result[key] = None
+        return result
+
+    def delete(self, ids=None, where=None):
+        with self._lock:
+            targets = [self._ids[p] for p in self._select(ids, where)]
+            for chunk_id in targets:
+                position = self._positions.pop(chunk_id)
+                last = len(self._ids) - 1
+                if position != last:
+                    # 把最后一行移到被删除的位置，保持矩阵连续
+                    moved_id = self._ids[last]
+                    self._ids[position] = moved_id
+                    self._documents[position] = self._documents[last]
+                    self._metadatas[position] = self._metadatas[last]
+                    self._embeddings[position] = self._embeddings[last]
+                    self._norms[position] = self._norms[last]
+                    self._positions[moved_id] = position
+                self._ids.pop()
+                self._documents.pop()
+                self._metadatas.pop()
+
+    def count(self):
+        return len(self._ids)
+
+
+class InMemoryVectorStore(VectorStore):
+    def __init__(self, space: str = "l2"):
+        self.space = space
+        self._collections: Dict[str, InMemoryCollection] = {}
+        self._lock = threading.Lock()
+
+    def get_or_create_collection(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = InMemoryCollection(name, self.space)
+            return self._collections[name]
+
+    def get_collection(self, name):
+        with self._lock:
+            if name not in self._collections:
+                raise ValueError(f"Collection {name} does not exist.")
+            return self._collections[name]
+
+    def delete_collection(self, name):
+        with self._lock:
+            if name not in self._collections:
+                raise ValueError(f"Collection {name} does not exist.")
+            del self._collections[name]
+
+    def list_collections(self):
+        with self._lock:
+            return list(self._collections)
+
+
+def create_vector_store(backend: str, host: str = None, port: int = None, ssl: bool = False,
+                        persist_dir: str = None) -> VectorStore:
+    """按后端名称创建向量库"""
+    if backend == "memory":
+        return InMemoryVectorStore()
+    if backend == "chroma_http":
+        def factory():
+            import chromadb
+            return chromadb.HttpClient(host=host, port=port, ssl=ssl)
+        return ChromaVectorStore(factory)
+    if backend == "chroma_persistent":
+        if not persist_dir:
+            raise ValueError("persist_dir is required for the chroma_persistent backend")
+
+        def factory():
+            import chromadb
+            return chromadb.PersistentClient(path=persist_dir)
+        return ChromaVectorStore(factory)
+    raise ValueError(f"Unknown vector store backend: {backend}")
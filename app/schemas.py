@@ -18,7 +18,8 @@ class ChatMessage(BaseModel):
 class ChatQuery(BaseModel):
     """聊天请求的模型"""
     query: str = Field(..., description="用户的最新一条消息")
-    history: List[ChatMessage] = Field([], description="历史对话记录，由前端负责维护和传递")  # TODO: 真的由前端吗
+    history: List[ChatMessage] = Field([], description="历史对话记录，由前端维护和传递；带 conversation_id 时可以不传，改用服务端保存的历史")
+    conversation_id: Optional[str] = Field(None, description="对话 ID，同一对话中的追问会复用上一轮的检索结果")
 
 class ChatResponse(BaseModel):
     """聊天响应的模型，结构与SearchResponse相同"""
@@ -0,0 +1,47 @@
+import json
+import uuid
+from typing import Any, Callable, List
+
+from app.schemas import ChatMessage
+
+# 服务端保存的对话历史。每个对话是 Redis 中的一个列表，每轮只追加新消息 (RPUSH)，
+# 并裁剪到最近 max_messages 条 (LTRIM)，客户端不需要每轮重新上传完整历史，单轮的开销与对话长度无关。
+
+
+class ConversationStore:
+    def __init__(self, redis_factory: Callable[[], Any], max_messages: int = 20, ttl_s: int = 86400,
+                 key_prefix: str = "chat:history:"):
+        """
+        redis_factory: 返回 Redis 客户端 (decode_responses=True)
+        max_messages: 每个对话最多保留的消息条数，超出时丢弃最早的消息
+        ttl_s: 对话多久没有新消息后删除
+        """
+        self.redis_factory = redis_factory
+        self.max_messages = max_messages
+        self.ttl_s = ttl_s
+        self.key_prefix = key_prefix
+
+    @staticmethod
+    def new_conversation_id() -> str:
+        return uuid.uuid4().hex
+
+    def _key(self, conversation_id: str) -> str:
+        return f"{self.key_prefix}{conversation_id}"
+
+    def append(self, conversation_id: str, *messages: ChatMessage):
+        """追加消息，同时裁剪长度并刷新过期时间 (一次事务)"""
+        if not messages:
+            return
+        key = self._key(conversation_id)
+        pipe = self.redis_factory().pipeline(transaction=True)
+        pipe.rpush(key, *(json.dumps(message.model_dump(), ensure_ascii=False) for message in messages))
+        pipe.ltrim(key, -self.max_messages, -1)
+        pipe.expire(key, self.ttl_s)
+        pipe.execute()
+
+    def history(self, conversation_id: str) -> List[ChatMessage]:
+        raw = self.redis_factory().lrange(self._key(conversation_id), 0, -1)
+        return [ChatMessage(**json.loads(item)) for item in raw]
+
+    def clear(self, conversation_id: str):
+        self.redis_factory().delete(self._key(conversation_id))
@@ -0,0 +1,108 @@
+import re
+from typing import Dict, Iterable, Optional
+
+# 检索前的轻量判断：问候、感谢、告别、简单应答这类闲聊不需要知识库，跳过检索可以省掉一次
+# 检索服务往返 (嵌入、向量库查询、上下文压缩)，prompt 也不会带上 5 段无关的背景资料。
+# 判断规则刻意保守：去掉标点、空白和表情后，整句只由下面的闲聊短语和语气词组成 (且不超过 max_chars 个字符)
+# 才跳过；只要出现其他内容 (例如 "谢谢，那报名截止是哪天")，就照常检索。
+# 肯定应答 ("好的"、"可以"、"是的" 等) 在助手上一轮提问或提出帮忙 ("需要我列出报名材料吗？") 时是对问题的回答，
+# 这时不算闲聊，照常检索。
+
+AFFIRMATIVE_PHRASES = (
+    "好", "好的", "好滴", "行", "可以", "嗯", "嗯嗯", "ok", "okay", "是的", "对", "对的", "没问题",
+)
+
+CHITCHAT_PHRASES = (
+    # 问候
+    "你好", "您好", "你好吗", "嗨", "哈喽", "哈罗", "hello", "hi", "hey", "在吗", "在不在", "有人吗",
+    "早", "早上好", "早安", "上午好", "中午好", "下午好", "晚上好", "晚安",
+    # 感谢
+    "谢谢", "谢谢你", "谢谢您", "谢啦", "多谢", "感谢", "非常感谢", "太感谢了", "辛苦了", "麻烦你了",
+    "thanks", "thank you", "thankyou", "thx",
+    # 应答
+    *AFFIRMATIVE_PHRASES, "明白", "明白了", "知道了", "懂了", "收到", "了解", "不客气", "没事", "没关系", "对不起", "抱歉",
+    # 告别
+    "再见", "拜拜", "bye", "byebye", "回头见", "下次见",
+    # 夸奖、笑
+    "你真棒", "真棒", "太棒了", "厉害", "不错", "哈哈", "哈哈哈", "666", "赞",
+)
+# 可以出现在闲聊短语前后的语气词 (不包括 "吗"、"呢" 这类可能构成追问的字)
+_FILLERS = "啊呀吧哈嘿嗯哦噢喔啦嘛哇耶了的~"
+# 标点、空白、表情等非文字字符
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+# 助手消息最后一句是提问或提出帮忙
+_QUESTION = re.compile(r"[?？]|吗|要不要|是否|需不需要|需要我|我可以|我来")
+_SENTENCE_END = re.compile(r"[。！!\n]+")
+
+
+class RetrievalGate:
+    def __init__(self, phrases: Iterable[str] = CHITCHAT_PHRASES, max_chars: int = 12, enabled: bool = True,
+                 smoothing: float = 0.1, affirmatives: Iterable[str] = AFFIRMATIVE_PHRASES):
+        """
+        phrases: 闲聊短语，匹配前统一转成小写并去掉空白和标点
+        affirmatives: phrases 中的肯定应答，助手上一轮在提问时这些短语不算闲聊
+        max_chars: 去掉标点后超过这个长度的消息总是检索
+        smoothing: 检索耗时指数移动平均的系数，用于估算跳过检索省下的时间
+        """
+        normalized = {self.normalize(phrase) for phrase in phrases} - {""}
+        affirmatives = {self.normalize(phrase) for phrase in affirmatives}
+        self._pattern = self._compile(normalized, _FILLERS)
+        # 同时是语气词的肯定应答 ("嗯") 也不能作为语气词匹配
+        self._answer_pattern = self._compile(normalized - affirmatives,
+                                             "".join(c for c in _FILLERS if c not in affirmatives))
+        self.max_chars = max_chars
+        self.enabled = enabled
+        self.smoothing = smoothing
+        self.turns = 0
+        self.skipped = 0
+        self.retrieval_ms: Optional[float] = None  # 最近检索耗时的指数移动平均
+
+    @staticmethod
+    def _compile(phrases, fillers: str) -> re.Pattern:
+        # 长短语优先匹配，"谢谢你" 不会被拆成 "谢谢" + 无法匹配的 "你"
+        alternatives = sorted(phrases, key=len, reverse=True)
+        return re.compile("(?:" + "".join(re.escape(p) + "|" for p in alternatives) + "[" + re.escape(fillers) + "])+")
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return _NON_WORD.sub("", text).lower()
+
+    @staticmethod
+    def is_question(text: Optional[str]) -> bool:
+        """助手消息的最后一句是否在提问或提出帮忙"""
+        sentences = [sentence for sentence in _SENTENCE_END.split(text or "") if sentence.strip()]
+        return bool(sentences) and _QUESTION.search(sentences[-1]) is not None
+
+    def is_chitchat(self, query: str, last_assistant: Optional[str] = None) -> bool:
+        """last_assistant: 助手的上一条回复，它在提问时肯定应答不算闲聊"""
+        text = self.normalize(query)
+        if not text:
+            # 只有标点或表情
+            return True
+        pattern = self._answer_pattern if self.is_question(last_assistant) else self._pattern
+        return len(text) <= self.max_chars and pattern.fullmatch(text) is not None
+
+    def needs_retrieval(self, query: str, last_assistant: Optional[str] = None) -> bool:
+        """判断这一轮对话是否需要检索知识库，同时计入跳过比例的统计"""
+        self.turns += 1
+        if self.enabled and self.is_chitchat(query, last_assistant):
+            self.skipped += 1
+            return False
+        return True
+
+    def record_retrieval(self, elapsed_ms: float):
+        """记录一次实际检索的耗时"""
+        if self.retrieval_ms is None:
+            self.retrieval_ms = elapsed_ms
+        else:
+            self.retrieval_ms += self.smoothing * (elapsed_ms - self.retrieval_ms)
+
+    def stats(self) -> Dict[str, float]:
+        """跳过比例，以及按平均检索耗时估算的累计节省时间"""
+        return {
+            "turns": self.turns,
+            "skipped": self.skipped,
+            "skip_ratio": self.skipped / self.turns if self.turns else 0.0,
+            "avg_retrieval_ms": self.retrieval_ms or 0.0,
+            "estimated_saved_ms": self.skipped * (self.retrieval_ms or 0.0),
+        }
@@ -1,29 +1,44 @@
 import logging
-import chromadb
 from redis import ConnectionPool
 from app.configs.config import settings
+from app.rag.partitions import TimePartitioner
+from app.rag.sharding import create_collection_resolver
+from app.rag.vector_store import create_vector_store
 
 logging.basicConfig(level=settings.LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# --- ChromaDB Client Singleton ---
-logger.info(f"Initializing ChromaDB client to connect to {settings.CHROMA_SERVER_HOST}:{settings.CHROMA_SERVER_PORT}")
+# --- Vector Store Singleton ---
+logger.info(f"Initializing vector store backend '{settings.VECTOR_STORE_BACKEND}'")
 
 try:
-    # 这个对象在模块第一次被导入时创建，之后会被所有导入者复用
-    chroma_client = chromadb.HttpClient(
+    # 这个对象在模块第一次被导入时创建，之后会被所有导入者复用；
+    # Chroma 客户端在第一次访问集合时才连接，导入本模块不会发起网络请求
+    vector_store = create_vector_store(
+        settings.VECTOR_STORE_BACKEND,
         host=settings.CHROMA_SERVER_HOST,
-        port=settings.CHROMA_SERVER_PORT
+        port=settings.CHROMA_SERVER_PORT,
+        ssl=settings.CHROMA_SERVER_SSL,
+        persist_dir=settings.CHROMA_PERSIST_DIR
     )
 
-    # 我们可以把 collection 的获取也放在这里，因为它也是共享的
-    chroma_collection = chroma_client.get_or_create_collection(
-        name=settings.CHROMA_RAG_COLLECTION_NAME
+    # 集合名通过别名解析，蓝绿重建切换后，长期运行的进程会在刷新间隔内自动切到新版本；
+    # 启用分片时每个分片各有一个别名，解析结果是组合了所有分片的 ShardedCollection
+    collection_resolver = create_collection_resolver(
+        vector_store,
+        settings.CHROMA_RAG_COLLECTION_NAME,
+        settings.RAG_SHARDING,
+        refresh_interval_s=settings.RAG_ALIAS_REFRESH_S,
+        max_workers=settings.RAG_SHARD_QUERY_WORKERS,
+        partitioner=TimePartitioner(
+            time_field=settings.RAG_PARTITION_TIME_FIELD,
+            retention_months=settings.RAG_PARTITION_RETENTION_MONTHS,
+            default_retention_months=settings.RAG_PARTITION_DEFAULT_RETENTION_MONTHS
+        )
     )
-    logger.info(f"Successfully connected to ChromaDB and got collection '{settings.CHROMA_RAG_COLLECTION_NAME}'")
 
 except Exception as e:
-    logger.critical(f"Failed to initialize ChromaDB client. Exiting. Error: {e}", exc_info=True)
+    logger.critical(f"Failed to initialize vector store. Exiting. Error: {e}", exc_info=True)
     # 在实际应用中，如果核心服务无法连接，直接退出
     raise
 
@@ -0,0 +1,63 @@
+import json
+import time
+from typing import Any, AsyncIterator, Dict, List, Sequence
+
+from app.configs.config import settings
+
+# 溯源事件 (SSE 的第一个事件) 的两种格式:
+# - full: 检索结果原样发送，包括每个文本块的完整正文和全部 metadata
+# - compact: 只发送 ID、标题、链接和一小段摘要，完整内容由前端点开来源时通过 /sources/{id} 按需获取
+# 第一个 token 要等溯源事件传完才能显示，网络慢时 compact 可以明显提前首屏。
+
+SOURCE_MODES = ("full", "compact")
+
+
+def first_field(metadata: Dict[str, Any], fields: Sequence[str]):
+    for field in fields:
+        value = metadata.get(field)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def compact_sources(retrieved_docs: List[Dict[str, Any]], snippet_chars: int = 80,
+                    title_fields: Sequence[str] = ("title", "name", "source"),
+                    url_fields: Sequence[str] = ("url", "link")) -> List[Dict[str, Any]]:
+    """标题和链接取 metadata 中第一个非空的候选字段，摘要为正文开头 snippet_chars 个字符"""
+    sources = []
+    for doc in retrieved_docs:
+        metadata = doc.get("metadata") or {}
+        content = " ".join((doc.get("content") or "").split())
+        snippet = content if len(content) <= snippet_chars else content[:snippet_chars] + "…"
+        sources.append({"id": doc.get("id"), "title": first_field(metadata, title_fields),
+                        "url": first_field(metadata, url_fields), "snippet": snippet})
+    return sources
+
+
+def source_payload(retrieved_docs: List[Dict[str, Any]], mode: str) -> str:
+    """溯源事件的 data 部分，compact 模式的摘要长度和标题、链接字段见 SOURCE_* 配置"""
+    if mode == "compact":
+        sources = compact_sources(retrieved_docs, snippet_chars=settings.SOURCE_SNIPPET_CHARS,
+                                  title_fields=settings.SOURCE_TITLE_FIELDS, url_fields=settings.SOURCE_URL_FIELDS)
+        return json.dumps(sources, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(retrieved_docs, ensure_ascii=False)
+
+
+async def metered(stream: AsyncIterator[str], label: str, started_at: float, logger) -> AsyncIterator[str]:
+    """
+    转发 SSE 文本并在结束时记录首字节时间 (从收到请求到产出第一段) 和传输字节数 (UTF-8 编码后)。
+    started_at 为 time.perf_counter() 的值
+    """
+    first_chunk_ms = None
+    first_chunk_bytes = total_bytes = 0
+    try:
+        async for chunk in stream:
+            size = len(chunk.encode("utf-8"))
+            if first_chunk_ms is None:
+                first_chunk_ms = (time.perf_counter() - started_at) * 1000
+                first_chunk_bytes = size
+            total_bytes += size
+            yield chunk
+    finally:
+        logger.info(f"{label}: ttfb_ms={first_chunk_ms if first_chunk_ms is None else round(first_chunk_ms, 1)} "
+                    f"first_event_bytes={first_chunk_bytes} total_bytes={total_bytes}")
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import uuid
+from typing import Any, AsyncIterator, Callable, Optional, Tuple
+
+# 可续传的 SSE 流。生成过程 (检索 + LLM 流式输出) 在后台任务中运行，与客户端连接解耦，
+# 产生的每个事件都写进该次生成专属的 Redis Stream (短 TTL)，客户端连接只是从 Stream 中读取并转发。
+# 每个 SSE 事件的 id 为 "{生成 id}:{Stream 条目 id}"，客户端断线重连时带上 Last-Event-ID，
+# 服务端从该条目之后继续读取：生成还在进行就接着等待新事件，已经结束就回放剩余事件，不会重新检索和生成。
+# 事件都在 Redis 中，重连落到另一个 worker 进程上也能续传。
+# Redis 不可用时 open 退回为直接转发生成的事件 (不带 id，不可续传)；生成途中写入失败则放弃这次生成，
+# 读取端发送错误事件后结束，不会让异常留在后台任务里。
+
+END_EVENT = "end"
+ERROR_EVENT = "error"
+
+
+def format_sse(event: str, data: str, event_id: Optional[str] = None) -> str:
+    prefix = f"id: {event_id}\n" if event_id else ""
+    return f"{prefix}event: {event}\ndata: {data}\n\n"
+
+
+class BufferUnavailable(RuntimeError):
+    """事件写不进缓冲 (Redis 不可用)"""
+
+
+def parse_last_event_id(last_event_id: Optional[str]) -> Optional[Tuple[str, str]]:
+    """把 Last-Event-ID 拆成 (生成 id, Stream 条目 id)，格式不对时返回 None"""
+    if not last_event_id or ":" not in last_event_id:
+        return None
+    generation_id, entry_id = last_event_id.strip().rsplit(":", 1)
+    if not generation_id or "-" not in entry_id:
+        return None
+    return generation_id, entry_id
+
+
+class SSEReplayBuffer:
+    def __init__(self, redis, key_prefix: str = "sse:smart-search:", ttl_s: int = 300, idle_timeout_s: float = 90,
+                 block_ms: int = 5000, logger=None):
+        """
+        redis: redis.asyncio 客户端 (decode_responses=True)
+        ttl_s: 生成结束 (或最后一个事件) 之后缓冲保留多久，在此期间可以续传
+        idle_timeout_s: 读取时超过这么久没有新事件 (例如生成所在进程已退出) 就发送错误并结束
+        """
+        self.redis = redis
+        self.key_prefix = key_prefix
+        self.ttl_s = ttl_s
+        self.idle_timeout_s = idle_timeout_s
+        self.block_ms = block_ms
+        self.logger = logger
+        self._tasks = set()  # 保存后台生成任务的引用，避免被垃圾回收
+
+    def _key(self, generation_id: str) -> str:
+        return f"{self.key_prefix}{generation_id}"
+
+    async def exists(self, generation_id: str) -> bool:
+        return bool(await self.redis.exists(self._key(generation_id)))
+
+    async def publish(self, generation_id: str, event: str, data: str) -> str:
+        key = self._key(generation_id)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.xadd(key, {"event": event, "data": data})
+        pipe.expire(key, self.ttl_s)
+        entry_id, _ = await pipe.execute()
+        return entry_id
+
+    async def _append(self, generation_id: str, event: str, data: str) -> str:
+        try:
+            return await self.publish(generation_id, event, data)
+        except Exception as e:
+            raise BufferUnavailable(str(e)) from e
+
+    def _log(self, level: str, message: str, **kwargs):
+        if self.logger:
+            getattr(self.logger, level)(message, **kwargs)
+
+    async def open(self, produce: Callable[[], AsyncIterator[Tuple[str, Any]]]) -> AsyncIterator[str]:
+        """
+        启动一次生成并返回它的 SSE 文本流 (start + stream)。
+        Redis 不可用时退回为 direct：直接运行 produce 并逐个转发，事件不带 id，断线后无法续传
+        """
+        try:
+            await self.redis.ping()
+        except Exception as e:
+            self._log("warning", f"SSE 缓冲不可用，本次生成不可续传: {e}")
+            return self.direct(produce)
+        return self.stream(self.start(produce))
+
+    async def direct(self, produce: Callable[[], AsyncIterator[Tuple[str, Any]]]) -> AsyncIterator[str]:
+        """不经过缓冲，直接把 produce() 的事件格式化为不带 id 的 SSE 文本，出错和结束的处理与 start 相同"""
+        try:
+            async for event, data in produce():
+                yield format_sse(event, data if isinstance(data, str) else json.dumps(data, ensure_ascii=False))
+        except Exception as e:
+            self._log("error", f"生成出错: {e}", exc_info=True)
+            yield format_sse(ERROR_EVENT, json.dumps({"error": "处理请求时发生内部错误"}, ensure_ascii=False))
+        yield format_sse(END_EVENT, "{}")
+
+    def start(self, produce: Callable[[], AsyncIterator[Tuple[str, Any]]]) -> str:
+        """
+        在后台运行 produce() 产出的 (事件名, 数据) 序列并写入缓冲，返回生成 id。
+        数据不是字符串时按 JSON 序列化；produce 出错时写入 error 事件，最后总是写入 end 事件
+        """
+        generation_id = uuid.uuid4().hex
+        task = asyncio.create_task(self._run(generation_id, produce))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return generation_id
+
+    async def _run(self, generation_id: str, produce: Callable[[], AsyncIterator[Tuple[str, Any]]]):
+        events = produce()
+        try:
+            try:
+                async for event, data in events:
+                    payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+                    await self._append(generation_id, event, payload)
+            except BufferUnavailable:
+                raise
+            except Exception as e:
+                self._log("error", f"生成 {generation_id} 出错: {e}", exc_info=True)
+                await self._append(generation_id, ERROR_EVENT,
+                                   json.dumps({"error": "处理请求时发生内部错误"}, ensure_ascii=False))
+            await self._append(generation_id, END_EVENT, "{}")
+        except BufferUnavailable as e:
+            # 事件写不进缓冲，继续生成也没有人能读到，放弃这次生成
+            self._log("error", f"生成 {generation_id} 的事件无法写入缓冲，已放弃: {e}")
+        finally:
+            await events.aclose()
+
+    async def stream(self, generation_id: str, after: str = "0-0") -> AsyncIterator[str]:
+        """
+        从缓冲中读取条目 after 之后的事件，格式化为带 id 的 SSE 文本，读到 end 事件后结束。
+        客户端断开时只停止读取，后台生成不受影响
+        """
+        key = self._key(generation_id)
+        loop = asyncio.get_running_loop()
+        last_event_at = loop.time()
+        while True:
+            try:
+                response = await self.redis.xread({key: after}, block=self.block_ms, count=100)
+            except Exception as e:
+                self._log("error", f"读取生成 {generation_id} 的缓冲失败: {e}")
+                yield format_sse(ERROR_EVENT, json.dumps({"error": "生成已中断，请重新提问"}, ensure_ascii=False))
+                yield format_sse(END_EVENT, "{}")
+                return
+            if not response:
+                if loop.time() - last_event_at >= self.idle_timeout_s:
+                    error = json.dumps({"error": "生成已中断，请重新提问"}, ensure_ascii=False)
+                    yield format_sse(ERROR_EVENT, error)
+                    yield format_sse(END_EVENT, "{}")
+                    return
+                continue
+            last_event_at = loop.time()
+            for entry_id, fields in response[0][1]:
+                after = entry_id
+                yield format_sse(fields["event"], fields["data"], f"{generation_id}:{entry_id}")
+                if fields["event"] == END_EVENT:
+                    return
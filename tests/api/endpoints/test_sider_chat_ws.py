@@ -0,0 +1,74 @@
+# WebSocket 对话接口的单元测试：检索和 LLM 用替身，对话历史保存在 tests/conftest.py 的内存 Redis 中
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+pytest.importorskip("redis")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.endpoints import sider_chat
+from app.utils.auth import API_KEY, API_KEY_NAME
+
+
+class UnavailableRedis:
+    def __getattr__(self, name):
+        raise ConnectionError("Error connecting to Redis")
+
+
+@pytest.fixture
+def client(monkeypatch, fake_redis):
+    async def prepare_llm_messages(user_query, history, conversation_id=None):
+        return [{"id": "c1", "content": "报名材料", "metadata": {}}], [{"role": "user", "content": user_query}]
+
+    async def stream_llm_tokens(messages_for_llm, enable_thinking):
+        for token in ("需要", "申请表"):
+            yield token
+
+    monkeypatch.setattr(sider_chat, "prepare_llm_messages", prepare_llm_messages)
+    monkeypatch.setattr(sider_chat, "stream_llm_tokens", stream_llm_tokens)
+    monkeypatch.setattr(sider_chat.conversation_store, "redis_factory", lambda: fake_redis)
+    app = FastAPI()
+    app.include_router(sider_chat.ws_router)
+    return TestClient(app)
+
+
+def receive_turn(websocket):
+    messages = [websocket.receive_json()]
+    while messages[-1]["type"] not in ("end", "error"):
+        messages.append(websocket.receive_json())
+    return messages
+
+
+def test_turn_streams_answer_and_saves_history(client, fake_redis):
+    with client.websocket_connect("/sider-chat/ws", headers={API_KEY_NAME: API_KEY}) as websocket:
+        conversation_id = websocket.receive_json()["conversation_id"]
+        websocket.send_json({"query": "怎么报名"})
+        turn = receive_turn(websocket)
+
+    assert [message["type"] for message in turn] == ["source", "token", "token", "end"]
+    history = sider_chat.conversation_store.history(conversation_id)
+    assert [(message.role, message.content) for message in history] == [("user", "怎么报名"),
+                                                                        ("assistant", "需要申请表")]
+
+
+def test_bad_frames_and_redis_outage_answer_with_error_and_keep_connection(client, monkeypatch, fake_redis):
+    redis = {"client": UnavailableRedis()}
+    monkeypatch.setattr(sider_chat.conversation_store, "redis_factory", lambda: redis["client"])
+    with client.websocket_connect("/sider-chat/ws", headers={API_KEY_NAME: API_KEY}) as websocket:
+        websocket.receive_json()
+        websocket.send_bytes(b"\x00\x01")
+        assert websocket.receive_json()["type"] == "error"
+        websocket.send_text("not json")
+        assert websocket.receive_json()["type"] == "error"
+        websocket.send_json({"query": "x" * (sider_chat.settings.CHAT_MAX_QUERY_CHARS + 1)})
+        assert websocket.receive_json()["type"] == "error"
+        websocket.send_json({"query": "怎么报名"})
+        assert websocket.receive_json()["type"] == "error"
+
+        # Redis 恢复后同一个连接照常对话
+        redis["client"] = fake_redis
+        websocket.send_json({"query": "怎么报名"})
+        assert receive_turn(websocket)[-1]["type"] == "end"
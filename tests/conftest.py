@@ -0,0 +1,125 @@
+# 测试共用的内存 Redis 替身：只实现被测代码用到的命令，pipeline 中的命令在 execute 时按顺序执行
+
+import asyncio
+
+import pytest
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+
+
+class FakeRedis:
+    """字符串 (get/set) 和列表 (rpush/ltrim/lrange) 命令，ttl 记录每个键最后一次设置的过期秒数"""
+
+    def __init__(self):
+        self.data = {}
+        self.lists = {}
+        self.ttl = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+        self.ttl[key] = ex
+
+    def rpush(self, key, *values):
+        self.lists.setdefault(key, []).extend(values)
+
+    def ltrim(self, key, start, end):
+        items = self.lists.get(key, [])
+        self.lists[key] = items[start:] if end == -1 else items[start:end + 1]
+
+    def expire(self, key, seconds):
+        self.ttl[key] = seconds
+
+    def lrange(self, key, start, end):
+        return list(self.lists.get(key, []))
+
+    def delete(self, key):
+        self.data.pop(key, None)
+        self.lists.pop(key, None)
+
+
+class FakeAsyncPipeline(FakePipeline):
+    async def execute(self):
+        return [await getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+
+
+class FakeAsyncRedis:
+    """
+    redis.asyncio 的替身，只实现 Stream 的 xadd/xread (按序号生成条目 id) 和 exists/expire/ping。
+    down 为 True 时所有命令抛出 ConnectionError，模拟 Redis 不可用
+    """
+
+    def __init__(self):
+        self.streams = {}
+        self.changed = asyncio.Condition()
+        self.down = False
+
+    def _check(self):
+        if self.down:
+            raise ConnectionError("Error connecting to Redis")
+
+    def pipeline(self, transaction=True):
+        return FakeAsyncPipeline(self)
+
+    async def ping(self):
+        self._check()
+        return True
+
+    async def xadd(self, key, fields):
+        self._check()
+        entries = self.streams.setdefault(key, [])
+        entry_id = f"{len(entries) + 1}-0"
+        entries.append((entry_id, dict(fields)))
+        async with self.changed:
+            self.changed.notify_all()
+        return entry_id
+
+    async def expire(self, key, seconds):
+        self._check()
+        return True
+
+    async def exists(self, key):
+        self._check()
+        return int(key in self.streams)
+
+    async def xread(self, streams, block=None, count=None):
+        self._check()
+        (key, after), = streams.items()
+
+        def pending():
+            sequence = int(after.split("-")[0])
+            return self.streams.get(key, [])[sequence:sequence + (count or 100)]
+
+        if not pending() and block:
+            try:
+                async with self.changed:
+                    await asyncio.wait_for(self.changed.wait_for(lambda: bool(pending())), block / 1000)
+            except asyncio.TimeoutError:
+                pass
+        entries = pending()
+        return [[key, entries]] if entries else []
+
+
+@pytest.fixture
+def fake_redis():
+    return FakeRedis()
+
+
+@pytest.fixture
+def fake_async_redis():
+    return FakeAsyncRedis()
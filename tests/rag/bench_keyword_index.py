@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BM25 关键词索引的构建、查询与更新速度基准。
+用法: python tests/rag/bench_keyword_index.py [--docs N] [--queries N] [--k K] [--tokenizer bigram|jieba]
+默认合成 200000 个文本块 (按当前知识库约 2000 个文本块的 100 倍估计)，目标是 p50 和 p95 都在 1 毫秒以内，
+结果按查询类型分别给出 p50/p95/p99，另外测量带 source_type 过滤的查询。
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, os.path.abspath('.'))
+
+from app.rag.keyword_index import KeywordIndex, create_tokenizer
+
+SUFFIXES = ["社", "协会", "俱乐部", "团", "实验室", "队"]
+SOURCE_TYPES = ["event", "announcement", "member_profile", "club_info"]
+BUILDINGS = ["活动室", "教学楼A", "教学楼B", "图书馆", "学生活动中心", "体育馆"]
+
+
+def synthetic_vocabulary(size: int, rng: random.Random):
+    """随机生成 2~4 个汉字的词，按 Zipf 分布取词，接近真实文本中少数常用词、大量稀有词的情况"""
+    words = ["".join(chr(rng.randrange(0x4E00, 0x4E00 + 3000)) for _ in range(rng.randint(2, 4)))
+             for _ in range(size)]
+    weights = 1.0 / np.arange(1, size + 1)
+    return words, weights / weights.sum()
+
+
+def synthetic_names(words, rng: random.Random, clubs: int = 300, rooms: int = 600):
+    """社团名 ("xx社"、"xx协会") 和教室号 ("活动室301")"""
+    club_names = [rng.choice(words) + rng.choice(SUFFIXES) for _ in range(clubs)]
+    room_names = [f"{rng.choice(BUILDINGS)}{rng.randint(1, 6)}{rng.randint(0, 2)}{rng.randint(1, 9)}"
+                  for _ in range(rooms)]
+    return club_names, room_names
+
+
+def synthetic_corpus(n: int, seed: int = 0, vocabulary_size: int = 30000):
+    """文本块长度与 CHUNK_SIZE=300 时相近，部分文本块提到社团名和教室号，返回 (ID, 正文, metadata)"""
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    words, probabilities = synthetic_vocabulary(vocabulary_size, random.Random(0))
+    clubs, rooms = synthetic_names(words, random.Random(0))
+    for i in range(n):
+        parts = [words[j] for j in np_rng.choice(vocabulary_size, size=rng.randint(40, 120), p=probabilities)]
+        if rng.random() < 0.5:
+            parts.insert(rng.randrange(len(parts)), rng.choice(clubs))
+        if rng.random() < 0.3:
+            parts.insert(rng.randrange(len(parts)), rng.choice(rooms))
+        yield (f"dynamic::doc{i}::chunk::0", "，".join(parts) + f"。编号{rng.randrange(100000)}",
+               {"source_type": SOURCE_TYPES[i % len(SOURCE_TYPES)]})
+
+
+def synthetic_queries(n: int, seed: int = 1, vocabulary_size: int = 30000):
+    """按类型生成查询: 教室号、社团名加常用词、带多个词的自然语言问题、编号"""
+    rng = random.Random(seed)
+    words, _ = synthetic_vocabulary(vocabulary_size, random.Random(0))
+    clubs, rooms = synthetic_names(words, random.Random(0))
+    templates = {
+        "room": lambda: rng.choice(rooms),
+        "club": lambda: f"{rng.choice(clubs)}{rng.choice(words[:200])}",
+        "question": lambda: f"{rng.choice(clubs)}在{rng.choice(rooms)}的{rng.choice(words)}{rng.choice(words)}什么时候",
+        "number": lambda: f"编号{rng.randrange(100000)}",
+    }
+    kinds = sorted(templates)
+    return [(kind, templates[kind]()) for kind in (rng.choice(kinds) for _ in range(n))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--tokenizer", default="bigram")
+    args = parser.parse_args()
+
+    index = KeywordIndex(create_tokenizer(args.tokenizer), filter_fields=["source_type"])
+    start = time.perf_counter()
+    batch_ids, batch_docs, batch_metadatas = [], [], []
+    for chunk_id, document, metadata in synthetic_corpus(args.docs):
+        batch_ids.append(chunk_id)
+        batch_docs.append(document)
+        batch_metadatas.append(metadata)
+        if len(batch_ids) == 1000:
+            index.upsert(batch_ids, batch_docs, batch_metadatas)
+            batch_ids, batch_docs, batch_metadatas = [], [], []
+    index.upsert(batch_ids, batch_docs, batch_metadatas)
+    index.prepare()
+    build_s = time.perf_counter() - start
+    stats = index.stats()
+    print(f"构建 {stats['chunks']} 个文本块: {build_s:.1f}s, {stats['terms']} 个词, "
+          f"{stats['postings']} 条倒排记录 ({stats['posting_bytes'] / 1e6:.1f} MB)")
+
+    queries = synthetic_queries(args.queries)
+    latencies = {}
+    for kind, query in queries:
+        start = time.perf_counter()
+        index.search(query, args.k)
+        latencies.setdefault(kind, []).append(time.perf_counter() - start)
+    latencies["all"] = [latency for values in latencies.values() for latency in values]
+    # 过滤掩码在选 top-k 之前生效，每次查询多一次对所有序号的掩码计算
+    latencies["filtered"] = []
+    for i, (_, query) in enumerate(queries):
+        where = {"source_type": SOURCE_TYPES[i % len(SOURCE_TYPES)]}
+        start = time.perf_counter()
+        index.search(query, args.k, where=where)
+        latencies["filtered"].append(time.perf_counter() - start)
+    for kind, values in latencies.items():
+        p50, p95, p99 = (np.percentile(values, q) * 1000 for q in (50, 95, 99))
+        print(f"{kind:>8} 查询 {len(values)} 次 (top-{args.k}): p50 {p50:.3f}ms, p95 {p95:.3f}ms, p99 {p99:.3f}ms")
+    for kind in ("all", "filtered"):
+        for q in (50, 95):
+            value = np.percentile(latencies[kind], q) * 1000
+            print(f"{'✅' if value < 1 else '❌'} {kind} p{q} = {value:.3f}ms (目标 < 1ms)")
+
+    # 更新路径: 覆盖 1% 的文本块后再查询
+    updates = [(f"dynamic::doc{i}::chunk::0", document, metadata)
+               for i, (_, document, metadata) in enumerate(synthetic_corpus(args.docs // 100, seed=2))]
+    start = time.perf_counter()
+    index.upsert([update[0] for update in updates], [update[1] for update in updates],
+                 [update[2] for update in updates])
+    print(f"覆盖 {len(updates)} 个文本块: {(time.perf_counter() - start) * 1000:.0f}ms")
+    start = time.perf_counter()
+    index.search(queries[0][1], args.k)
+    # 索引变化后的第一次查询需要重新计算长度归一化项和新增倒排记录的分块统计
+    print(f"更新后的第一次查询: {(time.perf_counter() - start) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
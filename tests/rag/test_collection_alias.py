@@ -0,0 +1,80 @@
+# 别名解析的写入计划：蓝绿重建换了嵌入模型时，旧模型的向量不能双写进新版本
+
+import pytest
+
+from app.rag.collection_alias import (CollectionAliasResolver, EmbeddingMismatchError, embedding_signature,
+                                      same_embedding, write_alias)
+from app.rag.sharding import ShardedCollectionResolver
+from app.rag.vector_store import InMemoryVectorStore
+
+OLD = embedding_signature("moka-ai/m3e-base", 768, "/models/m3e-base")
+NEW = embedding_signature("BAAI/bge-small-zh", 512, "/models/bge-small-zh")
+
+
+def test_same_embedding_compares_model_and_known_dimension():
+    assert same_embedding(OLD, dict(OLD, dir="/elsewhere/m3e-base")), "模型目录不同不影响判断"
+    assert not same_embedding(OLD, NEW)
+    assert not same_embedding(OLD, dict(OLD, dim=1024)), "同名模型维度不同也视为不同"
+    assert same_embedding(OLD, embedding_signature("moka-ai/m3e-base")), "维度未知时只比较模型名"
+    assert same_embedding(None, NEW), "未登记模型的旧集合视为一致"
+
+
+def test_same_model_rebuild_is_dual_written():
+    store = InMemoryVectorStore()
+    write_alias(store, "rag", {"active": "rag", "building": "rag__v1",
+                               "active_embedding": OLD, "building_embedding": OLD})
+    resolver = CollectionAliasResolver(store, "rag", refresh_interval_s=0)
+
+    collections, deferred = resolver.write_plan(OLD)
+    assert [collection.name for collection in collections] == ["rag", "rag__v1"]
+    assert deferred == []
+
+
+def test_model_change_defers_building_writes():
+    """building 换了模型时，旧模型的写入方只写 active，文本块ID转给重新嵌入队列"""
+    store = InMemoryVectorStore()
+    write_alias(store, "rag", {"active": "rag", "building": "rag__v1",
+                               "active_embedding": OLD, "building_embedding": NEW})
+    resolver = CollectionAliasResolver(store, "rag", refresh_interval_s=0)
+
+    collections, deferred = resolver.write_plan(OLD)
+    assert [collection.name for collection in collections] == ["rag"]
+    assert resolver.route_deferred(deferred, ["dynamic::a::0"]) == {"rag__v1": ["dynamic::a::0"]}
+    assert resolver.write_names() == ["rag", "rag__v1"], "不涉及向量的写入 (删除) 仍发往两个版本"
+
+
+def test_writer_with_stale_model_is_refused_after_switch():
+    store = InMemoryVectorStore()
+    write_alias(store, "rag", {"active": "rag__v1", "building": None, "active_embedding": NEW})
+    resolver = CollectionAliasResolver(store, "rag", refresh_interval_s=0)
+
+    with pytest.raises(EmbeddingMismatchError):
+        resolver.write_plan(OLD)
+    assert resolver.active_embedding() == NEW
+    assert [collection.name for collection in resolver.write_plan(NEW)[0]] == ["rag__v1"]
+
+
+def test_legacy_alias_without_models_keeps_dual_write():
+    store = InMemoryVectorStore()
+    write_alias(store, "rag", {"active": "rag", "building": "rag__v1"})
+    resolver = CollectionAliasResolver(store, "rag", refresh_interval_s=0)
+
+    collections, deferred = resolver.write_plan(OLD)
+    assert [collection.name for collection in collections] == ["rag", "rag__v1"]
+    assert deferred == []
+
+
+def test_sharded_plan_routes_deferred_ids_by_shard():
+    store = InMemoryVectorStore()
+    write_alias(store, "rag__dynamic", {"active": "rag__dynamic", "building": "rag__dynamic__v1",
+                                        "active_embedding": OLD, "building_embedding": NEW})
+    resolver = ShardedCollectionResolver(store, "rag", refresh_interval_s=0)
+
+    collections, deferred = resolver.write_plan(OLD)
+    assert deferred == ["rag__dynamic__v1"]
+    collections[0].upsert(ids=["static::a::0", "dynamic::b::0"], embeddings=[[0.0] * 4] * 2)
+    assert "rag__dynamic__v1" not in store.list_collections(), "旧模型的向量不应写进新版本"
+    assert store.get_collection("rag__dynamic").get()["ids"] == ["dynamic::b::0"]
+    assert resolver.route_deferred(deferred, ["static::a::0", "dynamic::b::0"]) == {
+        "rag__dynamic__v1": ["dynamic::b::0"]}
+    assert resolver.active_embedding() == OLD
@@ -0,0 +1,80 @@
+# 对话检索候选池的单元测试：保存读取、是否复用的判断、按新问题重新打分
+
+import numpy as np
+import pytest
+
+from app.rag import conversation_context
+from app.rag.conversation_context import ConversationRetrievalStore, rescore_candidates, retrieval_scope
+
+
+def unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def make_candidates():
+    return [{"id": f"c{i}", "content": f"文本{i}", "metadata": {"source": "manual"}, "similarity": 0.5,
+             "embedding": unit(vector)} for i, vector in enumerate([[1, 0, 0], [0, 1, 0], [1, 1, 0]])]
+
+
+def test_save_and_load_round_trip(fake_redis):
+    redis = fake_redis
+    store = ConversationRetrievalStore(lambda: redis, ttl_s=60, max_pool=2)
+    scope = retrieval_scope("kb_v1", {"source_type": "event"}, None)
+    store.save("conv-1", unit([1, 0, 0]), make_candidates(), scope)
+
+    assert redis.ttl == {"rag:conversation:conv-1": 60}
+    context = store.load("conv-1")
+    assert context["scope"] == scope
+    assert [candidate["id"] for candidate in context["candidates"]] == ["c0", "c1"]
+    np.testing.assert_allclose(context["candidates"][1]["embedding"], unit([0, 1, 0]))
+    assert store.load("missing") is None
+
+
+def test_reusable_requires_close_query_and_same_scope(fake_redis):
+    redis = fake_redis
+    store = ConversationRetrievalStore(lambda: redis, reuse_threshold=0.9)
+    scope = retrieval_scope("kb_v1", None, None)
+    store.save("conv-1", unit([1, 0, 0]), make_candidates(), scope)
+    context = store.load("conv-1")
+
+    assert store.reusable(context, unit([1, 0.1, 0]), scope)
+    assert not store.reusable(context, unit([1, 1, 0]), scope)
+    assert not store.reusable(context, unit([1, 0.1, 0]), retrieval_scope("kb_v2", None, None))
+    assert not store.reusable(context, unit([1, 0.1, 0]), retrieval_scope("kb_v1", {"source_type": "event"}, None))
+    assert not store.reusable(None, unit([1, 0, 0]), scope)
+
+
+def test_pool_expires_after_max_age_even_when_reused(fake_redis, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(conversation_context.time, "time", lambda: now[0])
+    store = ConversationRetrievalStore(lambda: fake_redis, ttl_s=1800, max_age_s=300)
+    scope = retrieval_scope("kb_v1", None, None)
+    store.save("conv-1", unit([1, 0, 0]), make_candidates(), scope)
+    assert fake_redis.ttl["rag:conversation:conv-1"] == 300
+
+    # 复用时保留原来的锚点时间，过期时间不会被推后
+    now[0] = 1200.0
+    context = store.load("conv-1")
+    assert store.reusable(context, unit([1, 0.1, 0]), scope)
+    store.save("conv-1", context["anchor"], context["candidates"], scope, context["anchored_at"])
+    assert fake_redis.ttl["rag:conversation:conv-1"] == 100
+
+    now[0] = 1300.0
+    assert not store.reusable(store.load("conv-1"), unit([1, 0.1, 0]), scope)
+
+
+def test_rescore_orders_by_new_query():
+    rescored = rescore_candidates(make_candidates(), unit([0, 1, 0]))
+    assert [candidate["id"] for candidate in rescored] == ["c1", "c2", "c0"]
+    assert rescored[0]["similarity"] == pytest.approx(1.0)
+    assert rescored[2]["similarity"] == pytest.approx(-1.0)
+    assert all(candidate["rrf_score"] is None for candidate in rescored)
+
+
+def test_stats_reports_reuse_ratio(fake_redis):
+    store = ConversationRetrievalStore(lambda: fake_redis, ttl_s=60)
+    assert store.stats() == {"reused": 0, "refreshed": 0, "reuse_ratio": 0.0}
+    store.counts["reused"] += 3
+    store.counts["refreshed"] += 1
+    assert store.stats() == {"reused": 3, "refreshed": 1, "reuse_ratio": 0.75}
@@ -0,0 +1,89 @@
+# 近重复文本块检测的单元测试，用内存中的假集合代替 ChromaDB
+
+from app.rag.dedup import ChunkDeduplicator, SimHashIndex, duplicates_collection_name, hamming_distance, simhash
+
+NOTICE = ("各位同学请注意，本周六下午两点在学生活动中心三楼举行社团招新宣讲会，欢迎大家准时参加并携带学生证。"
+          "宣讲会将介绍各社团的年度活动计划、招新要求和报名流程，现场设有咨询台，各社团负责人会一一解答同学们的问题。"
+          "未能到场的同学可以在社团管理系统中查看宣讲会的录像和资料，并在下周五之前通过系统在线提交报名表。")
+EDITED_NOTICE = NOTICE.replace("两点", "三点")
+OTHER = ("图书馆将于下周一起延长开放时间至晚上十一点，期末复习期间请同学们保持安静，爱护公共设施和书籍。"
+         "自习室座位实行线上预约制度，每人每天最多预约两个时段，预约后十五分钟内未签到的座位将自动释放给其他同学。"
+         "借阅的图书请在到期日前归还，逾期将暂停借阅权限，如有疑问请咨询一楼服务台的工作人员。")
+
+
+class FakeCollection:
+    def __init__(self, name):
+        self.name = name
+        self.records = {}
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        for i, d, m in zip(ids, documents, metadatas):
+            self.records[i] = (d, dict(m))
+
+    def delete(self, ids):
+        for i in ids:
+            self.records.pop(i, None)
+
+    def get(self, ids=None, where=None, include=None, limit=None, offset=0):
+        items = sorted(self.records.items())
+        if where is not None:
+            (key, condition), = where.items()
+            items = [(i, r) for i, r in items if r[1].get(key) in condition["$in"]]
+        items = items[offset:offset + limit] if limit else items
+        return {"ids": [i for i, _ in items], "documents": [r[0] for _, r in items],
+                "metadatas": [r[1] for _, r in items]}
+
+
+def _deduplicator(collections):
+    return ChunkDeduplicator(lambda name: collections.setdefault(name, FakeCollection(name)),
+                             lambda texts: [[0.0]] * len(texts), mode="skip", max_distance=6)
+
+
+def test_simhash_distance_reflects_similarity():
+    assert hamming_distance(simhash(NOTICE), simhash(" ".join(NOTICE.split()))) == 0
+    assert hamming_distance(simhash(NOTICE), simhash(EDITED_NOTICE)) <= 6
+    assert hamming_distance(simhash(NOTICE), simhash(OTHER)) > 6
+
+
+def test_index_finds_near_duplicates_and_ignores_same_id():
+    index = SimHashIndex(max_distance=6)
+    index.add("a", simhash(NOTICE))
+    index.add("b", simhash(OTHER))
+
+    assert index.find_near(simhash(EDITED_NOTICE)) == "a"
+    assert index.find_near(simhash(EDITED_NOTICE), exclude_id="a") is None, "同一ID的旧版本不算重复"
+    index.remove("a")
+    assert index.find_near(simhash(EDITED_NOTICE)) is None
+
+
+def test_duplicates_are_skipped_and_linked_to_canonical():
+    collections = {}
+    main = collections.setdefault("main", FakeCollection("main"))
+    deduplicator = _deduplicator(collections)
+
+    ids = ["dynamic::1::chunk::0", "dynamic::2::chunk::0", "dynamic::3::chunk::0"]
+    keep, duplicates = deduplicator.filter_chunks(main, ids, [NOTICE, EDITED_NOTICE, OTHER], [{"source": "x"}] * 3)
+    assert keep == [0, 2], "同一批次中靠后的近重复文本块也要被跳过"
+    assert duplicates[0]["canonical_id"] == ids[0]
+
+    main.upsert([ids[0], ids[2]], None, [NOTICE, OTHER], [{"source": "x"}] * 2)
+    deduplicator.record_stored([main], [ids[0], ids[2]], duplicates)
+    linked = collections[duplicates_collection_name("main")].records
+    assert linked[ids[1]][1]["canonical_id"] == ids[0]
+    assert deduplicator.stats()["duplicates"] == 1
+
+
+def test_duplicate_is_promoted_when_canonical_is_deleted():
+    collections = {}
+    main = collections.setdefault("main", FakeCollection("main"))
+    deduplicator = _deduplicator(collections)
+    ids = ["static::a.pdf_chunk_0", "static::b.pdf_chunk_0"]
+    keep, duplicates = deduplicator.filter_chunks(main, ids, [NOTICE, NOTICE], [{"page": 0}, {"page": 1}])
+    main.upsert([ids[0]], None, [NOTICE], [{"page": 0}])
+    deduplicator.record_stored([main], [ids[0]], duplicates)
+
+    main.delete([ids[0]])
+    deduplicator.remove([main], [ids[0]])
+
+    assert main.records[ids[1]] == (NOTICE, {"page": 1}), "规范文本块删除后，重复文本块应以原 metadata 写回"
+    assert not collections[duplicates_collection_name("main")].records
@@ -0,0 +1,78 @@
+# 批量混合检索 (search_candidates_batch) 的单元测试：向量检索用内存向量库，关键词检索用固定结果的替身
+
+import pytest
+
+pytest.importorskip("redis")
+pytest.importorskip("mcp")
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("langchain_community")
+
+from app.configs.config import settings
+from app.rag.collection_alias import CollectionAliasResolver
+from app.rag.mcp_rag_service import KnowledgeRetrieverMCP
+from app.rag.vector_store import InMemoryVectorStore
+
+
+class StubKeywordSearch:
+    """按问题返回固定的关键词命中，记录每次调用的参数"""
+
+    def __init__(self, hits):
+        self.hits = hits
+        self.calls = []
+
+    def search(self, query, k=10, where=None, where_document=None):
+        self.calls.append((query, k, where))
+        return [(chunk_id, 1.0) for chunk_id in self.hits.get(query, [])][:k]
+
+
+@pytest.fixture
+def retriever(monkeypatch):
+    monkeypatch.setattr(settings, "HYBRID_CANDIDATES", 2)
+    monkeypatch.setattr(settings, "RRF_K", 60)
+    store = InMemoryVectorStore()
+    resolver = CollectionAliasResolver(store, "rag", refresh_interval_s=0)
+    resolver.active_collection().upsert(
+        ids=["a", "b", "c", "k", "x"],
+        embeddings=[[1.0, 0.0], [0.0, 1.0], [0.6, 0.8], [-1.0, 0.0], [0.0, -1.0]],
+        documents=["篮球社招新", "摄影社招新", "篮球和摄影", "活动室301", "已下线的公告"],
+        metadatas=[{"source_type": "event"}] * 4 + [{"source_type": "archive"}]
+    )
+    # 不加载嵌入模型，只设置 search_candidates_batch 用到的属性
+    instance = KnowledgeRetrieverMCP.__new__(KnowledgeRetrieverMCP)
+    instance.collection_resolver = resolver
+    instance.keyword_search = StubKeywordSearch({"活动室301在哪": ["k"], "摄影社": ["b", "x"]})
+    return instance
+
+
+def ids(candidates):
+    return [candidate["id"] for candidate in candidates]
+
+
+def test_batch_keeps_per_query_ordering(retriever):
+    results = retriever.search_candidates_batch(["活动室301在哪", "摄影社"], [[1.0, 0.0], [0.0, 1.0]], n_results=3)
+
+    # 第一个问题: 向量 [a, c]，关键词 [k]，a 与 k 同分按ID排序
+    assert ids(results[0]) == ["a", "k", "c"]
+    # 第二个问题: 向量 [b, c]，关键词 [b, x]，b 两路都排第一
+    assert ids(results[1]) == ["b", "c", "x"]
+    assert results[1][0]["rrf_score"] == pytest.approx(2 / 61)
+
+
+def test_keyword_only_hit_reaches_only_its_query(retriever):
+    results = retriever.search_candidates_batch(["活动室301在哪", "摄影社"], [[1.0, 0.0], [0.0, 1.0]], n_results=3)
+
+    assert "k" in ids(results[0]) and "k" not in ids(results[1])
+    assert "x" in ids(results[1]) and "x" not in ids(results[0])
+    keyword_only = next(candidate for candidate in results[0] if candidate["id"] == "k")
+    # 只由关键词命中的文本块按与本问题向量的距离计算相似度: 1 - |(-1, 0) - (1, 0)|^2
+    assert keyword_only["similarity"] == pytest.approx(-3.0)
+    assert keyword_only["content"] == "活动室301"
+
+
+def test_batch_applies_filters_to_keyword_hits(retriever):
+    where = {"source_type": "event"}
+    results = retriever.search_candidates_batch(["活动室301在哪", "摄影社"], [[1.0, 0.0], [0.0, 1.0]], n_results=3,
+                                                where=where)
+
+    assert "x" not in ids(results[1]), "关键词命中的文本块也要满足过滤条件"
+    assert all(call[2] == where for call in retriever.keyword_search.calls)
@@ -0,0 +1,74 @@
+# 静态文档导入清单的单元测试，不依赖 ChromaDB 和嵌入模型
+
+import os
+
+from app.rag.ingest_manifest import load_manifest, missing_from_collection, save_manifest, plan_incremental_ingest
+
+
+def _write(path, content: bytes):
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def test_plan_incremental_ingest(tmp_path):
+    """新文件和变化的文件需要导入，未变化的文件跳过，目录中消失的文件需要清除"""
+    pdf_dir = str(tmp_path)
+    _write(os.path.join(pdf_dir, "a.pdf"), b"aaa")
+    _write(os.path.join(pdf_dir, "b.pdf"), b"bbb")
+    _write(os.path.join(pdf_dir, "notes.txt"), b"ignored")
+
+    to_ingest, unchanged, deleted, fingerprints = plan_incremental_ingest(pdf_dir, {})
+    assert to_ingest == ["a.pdf", "b.pdf"], "首次运行时所有 PDF 都需要导入"
+
+    manifest = {name: dict(fp, chunk_ids=[f"static::{name}_chunk_0"]) for name, fp in fingerprints.items()}
+    manifest["gone.pdf"] = dict(fingerprints["a.pdf"], chunk_ids=["static::gone.pdf_chunk_0"])
+    manifest_path = os.path.join(pdf_dir, ".ingest_manifest.json")
+    save_manifest(manifest_path, manifest)
+    manifest = load_manifest(manifest_path)
+
+    _write(os.path.join(pdf_dir, "b.pdf"), b"bbbb")
+    to_ingest, unchanged, deleted, _ = plan_incremental_ingest(pdf_dir, manifest)
+    assert to_ingest == ["b.pdf"]
+    assert unchanged == ["a.pdf"]
+    assert deleted == ["gone.pdf"]
+
+    to_ingest, _, _, _ = plan_incremental_ingest(pdf_dir, manifest, force=True)
+    assert to_ingest == ["a.pdf", "b.pdf"], "force 时忽略清单"
+
+
+def test_touched_file_with_same_content_is_unchanged(tmp_path):
+    """只修改了 mtime、内容不变的文件不需要重新导入"""
+    pdf_dir = str(tmp_path)
+    path = os.path.join(pdf_dir, "a.pdf")
+    _write(path, b"aaa")
+    _, _, _, fingerprints = plan_incremental_ingest(pdf_dir, {})
+    manifest = {"a.pdf": dict(fingerprints["a.pdf"], chunk_ids=[])}
+
+    os.utime(path, (1, 1))
+    to_ingest, unchanged, _, fingerprints = plan_incremental_ingest(pdf_dir, manifest)
+    assert to_ingest == []
+    assert unchanged == ["a.pdf"]
+    assert fingerprints["a.pdf"]["mtime"] == 1
+
+
+def test_manifest_is_ignored_for_another_target(tmp_path):
+    """换了向量库后端或集合时，清单作废，相当于全量导入"""
+    manifest_path = os.path.join(str(tmp_path), ".ingest_manifest.json")
+    save_manifest(manifest_path, {"a.pdf": {"chunk_ids": ["static::a.pdf_chunk_0"]}}, target="chroma_http:h:8030/rag")
+
+    assert load_manifest(manifest_path, "chroma_http:h:8030/rag") == {"a.pdf": {"chunk_ids": ["static::a.pdf_chunk_0"]}}
+    assert load_manifest(manifest_path, "chroma_persistent:/data/rag") == {}
+
+
+def test_files_with_chunks_missing_from_collection():
+    """清单认为未变化、但文本块已不在集合中 (集合被清空) 的文件需要重新导入"""
+    manifest = {"a.pdf": {"chunk_ids": ["a0", "a1"]}, "b.pdf": {"chunk_ids": ["b0"]}, "empty.pdf": {"chunk_ids": []}}
+    stored = {"a0", "a1"}
+    queries = []
+
+    def existing_ids(ids):
+        queries.append(ids)
+        return [chunk_id for chunk_id in ids if chunk_id in stored]
+
+    assert missing_from_collection(["a.pdf", "b.pdf", "empty.pdf"], manifest, existing_ids, page_size=2) == ["b.pdf"]
+    assert queries == [["a0", "a1"], ["b0"]]
@@ -0,0 +1,172 @@
+# BM25 关键词索引的单元测试：分词、增删改、剪枝后的 top-k 与暴力计算一致、RRF 融合
+
+import math
+import random
+from collections import Counter
+
+import pytest
+
+from app.rag import keyword_index
+from app.rag.keyword_index import KeywordIndex, bigram_tokenize, reciprocal_rank_fusion
+from app.rag.vector_store import InMemoryCollection
+
+
+def test_bigram_tokenize():
+    assert bigram_tokenize("活动室301开会") == ["活动", "动室", "301", "开会"]
+    assert bigram_tokenize("篮 球社 Python-3.11") == ["篮", "球社", "python-3.11"]
+    assert bigram_tokenize("，。！") == []
+
+
+def test_upsert_replaces_and_remove_deletes():
+    index = KeywordIndex()
+    index.upsert(["a", "b"], ["篮球社招新", "摄影社招新"])
+    assert [chunk_id for chunk_id, _ in index.search("篮球")] == ["a"]
+
+    index.upsert(["a"], ["围棋社活动"])
+    assert index.search("篮球") == []
+    assert [chunk_id for chunk_id, _ in index.search("围棋")] == ["a"]
+    assert len(index) == 2
+
+    index.remove(["b", "missing"])
+    assert index.search("摄影") == []
+    assert len(index) == 1
+
+
+def brute_force_bm25(docs, query, k1=1.2, b=0.75):
+    tokenized = {chunk_id: Counter(bigram_tokenize(text)) for chunk_id, text in docs.items()}
+    n = len(tokenized)
+    avgdl = sum(sum(c.values()) for c in tokenized.values()) / n
+    scores = {}
+    for term, qtf in Counter(bigram_tokenize(query)).items():
+        df = sum(1 for c in tokenized.values() if term in c)
+        if not df:
+            continue
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        for chunk_id, counts in tokenized.items():
+            tf = counts.get(term, 0)
+            if tf:
+                dl = sum(counts.values())
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + qtf * idf * tf * (k1 + 1) / (
+                    tf + k1 * (1 - b + b * dl / avgdl))
+    return scores
+
+
+@pytest.mark.parametrize("block", [128, 4])
+def test_search_matches_brute_force_after_updates_and_compaction(monkeypatch, block):
+    # block=4 时几乎所有倒排表都按块剪枝
+    monkeypatch.setattr(keyword_index, "_BLOCK", block)
+    rng = random.Random(7)
+    vocabulary = "篮球摄影围棋社团招新活动报名教室周末比赛讲座志愿者部门例会"
+    index = KeywordIndex(compact_ratio=0.1)
+    docs = {}
+    for round_ in range(3):
+        ids = [f"dynamic::doc{rng.randrange(3000)}::chunk::0" for _ in range(2000)]
+        texts = ["".join(rng.choice(vocabulary) for _ in range(rng.randint(5, 40))) for _ in ids]
+        index.upsert(ids, texts)
+        docs.update(zip(ids, texts))
+        removed = rng.sample(sorted(docs), 200)
+        index.remove(removed)
+        for chunk_id in removed:
+            docs.pop(chunk_id)
+        if round_ == 1:
+            index.compact()
+    # 压缩之前失效序号仍计入文档频率，压缩后分数与暴力计算完全一致
+    index.compact()
+
+    for query in ["篮球比赛", "社团招新报名", "志愿者", "周末例会讲座在教室", "球"]:
+        expected = brute_force_bm25(docs, query)
+        for k in (1, 10, 50):
+            result = index.search(query, k=k)
+            top = sorted(expected.values(), reverse=True)[:k]
+            assert [score for _, score in result] == pytest.approx(top, rel=1e-4)
+            for chunk_id, score in result:
+                assert expected[chunk_id] == pytest.approx(score, rel=1e-4)
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]], k=60)
+    assert [chunk_id for chunk_id, _ in fused] == ["a", "c", "b"]
+    assert fused[0][1] == pytest.approx(1 / 61 + 1 / 62)
+
+
+def filtered_index():
+    index = KeywordIndex(filter_fields=["source_type"], range_fields=["created_at_ts"], compact_ratio=0.1)
+    # 篮球相关的文本块大多是 event，只有分数较低的几个是 announcement
+    ids = [f"e{i}" for i in range(50)] + ["a0", "a1", "a2", "n0"]
+    texts = ["篮球篮球社比赛"] * 50 + ["篮球场维修通知，周末关闭"] * 3 + ["篮球"]
+    metadatas = ([{"source_type": "event", "created_at_ts": 100 + i} for i in range(50)]
+                 + [{"source_type": "announcement", "created_at_ts": ts} for ts in (10, 200, 300)] + [{}])
+    index.upsert(ids, texts, metadatas)
+    return index
+
+
+def test_search_applies_filters_before_top_k():
+    index = filtered_index()
+    assert len(index.search("篮球", k=3)) == 3
+    assert not {chunk_id for chunk_id, _ in index.search("篮球", k=3)} & {"a0", "a1", "a2"}
+
+    # 过滤在选 top-k 之前进行: 分数较低的 announcement 仍能取满 k 个
+    result = index.search("篮球", k=3, where={"source_type": "announcement"})
+    assert sorted(chunk_id for chunk_id, _ in result) == ["a0", "a1", "a2"]
+    where = {"$and": [{"source_type": {"$in": ["announcement"]}}, {"created_at_ts": {"$gte": 150}}]}
+    assert sorted(chunk_id for chunk_id, _ in index.search("篮球", k=5, where=where)) == ["a1", "a2"]
+    where = {"$or": [{"created_at_ts": {"$lt": 101}}, {"source_type": "missing"}]}
+    assert sorted(chunk_id for chunk_id, _ in index.search("篮球", k=5, where=where)) == ["a0", "e0"]
+    # 字段缺失的文本块不满足 $ne / $nin
+    assert "n0" not in {chunk_id for chunk_id, _ in index.search("篮球", k=60, where={"source_type": {"$ne": "event"}})}
+
+
+def test_filter_fields_follow_updates_and_compaction():
+    index = filtered_index()
+    index.upsert(["a0"], ["篮球场维修通知"], [{"source_type": "event", "created_at_ts": 5}])
+    index.remove([f"e{i}" for i in range(1, 50)])
+    index.compact()
+    result = index.search("篮球", k=10, where={"source_type": "event"})
+    assert sorted(chunk_id for chunk_id, _ in result) == ["a0", "e0"]
+    assert index.filter_mask({"created_at_ts": {"$lte": 10}}).tolist() == [False, False, False, False, True]
+
+
+def test_unsupported_filters_raise():
+    index = filtered_index()
+    with pytest.raises(keyword_index.UnsupportedFilterError):
+        index.search("篮球", where={"department": "tech"})
+    with pytest.raises(keyword_index.UnsupportedFilterError):
+        index.search("篮球", where={"source_type": {"$gt": "a"}})
+
+
+def test_keyword_search_overfetches_when_index_cannot_filter():
+    search = keyword_index.KeywordSearch(lambda: None, None, "stream", overfetch=4)
+    search.start = lambda: None
+    search.index = filtered_index()
+
+    assert len(search.search("篮球", k=2, where={"source_type": "announcement"})) == 2
+    assert len(search.search("篮球", k=2, where={"department": "tech"})) == 8
+    assert len(search.search("篮球", k=2, where_document={"$contains": "维修"})) == 8
+
+
+class RecordingRedis:
+    def __init__(self):
+        self.entries = []
+
+    def xadd(self, stream, fields, maxlen=None, approximate=False):
+        self.entries.append(fields)
+
+
+def test_stream_carries_ids_and_reader_loads_text_from_collection():
+    collection = InMemoryCollection("rag")
+    collection.upsert(ids=["c1", "c2"], embeddings=[[0.0], [1.0]], documents=["篮球社招新", "摄影社招新"],
+                      metadatas=[{"source_type": "event"}, {"source_type": "announcement"}])
+    r = RecordingRedis()
+    keyword_index.publish_keyword_updates(r, "stream", ids=["c1", "c2", "gone"], deleted_ids=["old"])
+
+    assert [sorted(fields) for fields in r.entries] == [["ids", "op"], ["ids", "op"]]
+
+    search = keyword_index.KeywordSearch(lambda: collection, None, "stream", filter_fields=["source_type"])
+    search.start = lambda: None
+    search.index = KeywordIndex(filter_fields=["source_type"])
+    search.index.upsert(["gone", "old"], ["篮球旧文", "篮球旧文"])
+    for fields in r.entries:
+        search.apply(fields)
+
+    assert [chunk_id for chunk_id, _ in search.search("篮球", k=5)] == ["c1"]
+    assert search.search("招新", k=5, where={"source_type": "announcement"})[0][0] == "c2"
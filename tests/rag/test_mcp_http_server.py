@@ -0,0 +1,74 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+from mcp import ClientSession
+from mcp.client.streamable_http import streamablehttp_client
+from app.utils.singleton import logger
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+N_CLIENTS = 8
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 180):
+    """等待服务加载完模型并开始监听"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"MCP HTTP 服务提前退出，返回码 {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.5)
+    raise TimeoutError("等待 MCP HTTP 服务启动超时")
+
+
+async def run_client(url: str, client_id: int):
+    async with streamablehttp_client(url) as (read, write, _):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            tools = (await session.list_tools()).tools
+            assert {"retrieve", "retrieve_batch"} <= {tool.name for tool in tools}
+
+            result = await session.call_tool(name="retrieve", arguments={"query": "如何加入一个社团", "n_results": 3})
+            response_data = json.loads(result.content[0].text)
+            assert "error" not in response_data
+            logger.debug(f"客户端 {client_id} 检索成功")
+            return response_data
+
+
+@pytest.mark.asyncio
+async def test_http_server_serves_many_clients():
+    """
+    集成测试：启动一个 --transport http 的服务进程，N 个客户端并发连接、列出工具并检索，
+    所有会话由同一个进程处理 (模型只加载一次)
+    """
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "app.rag.mcp_rag_service", "--transport", "http", "--port", str(port)],
+        cwd=PROJECT_ROOT,
+    )
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, wait_for_port, port, process)
+        url = f"http://127.0.0.1:{port}/mcp"
+
+        results = await asyncio.gather(*(run_client(url, i) for i in range(N_CLIENTS)))
+        assert len(results) == N_CLIENTS
+        # 相同的问题在同一个进程中应得到相同的结果
+        assert all(result == results[0] for result in results)
+        assert process.poll() is None, "服务进程应在所有客户端断开后继续运行"
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
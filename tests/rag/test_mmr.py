@@ -0,0 +1,27 @@
+# MMR 多样化选择的单元测试：跳过几乎相同的候选、lambda=1 时退化为按相似度排序
+
+import numpy as np
+
+from app.rag.mmr import mmr_select
+
+
+def test_near_duplicates_are_skipped():
+    query = [1.0, 0.0, 0.0]
+    # 0 和 1 几乎相同且都与问题最相关，2 相关性略低但方向不同
+    embeddings = [[0.9, 0.1, 0.0], [0.9, 0.11, 0.0], [0.7, 0.0, 0.7], [0.0, 1.0, 0.0]]
+    assert mmr_select(query, embeddings, 2, lambda_mult=0.5) == [0, 2]
+
+
+def test_lambda_one_matches_similarity_order():
+    rng = np.random.default_rng(3)
+    query = rng.normal(size=16)
+    embeddings = rng.normal(size=(40, 16))
+    normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    expected = np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:10].tolist()
+    assert mmr_select(query, embeddings, 10, lambda_mult=1.0) == expected
+
+
+def test_k_larger_than_candidates():
+    selected = mmr_select([1.0, 0.0], [[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]], 10)
+    assert sorted(selected) == [0, 1, 2]
+    assert mmr_select([1.0, 0.0], [], 3) == []
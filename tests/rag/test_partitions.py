@@ -0,0 +1,123 @@
+# 时间分区的单元测试：按 metadata 路由到分区、更新后换分区、保留期判断
+
+from datetime import datetime, timezone
+
+import numpy as np
+
+from app.rag.metadata_fields import parse_timestamp
+from app.rag.partitions import (MAX_COLLECTION_NAME_CHARS, TimePartitioner, list_partitions, parse_partition,
+                                 partition_collection_name)
+from app.rag.sharding import create_collection_resolver
+from app.rag.vector_store import InMemoryCollection, InMemoryVectorStore
+
+NOW = datetime(2025, 7, 15, tzinfo=timezone.utc)
+
+
+def _resolver(store):
+    partitioner = TimePartitioner(retention_months={"reminder": 3})
+    return create_collection_resolver(store, "rag", "time", refresh_interval_s=0, partitioner=partitioner)
+
+
+def test_parse_timestamp_formats():
+    expected = datetime(2025, 7, 5, 12, 30, tzinfo=timezone.utc)
+    assert parse_timestamp("2025-07-05T12:30:00Z") == expected
+    assert parse_timestamp(expected.timestamp()) == expected
+    assert parse_timestamp(int(expected.timestamp() * 1000)) == expected
+    assert parse_timestamp(str(int(expected.timestamp()))) == expected
+    assert parse_timestamp("下周五") is None
+
+
+def test_retention_by_source_type():
+    partitioner = TimePartitioner(retention_months={"reminder": 3, "event": 12})
+    assert partitioner.is_expired("reminder", "202503", NOW)
+    assert not partitioner.is_expired("reminder", "202504", NOW)
+    assert not partitioner.is_expired("event", "202503", NOW)
+    # 未配置保留期的 source_type 永久保留
+    assert not partitioner.is_expired("member_profile", "201901", NOW)
+
+
+def test_upsert_routes_to_partitions_and_moves_on_update():
+    store = InMemoryVectorStore()
+    resolver = _resolver(store)
+    collection = resolver.write_collections()[0]
+    collection.upsert(
+        ids=["static::a.pdf::0", "dynamic::e1::chunk::0", "dynamic::r1::chunk::0"],
+        embeddings=[[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]],
+        metadatas=[{"source": "a.pdf"},
+                   {"source_type": "event", "created_at": "2025-07-05T12:30:00Z"},
+                   {"source_type": "reminder", "created_at": "2025-03-01T08:00:00Z"}]
+    )
+    assert set(list_partitions(store, "rag__dynamic")) == {"rag__dynamic__p__event__202507",
+                                                           "rag__dynamic__p__reminder__202503"}
+    assert store.get_collection("rag__static").count() == 1
+
+    collection.upsert(ids=["dynamic::e1::chunk::0"], embeddings=[[0.0, 1.0]],
+                      metadatas=[{"source_type": "event", "created_at": "2025-06-30T00:00:00Z"}])
+    assert store.get_collection("rag__dynamic__p__event__202507").count() == 0
+    assert store.get_collection("rag__dynamic__p__event__202506").get()["ids"] == ["dynamic::e1::chunk::0"]
+    assert collection.count() == 3
+
+
+def test_partitioned_query_matches_single_collection():
+    store = InMemoryVectorStore()
+    collection = _resolver(store).active_collection()
+    single = InMemoryCollection("single")
+    rng = np.random.default_rng(0)
+    ids = [f"dynamic::doc{i}::chunk::0" for i in range(40)]
+    vectors = rng.normal(size=(40, 8)).tolist()
+    metadatas = [{"source_type": ["event", "reminder"][i % 2], "created_at": f"2025-0{1 + i % 6}-01T00:00:00Z"}
+                 for i in range(40)]
+    for target in (collection, single):
+        target.upsert(ids=ids, embeddings=vectors, metadatas=metadatas)
+
+    query = rng.normal(size=(2, 8)).tolist()
+    assert collection.query(query_embeddings=query, n_results=5)["ids"] == \
+        single.query(query_embeddings=query, n_results=5)["ids"]
+
+    store.delete_collection(name="rag__dynamic__p__event__202501")
+    collection.shards["dynamic"][0].invalidate()
+    dropped = sum(1 for m in metadatas if m["source_type"] == "event" and m["created_at"].startswith("2025-01"))
+    assert collection.count() == 40 - dropped
+
+
+def test_long_source_type_fits_collection_name_limit():
+    partitioner = TimePartitioner()
+    source_type, month = partitioner.partition_for({"source_type": "club_announcement_weekly_digest",
+                                                    "created_at": "2026-10-01T00:00:00Z"})
+    name = partition_collection_name("club_management_rag__dynamic__v1", source_type, month)
+
+    assert len(name) <= MAX_COLLECTION_NAME_CHARS
+    assert parse_partition("club_management_rag__dynamic__v1", name) == (source_type, "202610")
+    # 同一个 source_type 总是映射到同一个分区，前缀相同的不同 source_type 不会合并
+    assert source_type == partitioner.source_type({"source_type": "club_announcement_weekly_digest"})
+    assert source_type != partitioner.source_type({"source_type": "club_announcement_weekly_summary"})
+    assert partitioner.may_match(source_type, month, {"source_type": "club_announcement_weekly_digest"})
+
+
+class CountingCollection(InMemoryCollection):
+    def __init__(self, name):
+        super().__init__(name)
+        self.deletes = 0
+
+    def delete(self, ids=None, where=None):
+        self.deletes += 1
+        super().delete(ids=ids, where=where)
+
+
+def test_upsert_deletes_only_from_partitions_holding_a_stale_copy():
+    store = InMemoryVectorStore()
+    store.get_or_create_collection = lambda name: store._collections.setdefault(name, CountingCollection(name))
+    collection = _resolver(store).write_collections()[0]
+    months = ["2025-01", "2025-02", "2025-03"]
+    collection.upsert(ids=[f"dynamic::e{i}::chunk::0" for i in range(3)], embeddings=[[1.0, 0.0]] * 3,
+                      metadatas=[{"source_type": "event", "created_at": f"{m}-05T00:00:00Z"} for m in months])
+
+    collection.upsert(ids=["dynamic::new::chunk::0"], embeddings=[[0.0, 1.0]],
+                      metadatas=[{"source_type": "event", "created_at": "2025-03-06T00:00:00Z"}])
+    assert sum(store.get_collection(name).deletes for name in list_partitions(store, "rag__dynamic")) == 0
+
+    collection.upsert(ids=["dynamic::e0::chunk::0"], embeddings=[[1.0, 0.0]],
+                      metadatas=[{"source_type": "event", "created_at": "2025-03-05T00:00:00Z"}])
+    assert store.get_collection("rag__dynamic__p__event__202501").deletes == 1
+    assert store.get_collection("rag__dynamic__p__event__202502").deletes == 0
+    assert collection.count() == 4
@@ -0,0 +1,80 @@
+# 交叉编码器重排的单元测试：打分排序、按延迟预算截断或跳过、并发上限
+
+import threading
+
+from app.rag.reranker import CrossEncoderReranker
+
+
+class FakeCrossEncoder:
+    """按文本长度打分，每对耗时 cost_ms (推进假时钟)"""
+
+    def __init__(self, clock, cost_ms=1.0):
+        self.clock = clock
+        self.cost_ms = cost_ms
+        self.calls = []
+
+    def predict(self, pairs, batch_size=32):
+        self.calls.append(len(pairs))
+        self.clock.now += len(pairs) * self.cost_ms / 1000
+        return [float(len(document)) for _, document in pairs]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_reranker(budget_ms, cost_ms=1.0, max_concurrency=2):
+    clock = FakeClock()
+    model = FakeCrossEncoder(clock, cost_ms)
+    return CrossEncoderReranker("unused", budget_ms=budget_ms, max_concurrency=max_concurrency,
+                                model=model, clock=clock, smoothing=1.0), model
+
+
+def test_rerank_keeps_top_k_by_score():
+    reranker, model = make_reranker(budget_ms=0)
+    documents = ["a", "aaaa", "aa", "aaa"]
+    assert reranker.rerank("q", documents, 2) == [(1, 4.0), (3, 3.0)]
+    assert model.calls == [4]
+    assert reranker.rerank("q", ["only"], 1) is None
+
+
+def test_budget_truncates_then_skips():
+    reranker, model = make_reranker(budget_ms=10, cost_ms=1.0)
+    documents = ["x" * i for i in range(20)]
+    # 第一次没有耗时数据，全部打分；之后预算只够 10 对，只给排名靠前的 10 个候选打分
+    assert len(reranker.rerank("q", documents, 5)) == 5
+    assert [i for i, _ in reranker.rerank("q", documents, 5)] == [9, 8, 7, 6, 5]
+    assert model.calls == [20, 10]
+
+    # 单对耗时变高，预算放不下 k 个候选时跳过重排，估计值逐渐回落后重新尝试
+    model.cost_ms = 4.0
+    reranker.rerank("q", documents, 5)
+    assert reranker.rerank("q", documents, 5) is None
+    results = [reranker.rerank("q", documents, 5) for _ in range(10)]
+    assert any(result is not None for result in results)
+    assert reranker.stats()["truncated"] > 1
+    assert 1 < reranker.stats()["skipped_budget"] < 11
+
+
+def test_concurrency_limit_skips():
+    reranker, _ = make_reranker(budget_ms=0, max_concurrency=1)
+    entered, release = threading.Event(), threading.Event()
+    original = reranker._model.predict
+
+    def blocking_predict(pairs, batch_size=32):
+        entered.set()
+        release.wait(5)
+        return original(pairs, batch_size)
+
+    reranker._model.predict = blocking_predict
+    worker = threading.Thread(target=reranker.rerank, args=("q", ["a", "bb"], 1))
+    worker.start()
+    entered.wait(5)
+    assert reranker.rerank("q", ["a", "bb"], 1) is None
+    release.set()
+    worker.join()
+    assert reranker.stats()["skipped_load"] == 1
@@ -0,0 +1,70 @@
+# 检索过滤条件的单元测试：参数组合、校验、同步时的 metadata 规范化，以及按条件跳过时间分区
+
+from datetime import datetime, timezone
+
+import pytest
+
+from app.rag.metadata_fields import normalize_metadata
+from app.rag.partitions import TimePartitioner
+from app.rag.retrieval_filters import build_filters, filters_from_arguments
+from app.rag.sharding import create_collection_resolver
+from app.rag.vector_store import InMemoryVectorStore
+
+NOW = datetime(2025, 7, 15, tzinfo=timezone.utc)
+
+
+def test_normalize_metadata_adds_numeric_timestamp():
+    metadata = normalize_metadata({"source_type": " Event ", "created_at": "2025-07-05T12:30:00Z"}, ["created_at"])
+    assert metadata == {"source_type": "event", "created_at": "2025-07-05T12:30:00Z",
+                        "created_at_ts": int(datetime(2025, 7, 5, 12, 30, tzinfo=timezone.utc).timestamp())}
+    assert "created_at_ts" not in normalize_metadata({"created_at": "unknown"}, ["created_at"])
+
+
+def test_build_filters_combines_conditions():
+    where, where_document = build_filters(source_type=["Event", "announcement"], metadata={"department": "tech_dept"},
+                                          since_days=30, where_document={"$contains": "报名"}, now=NOW)
+    assert where == {"$and": [
+        {"source_type": {"$in": ["event", "announcement"]}},
+        {"department": {"$eq": "tech_dept"}},
+        {"created_at_ts": {"$gte": int(datetime(2025, 6, 15, tzinfo=timezone.utc).timestamp())}},
+    ]}
+    assert where_document == {"$contains": "报名"}
+    assert build_filters() == (None, None)
+    assert build_filters(source_type="event") == ({"source_type": {"$eq": "event"}}, None)
+
+
+@pytest.mark.parametrize("arguments", [
+    {"where": {"department": {"$regex": "tech"}}},
+    {"where": {"a": 1, "b": 2}},
+    {"where_document": {"$contains": ""}},
+    {"created_after": "下周五"},
+    {"since_days": -1},
+    {"metadata_filter": {"tags": ["python"]}},
+])
+def test_invalid_filters_are_rejected(arguments):
+    with pytest.raises(ValueError):
+        filters_from_arguments(arguments)
+
+
+def test_filtered_query_prunes_partitions():
+    store = InMemoryVectorStore()
+    partitioner = TimePartitioner()
+    resolver = create_collection_resolver(store, "rag", "time", refresh_interval_s=0, partitioner=partitioner)
+    collection = resolver.write_collections()[0]
+    rows = [("event", "2025-05-10T00:00:00Z"), ("event", "2025-07-01T00:00:00Z"), ("reminder", "2025-07-02T00:00:00Z")]
+    collection.upsert(
+        ids=[f"dynamic::doc{i}::chunk::0" for i in range(len(rows))],
+        embeddings=[[1.0, float(i)] for i in range(len(rows))],
+        metadatas=[normalize_metadata({"source_type": t, "created_at": c}, ["created_at"]) for t, c in rows]
+    )
+
+    where, _ = build_filters(source_type="event", created_after="2025-06-01T00:00:00Z")
+    dynamic = collection.shards["dynamic"][0]
+    assert sorted(dynamic._targets(where)) == ["rag__dynamic__p__event__202507"]
+    result = collection.query(query_embeddings=[[1.0, 0.0]], n_results=3, where=where)
+    assert result["ids"] == [["dynamic::doc1::chunk::0"]]
+
+    # $or 中的条件不能用来跳过分区
+    where = {"$or": [{"source_type": "reminder"}, {"source_type": "event"}]}
+    assert len(dynamic._targets(where)) == 3
+    assert len(collection.query(query_embeddings=[[1.0, 0.0]], n_results=3, where=where)["ids"][0]) == 3
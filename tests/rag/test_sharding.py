@@ -0,0 +1,124 @@
+# 分片集合的单元测试：路由、并行查询合并后的结果需要与单个集合完全一致
+
+import numpy as np
+
+from app.rag.collection_alias import write_alias
+from app.rag.sharding import ShardedCollectionResolver
+from app.rag.vector_store import InMemoryCollection, InMemoryVectorStore
+
+
+def _rows(n=60, dim=8, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = [f"{'static' if i % 3 == 0 else 'dynamic'}::doc{i}::{i}" for i in range(n)]
+    vectors = rng.normal(size=(n, dim)).astype(np.float32).tolist()
+    documents = [f"文档 {i}" for i in range(n)]
+    metadatas = [{"index": i} for i in range(n)]
+    return ids, vectors, documents, metadatas
+
+
+def _populated():
+    store = InMemoryVectorStore()
+    resolver = ShardedCollectionResolver(store, "rag", refresh_interval_s=0)
+    single = InMemoryCollection("single")
+    ids, vectors, documents, metadatas = _rows()
+    for collection in resolver.write_collections() + [single]:
+        collection.upsert(ids=ids, embeddings=vectors, documents=documents, metadatas=metadatas)
+    return store, resolver, single
+
+
+def test_upsert_routes_by_id_prefix():
+    store, resolver, _ = _populated()
+    static_ids = store.get_collection("rag__static").get()["ids"]
+    dynamic_ids = store.get_collection("rag__dynamic").get()["ids"]
+    assert len(static_ids) == 20 and all(i.startswith("static::") for i in static_ids)
+    assert len(dynamic_ids) == 40 and all(i.startswith("dynamic::") for i in dynamic_ids)
+    assert resolver.active_collection().count() == 60
+
+
+def test_fan_out_query_matches_single_collection():
+    _, resolver, single = _populated()
+    query = np.random.default_rng(1).normal(size=(3, 8)).astype(np.float32).tolist()
+
+    expected = single.query(query_embeddings=query, n_results=7)
+    result = resolver.active_collection().query(query_embeddings=query, n_results=7)
+
+    assert result["ids"] == expected["ids"]
+    assert result["documents"] == expected["documents"]
+    np.testing.assert_allclose(result["distances"], expected["distances"], rtol=1e-5)
+    assert all(stats["queries"] == 1 for stats in resolver.shard_stats().values())
+
+
+def test_get_and_delete_by_ids_keep_order():
+    _, resolver, _ = _populated()
+    collection = resolver.active_collection()
+    ids = ["dynamic::doc1::1", "static::doc0::0", "dynamic::doc2::2"]
+    assert collection.get(ids=ids)["ids"] == ids
+
+    collection.delete(ids=ids[:2])
+    assert collection.get(ids=ids)["ids"] == ids[2:]
+    assert collection.count() == 58
+
+
+def test_paging_across_shards_covers_every_chunk():
+    _, resolver, _ = _populated()
+    collection = resolver.active_collection()
+    seen = []
+    offset = 0
+    while True:
+        page = collection.get(limit=7, offset=offset, include=[])
+        if not page["ids"]:
+            break
+        seen.extend(page["ids"])
+        offset += len(page["ids"])
+    assert sorted(seen) == sorted(_rows()[0])
+
+
+def test_filtered_paging_fetches_one_page_per_shard():
+    _, resolver, _ = _populated()
+    collection = resolver.active_collection()
+    fetched = []
+    for shard_collection in (collections[0] for collections in collection.shards.values()):
+        original = shard_collection.get
+
+        def get(*args, original=original, **kwargs):
+            page = original(*args, **kwargs)
+            if kwargs.get("include") != []:
+                fetched.append(len(page["ids"]))
+            return page
+        shard_collection.get = get
+
+    where = {"index": {"$gte": 30}}
+    seen, offset = [], 0
+    while True:
+        page = collection.get(where=where, limit=4, offset=offset, include=["documents"])
+        if not page["ids"]:
+            break
+        assert len(page["documents"]) == len(page["ids"])
+        seen.extend(page["ids"])
+        offset += len(page["ids"])
+
+    assert sorted(seen) == sorted(chunk_id for chunk_id in _rows()[0] if int(chunk_id.rsplit("::", 1)[1]) >= 30)
+    assert max(fetched) <= 4, "带过滤条件分页时每个分片只取本页需要的行"
+
+
+def test_rebuilding_shard_receives_dual_writes():
+    store, resolver, _ = _populated()
+    write_alias(store, "rag__static", {"active": "rag__static", "building": "rag__static__v1"})
+    resolver.refresh()
+
+    resolver.write_collections()[0].upsert(ids=["static::new::0", "dynamic::new::0"], embeddings=[[0.0] * 8] * 2)
+
+    assert store.get_collection("rag__static__v1").get()["ids"] == ["static::new::0"]
+    assert "static::new::0" in store.get_collection("rag__static").get()["ids"]
+    assert "rag__dynamic__v1" not in store.list_collections()
+
+
+def test_active_name_changes_when_any_shard_switches():
+    store, resolver, _ = _populated()
+    before = resolver.active_name()
+    assert before == "rag__dynamic|rag__static"
+
+    write_alias(store, "rag__dynamic", {"active": "rag__dynamic__v1"})
+    resolver.refresh()
+
+    assert resolver.active_name() == "rag__dynamic__v1|rag__static"
@@ -0,0 +1,159 @@
+# Stream 裁剪位置计算的单元测试，用内存中的假 Redis 客户端代替真实 Redis
+
+import pytest
+
+pytest.importorskip("redis")
+
+from app.configs.config import settings
+from app.rag import stream_retention
+from app.rag.stream_retention import (StreamTrimScheduler, compute_policy_trim_id, compute_safe_trim_id,
+                                      parse_stream_id, trim_stream)
+
+STREAM = "rag_sync_stream"
+
+
+class FakeStreamRedis:
+    """只实现裁剪用到的几个 Stream 命令，groups 为 {组名: (最后投递 ID, 未确认消息 ID 列表)}"""
+
+    def __init__(self, entry_ids, groups):
+        self.entry_ids = list(entry_ids)
+        self.groups = groups
+        self.trim_calls = []
+
+    def xinfo_groups(self, name):
+        return [{"name": group, "pending": len(pending), "last-delivered-id": last_delivered}
+                for group, (last_delivered, pending) in self.groups.items()]
+
+    def xpending(self, name, group):
+        pending = self.groups[group][1]
+        return {"pending": len(pending), "min": min(pending, key=parse_stream_id),
+                "max": max(pending, key=parse_stream_id), "consumers": []}
+
+    def xrevrange(self, name, count=None):
+        newest = [(entry_id, {}) for entry_id in reversed(self.entry_ids)]
+        return newest[:count] if count else newest
+
+    def xtrim(self, name, minid, approximate=True):
+        self.trim_calls.append(minid)
+        kept = [entry_id for entry_id in self.entry_ids if parse_stream_id(entry_id) >= parse_stream_id(minid)]
+        trimmed = len(self.entry_ids) - len(kept)
+        self.entry_ids = kept
+        return trimmed
+
+    def memory_usage(self, name, samples=0):
+        return 100 * len(self.entry_ids)
+
+    def xlen(self, name):
+        return len(self.entry_ids)
+
+
+@pytest.fixture
+def no_policy(monkeypatch):
+    monkeypatch.setattr(settings, "REDIS_STREAM_RETENTION_MAXLEN", 0)
+    monkeypatch.setattr(settings, "REDIS_STREAM_RETENTION_MIN_AGE_S", 0)
+
+
+def ids(*seconds):
+    return [f"{second * 1000}-0" for second in seconds]
+
+
+def test_safe_trim_id_stops_at_lowest_pending_entry():
+    """有未确认消息时，裁剪位置是最小的未确认 ID，而不是更靠后的最后投递 ID"""
+    r = FakeStreamRedis(ids(1, 2, 3, 4, 5), {"workers": ("5000-0", ["2000-0", "4000-0"])})
+
+    assert compute_safe_trim_id(r, STREAM) == "2000-0"
+
+
+def test_safe_trim_id_follows_lagging_consumer_group():
+    """多个消费者组时取最落后的组，最后投递 ID 和未确认 ID 一起比较"""
+    r = FakeStreamRedis(ids(1, 2, 3, 4, 5), {
+        "workers": ("5000-0", ["4000-0"]),
+        "audit": ("2000-0", []),
+    })
+
+    assert compute_safe_trim_id(r, STREAM) == "2000-0"
+
+
+def test_safe_trim_id_without_groups_is_none(no_policy):
+    """没有消费者组时不能判断哪些消息已处理，不裁剪"""
+    r = FakeStreamRedis(ids(1, 2, 3), {})
+
+    assert compute_safe_trim_id(r, STREAM) is None
+    stats = trim_stream(r, STREAM)
+    assert stats["trim_id"] is None
+    assert r.trim_calls == []
+
+
+def test_group_that_has_read_nothing_blocks_trim(no_policy):
+    """刚创建、还没读过消息的组 (最后投递 ID 为 0-0) 不允许删除任何消息"""
+    r = FakeStreamRedis(ids(1, 2, 3), {"workers": ("3000-0", []), "new": ("0-0", [])})
+
+    stats = trim_stream(r, STREAM)
+    assert stats["trim_id"] == "0-0"
+    assert r.trim_calls == []
+    assert r.xlen(STREAM) == 3
+
+
+def test_trim_keeps_pending_entries(no_policy):
+    """裁剪后未确认的消息及其之后的消息都还在"""
+    r = FakeStreamRedis(ids(1, 2, 3, 4, 5), {"workers": ("5000-0", ["3000-0"])})
+
+    stats = trim_stream(r, STREAM)
+    assert stats["trim_id"] == "3000-0"
+    assert stats["trimmed"] == 2
+    assert r.entry_ids == ids(3, 4, 5)
+    assert stats["memory_before"] - stats["memory_after"] == 200
+
+
+def test_policy_maxlen_keeps_newest_entries(monkeypatch):
+    """MAXLEN 策略：保留最新的 N 条，消息不足 N 条时不裁剪"""
+    monkeypatch.setattr(settings, "REDIS_STREAM_RETENTION_MAXLEN", 2)
+    monkeypatch.setattr(settings, "REDIS_STREAM_RETENTION_MIN_AGE_S", 0)
+
+    assert compute_policy_trim_id(FakeStreamRedis(ids(1, 2, 3, 4), {}), STREAM, now_ms=10_000) == "3000-0"
+    assert compute_policy_trim_id(FakeStreamRedis(ids(1), {}), STREAM, now_ms=10_000) == "0-0"
+
+
+def test_policy_min_age_keeps_recent_entries(monkeypatch):
+    """最小保留时间策略：最近 N 秒内的消息不裁剪，与 MAXLEN 同时配置时取更早 (更保守) 的位置"""
+    monkeypatch.setattr(settings, "REDIS_STREAM_RETENTION_MAXLEN", 0)
+    monkeypatch.setattr(settings, "REDIS_STREAM_RETENTION_MIN_AGE_S", 3)
+    r = FakeStreamRedis(ids(1, 2, 3, 4, 5), {})
+    assert compute_policy_trim_id(r, STREAM, now_ms=5_000) == "2000-0"
+
+    monkeypatch.setattr(settings, "REDIS_STREAM_RETENTION_MAXLEN", 4)
+    assert compute_policy_trim_id(r, STREAM, now_ms=5_000) == "2000-0"
+    monkeypatch.setattr(settings, "REDIS_STREAM_RETENTION_MAXLEN", 2)
+    assert compute_policy_trim_id(r, STREAM, now_ms=5_000) == "2000-0"
+
+
+def test_policy_never_trims_past_safe_id(monkeypatch):
+    """保留策略只会让裁剪更保守：策略允许删到更后面时，仍停在未确认消息处"""
+    monkeypatch.setattr(settings, "REDIS_STREAM_RETENTION_MAXLEN", 1)
+    monkeypatch.setattr(settings, "REDIS_STREAM_RETENTION_MIN_AGE_S", 0)
+    r = FakeStreamRedis(ids(1, 2, 3, 4, 5), {"workers": ("5000-0", ["2000-0"])})
+
+    stats = trim_stream(r, STREAM)
+    assert stats["trim_id"] == "2000-0"
+    assert r.entry_ids == ids(2, 3, 4, 5)
+
+
+def test_scheduler_respects_interval_and_swallows_errors(monkeypatch, no_policy):
+    """调度器按间隔触发裁剪，裁剪出错只返回 None"""
+    now = [1000.0]
+    monkeypatch.setattr(stream_retention.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(settings, "REDIS_STREAM_NAME", STREAM)
+    scheduler = StreamTrimScheduler(interval_s=60)
+    r = FakeStreamRedis(ids(1, 2, 3), {"workers": ("3000-0", [])})
+
+    assert scheduler.maybe_trim(r) is None, "未到间隔不应裁剪"
+    now[0] += 60
+    assert scheduler.maybe_trim(r)["trim_id"] == "3000-0"
+
+    def broken(*args, **kwargs):
+        raise ConnectionError("redis down")
+
+    r.xinfo_groups = broken
+    now[0] += 60
+    assert scheduler.maybe_trim(r) is None
+    assert StreamTrimScheduler(interval_s=0).maybe_trim(r) is None, "间隔为 0 时不裁剪"
@@ -0,0 +1,76 @@
+# 同步 worker 批处理工具函数的单元测试，不依赖 Redis 和 ChromaDB
+
+from app.rag.sync_batching import AdaptivePullSizer, backoff_delay, coalesce_messages, plan_embedding_batches
+
+
+def test_coalesce_keeps_latest_version():
+    """同一 source_id 的多条消息只保留最后一条"""
+    messages = [
+        ("1-0", {"source_id": "club_1", "content": "v1"}),
+        ("2-0", {"source_id": "club_2", "content": "other"}),
+        ("3-0", {"source_id": "club_1", "content": "v2"}),
+        ("4-0", {"source_id": "club_1", "content": "v3"}),
+    ]
+    kept, superseded = coalesce_messages(messages)
+
+    assert [msg_id for msg_id, _ in kept] == ["2-0", "4-0"], "应按 Stream 顺序保留每个 source_id 的最新消息"
+    assert kept[1][1]["content"] == "v3"
+    assert superseded == ["1-0", "3-0"], "旧版本应被标记为已覆盖"
+
+
+def test_coalesce_keeps_messages_without_source_id():
+    """缺少 source_id 的消息原样保留，交给后续流程处理"""
+    messages = [
+        ("1-0", {"content": "no id"}),
+        ("2-0", {"source_id": "", "content": "empty id"}),
+    ]
+    kept, superseded = coalesce_messages(messages)
+
+    assert len(kept) == 2
+    assert superseded == []
+
+
+def test_plan_embedding_batches_splits_long_and_merges_short():
+    """长文档拆到多个批次，短消息合并到同一批次"""
+    prepared = [
+        ("1-0", [f"a::{i}" for i in range(5)], ["x" * 10] * 5, [{}] * 5),
+        ("2-0", ["b::0"], ["y"], [{}]),
+        ("3-0", ["c::0"], ["z"], [{}]),
+    ]
+    batches = plan_embedding_batches(prepared, max_chunks=3, max_tokens=1000)
+
+    assert [len(b["ids"]) for b in batches] == [3, 3, 1]
+    assert batches[0]["msg_ids"] == ["1-0"]
+    assert batches[1]["msg_ids"] == ["1-0", "2-0"], "批次应记录涉及的所有消息"
+
+    token_limited = plan_embedding_batches(prepared, max_chunks=100, max_tokens=25)
+    assert all(sum(len(d) for d in b["documents"]) <= 25 for b in token_limited), "批次不应超过 token 预算"
+
+
+def test_adaptive_pull_sizer_tracks_latency_target():
+    """嵌入越慢，拉取条数和批次块数越小，并被限制在上下限之间"""
+    sizer = AdaptivePullSizer(initial_pull_size=64, min_pull_size=4, max_pull_size=256,
+                              max_chunks=128, target_latency_s=1.0, smoothing=1.0)
+    sizer.observe_pull(message_count=10, chunk_count=100)  # 每条消息 10 个块
+    sizer.observe_embedding(chunk_count=100, elapsed_s=2.0)  # 每块 20ms
+
+    assert sizer.chunk_budget == 50
+    assert sizer.pull_size == 5
+
+    sizer.observe_embedding(chunk_count=100, elapsed_s=0.01)
+    assert sizer.chunk_budget == 128, "批次块数不应超过配置上限"
+    assert sizer.pull_size == 256, "拉取条数不应超过配置上限"
+
+
+def test_backoff_delay_is_bounded():
+    """退避时间随重试次数指数增长，但不超过上限"""
+    for attempt in range(10):
+        delay = backoff_delay(attempt, base_s=0.5, max_s=30.0)
+        assert 0 <= delay <= min(30.0, 0.5 * 2 ** attempt)
+
+
+def test_backoff_delay_survives_long_outage():
+    """长时间故障后重试次数很大时不应溢出，仍然返回不超过上限的退避时间"""
+    for attempt in (1030, 10 ** 6):
+        delay = backoff_delay(attempt, base_s=0.5, max_s=30.0)
+        assert 0 <= delay <= 30.0
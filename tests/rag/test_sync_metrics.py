@@ -0,0 +1,80 @@
+# 同步流水线指标的单元测试，不依赖 Redis 和 ChromaDB
+
+from urllib.request import urlopen
+
+from app.rag.sync_metrics import Histogram, SyncMetrics, start_metrics_server
+
+
+def test_histogram_buckets_and_quantile():
+    """直方图按桶累积计数，分位数用桶上界近似"""
+    histogram = Histogram((0.1, 1.0, 10.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value)
+
+    assert histogram.count == 4
+    assert histogram.quantile(0.5) == 1.0
+    assert histogram.quantile(1.0) == 10.0
+    lines = histogram.prometheus_lines("x")
+    assert 'x_bucket{le="1.0"} 3' in lines
+    assert 'x_bucket{le="+Inf"} 4' in lines
+
+
+def test_sync_metrics_freshness_from_stream_id():
+    """端到端新鲜度由消息 ID 中的发布时间计算"""
+    metrics = SyncMetrics()
+    metrics.observe_processed(["1700000000000-0", "1700000001000-1"], chunk_count=5, now=1700000010.0)
+
+    snapshot = metrics.snapshot()
+    assert snapshot["messages_total"] == 2
+    assert snapshot["chunks_total"] == 5
+    assert snapshot["freshness_last_s"] == 9.0
+
+    text = metrics.to_prometheus()
+    assert "rag_sync_messages_total 2" in text
+    assert "rag_sync_freshness_seconds_count 2" in text
+
+
+class FakeStreamRedis:
+    def __init__(self):
+        self.length = 3
+
+    def xlen(self, name):
+        return self.length
+
+    def xinfo_groups(self, name):
+        return [{"name": "workers", "lag": self.length - 1, "pending": 1}]
+
+
+def test_metrics_endpoint_refreshes_stream_state_on_scrape():
+    """每次抓取前刷新 Stream 状态，不依赖日志间隔"""
+    metrics = SyncMetrics()
+    r = FakeStreamRedis()
+    server = start_metrics_server(metrics, 0, refresh=lambda: metrics.refresh_stream_state(r, "s", "workers"))
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        assert "rag_sync_stream_length 3" in urlopen(url).read().decode()
+        r.length = 7
+        text = urlopen(url).read().decode()
+        assert "rag_sync_stream_length 7" in text
+        assert "rag_sync_consumer_group_lag 6" in text
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_second_server_on_same_port_is_skipped():
+    """端口已被同一台机器上的另一个 worker 占用时不抛出异常，worker 照常运行"""
+    metrics = SyncMetrics()
+    first = start_metrics_server(metrics, 0)
+    warnings = []
+
+    class Logger:
+        def warning(self, message, **kwargs):
+            warnings.append(message)
+
+    try:
+        assert start_metrics_server(metrics, first.server_address[1], logger=Logger()) is None
+        assert len(warnings) == 1
+    finally:
+        first.shutdown()
+        first.server_close()
@@ -0,0 +1,42 @@
+# 两个同步 worker 共用的处理步骤的单元测试，不依赖 Redis 和嵌入模型
+
+import json
+import logging
+
+from app.rag import sync_pipeline
+from app.rag.dedup import ChunkDeduplicator
+from app.rag.sync_metrics import SyncMetrics
+from app.rag.sync_pipeline import SyncPipeline
+
+
+def make_pipeline(monkeypatch):
+    published = []
+    monkeypatch.setattr(sync_pipeline, "sync_metrics", SyncMetrics())
+    monkeypatch.setattr(sync_pipeline, "notify_keyword_index",
+                        lambda ids, deleted_ids: published.append((ids, deleted_ids)))
+    deduplicator = ChunkDeduplicator(lambda name: None, lambda documents: [], mode="off")
+    return SyncPipeline(deduplicator, logging.getLogger("test_sync_pipeline")), published
+
+
+def message(msg_id, source_id, content):
+    return msg_id, {"source_id": source_id, "content": content, "metadata": json.dumps({"source_type": "event"})}
+
+
+def test_coalesce_prepare_and_finalize(monkeypatch):
+    pipeline, published = make_pipeline(monkeypatch)
+    messages = [message("1-0", "event::1", "旧版本"), message("2-0", "event::2", "篮球赛"),
+                message("3-0", "event::1", "新版本"), ("4-0", {"source_id": "event::3", "content": None})]
+
+    latest = pipeline.coalesce(messages)
+    assert [msg_id for msg_id, _ in latest] == ["2-0", "3-0", "4-0"]
+    assert sync_pipeline.sync_metrics.superseded_total == 1
+
+    prepared = pipeline.prepare_messages(latest)
+    prepared, duplicates_by_msg = pipeline.deduplicate(prepared, collection=None)
+    processed = pipeline.finalize([], prepared, duplicates_by_msg, failed_msg_ids={"2-0"}, message_count=len(latest))
+
+    assert processed == ["3-0"]
+    assert published == [([chunk_id for msg_id, chunk_ids, _, _ in prepared if msg_id == "3-0"
+                           for chunk_id in chunk_ids], [])]
+    # 写入失败的 2-0 和解析失败的 4-0 都计入失败数
+    assert sync_pipeline.sync_metrics.failed_messages_total == len(latest) - 1
@@ -0,0 +1,47 @@
+# 文本切分器的单元测试：与 LangChain 的 RecursiveCharacterTextSplitter 输出必须逐字节一致
+
+import random
+
+import pytest
+
+from app.rag.text_splitter import DEFAULT_SEPARATORS, ChineseTextSplitter
+
+langchain_splitters = pytest.importorskip("langchain_text_splitters")
+
+PIECES = ["社团", "活动报名", "\n\n", "\n", "。", "，", "、", " ", "  ", "club", "长" * 45]
+
+
+def _random_text(rng: random.Random) -> str:
+    return "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 300)))
+
+
+@pytest.mark.parametrize("length_function", [len, lambda s: (len(s.encode("utf-8")) + 2) // 3])
+def test_matches_langchain_splitter(length_function):
+    """随机文本、随机参数下与 LangChain 的切分结果一致"""
+    rng = random.Random(42)
+    for _ in range(500):
+        text = _random_text(rng)
+        chunk_size = rng.randint(5, 120)
+        chunk_overlap = rng.randint(0, chunk_size)
+        expected = langchain_splitters.RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+            separators=DEFAULT_SEPARATORS, length_function=length_function
+        ).split_text(text)
+        actual = ChineseTextSplitter(chunk_size, chunk_overlap, length_function=length_function).split_text(text)
+        assert actual == expected, f"chunk_size={chunk_size}, chunk_overlap={chunk_overlap}, text={text!r}"
+
+
+def test_iter_split_text_is_lazy():
+    """超长文本的第一个文本块不需要等全文切完就能拿到"""
+    calls = []
+
+    def counting_len(text):
+        calls.append(text)
+        return len(text)
+
+    text = "社团活动。" * 300000
+    chunks = ChineseTextSplitter(300, 50, length_function=counting_len).iter_split_text(text)
+    first = next(chunks)
+
+    assert len(first) <= 300
+    assert len(calls) < 1000, "取第一个文本块时不应遍历全文"
@@ -0,0 +1,102 @@
+# 内存向量库的单元测试，行为需要与 Chroma 的 Collection 保持一致
+
+import numpy as np
+import pytest
+
+from app.rag.vector_store import InMemoryCollection, InMemoryVectorStore, VectorCollection, VectorStore, match_where
+
+
+def _collection(space="l2", n=50, dim=8, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(n, dim)).astype(np.float32)
+    collection = InMemoryCollection("test", space)
+    collection.upsert(
+        ids=[f"id{i}" for i in range(n)],
+        embeddings=vectors.tolist(),
+        documents=[f"文档 {i}" for i in range(n)],
+        metadatas=[{"index": i, "kind": "even" if i % 2 == 0 else "odd"} for i in range(n)]
+    )
+    return collection, vectors
+
+
+@pytest.mark.parametrize("space", ["l2", "cosine", "ip"])
+def test_query_matches_brute_force(space):
+    collection, vectors = _collection(space)
+    query = np.random.default_rng(1).normal(size=(2, vectors.shape[1])).astype(np.float32)
+    if space == "l2":
+        expected = ((vectors[None, :, :] - query[:, None, :]) ** 2).sum(axis=2)
+    elif space == "cosine":
+        expected = 1 - (query @ vectors.T) / np.outer(np.linalg.norm(query, axis=1), np.linalg.norm(vectors, axis=1))
+    else:
+        expected = 1 - query @ vectors.T
+
+    result = collection.query(query_embeddings=query.tolist(), n_results=5)
+
+    for row in range(2):
+        order = np.argsort(expected[row])[:5]
+        assert result["ids"][row] == [f"id{i}" for i in order]
+        np.testing.assert_allclose(result["distances"][row], expected[row][order], rtol=1e-4, atol=1e-4)
+        assert result["metadatas"][row][0]["index"] == order[0]
+
+
+def test_where_filters_and_include():
+    collection, vectors = _collection()
+    result = collection.query(query_embeddings=[vectors[3].tolist()], n_results=3,
+                              where={"kind": "odd"}, include=["documents"])
+
+    assert result["ids"][0][0] == "id3"
+    assert all(int(i[2:]) % 2 == 1 for i in result["ids"][0])
+    assert result["metadatas"] is None and result["distances"] is None
+
+    page = collection.get(where={"$and": [{"index": {"$gte": 10}}, {"index": {"$lt": 13}}]})
+    assert page["ids"] == ["id10", "id11", "id12"]
+    assert collection.get(where_document={"$contains": "文档 4"})["ids"] == ["id4", "id40", "id41", "id42", "id43",
+                                                                           "id44", "id45", "id46", "id47", "id48",
+                                                                           "id49"]
+    assert not match_where({"other": 1}, {"index": {"$ne": 1}}), "缺少字段的记录不匹配任何比较条件"
+
+
+def test_upsert_delete_and_paging():
+    collection, vectors = _collection(n=10)
+    collection.upsert(ids=["id0"], embeddings=[vectors[9].tolist()], documents=["新版本"], metadatas=[{"index": 0}])
+    collection.delete(ids=["id3", "missing"])
+    collection.delete(where={"kind": "even"})
+
+    assert collection.count() == 5, "删除 id3 以及带 kind=even 的 id2/4/6/8 (id0 的新版本没有 kind)"
+    assert collection.get(ids=["id0"])["documents"] == ["新版本"]
+    pages = [collection.get(limit=3, offset=offset, include=[])["ids"] for offset in (0, 3)]
+    assert sorted(pages[0] + pages[1]) == ["id0", "id1", "id5", "id7", "id9"], "分页结果不重不漏"
+
+    # 删除后搬移过的行仍然能被正确查询到
+    result = collection.query(query_embeddings=[vectors[9].tolist()], n_results=2)
+    assert set(result["ids"][0]) == {"id0", "id9"}
+
+
+def test_store_manages_collections():
+    store = InMemoryVectorStore()
+    store.get_or_create_collection(name="a").upsert(ids=["x"], embeddings=[[0.0]])
+    assert store.list_collections() == ["a"]
+    assert store.get_or_create_collection(name="a").count() == 1
+    store.delete_collection(name="a")
+    with pytest.raises(ValueError):
+        store.get_collection(name="a")
+
+
+
+def test_incomplete_backend_fails_at_construction():
+    """缺少接口方法的后端在创建实例时就报错，而不是等到第一次调用"""
+    class NoCount(VectorCollection):
+        def upsert(self, ids, embeddings, documents=None, metadatas=None): ...
+        def get(self, ids=None, where=None, where_document=None, limit=None, offset=None, include=None): ...
+        def query(self, query_embeddings, n_results=10, where=None, where_document=None, include=None): ...
+        def delete(self, ids=None, where=None): ...
+
+    class NoList(VectorStore):
+        def get_or_create_collection(self, name): ...
+        def get_collection(self, name): ...
+        def delete_collection(self, name): ...
+
+    with pytest.raises(TypeError, match="count"):
+        NoCount()
+    with pytest.raises(TypeError, match="list_collections"):
+        NoList()
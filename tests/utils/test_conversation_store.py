@@ -0,0 +1,23 @@
+# 服务端对话历史的单元测试：追加、按长度裁剪、过期时间
+
+from app.schemas import ChatMessage
+from app.utils.conversation_store import ConversationStore
+
+
+def test_append_keeps_most_recent_messages(fake_redis):
+    redis = fake_redis
+    store = ConversationStore(lambda: redis, max_messages=4, ttl_s=60)
+    conversation_id = store.new_conversation_id()
+    assert store.history(conversation_id) == []
+
+    for turn in range(3):
+        store.append(conversation_id, ChatMessage(role="user", content=f"问题{turn}"),
+                     ChatMessage(role="assistant", content=f"回答{turn}"))
+
+    history = store.history(conversation_id)
+    assert [message.content for message in history] == ["问题1", "回答1", "问题2", "回答2"]
+    assert history[0].role == "user"
+    assert redis.ttl == {f"chat:history:{conversation_id}": 60}
+
+    store.clear(conversation_id)
+    assert store.history(conversation_id) == []
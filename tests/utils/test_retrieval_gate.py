@@ -0,0 +1,42 @@
+# 检索跳过判断的单元测试：闲聊跳过、带实际问题的消息照常检索、统计
+
+import pytest
+
+from app.utils.retrieval_gate import RetrievalGate
+
+
+@pytest.mark.parametrize("query", ["谢谢", "你好", "您好！", "谢谢你~", "好的，谢谢啦", "OK", "Thank you!", "哈哈哈 👍",
+                                   "嗯嗯 明白了", "再见", "🙏", "  "])
+def test_chitchat_skips_retrieval(query):
+    assert not RetrievalGate().needs_retrieval(query)
+
+
+@pytest.mark.parametrize("query", ["如何加入社团", "谢谢，那报名截止是哪天", "你好，社团会费怎么交",
+                                   "那第二个呢", "好的吗", "活动室301在哪", "thanks for the reminder about the meeting"])
+def test_questions_need_retrieval(query):
+    assert RetrievalGate().needs_retrieval(query)
+
+
+def test_disabled_gate_and_stats():
+    assert RetrievalGate(enabled=False).needs_retrieval("谢谢")
+
+    gate = RetrievalGate(phrases=["收到了哈"], smoothing=0.5)
+    for query in ["收到了哈", "谢谢", "如何加入社团", "周末有什么活动"]:
+        gate.needs_retrieval(query)
+    gate.record_retrieval(100)
+    gate.record_retrieval(200)
+    stats = gate.stats()
+    assert (stats["turns"], stats["skipped"], stats["skip_ratio"]) == (4, 1, 0.25)
+    assert stats["avg_retrieval_ms"] == 150
+    assert stats["estimated_saved_ms"] == 150
+
+
+@pytest.mark.parametrize("query", ["好的", "可以", "嗯", "是的，谢谢", "OK"])
+def test_affirmative_answer_to_assistant_offer_needs_retrieval(query):
+    assert RetrievalGate().needs_retrieval(query, last_assistant="报名需要提交申请表。需要我列出报名材料吗？")
+
+
+def test_affirmative_after_statement_and_thanks_after_offer_skip_retrieval():
+    gate = RetrievalGate()
+    assert not gate.needs_retrieval("好的", last_assistant="报名截止时间是本周五。")
+    assert not gate.needs_retrieval("谢谢", last_assistant="需要我列出报名材料吗？")
@@ -0,0 +1,44 @@
+# 溯源事件格式的单元测试：compact 只保留 ID、标题、链接和摘要，metered 统计首字节时间和字节数
+
+import json
+import logging
+
+import pytest
+
+from app.utils.source_events import compact_sources, metered, source_payload
+
+DOCS = [
+    {"id": "dynamic::event_1::chunk::0", "content": "篮球社  周末\n招新活动" * 20,
+     "metadata": {"name": "篮球社招新", "link": "https://example.edu/e/1", "similarity_score": 0.8, "tags": "[\"a\"]"}},
+    {"id": "static::manual.pdf_chunk_3", "content": "社团注册流程",
+     "metadata": {"title": "", "source": "manual.pdf", "page": 3}},
+]
+
+
+def test_compact_sources():
+    sources = compact_sources(DOCS, snippet_chars=10)
+    assert sources[0] == {"id": "dynamic::event_1::chunk::0", "title": "篮球社招新", "url": "https://example.edu/e/1",
+                          "snippet": "篮球社 周末 招新活…"}
+    # 空标题跳过，取下一个候选字段；没有链接时为 None
+    assert sources[1] == {"id": "static::manual.pdf_chunk_3", "title": "manual.pdf", "url": None,
+                          "snippet": "社团注册流程"}
+
+
+def test_source_payload_modes():
+    assert json.loads(source_payload(DOCS, "full")) == DOCS
+    compact = source_payload(DOCS, "compact")
+    assert [source["id"] for source in json.loads(compact)] == [doc["id"] for doc in DOCS]
+    assert len(compact.encode("utf-8")) < len(source_payload(DOCS, "full").encode("utf-8")) / 2
+
+
+@pytest.mark.asyncio
+async def test_metered_reports_bytes(caplog):
+    async def stream():
+        yield "event: source\ndata: []\n\n"
+        yield "event: token\ndata: {\"token\": \"你\"}\n\n"
+
+    with caplog.at_level(logging.INFO):
+        chunks = [chunk async for chunk in metered(stream(), "test", 0.0, logging.getLogger("test"))]
+    assert len(chunks) == 2
+    total = sum(len(chunk.encode("utf-8")) for chunk in chunks)
+    assert f"first_event_bytes={len(chunks[0])} total_bytes={total}" in caplog.text
@@ -0,0 +1,123 @@
+# 可续传 SSE 缓冲的单元测试：事件 id、断线后按 Last-Event-ID 续传进行中的生成、回放已结束的生成、生成中断
+
+import asyncio
+import json
+
+import pytest
+
+from app.utils.sse_replay import SSEReplayBuffer, parse_last_event_id
+
+
+def parse_events(chunks):
+    events = []
+    for chunk in chunks:
+        fields = dict(line.split(": ", 1) for line in chunk.strip().split("\n"))
+        events.append(fields)
+    return events
+
+
+@pytest.mark.asyncio
+async def test_resume_running_generation_then_replay(fake_async_redis):
+    buffer = SSEReplayBuffer(fake_async_redis, block_ms=50)
+    release = asyncio.Event()
+
+    async def produce():
+        yield "source", [{"content": "文档"}]
+        yield "token", {"token": "你"}
+        await release.wait()
+        yield "token", {"token": "好"}
+
+    generation_id = buffer.start(produce)
+
+    # 第一次连接读到两个事件后断开
+    first = []
+    stream = buffer.stream(generation_id)
+    async for chunk in stream:
+        first.append(chunk)
+        if len(first) == 2:
+            break
+    await stream.aclose()
+    first = parse_events(first)
+    assert [event["event"] for event in first] == ["source", "token"]
+    assert parse_last_event_id(first[-1]["id"]) == (generation_id, "2-0")
+
+    # 带 Last-Event-ID 重连，生成仍在进行，接着收到后续事件
+    resumed_task = asyncio.create_task(_collect(buffer.stream(*parse_last_event_id(first[-1]["id"]))))
+    await asyncio.sleep(0.01)
+    release.set()
+    resumed = parse_events(await resumed_task)
+    assert [event["event"] for event in resumed] == ["token", "end"]
+    assert json.loads(resumed[0]["data"]) == {"token": "好"}
+
+    # 生成结束后再从头回放，事件与 id 不变
+    replayed = parse_events(await _collect(buffer.stream(generation_id)))
+    assert [event["id"] for event in replayed] == [event["id"] for event in first + resumed]
+
+
+@pytest.mark.asyncio
+async def test_producer_error_and_idle_timeout(fake_async_redis):
+    buffer = SSEReplayBuffer(fake_async_redis, block_ms=20, idle_timeout_s=0.05)
+
+    async def failing():
+        yield "source", []
+        raise RuntimeError("vLLM 不可用")
+
+    events = parse_events(await _collect(buffer.stream(buffer.start(failing))))
+    assert [event["event"] for event in events] == ["source", "error", "end"]
+
+    # 缓冲中没有生成在写入 (例如生成所在进程已退出)，超时后发送错误并结束
+    events = parse_events(await _collect(buffer.stream("gone")))
+    assert [event["event"] for event in events] == ["error", "end"]
+
+
+@pytest.mark.asyncio
+async def test_redis_down_streams_directly_without_ids(fake_async_redis):
+    fake_async_redis.down = True
+    buffer = SSEReplayBuffer(fake_async_redis, block_ms=20)
+
+    async def produce():
+        yield "source", []
+        yield "token", {"token": "你"}
+
+    events = parse_events(await _collect(await buffer.open(produce)))
+    assert [event["event"] for event in events] == ["source", "token", "end"]
+    assert all("id" not in event for event in events), "不可续传的事件不应带 id"
+    assert json.loads(events[1]["data"]) == {"token": "你"}
+
+
+@pytest.mark.asyncio
+async def test_redis_failure_mid_generation_is_contained(fake_async_redis):
+    """生成途中 Redis 断开: 后台任务放弃生成且不留下异常，读取端收到错误和结束事件"""
+    buffer = SSEReplayBuffer(fake_async_redis, block_ms=20)
+    release, closed = asyncio.Event(), asyncio.Event()
+
+    async def produce():
+        try:
+            yield "source", []
+            await release.wait()
+            fake_async_redis.down = True
+            yield "token", {"token": "你"}
+            yield "token", {"token": "好"}
+        finally:
+            closed.set()
+
+    stream = await buffer.open(produce)
+    tasks = set(buffer._tasks)
+    first = await stream.__anext__()
+    release.set()
+    events = parse_events([first] + await _collect(stream))
+    assert [event["event"] for event in events] == ["source", "error", "end"]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert results == [None]
+    assert closed.is_set(), "放弃生成时应关闭生成器"
+
+
+def test_parse_last_event_id():
+    assert parse_last_event_id("abc:1700000000000-3") == ("abc", "1700000000000-3")
+    assert parse_last_event_id("abc") is None
+    assert parse_last_event_id("abc:12") is None
+    assert parse_last_event_id(None) is None
+
+
+async def _collect(stream):
+    return [chunk async for chunk in stream]